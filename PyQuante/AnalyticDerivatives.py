@@ -19,10 +19,66 @@ COPYRIGHT
 
 """
 
-from NumWrap import array2string
+from NumWrap import array2string,array,zeros,reshape,transpose
 from math import sqrt
 from PGBF import PGBF,coulomb
-from pyints import grad_nuc_att
+from Ints import pack_basis,pack_nuclei
+try:
+    from PyQuante.cints import overlap_deriv,kinetic_deriv,nuclear_deriv,\
+         coulomb_deriv_block
+    have_cderivs = True
+except ImportError:
+    # cints was built before the derivative kernels were added
+    have_cderivs = False
+
+class DerivInts:
+    """
+    DerivInts(bset,atoms) - The derivative one-electron integrals for all
+    atoms at once, from the cints kernels.
+
+    The kernels give the derivatives of S_ij, T_ij and of the attraction
+    to each nucleus C, q_C <i|1/r_C|j>, with respect to the center of
+    function i, for every i and j. The derivative with respect to the
+    center of j is the (j,i) element, and that with respect to C itself
+    is minus the sum of the two, by translational invariance.
+    overlap(a) and hcore(a) then give the same (dX,dY,dZ) matrices as
+    der_overlap_matrix(a,bset) and der_Hcore_matrix(a,bset,atoms), the
+    Python versions of which are kept as the reference.
+    """
+    def __init__(self,bset,atoms):
+        nbf = len(bset)
+        natoms = len(atoms)
+        basis = pack_basis(bset)
+        self.atids = array([bf.atid for bf in bset])
+        dS = zeros(3*nbf*nbf,'d')
+        overlap_deriv(basis,dS)
+        dT = zeros(3*nbf*nbf,'d')
+        kinetic_deriv(basis,dT)
+        cxyz,cq = pack_nuclei(atoms)
+        dV = zeros(3*natoms*nbf*nbf,'d')
+        nuclear_deriv(basis,cxyz,cq,dV)
+        dV = reshape(dV,(natoms,nbf,nbf,3))
+        self.dS = reshape(dS,(nbf,nbf,3))
+        self.dH = reshape(dT,(nbf,nbf,3)) + dV.sum(0)
+        self.dVnuc = -(dV + transpose(dV,(0,2,1,3)))
+        return
+
+    def matrices(self,a,dX,extra=None):
+        "The (dX,dY,dZ) matrices for atom a from the derivatives dX"
+        on = self.atids == a
+        dXa = zeros(dX.shape,'d')
+        dXa[on,:,:] += dX[on,:,:]
+        dXa[:,on,:] += transpose(dX,(1,0,2))[:,on,:]
+        if extra is not None: dXa += extra
+        return dXa[:,:,0],dXa[:,:,1],dXa[:,:,2]
+
+    def overlap(self,a):
+        "dS/dRa, as der_overlap_matrix(a,bset)"
+        return self.matrices(a,self.dS)
+
+    def hcore(self,a):
+        "dH/dRa, as der_Hcore_matrix(a,bset,atoms)"
+        return self.matrices(a,self.dH,self.dVnuc[a])
 
 def der_Hcore_element(a,bfi,bfj,atoms):
     """
@@ -175,162 +231,35 @@ def der_nuc_att(a,bfi,bfj,atoms):
     grad <i|V|j> = <grad i|V|j> + <i|V|grad j> + <i| grad V |j>
     
     The first two terms are straightforward to evaluate using the recursion relation for the
-    derivative of a Gaussian basis function.  The last term found through the nuclear_gradient
-    function in the primitive Gaussian class.  
-    """
+    derivative of a Gaussian basis function.  The last term, the attraction to atom a
+    itself, follows from translational invariance: moving i, j and atom a together
+    leaves <i|V_a|j> unchanged, so
     
-    dVij_dXa,dVij_dYa,dVij_dZa = 0.0,0.0,0.0
-    if bfi.atid==a: #bfi is centered on atom a
-        for upbf in bfj.prims():
-            for vpbf in bfi.prims():
-                alpha = vpbf.exp()
-                l,m,n = vpbf.powers()
-                origin = vpbf.origin()
-                coefs  = upbf.coef()*vpbf.coef()
-                                
-                #x component
-                v = PGBF(alpha,origin,(l+1,m,n))
-                v.normalize()
-                
-                terma=0.0
-                for atom in atoms:                    
-                    terma += atom.atno*sqrt(alpha*(2.0*l+1.0))*coefs*v.nuclear(upbf,atom.pos())
-                
-                if l>0:
-                    v.reset_powers(l-1,m,n)
-                    v.normalize()
-                    
-                    termb=0.0
-                    for atom in atoms:
-                        termb += -2*l*atom.atno*sqrt(alpha/(2.0*l-1.0))*coefs*v.nuclear(upbf,atom.pos())
-                        
-                else: termb = 0.0
-                
-                dVij_dXa += terma + termb
-                
-                
-                #y component
-                v.reset_powers(l,m+1,n)
-                v.normalize()
-
-                terma=0.0
-                for atom in atoms:
-                    terma += atom.atno*sqrt(alpha*(2.0*m+1.0))*coefs*v.nuclear(upbf,atom.pos())
-                
-                if m>0:
-                    v.reset_powers(l,m-1,n)
-                    v.normalize()
-                    
-                    termb=0.0
-                    for atom in atoms:
-                        termb += -2*m*atom.atno*sqrt(alpha/(2.0*m-1.0))*coefs*v.nuclear(upbf,atom.pos())
-                else: termb = 0.0
-                
-                dVij_dYa += terma + termb
-                
-                #z component
-                v.reset_powers(l,m,n+1)
-                v.normalize()
-                
-                terma=0.0
-                for atom in atoms:
-                    terma += atom.atno*sqrt(alpha*(2.0*n+1.0))*coefs*v.nuclear(upbf,atom.pos())
-                
-                if n>0:
-                    v.reset_powers(l,m,n-1)
-                    v.normalize()
-                    
-                    termb=0.0
-                    for atom in atoms:
-                        termb += -2*n*atom.atno*sqrt(alpha/(2.0*n-1.0))*coefs*v.nuclear(upbf,atom.pos())
-                else: termb = 0.0
-                
-                dVij_dZa += terma + termb
-
-                
-    #bfj is centered on atom a
-    if bfj.atid==a:
-        for upbf in bfi.prims():
-            for vpbf in bfj.prims():
-                alpha = vpbf.exp()
-                l,m,n = vpbf.powers()
-                origin = vpbf.origin()
-                coefs = upbf.coef()*vpbf.coef()
-                
-                #x component 
-                v = PGBF(alpha,origin,(l+1,m,n))
-                v.normalize()
-                
-                terma=0.0
-                for atom in atoms:
-                    terma += atom.atno*sqrt(alpha*(2.0*l+1.0))*coefs*v.nuclear(upbf,atom.pos())
-                
-                if l>0:
-                    v.reset_powers(l-1,m,n)
-                    v.normalize()
-                    
-                    termb=0.0
-                    for atom in atoms:
-                        termb += -2*l*atom.atno*sqrt(alpha/(2.0*l-1.0))*coefs*v.nuclear(upbf,atom.pos())
-                else: termb = 0.0
-                
-                dVij_dXa += terma + termb
-                
-
-                #y component
-                v.reset_powers(l,m+1,n)
-                v.normalize()
-
-                terma=0.0
-                for atom in atoms:
-                    terma += atom.atno*sqrt(alpha*(2.0*m+1.0))*coefs*v.nuclear(upbf,atom.pos())
-                
-                if m>0:
-                    v.reset_powers(l,m-1,n)
-                    v.normalize()
-                    
-                    termb=0.0
-                    for atom in atoms:
-                        termb += -2*m*atom.atno*sqrt(alpha/(2.0*m-1.0))*coefs*v.nuclear(upbf,atom.pos())
-                else: termb = 0.0
-                
-                dVij_dYa += terma + termb
-                
-                #z component
-                v.reset_powers(l,m,n+1)
-                v.normalize()
-                
-                terma=0.0
-                for atom in atoms:
-                    terma += atom.atno*sqrt(alpha*(2.0*n+1.0))*coefs*v.nuclear(upbf,atom.pos())
-                
-                if n>0:
-                    v.reset_powers(l,m,n-1)
-                    v.normalize()
-                    
-                    termb = 0.0
-                    for atom in atoms:
-                        termb += -2*n*atom.atno*sqrt(alpha/(2.0*n-1.0))*coefs*v.nuclear(upbf,atom.pos())
-                else: termb = 0.0
-                
-                dVij_dZa += terma + termb
+    <i| grad_a V_a |j> = -<grad i|V_a|j> - <i|V_a|grad j>
     
-    #finally evaluate <i| grad V |j>
-    for atom in atoms:
-        if atom.atid==a:
-            for upbf in bfi.prims():
-                for vpbf in bfj.prims():
-                    prefactor = upbf.coef()*vpbf.coef()*atom.atno
-                    list = upbf.nuclear_gradient(vpbf,atom.pos())
-                    
-                    dVij_dXa+=prefactor*list[0]
-                    dVij_dYa+=prefactor*list[1]
-                    dVij_dZa+=prefactor*list[2]
-        
-
-    return dVij_dXa,dVij_dYa,dVij_dZa
-
-
+    with the gradients taken with respect to the centers of i and j wherever they are.
+    """
+    dVij = [0.0,0.0,0.0]
+    jders = [der_prim(vpbf) for vpbf in bfj.prims()]
+    for upbf in bfi.prims():
+        dus = der_prim(upbf)
+        for vpbf,dvs in zip(bfj.prims(),jders):
+            coefs = bfi.norm()*bfj.norm()*upbf.coef()*vpbf.coef()
+            for atom in atoms:
+                # The weights of the derivatives with respect to the
+                #  centers of i and of j
+                wi = (bfi.atid == a) - (atom.atid == a)
+                wj = (bfj.atid == a) - (atom.atid == a)
+                if not (wi or wj): continue
+                C = atom.pos()
+                for d in range(3):
+                    for factor,tmp in dus[d]:
+                        if wi: dVij[d] += wi*atom.atno*coefs*factor*\
+                                          tmp.nuclear(vpbf,C)
+                    for factor,tmp in dvs[d]:
+                        if wj: dVij[d] += wj*atom.atno*coefs*factor*\
+                                          upbf.nuclear(tmp,C)
+    return dVij[0],dVij[1],dVij[2]
 
 def der_overlap_element(a,bfi, bfj):
     """
@@ -672,4 +601,53 @@ def der_Jints(a, bfi,bfj,bfk,bfl):
                         dJint_dZa += terma + termb
     
     return dJint_dXa,dJint_dYa,dJint_dZa
-    
+
+def der_prim(pbf):
+    """
+    The derivatives of the primitive pbf with respect to its center,
+    d pbf/dXa = sqrt(alpha(2l+1)) pbf(l+1) - 2l sqrt(alpha/(2l-1)) pbf(l-1)
+    over normalized primitives, as a list for x,y,z of (factor,pgbf) terms
+    """
+    alpha = pbf.exp()
+    origin = pbf.origin()
+    powers = pbf.powers()
+    terms = []
+    for d in range(3):
+        l = powers[d]
+        up = list(powers)
+        up[d] = l+1
+        tmp = PGBF(alpha,origin,tuple(up))
+        tmp.normalize()
+        dterms = [(sqrt(alpha*(2.0*l+1.0)),tmp)]
+        if l>0:
+            down = list(powers)
+            down[d] = l-1
+            tmp = PGBF(alpha,origin,tuple(down))
+            tmp.normalize()
+            dterms.append((-2*l*sqrt(alpha/(2.*l-1)),tmp))
+        terms.append(dterms)
+    return terms
+
+def der_Jints_center(bfs,n):
+    """
+    The gradient of the Coulomb integral (ij|kl) over the basis functions
+    bfs = (bfi,bfj,bfk,bfl) with respect to the center of bfs[n] alone,
+    so that der_Jints(a,...) is the sum of these over the functions on
+    atom a. The derivatives of the primitives of bfs[n] are formed once,
+    rather than for every primitive quartet.
+    """
+    dJint = [0.0,0.0,0.0]
+    prims = [bf.prims() for bf in bfs]
+    ders = dict([(id(pbf),der_prim(pbf)) for pbf in prims[n]])
+    for tpbf in prims[0]:
+        for upbf in prims[1]:
+            for vpbf in prims[2]:
+                for wpbf in prims[3]:
+                    pbfs = [tpbf,upbf,vpbf,wpbf]
+                    coefs = tpbf.coef()*upbf.coef()*vpbf.coef()*wpbf.coef()
+                    terms = ders[id(pbfs[n])]
+                    for d in range(3):
+                        for factor,tmp in terms[d]:
+                            pbfs[n] = tmp
+                            dJint[d] += factor*coefs*coulomb(*pbfs)
+    return dJint
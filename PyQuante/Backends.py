@@ -0,0 +1,221 @@
+"""\
+ Backends.py Dispatch of two-electron integrals between the integral
+ modules, optionally tuned
+
+ The same integrals can be computed by cints (Taketa, Huzinaga and
+ O-ohata), chgp (Head-Gordon and Pople), crys (Rys quadrature) and
+ pyints (pure Python), whose relative speed depends upon the angular
+ momenta involved. A Registry routes each call to a module chosen
+ for its angular momentum class: the total angular momentum of the
+ bra and of the ket, (la+lb,lc+ld). The shell quartets of get2ints
+ follow the choices of contr_coulomb (see Shell.shell_kernel).
+
+ By default every class goes to chgp, so the results don't depend
+ upon timings. Tuning has to be asked for with set_tuning(): then the
+ first time a class is seen, every available module is timed on that
+ call, modules whose result disagrees with cints are not used for the
+ class, and the fastest of the rest is chosen. Nothing is written
+ unless save() is called; the choices it writes are read back when
+ the registries are made, from the tuning file $PYQUANTE_BACKENDS if
+ that is set. report() logs which module was used for each class.
+
+ This program is part of the PyQuante quantum chemistry program suite.
+
+ Copyright (c) 2004, Richard P. Muller. All Rights Reserved.
+
+ PyQuante version 1.2 and later is covered by the modified BSD
+ license. Please see the file LICENSE that is part of this
+ distribution.
+"""
+
+import os,logging
+from time import time
+
+module_names = ['cints','chgp','crys','pyints']
+reference = 'cints'
+default = 'chgp'
+
+# The classes (la+lb,lc+ld) each module can do: crys only has Rys roots
+#  up to order 5
+limits = {
+    'crys' : lambda lab,lcd: (lab+lcd)/2+1 <= 5,
+    }
+
+def available_modules():
+    "The integral modules that can be imported, by name"
+    modules = {}
+    for name in module_names:
+        try:
+            modules[name] = __import__('PyQuante.'+name,{},{},[name])
+        except ImportError:
+            logging.debug("Integral module %s isn't available" % name)
+    return modules
+
+def tuning_file():
+    "The tuning file named by $PYQUANTE_BACKENDS, or None"
+    return os.environ.get('PYQUANTE_BACKENDS') or None
+
+class Registry:
+    """\
+    Registry(function,powers_args) - Route calls to the fastest module
+
+    function     The name of the function in each module, which must
+                 all take the same arguments
+    powers_args  The positions of the (l,m,n) powers of the four
+                 functions in the argument list
+    tuning       If True, time the modules on the first call of each
+                 class, and use the fastest (see tune)
+    """
+    def __init__(self,function,powers_args,tuning=False):
+        self.function = function
+        self.powers_args = powers_args
+        self.funcs = {}
+        for name,module in available_modules().items():
+            if hasattr(module,function):
+                self.funcs[name] = getattr(module,function)
+        self.tuning = tuning
+        self.choice = {}  # class -> module name, if tuned or loaded
+        self.defaults = {}  # class -> module name otherwise
+        self.timings = {} # class -> {module name: seconds per call}
+        self.ncalls = {}  # class -> number of calls
+        self.load()
+        return
+
+    def __call__(self,*args):
+        ia,ib,ic,id = self.powers_args
+        key = (sum(args[ia])+sum(args[ib]),sum(args[ic])+sum(args[id]))
+        self.ncalls[key] = self.ncalls.get(key,0)+1
+        name = self.module(key)
+        if name is None: name = self.tune(key,args)
+        return self.funcs[name](*args)
+
+    def module(self,key):
+        """\
+        The name of the module for the class key, or None if it is
+        still to be tuned
+        """
+        name = self.choice.get(key)
+        if name is None and not self.tuning:
+            name = self.defaults.get(key)
+            if name is None:
+                name = self.defaults[key] = self.default_module(key)
+        return name
+
+    def default_module(self,key):
+        "The module used for class key when it isn't tuned"
+        for name in [default,reference]:
+            if name in self.funcs \
+                   and (name not in limits or limits[name](*key)):
+                return name
+        return sorted(self.funcs)[0]
+
+    def force(self,name):
+        "Route every class to the module name, e.g. for testing"
+        for key in self.choice: self.choice[key] = name
+        self.funcs = {name:self.funcs[name]}
+        self.defaults = {}
+        return
+
+    def tune(self,key,args,mintime=1e-3):
+        "Time each module on args, and choose the fastest for key"
+        ref = None
+        if reference in self.funcs: ref = self.funcs[reference](*args)
+        times = {}
+        for name,func in self.funcs.items():
+            if name in limits and not limits[name](*key): continue
+            try:
+                value = func(*args)
+            except Exception:
+                continue
+            if ref is not None and abs(value-ref) > 1e-6*max(1,abs(ref)):
+                logging.info("%s.%s disagrees with %s for class %s"
+                             % (name,self.function,reference,key))
+                continue
+            n = 0
+            start = time()
+            while True:
+                func(*args)
+                n += 1
+                elapsed = time()-start
+                if elapsed > mintime: break
+            times[name] = elapsed/n
+        if times:
+            best = min([(t,name) for name,t in times.items()])[1]
+        else:
+            best = self.default_module(key)
+            logging.warning("No module could be timed on %s for class %s; "
+                            "using %s" % (self.function,key,best))
+        self.choice[key] = best
+        self.timings[key] = times
+        return best
+
+    def load(self,fname=None):
+        "Read the choices from fname, by default the tuning file, if any"
+        fname = fname or tuning_file()
+        if not fname or not os.path.exists(fname): return
+        import json
+        try:
+            data = json.load(open(fname)).get(self.function,{})
+        except (IOError,ValueError):
+            logging.warning("Can't read the tuning file %s" % fname)
+            return
+        for skey,name in data.items():
+            key = tuple([int(l) for l in skey.split(',')])
+            if name in self.funcs \
+                   and (name not in limits or limits[name](*key)):
+                self.choice[key] = name
+        return
+
+    def save(self,fname=None):
+        "Add the choices to fname, by default the tuning file, if any"
+        fname = fname or tuning_file()
+        if not fname: return
+        import json
+        try:
+            data = json.load(open(fname))
+        except (IOError,ValueError):
+            data = {}
+        data[self.function] = dict([('%d,%d' % key,name) for key,name
+                                    in self.choice.items()])
+        try:
+            json.dump(data,open(fname,'w'),indent=1)
+        except IOError:
+            logging.debug("Can't write the tuning file %s" % fname)
+        return
+
+    def report(self):
+        "Log the module used for each class"
+        logging.info("%s: class  module  calls  (us/call by module)"
+                     % self.function)
+        for key in sorted(set(self.choice) | set(self.ncalls)):
+            if key in self.timings:
+                times = ' '.join(['%s=%.1f' % (name,1e6*t) for name,t
+                                  in sorted(self.timings[key].items())])
+            elif key in self.choice:
+                times = '(tuning file)'
+            else:
+                times = '(default)'
+            logging.info("  (%d,%d)  %-6s %6d  %s"
+                         % (key[0],key[1],self.module(key) or '-',
+                            self.ncalls.get(key,0),times))
+        return
+
+contr_coulomb = Registry('contr_coulomb',(4,9,14,19))
+coulomb_repulsion = Registry('coulomb_repulsion',(2,6,10,14))
+
+def set_tuning(tuning=True):
+    "Turn the timing of the modules for new classes on or off"
+    contr_coulomb.tuning = coulomb_repulsion.tuning = tuning
+    return
+
+def save(fname=None):
+    "Write the choices to fname, by default the tuning file, if any"
+    contr_coulomb.save(fname)
+    coulomb_repulsion.save(fname)
+    return
+
+def report():
+    "Log the modules used for each angular momentum class"
+    contr_coulomb.report()
+    coulomb_repulsion.report()
+    return
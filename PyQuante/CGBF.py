@@ -20,7 +20,7 @@ from NumWrap import zeros
 from math import sqrt
 
 from PyQuante.cints import overlap
-from PyQuante.chgp import contr_coulomb
+from PyQuante.Backends import contr_coulomb
 
 class CGBF:
     "Class for a contracted Gaussian basis function"
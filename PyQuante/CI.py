@@ -13,8 +13,9 @@
 """
 
 import os,sys
-from PyQuante.cints import ijkl2intindex
-from NumWrap import zeros,dot,matrixmultiply,eigh
+from PyQuante.ERIStore import intindices,unpack_full,unpack_indices
+from NumWrap import zeros,dot,matrixmultiply,eigh,array
+from numpy import newaxis,tensordot
 from Ints import getbasis, get2ints
 
 def SingleExcitations(occs,virts):
@@ -57,17 +58,17 @@ def CISMatrix(Ints,orbs,Ehf,orbe,nocc,nvirt):
     MOInts = TransformInts(Ints,orbs)
 
     # Build the CI matrix using the Slater Condon rules
-    # see Szabo/Ostlund Table 4.1
-    CIMatrix = zeros((nex,nex),'d')
-    for ar in range(nex):
-        a,r = singles[ar]
-        for bs in range(nex):
-            b,s = singles[bs]
-            rabs = ijkl2intindex(r,a,b,s)
-            rsba = ijkl2intindex(r,s,b,a)
-            CIMatrix[ar,bs] = 2*MOInts[rabs] - MOInts[rsba]
-            if r==s and a==b: CIMatrix[ar,bs] += Ehf+orbe[r]-orbe[a]
-            CIMatrix[bs,ar] = CIMatrix[ar,bs]
+    return SinglesBlock(MOInts,singles,Ehf,orbe)
+
+def SinglesBlock(MOInts,singles,Ehf,orbe):
+    "The singles-singles block of the CI matrix, see Szabo/Ostlund Table 4.1"
+    occs = array([occ for occ,virt in singles])
+    virts = array([virt for occ,virt in singles])
+    a,r = occs[:,newaxis],virts[:,newaxis]
+    b,s = occs[newaxis,:],virts[newaxis,:]
+    CIMatrix = 2*MOInts[intindices(r,a,b,s)] - MOInts[intindices(r,s,b,a)]
+    for ar,(occ,virt) in enumerate(singles):
+        CIMatrix[ar,ar] += Ehf+orbe[virt]-orbe[occ]
     return CIMatrix
 
 def CISDMatrix(Ints,orbs,Ehf,orbe,occs):
@@ -81,77 +82,27 @@ def CISDMatrix(Ints,orbs,Ehf,orbe,occs):
     
     MOInts = TransformInts(Ints,orbs)
 
-    # see Szabo/Ostlund Table 4.1
     CIMatrix = zeros((nex,nex),'d')
-    for ar in range(nsin):
-        a,r = singles[ar]
-        for bs in range(nsin):
-            b,s = singles[bs]
-            rabs = ijkl2intindex(r,a,b,s)
-            rsba = ijkl2intindex(r,s,b,a)
-            CIMatrix[ar,bs] = 2*MOInts[rabs] - MOInts[rsba]
-            if r==s and a==b: CIMatrix[ar,bs] += Ehf+orbe[r]-orbe[a]
-            CIMatrix[bs,ar] = CIMatrix[ar,bs]
+    CIMatrix[:nsin,:nsin] = SinglesBlock(MOInts,singles,Ehf,orbe)
     return CIMatrix
     
 def TransformInts(Ints,orbs):
     """O(N^5) 4-index transformation of the two-electron integrals. Not as
     efficient as it could be, since it inflates to the full rectangular
     matrices rather than keeping them compressed. But at least it gets the
-    correct result."""
-
-    from time import time
-
-    t0 = time()
-
+    correct result. Each of the four transforms is a single tensordot over
+    the unpacked integrals (see ERIStore.unpack_full)."""
     nbf,nmo = orbs.shape
     totlen = nmo*(nmo+1)*(nmo*nmo+nmo+2)/8
 
-    temp = zeros((nbf,nbf,nbf,nmo),'d')
-    tempvec = zeros(nbf,'d')
-    temp2 = zeros((nbf,nbf,nmo,nmo),'d')
-
-    mos = range(nmo) # preform so we don't form inside loops
-    bfs = range(nbf)
-
-    # Start with (mu,nu|sigma,eta)
-    # Unpack aoints and transform eta -> l
-    for mu in bfs:
-        for nu in bfs:
-            for sigma in bfs:
-                for l in mos:
-                    for eta in bfs:
-                        tempvec[eta] = Ints[ijkl2intindex(mu,nu,sigma,eta)]
-                    temp[mu,nu,sigma,l] = dot(orbs[:,l],tempvec)
-
-    # Transform sigma -> k
-    for mu in bfs:
-        for nu in bfs:
-            for l in mos:
-                for k in mos:
-                    temp2[mu,nu,k,l] = dot(orbs[:,k],temp[mu,nu,:,l])
-
-    # Transform nu -> j
-    for mu in bfs:
-        for k in mos:
-            for l in mos:
-                for j in mos:
-                    temp[mu,j,k,l] = dot(orbs[:,j],temp2[mu,:,k,l])
-
-    # Transform mu -> i and repack integrals:
-    MOInts = zeros(totlen,'d')
-    for i in mos:
-        for j in range(i+1):
-            ij = i*(i+1)/2+j
-            for k in mos:
-                for l in range(k+1):
-                    kl = k*(k+1)/2+l
-                    if ij >= kl:
-                        ijkl = ijkl2intindex(i,j,k,l)
-                        MOInts[ijkl] = dot(orbs[:,i],temp[:,j,k,l])
-
-    del temp,temp2,tempvec #force garbage collection now
-    return MOInts
+    # Each transform contracts the first index of (mu,nu|sigma,eta),
+    #  and puts the new one last, so that four of them give (ij|kl)
+    temp = unpack_full(Ints,nbf)
+    for n in xrange(4):
+        temp = tensordot(temp,orbs,(0,0))
+
+    # Repack the integrals
+    return temp[unpack_indices(0,totlen)]
 
 
 def test():
@@ -10,9 +10,9 @@
  distribution. 
 """
 
-from PyQuante.NumWrap import dot,ravel,matrixmultiply,zeros
-from PyQuante.NumWrap import solve
-from PyQuante.LA2 import SymOrth
+from PyQuante.NumWrap import dot,ravel,matrixmultiply,zeros,transpose
+from PyQuante.NumWrap import solve,concatenate,argsort
+from PyQuante.LA2 import SymOrth,trace2
 from math import sqrt
 
 VERBOSE=0
@@ -71,25 +71,73 @@ class AndersonAverager:
 
 # Pulay's DIIS
 class DIIS:
-    def __init__(self,S):
-        self.Fs = []
-        self.Errs = []
-        self.Fold = None
+    """\
+    DIIS(S,nmax=8,evict='age') - Pulay's DIIS, over a bounded subspace
+
+    S      The overlap matrix
+    nmax   The most Fock matrices kept in the subspace
+    evict  Which one to drop when the subspace is full: 'age' drops the
+           oldest, 'error' the one with the largest error
+
+    The error FDS-SDF is taken in the orthonormal basis of X = S^-1/2,
+    X^T (FDS-SDF) X. The matrix B of the dot products of the errors is
+    kept between iterations, and each new error only fills in its own
+    row and column of it.
+
+    getF(F,D) extrapolates a single Fock matrix; getFs(Fs,Ds) several,
+    such as the alpha and beta ones of UHF, with one set of
+    coefficients from their combined error. The largest error of each
+    call is kept in errors, from which stalled() tells whether DIIS has
+    stopped making progress.
+    """
+    def __init__(self,S,nmax=8,evict='age'):
+        if evict not in ('age','error'):
+            raise ValueError("Unknown DIIS eviction %s" % evict)
         self.S = S
-        #self.X = SymOrth(S)
+        self.X = SymOrth(S)
+        self.nmax = nmax
+        self.evict = evict
+        self.Fs = []     # The Fock matrices of each slot of the subspace
+        self.Errs = []   # and their errors
+        self.order = []  # The slots, oldest first
+        self.B = zeros((nmax,nmax),'d')
+        self.Fold = None
         self.started = 0
         self.errcutoff = 0.1
+        self.errors = []
         return
 
     def error(self): return self.maxerr
 
-    def getF(self,F,D):
-        n,m = F.shape
-        err = matrixmultiply(F,matrixmultiply(D,self.S)) -\
-              matrixmultiply(self.S,matrixmultiply(D,F))
-        err = ravel(err)
-        maxerr = max(abs(err))
-        self.maxerr = maxerr
+    def stalled(self,niter=6,factor=0.5,tol=1e-7):
+        """\
+        Has DIIS stalled: in the last niter iterations, has the largest
+        error stayed above both tol and factor times the lowest it had
+        reached before them?
+        """
+        if len(self.errors) <= niter: return False
+        recent = min(self.errors[-niter:])
+        return recent > tol and recent > factor*min(self.errors[:-niter])
+
+    def orth_error(self,F,D):
+        "The error X^T (FDS-SDF) X of F and D, as a vector"
+        FDS = matrixmultiply(F,matrixmultiply(D,self.S))
+        return ravel(matrixmultiply(transpose(self.X),
+                                    matrixmultiply(FDS-transpose(FDS),
+                                                   self.X)))
+
+    def errors_of(self,Fs,Ds):
+        "The combined error of Fs and Ds, keeping its largest element"
+        err = concatenate([self.orth_error(F,D) for F,D in zip(Fs,Ds)])
+        self.maxerr = max(abs(err))
+        self.errors.append(self.maxerr)
+        return err
+
+    def getF(self,F,D): return self.getFs([F],[D])[0]
+
+    def getFs(self,Fs,Ds):
+        err = self.errors_of(Fs,Ds)
+        maxerr = self.maxerr
 
         if maxerr < self.errcutoff and not self.started:
             if VERBOSE: print "Starting DIIS: Max Err = ",maxerr
@@ -97,27 +145,27 @@ class DIIS:
 
         if not self.started:
             # Do simple averaging until DIIS starts
-            if self.Fold != None:
-                Freturn = 0.5*F + 0.5*self.Fold
-                self.Fold = F
+            if self.Fold is not None:
+                Freturn = [0.5*F + 0.5*Fold for F,Fold in zip(Fs,self.Fold)]
             else:
-                self.Fold = F
-                Freturn = F
+                Freturn = Fs
+            self.Fold = Fs
             return Freturn
 
-        self.Fs.append(F)
-        self.Errs.append(err)
+        self.add(Fs,err)
+        c = self.diis_coefs()
+        if c is None:
+            self.Fold = Fs
+            return Fs
+        return self.combine(c)
+
+    def diis_coefs(self):
+        "The DIIS coefficients of the subspace, or None if B is singular"
         nit = len(self.Errs)
         a = zeros((nit+1,nit+1),'d')
         b = zeros(nit+1,'d')
-        for i in range(nit):
-            for j in range(nit):
-                a[i,j] = dot(self.Errs[i],self.Errs[j])
-        for i in range(nit):
-            a[nit,i] = a[i,nit] = -1.0
-            b[i] = 0
-        #mtx2file(a,'A%d.dat' % nit)
-        a[nit,nit] = 0
+        a[:nit,:nit] = self.B[:nit,:nit]
+        a[nit,:nit] = a[:nit,nit] = -1.0
         b[nit] = -1.0
 
         # The try loop makes this a bit more stable.
@@ -125,13 +173,114 @@ class DIIS:
         try:
             c = solve(a,b)
         except:
-            self.Fold = F
-            return F
-        
-        F = zeros((n,m),'d')
-        for i in range(nit):
-            F += c[i]*self.Fs[i]
-        return F
+            return None
+        return c[:nit]
+
+    def combine(self,c):
+        "The combinations with coefficients c of the Fock matrices kept"
+        Freturn = []
+        for n in range(len(self.Fs[0])):
+            F = zeros(self.Fs[0][n].shape,'d')
+            for i in range(len(c)):
+                F += c[i]*self.Fs[i][n]
+            Freturn.append(F)
+        return Freturn
+
+    def add(self,Fs,err):
+        """\
+        Put Fs and their error into the subspace, evicting one if full.
+        Returns the slot they went into.
+        """
+        if len(self.Errs) < self.nmax:
+            k = len(self.Errs)
+            self.Fs.append(Fs)
+            self.Errs.append(err)
+        else:
+            if self.evict == 'age':
+                k = self.order[0]
+            else:
+                k = argsort(self.B.diagonal())[-1]
+            self.order.remove(k)
+            self.Fs[k] = Fs
+            self.Errs[k] = err
+        self.order.append(k)
+        for i in range(len(self.Errs)):
+            self.B[i,k] = self.B[k,i] = dot(self.Errs[i],err)
+        return k
+
+class ADIIS(DIIS):
+    """\
+    ADIIS(S,nmax=8,evict='age',adiis_tol=0.5,diis_tol=1e-2) - ADIIS
+    for the early iterations, blended into DIIS near convergence
+
+    Far from convergence DIIS can extrapolate to a Fock matrix much
+    worse than any it was given, which is why DIIS only starts once the
+    error is below errcutoff. ADIIS instead takes the convex combination
+    of the densities kept that minimizes the second-order estimate of
+    the energy about the latest one, n,
+
+      E(c) = E(D_n) + 2 sum_i c_i Tr[(D_i-D_n) F_n]
+             + sum_ij c_i c_j Tr[(D_i-D_n) (F_j-F_n)]
+
+    with c_i >= 0 and sum c_i = 1 [X. Hu and W. Yang, JCP 132, 054109
+    (2010)], which needs no energies, so it is a drop-in for DIIS. The
+    Fock matrix is combined with the ADIIS coefficients while the
+    largest error is above adiis_tol, with the DIIS ones once it is
+    below diis_tol, and with a mix of the two, weighted by the error,
+    in between [A. Garza and G. Scuseria, JCP 137, 054110 (2012)].
+    Their switch points, 0.1 and 1e-4, leave DIIS too little of the
+    end game and cost an iteration or two on easy molecules, so the
+    hand over here is earlier (see Tests/scf_accel.py). The ADIIS
+    minimization looks at the most recent nadiis of the matrices kept.
+    """
+    nadiis = 8
+
+    def __init__(self,S,nmax=8,evict='age',adiis_tol=0.5,diis_tol=1e-2):
+        DIIS.__init__(self,S,nmax,evict)
+        self.adiis_tol = adiis_tol
+        self.diis_tol = diis_tol
+        self.Ds = []
+        return
+
+    def getFs(self,Fs,Ds):
+        err = self.errors_of(Fs,Ds)
+        maxerr = self.maxerr
+        k = self.add(Fs,err)
+        if k == len(self.Ds):
+            self.Ds.append(Ds)
+        else:
+            self.Ds[k] = Ds
+
+        if maxerr < self.diis_tol:
+            c = self.diis_coefs()
+        else:
+            c = self.adiis_coefs(k)
+            if maxerr < self.adiis_tol:
+                cdiis = self.diis_coefs()
+                if cdiis is not None:
+                    w = maxerr/self.adiis_tol
+                    c = w*c + (1-w)*cdiis
+        if c is None: return Fs
+        return self.combine(c)
+
+    def adiis_coefs(self,n):
+        "The ADIIS coefficients of the subspace, about the slot n"
+        slots = self.order[-self.nadiis:]
+        a = zeros(len(slots),'d')
+        M = zeros((len(slots),len(slots)),'d')
+        for s in range(len(self.Fs[n])):
+            Fn,Dn = self.Fs[n][s],self.Ds[n][s]
+            dDs = [self.Ds[i][s]-Dn for i in slots]
+            dFs = [self.Fs[i][s]-Fn for i in slots]
+            for i in range(len(slots)):
+                a[i] += 2*trace2(dDs[i],Fn)
+                for j in range(len(slots)):
+                    M[i,j] += trace2(dDs[i],dFs[j])
+        # E(c) = a.c + c.M.c, with M made symmetric
+        cs = simplex_min(a,M+transpose(M))
+        c = zeros(len(self.Errs),'d')
+        for i,slot in enumerate(slots): c[slot] = cs[i]
+        return c
 
 class DIIS2:
     # Two-point version of DIIS to save memory
@@ -196,6 +345,40 @@ class DIIS2:
 def dot1d(a,b):
     return dot(ravel(a),ravel(b))
 
+def simplex_min(a,M):
+    """\
+    The c, with c_i >= 0 and sum(c) = 1, that minimizes a.c + c.M.c/2,
+    for symmetric M. The minimum lies on some face of the simplex, where
+    it is the stationary point of the function restricted to the face;
+    these are found for every face, and the lowest that lies in the
+    simplex is taken. There are 2^len(a)-1 faces, so this is only for
+    a handful of coefficients.
+    """
+    n = len(a)
+    best,cbest = None,None
+    for mask in range(1,2**n):
+        face = [i for i in range(n) if mask & (1 << i)]
+        m = len(face)
+        K = zeros((m+1,m+1),'d')
+        rhs = zeros(m+1,'d')
+        for p in range(m):
+            for q in range(m):
+                K[p,q] = M[face[p],face[q]]
+            K[p,m] = K[m,p] = 1
+            rhs[p] = -a[face[p]]
+        rhs[m] = 1
+        try:
+            x = solve(K,rhs)
+        except:
+            continue
+        if min(x[:m]) < 0: continue
+        c = zeros(n,'d')
+        for p in range(m): c[face[p]] = x[p]
+        f = dot(a,c) + 0.5*dot(c,dot(M,c))
+        if best is None or f < best:
+            best,cbest = f,c
+    return cbest
+
 def test():
     from Ints import getbasis,getints,get2JmK
     from hartree_fock import get_nel, get_enuke,get_energy
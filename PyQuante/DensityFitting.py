@@ -0,0 +1,223 @@
+"""\
+ DensityFitting.py Density-fitting (resolution of the identity) J and K
+
+ The two-electron integrals are approximated through an auxiliary
+ basis {P} as
+
+   (ij|kl) ~ sum_PQ (ij|P) [V^-1]_PQ (Q|kl),  V_PQ = (P|Q)
+
+ so that only the three-index (ij|P) and two-index (P|Q) integrals are
+ needed, and the storage is O(N^2 Naux) rather than O(N^4). The
+ integrals with a single auxiliary function are computed with the
+ shell code, pairing the auxiliary shell with a unit s function
+ (exponent zero).
+
+ The auxiliary basis is given in the same form as the orbital basis
+ data in PyQuante.Basis, or is made from the orbital basis with
+ even_tempered_aux.
+
+ This program is part of the PyQuante quantum chemistry program suite.
+
+ Copyright (c) 2004, Richard P. Muller. All Rights Reserved.
+
+ PyQuante version 1.2 and later is covered by the modified BSD
+ license. Please see the file LICENSE that is part of this
+ distribution.
+"""
+
+import logging
+from math import log,ceil
+from numpy import zeros,dot,tensordot,reshape,sqrt,transpose
+from numpy.linalg import eigh
+from PyQuante.chgp import shell_coulomb
+from Shell import getshells
+from PairData import PairData
+from Screening import Schwarz
+
+Lsym = 'SPDF'
+
+class DFJK:
+    """\
+    DFJK(bfs,atoms,**opts) - J and K from density-fitted integrals
+
+    Options:      Value   Description
+    --------      -----   -----------
+    aux_basis     None    The auxiliary basis: the name of a basis set,
+                          or basis data in the form of PyQuante.Basis.
+                          If None, an even-tempered auxiliary basis is
+                          made from the orbital basis
+    aux_ratio     2.0     Ratio between successive exponents of the
+                          even-tempered auxiliary basis
+    aux_cutoff    1e-10   Eigenvalues of the metric (P|Q) below this
+                          are dropped, to avoid linear dependencies
+    schwarz_tol   1e-12   Skip the (P|Q) and (P|ij) whose Schwarz
+                          bounds, sqrt((P|P)(Q|Q)) and
+                          sqrt((P|P)(ij|ij)), are below this value
+
+    The fitted three-index integrals B[P,i,j], with (ij|kl) ~ sum_P
+    B[P,i,j]*B[P,k,l], are formed once, at construction. It has the
+    same getJ/getK/get2JmK/getJK methods as the other integral types,
+    so it can be used wherever the stored integrals are.
+    """
+    def __init__(self,bfs,atoms,**opts):
+        from Ints import getbasis
+        aux_basis = opts.get('aux_basis')
+        aux_ratio = opts.get('aux_ratio',2.0)
+        aux_cutoff = opts.get('aux_cutoff',1e-10)
+        schwarz_tol = opts.get('schwarz_tol',1e-12)
+        if aux_basis is None:
+            aux_basis = even_tempered_aux(bfs,atoms,aux_ratio)
+        self.auxbfs = getbasis(atoms,aux_basis)
+        self.nbf = len(bfs)
+        logging.info("Density fitting with %d auxiliary functions"
+                     % len(self.auxbfs))
+        shells = getshells(bfs)
+        auxshells = getshells(self.auxbfs)
+        pairdata = PairData(shells)
+        V = get_metric(auxshells,len(self.auxbfs),schwarz_tol)
+        val,vec = eigh(V)
+        keep = val > aux_cutoff
+        if not keep.all():
+            logging.info("Dropping %d auxiliary functions from the metric"
+                         % (len(val)-keep.sum()))
+        # V^-1 = X X^T, with X = U val^-1/2 over the eigenvalues kept
+        X = vec[:,keep]/sqrt(val[keep])
+        screen = None
+        if schwarz_tol:
+            screen = Schwarz(bfs,schwarz_tol,shells,pairdata)
+        A = get_3index(shells,auxshells,self.nbf,len(self.auxbfs),
+                       pairdata,screen,sqrt(abs(V.diagonal())))
+        if screen: screen.report('(P|IJ) shell triples')
+        naux = X.shape[1]
+        self.B = reshape(dot(transpose(X),reshape(A,(len(self.auxbfs),-1))),
+                         (naux,self.nbf,self.nbf))
+        return
+
+    def getJ(self,D): return self.getJK([D],doK=False)[0][0]
+    def getK(self,D): return self.getJK([D],doJ=False)[1][0]
+
+    def get2JmK(self,D):
+        Js,Ks = self.getJK([D])
+        return 2*Js[0]-Ks[0]
+
+    def getJK(self,Ds,doJ=True,doK=True):
+        """\
+        Js,Ks = getJK(Ds)
+
+        Lists of the Coulomb and exchange matrices for each of the
+        density matrices in Ds. If doJ (doK) is False, Js (Ks) is empty.
+        """
+        B = self.B
+        Js,Ks = [],[]
+        for D in Ds:
+            if doJ:
+                # J_ij = sum_P B_Pij gamma_P, gamma_P = sum_kl B_Pkl D_kl
+                gamma = tensordot(B,D,([1,2],[0,1]))
+                Js.append(tensordot(gamma,B,(0,0)))
+            if doK:
+                # K_il = sum_P (B_P D B_P)_il
+                BD = tensordot(B,D,(2,0))
+                Ks.append(tensordot(BD,B,([0,2],[0,1])))
+        return Js,Ks
+
+def unit_shell(shell):
+    "An s function with a zero exponent (=1 everywhere) at shell's center"
+    return shell.origin(),[0.0],[1.0],[(0,0,0)],[1.0]
+
+def metric_block(P,Q):
+    "The (P|Q) of the auxiliary shells P and Q, as a (P.nbf,Q.nbf) array"
+    vals = shell_coulomb(P.data(),unit_shell(P),Q.data(),unit_shell(Q))
+    return reshape(vals,(P.nbf,Q.nbf))
+
+def get_metric(auxshells,naux,tol=0):
+    """\
+    The two-index Coulomb metric (P|Q) over the auxiliary basis. The
+    diagonal shell blocks are formed first, and the off-diagonal ones
+    whose Schwarz bound sqrt((P|P)(Q|Q)) is below tol are left zero.
+    """
+    V = zeros((naux,naux),'d')
+    Qaux = []
+    for P in auxshells:
+        sP = slice(P.start,P.start+P.nbf)
+        V[sP,sP] = metric_block(P,P)
+        Qaux.append(sqrt(abs(V[sP,sP].diagonal()).max()))
+    nskipped = ntested = 0
+    for p,P in enumerate(auxshells):
+        sP = slice(P.start,P.start+P.nbf)
+        for q in xrange(p):
+            Q = auxshells[q]
+            ntested += 1
+            if Qaux[p]*Qaux[q] < tol:
+                nskipped += 1
+                continue
+            sQ = slice(Q.start,Q.start+Q.nbf)
+            block = metric_block(P,Q)
+            V[sP,sQ] = block
+            V[sQ,sP] = transpose(block)
+    if tol:
+        logging.info("Schwarz screening (tol=%g) skipped %d of %d (P|Q) "
+                     "shell pairs" % (tol,nskipped,ntested))
+    return V
+
+def get_3index(shells,auxshells,nbf,naux,pairdata=None,screen=None,
+               Qaux=None):
+    """\
+    The three-index integrals (P|ij) as a (naux,nbf,nbf) array. If
+    screen (a Screening.Schwarz object over shells) is given, with
+    Qaux, the sqrt((P|P)) of each auxiliary function, the shell triples
+    whose bound sqrt((P|P))*sqrt((ij|ij)) is below screen.tol are
+    skipped, and counted in screen.
+    """
+    A = zeros((naux,nbf,nbf),'d')
+    if pairdata is None: pairdata = PairData(shells)
+    for P in auxshells:
+        unit = unit_shell(P)
+        sP = slice(P.start,P.start+P.nbf)
+        if screen: QP = Qaux[sP].max()
+        for i,I in enumerate(shells):
+            sI = slice(I.start,I.start+I.nbf)
+            for j,J in enumerate(shells):
+                if J.start > I.start: break
+                if screen:
+                    screen.ntested += 1
+                    if QP*screen.Qshell[i,j] < screen.tol:
+                        screen.nskipped += 1
+                        continue
+                sJ = slice(J.start,J.start+J.nbf)
+                vals = shell_coulomb(I.data(),J.data(),P.data(),unit,
+                                     pairdata.get(I,J))
+                block = transpose(reshape(vals,(I.nbf,J.nbf,P.nbf)),(2,0,1))
+                A[sP,sI,sJ] = block
+                A[sP,sJ,sI] = transpose(block,(0,2,1))
+    return A
+
+def even_tempered_aux(bfs,atoms,ratio=2.0):
+    """\
+    basis_data = even_tempered_aux(bfs,atoms,ratio=2.0)
+
+    Make an even-tempered auxiliary basis, in the form of the basis
+    data in PyQuante.Basis, for the orbital basis bfs. For each
+    element, and each auxiliary angular momentum L up to twice the
+    largest in the orbital basis (at most F), the exponents span the
+    range of the products of orbital primitives whose angular momenta
+    add up to at least L, in steps of ratio.
+    """
+    atno = dict([(atom.atid,atom.atno) for atom in atoms])
+    exps = {}  # exps[Z][l] = orbital exponents of angular momentum l
+    for bf in bfs:
+        Z = atno[bf.atid]
+        l = sum(bf.powers())
+        exps.setdefault(Z,{}).setdefault(l,set()).update(bf.exps())
+    basis_data = {}
+    for Z,byl in exps.items():
+        lmax = max(byl.keys())
+        shells = []
+        for L in xrange(min(2*lmax,len(Lsym)-1)+1):
+            products = [a+b for l1 in byl for l2 in byl if l1+l2 >= L
+                        for a in byl[l1] for b in byl[l2]]
+            amin,amax = min(products),max(products)
+            n = int(ceil(log(amax/amin)/log(ratio)))+1
+            for k in xrange(n):
+                shells.append((Lsym[L],[(amin*ratio**k,1.0)]))
+        basis_data[Z] = shells
+    return basis_data
@@ -0,0 +1,189 @@
+"""\
+ DirectJK.py Integral-direct formation of the J and K matrices
+
+ A DirectJK object stands in for the stored two-electron integrals:
+ no integrals are kept between calls, and they are recomputed a
+ shell quartet at a time whenever J or K is needed. It has the same
+ getJ/getK/get2JmK/getJK methods as the stored integral types, so
+ the Ints.py functions of the same name, and hence rhf, uhf and the
+ PyQuante2 Hamiltonians, work with it unchanged.
+
+ Each build is incremental: the J and K of the last call are kept,
+ and only J(dD) and K(dD) are formed for the change dD in the
+ density. Shell quartets are skipped when their Schwarz bound times
+ the largest relevant element of dD is below the threshold, and as
+ the SCF converges dD shrinks, so later iterations are much cheaper
+ than the first one. Every so often J and K are rebuilt from the full
+ density, so that the screening errors don't accumulate.
+
+ This program is part of the PyQuante quantum chemistry program suite.
+
+ Copyright (c) 2004, Richard P. Muller. All Rights Reserved.
+
+ PyQuante version 1.2 and later is covered by the modified BSD
+ license. Please see the file LICENSE that is part of this
+ distribution.
+"""
+
+import logging
+from numpy import array,zeros,ravel,reshape,transpose,concatenate
+from numpy import bincount,indices
+from Shell import getshells,coulomb
+from Screening import Schwarz
+from PairData import PairData
+
+class DirectJK:
+    """\
+    DirectJK(bfs,**opts) - J and K recomputed from the integrals each call
+
+    Options:      Value   Description
+    --------      -----   -----------
+    schwarz_tol   1e-12   Skip shell quartets whose Schwarz bound times
+                          the largest element of the density (change)
+                          they multiply is below this value
+    direct_rebuild 10     Form J and K from the full density, rather
+                          than from the change in the density, every
+                          direct_rebuild calls; 0 or less never
+                          rebuilds after the first call
+    pair_tol      1e-15   Drop primitive pairs whose prefactor is below
+                          this value (see PairData.py)
+
+    The J and K of the last set of densities are cached, so asking for
+    getJ(D) and then getK(D) only computes the integrals once.
+    """
+    def __init__(self,bfs,**opts):
+        self.nbf = len(bfs)
+        self.shells = getshells(bfs)
+        self.tol = opts.get('schwarz_tol',1e-12)
+        self.rebuild = opts.get('direct_rebuild',10)
+        self.pairdata = PairData(self.shells,opts.get('pair_tol',1e-15))
+        self.screen = Schwarz(bfs,self.tol or 0,self.shells,self.pairdata)
+        self.ncalls = 0
+        self.Ds = None
+        self.Js = self.Ks = None
+        return
+
+    def getJ(self,D): return self.getJK([D])[0][0]
+    def getK(self,D): return self.getJK([D])[1][0]
+
+    def get2JmK(self,D):
+        Js,Ks = self.getJK([D])
+        return 2*Js[0]-Ks[0]
+
+    def getJK(self,Ds):
+        """\
+        Js,Ks = getJK(Ds)
+
+        Lists of the Coulomb and exchange matrices for each of the
+        density matrices in Ds.
+        """
+        Ds = [array(D) for D in Ds]
+        if self.Ds is not None and len(Ds) == len(self.Ds):
+            dDs = [D-D0 for D,D0 in zip(Ds,self.Ds)]
+            if max([abs(dD).max() for dD in dDs]) == 0:
+                return self.Js,self.Ks
+            incremental = self.rebuild <= 0 or \
+                          self.ncalls % self.rebuild != 0
+        else:
+            incremental = False
+        if incremental:
+            dJs,dKs = self.build(dDs)
+            Js = [J0+dJ for J0,dJ in zip(self.Js,dJs)]
+            Ks = [K0+dK for K0,dK in zip(self.Ks,dKs)]
+        else:
+            Js,Ks = self.build(Ds)
+        self.ncalls += 1
+        self.Ds,self.Js,self.Ks = Ds,Js,Ks
+        return Js,Ks
+
+    def build(self,Ds):
+        "J and K for the densities Ds, straight from the integrals"
+        nbf = self.nbf
+        shells = self.shells
+        nsh = len(shells)
+        # Largest element of any of the densities in each shell block
+        Dshell = zeros((nsh,nsh),'d')
+        for I in xrange(nsh):
+            si = slice(shells[I].start,shells[I].start+shells[I].nbf)
+            for J in xrange(nsh):
+                sj = slice(shells[J].start,shells[J].start+shells[J].nbf)
+                Dshell[I,J] = max([abs(D[si,sj]).max() for D in Ds])
+        Qshell = self.screen.Qshell
+        Dfs = [ravel(D) for D in Ds]
+        Js = [zeros(nbf*nbf,'d') for D in Ds]
+        Ks = [zeros(nbf*nbf,'d') for D in Ds]
+        self.screen.reset()
+        for I in xrange(nsh):
+            # The quartets with the same first shell are contracted
+            #  with the densities together
+            batch = QuartetBatch(self.pairdata)
+            for J in xrange(I+1):
+                IJ = I*(I+1)/2+J
+                for K in xrange(I+1):
+                    for L in xrange(K+1):
+                        KL = K*(K+1)/2+L
+                        if KL > IJ: break
+                        self.screen.ntested += 1
+                        if self.tol:
+                            dmax = max(Dshell[I,J],Dshell[K,L],
+                                       Dshell[I,K],Dshell[I,L],
+                                       Dshell[J,K],Dshell[J,L])
+                            if Qshell[I,J]*Qshell[K,L]*dmax < self.tol:
+                                self.screen.nskipped += 1
+                                continue
+                        batch.add(shells[I],shells[J],shells[K],shells[L])
+            batch.contract(nbf,Dfs,Js,Ks)
+        self.screen.report('shell quartets in the direct J/K build')
+        # Only half of the permutations were added; the other half
+        #  are the transposes
+        Js = [reshape(J,(nbf,nbf)) for J in Js]
+        Ks = [reshape(K,(nbf,nbf)) for K in Ks]
+        return [J+transpose(J) for J in Js],[K+transpose(K) for K in Ks]
+
+class QuartetBatch:
+    """\
+    The integrals of a set of unique shell quartets, along with the
+    basis function indices of each integral, to be contracted with the
+    density matrices by contract().
+    """
+    offsets = {} # Local indices for each shape of shell quartet
+
+    def __init__(self,pairdata=None):
+        self.pairdata = pairdata
+        self.values = []
+        self.indices = [[],[],[],[]]
+        return
+
+    def add(self,a,b,c,d):
+        "Compute the integrals of the unique shell quartet (ab|cd)"
+        shape = a.nbf,b.nbf,c.nbf,d.nbf
+        if shape not in self.offsets:
+            self.offsets[shape] = [ravel(x) for x in indices(shape)]
+        V = array(coulomb(a,b,c,d,self.pairdata))
+        # Scale for the permutations that give the same quartet
+        if a is b: V *= 0.5
+        if c is d: V *= 0.5
+        if a is c and b is d: V *= 0.5
+        self.values.append(V)
+        for n,sh in enumerate([a,b,c,d]):
+            self.indices[n].append(self.offsets[shape][n]+sh.start)
+        return
+
+    def contract(self,nbf,Dfs,Js,Ks):
+        """\
+        Add the contributions to the flattened J and K of each density.
+        Only the permutations that aren't transposes of each other are
+        added, which for symmetric densities leaves J+J.T and K+K.T.
+        """
+        if not self.values: return
+        v = concatenate(self.values)
+        i,j,k,l = [concatenate(x) for x in self.indices]
+        n2 = nbf*nbf
+        for Df,J,K in zip(Dfs,Js,Ks):
+            J += bincount(i*nbf+j,2*v*Df[k*nbf+l],n2)
+            J += bincount(k*nbf+l,2*v*Df[i*nbf+j],n2)
+            K += bincount(i*nbf+l,v*Df[j*nbf+k],n2)
+            K += bincount(j*nbf+l,v*Df[i*nbf+k],n2)
+            K += bincount(i*nbf+k,v*Df[j*nbf+l],n2)
+            K += bincount(j*nbf+k,v*Df[i*nbf+l],n2)
+        return
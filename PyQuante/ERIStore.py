@@ -0,0 +1,528 @@
+"""\
+ ERIStore.py Memory-mapped on-disk storage of two-electron integrals
+
+ An ERIFile holds the integrals in the same packed ijkl2intindex layout
+ as the array('d') made by Ints.get2ints, but in a file that is mapped
+ into memory with numpy.memmap, so that basis sets whose integrals
+ don't fit into RAM can still be used. The J and K matrices are formed
+ by reading the file sequentially, a block at a time.
+
+ The file starts with a short header holding the number of basis
+ functions and a fingerprint of the basis set, so that a later job on
+ the same molecule and basis can reopen the file instead of computing
+ the integrals again.
+
+ A CompressedERIs holds the integrals in less memory: the larger ones
+ in double precision, and the rest in single precision, or, in the
+ sparse layout, only those that aren't negligible. It knows a bound on
+ the error this makes in the energy. It can be filled a block at a
+ time, from the PackedBlocks that get2ints computes the integrals
+ into, so the full array of doubles never has to exist.
+
+ The module also holds the vectorized index helpers for the packed
+ layout (unpack_indices, intindices, slice_indices, unpack_full), which
+ let a consumer fetch many integrals with one numpy indexing operation
+ instead of one ijkl2intindex call each.
+
+ This program is part of the PyQuante quantum chemistry program suite.
+
+ Copyright (c) 2004, Richard P. Muller. All Rights Reserved.
+
+ PyQuante version 1.2 and later is covered by the modified BSD
+ license. Please see the file LICENSE that is part of this
+ distribution.
+"""
+
+import os,struct,logging
+from numpy import memmap,bincount,sqrt,floor,where,zeros,reshape,array
+from numpy import arange,int64,maximum,minimum,asarray,ndarray,frombuffer
+from numpy import integer,uint32,float32,concatenate,searchsorted
+from numpy import empty,newaxis
+
+magic = 'PYQERI01'
+header_format = '8sqq32s'  # magic, nbf, complete flag, fingerprint
+header_size = 64           # padded, so that the data is aligned
+
+def fingerprint(bfs,*extra):
+    "A hash of everything the integrals over bfs depend upon"
+    import hashlib
+    data = [(bf.origin(),bf.powers(),bf.exps(),bf.coefs()) for bf in bfs]
+    return hashlib.md5(repr((data,extra))).hexdigest()
+
+class ERIFile:
+    """\
+    ERIFile(filename,bfs,*extra) - Packed integrals stored in a file
+
+    filename  The file holding the integrals
+    bfs       The list of CGBFs
+    extra     Anything else the integrals depend upon (e.g. the
+              screening threshold), added to the fingerprint
+
+    If filename already holds the complete integrals for the same
+    basis set, it is reopened, and the complete attribute is True.
+    Otherwise a new file is made, which the caller fills through the
+    data attribute, and then calls finish().
+
+    The object can be indexed like the array from get2ints, and the
+    getJ/getK/get2JmK methods are used by the functions of the same
+    name in Ints.py.
+    """
+    def __init__(self,filename,bfs,*extra):
+        self.filename = filename
+        self.nbf = nbf = len(bfs)
+        self.totlen = nbf*(nbf+1)*(nbf*nbf+nbf+2)/8
+        self.fingerprint = fingerprint(bfs,*extra)
+        self.complete = self.check_header()
+        if self.complete:
+            logging.info("Reusing the integrals in %s" % filename)
+            self.data = memmap(filename,'d','r',header_size,(self.totlen,))
+        else:
+            self.write_header(False)
+            self.data = memmap(filename,'d','r+',header_size,(self.totlen,))
+        return
+
+    def check_header(self):
+        "Does the file hold the complete integrals for this basis?"
+        if not os.path.exists(self.filename): return False
+        size = header_size + 8*self.totlen
+        if os.path.getsize(self.filename) != size: return False
+        f = open(self.filename,'rb')
+        fields = struct.unpack(header_format,
+                               f.read(struct.calcsize(header_format)))
+        f.close()
+        return fields == (magic,self.nbf,1,self.fingerprint)
+
+    def write_header(self,complete):
+        if complete:
+            f = open(self.filename,'r+b')
+        else:
+            f = open(self.filename,'wb')
+            f.truncate(header_size + 8*self.totlen)
+        f.write(struct.pack(header_format,magic,self.nbf,int(complete),
+                            self.fingerprint))
+        f.close()
+        return
+
+    def finish(self):
+        "Flush the integrals to disk, and mark the file as complete"
+        self.data.flush()
+        self.write_header(True)
+        self.complete = True
+        return
+
+    def __len__(self): return self.totlen
+    def __getitem__(self,index): return self.data[index]
+    def __setitem__(self,index,value): self.data[index] = value
+
+    def blocks(self,blocksize=2**20):
+        """\
+        Iterate over (start,values) for consecutive blocks of at most
+        blocksize integrals, read sequentially from the file.
+        """
+        for start in xrange(0,self.totlen,blocksize):
+            yield start,array(self.data[start:start+blocksize])
+        return
+
+    def getJ(self,D): return self.getJK([D],doK=False)[0][0]
+    def getK(self,D): return self.getJK([D],doJ=False)[1][0]
+
+    def get2JmK(self,D):
+        Js,Ks = self.getJK([D])
+        return 2*Js[0]-Ks[0]
+
+    def getJK(self,Ds,doJ=True,doK=True,blocksize=2**20):
+        """\
+        Js,Ks = getJK(Ds)
+
+        Lists of the Coulomb and exchange matrices for each of the
+        density matrices in Ds, from a single pass through the file.
+        If doJ (doK) is False, Js (Ks) is empty. Each unique integral
+        (ij|kl) is scaled by its degeneracy and applied to all eight
+        of its permutations.
+        """
+        nbf = self.nbf
+        Dfs = [reshape(D,(nbf*nbf,)) for D in Ds]
+        Js = [zeros(nbf*nbf,'d') for D in Ds]
+        Ks = [zeros(nbf*nbf,'d') for D in Ds]
+        for start,v in self.blocks(blocksize):
+            add_jk(unpack_indices(start,len(v)),v,Dfs,Js,Ks,doJ,doK,nbf)
+        return finish_jk(Js,Ks,doJ,doK,nbf)
+
+class CompressedERIs:
+    """\
+    CompressedERIs(Ints,single_tol=1e-4,drop_tol=None) - Packed integrals
+    in reduced precision
+
+    Ints        The packed integrals (e.g. an ERIArray or ERIFile), or
+                None to add them a block at a time, in order, with add,
+                and call finish after the last
+    single_tol  Integrals with |(ij|kl)| below this are kept in single
+                precision, the rest in double precision
+    drop_tol    If not None, use the sparse layout, and drop the
+                integrals with |(ij|kl)| below this
+    totlen      The number of integrals, if Ints is None
+
+    The double precision integrals are a sorted list of their indices
+    and values. The single precision ones are either a float32 array
+    over all of the integrals (with zeros where the double list has
+    the integral), which halves the memory, or, in the sparse layout,
+    a second sorted list of indices and float32 values. Ints is read
+    a block at a time, so an ERIFile is never all in memory at once.
+
+    A float32 keeps about 7 digits, so each integral in single
+    precision is off by at most 6e-8 single_tol, and each dropped one
+    by at most drop_tol. error_sum holds the sum of these errors over
+    all the integrals, times the number of permutations of each, from
+    which energy_error bounds the error in the energy before any SCF
+    is run.
+
+    The object can be indexed like the array from get2ints, by an
+    index or an integer array of them, and has the getJ/getK/get2JmK/
+    getJK methods used by the functions of the same name in Ints.py.
+    """
+    def __init__(self,Ints,single_tol=1e-4,drop_tol=None,blocksize=2**20,
+                 totlen=None):
+        if Ints is not None:
+            values = ints_view(Ints)
+            totlen = len(values)
+        self.totlen = totlen
+        self.nbf = nbf_from_totlen(self.totlen)
+        self.single_tol = single_tol
+        self.drop_tol = drop_tol
+        self.sparse = drop_tol is not None
+        self.blocksize = blocksize
+        if self.totlen < 2**32:
+            self.index_type = uint32
+        else:
+            self.index_type = int64
+        if not self.sparse: self.single = zeros(self.totlen,float32)
+        self.parts = [],[],[],[] # dindex,dvalues,sindex,svalues
+        self.filled = 0
+        self.error_sum = 0.
+        if Ints is None: return
+        for start in xrange(0,self.totlen,blocksize):
+            self.add(array(values[start:start+blocksize],'d'))
+        self.finish()
+        return
+
+    def add(self,v):
+        "Compress the next len(v) integrals, v, given in double precision"
+        if self.filled+len(v) > self.totlen:
+            raise ValueError("More than %d integrals added" % self.totlen)
+        # A blocksize at a time, to bound the temporaries
+        for n in xrange(0,len(v),self.blocksize):
+            self.add_block(v[n:n+self.blocksize])
+        return
+
+    def add_block(self,v):
+        "Compress the next len(v) integrals, at most blocksize of them"
+        start = self.filled
+        dindex,dvalues,sindex,svalues = self.parts
+        big = abs(v) >= self.single_tol
+        dindex.append((start+big.nonzero()[0]).astype(self.index_type))
+        dvalues.append(v[big])
+        if self.sparse:
+            keep = (~big) & (abs(v) >= self.drop_tol) & (v != 0)
+            sindex.append((start+keep.nonzero()[0]).astype(self.index_type))
+            svalues.append(v[keep].astype(float32))
+            stored = zeros(len(v),'d')
+            stored[keep] = svalues[-1]
+        else:
+            self.single[start:start+len(v)] = where(big,0,v)
+            stored = self.single[start:start+len(v)].astype('d')
+        stored[big] = v[big]
+        err = abs(v-stored)
+        n = err.nonzero()[0]
+        self.error_sum += \
+            8*(err[n]*degeneracy_scale(*index_quartets(start+n))).sum()
+        self.filled += len(v)
+        return
+
+    def finish(self):
+        "Join the blocks, once all of the integrals have been added"
+        if self.filled != self.totlen:
+            raise ValueError("Only %d of the %d integrals were added"
+                             % (self.filled,self.totlen))
+        dindex,dvalues,sindex,svalues = self.parts
+        self.dindex = concatenate(dindex)
+        self.dvalues = concatenate(dvalues)
+        if self.sparse:
+            self.sindex = concatenate(sindex)
+            self.svalues = concatenate(svalues)
+        del self.parts
+        return
+
+    def __len__(self): return self.totlen
+
+    def __getitem__(self,index):
+        index = asarray(index,int64)
+        flat = index.ravel()
+        if self.sparse:
+            v = sorted_lookup(self.sindex,self.svalues,flat)
+        else:
+            v = self.single[flat].astype('d')
+        v += sorted_lookup(self.dindex,self.dvalues,flat)
+        if index.ndim == 0: return float(v[0])
+        return reshape(v,index.shape)
+
+    def nbytes(self):
+        "The memory taken by the integrals, in bytes"
+        arrays = [self.dindex,self.dvalues]
+        if self.sparse:
+            arrays.extend([self.sindex,self.svalues])
+        else:
+            arrays.append(self.single)
+        return sum([a.nbytes for a in arrays])
+
+    def counts(self):
+        "The number of integrals in double precision, single, and dropped"
+        ndouble = len(self.dindex)
+        if self.sparse:
+            nsingle = len(self.sindex)
+        else:
+            nsingle = self.totlen-ndouble
+        return ndouble,nsingle,self.totlen-ndouble-nsingle
+
+    def energy_error(self,D=None,dmax=1.):
+        """\
+        A bound on the error of the closed-shell two-electron energy
+        tr D(2J-K) (as in hartree_fock.rhf) from the reduced precision,
+        for the density matrix D, or else for any density none of whose
+        elements is bigger than dmax. Each permutation of an integral
+        enters 2J-K three times, times a product of two elements of D.
+        """
+        if D is not None: dmax = abs(D).max()
+        return 3*dmax*dmax*self.error_sum
+
+    def report(self):
+        "Log the sizes of the parts, and the error bound"
+        logging.info("Compressed integrals: %d double, %d single and %d "
+                     "dropped; %.1f MB in place of %.1f MB; energy error "
+                     "bound %g max|D|^2" % (self.counts()
+                     +(self.nbytes()/1e6,8*self.totlen/1e6,
+                       self.energy_error())))
+        return
+
+    def entries(self,blocksize=2**20):
+        """\
+        Iterate over (index,values) for blocks of at most blocksize of
+        the stored nonzero integrals, with the values in double precision
+        """
+        lists = [(self.dindex,self.dvalues)]
+        if self.sparse: lists.append((self.sindex,self.svalues))
+        for index,values in lists:
+            for start in xrange(0,len(index),blocksize):
+                yield (index[start:start+blocksize],
+                       values[start:start+blocksize].astype('d'))
+        if not self.sparse:
+            for start in xrange(0,self.totlen,blocksize):
+                v = self.single[start:start+blocksize]
+                n = v.nonzero()[0]
+                yield start+n,v[n].astype('d')
+        return
+
+    def getJ(self,D): return self.getJK([D],doK=False)[0][0]
+    def getK(self,D): return self.getJK([D],doJ=False)[1][0]
+
+    def get2JmK(self,D):
+        Js,Ks = self.getJK([D])
+        return 2*Js[0]-Ks[0]
+
+    def getJK(self,Ds,doJ=True,doK=True,blocksize=2**20):
+        """\
+        Js,Ks = getJK(Ds)
+
+        Lists of the Coulomb and exchange matrices for each of the
+        density matrices in Ds, from a single pass through the stored
+        integrals. If doJ (doK) is False, Js (Ks) is empty.
+        """
+        nbf = self.nbf
+        Dfs = [reshape(D,(nbf*nbf,)) for D in Ds]
+        Js = [zeros(nbf*nbf,'d') for D in Ds]
+        Ks = [zeros(nbf*nbf,'d') for D in Ds]
+        for index,v in self.entries(blocksize):
+            add_jk(index_quartets(index),v,Dfs,Js,Ks,doJ,doK,nbf)
+        return finish_jk(Js,Ks,doJ,doK,nbf)
+
+class PackedBlock:
+    """\
+    PackedBlock(start,stop) - The packed integrals start..stop-1
+
+    A block of the packed integral array, which is read and written
+    by the indices of the whole array, so it can stand in for the
+    array where the integrals of a range of shell quartets are stored.
+    """
+    def __init__(self,start,stop):
+        self.start = start
+        self.values = zeros(stop-start,'d')
+        return
+
+    def __len__(self): return len(self.values)
+
+    def __getitem__(self,index):
+        return self.values[index-self.start]
+
+    def __setitem__(self,index,values):
+        self.values[index-self.start] = values
+        return
+
+def sorted_lookup(sorted_index,values,index):
+    """\
+    The values at each of index in the sorted list sorted_index, and 0
+    where index isn't in the list
+    """
+    v = zeros(len(index),'d')
+    if not len(sorted_index): return v
+    index = index.astype(sorted_index.dtype)
+    pos = minimum(searchsorted(sorted_index,index),len(sorted_index)-1)
+    found = sorted_index[pos] == index
+    v[found] = values[pos[found]]
+    return v
+
+def nbf_from_totlen(totlen):
+    "The number of basis functions that give totlen packed integrals"
+    from math import sqrt
+    npair = int((sqrt(8*totlen+1)-1)/2+0.5)
+    return int((sqrt(8*npair+1)-1)/2+0.5)
+
+def degeneracy_scale(i,j,k,l):
+    "1/8 of the number of permutations of each (ij|kl)"
+    return where(i==j,0.5,1)*where(k==l,0.5,1)\
+           *where(i*(i+1)/2+j == k*(k+1)/2+l,0.5,1)
+
+def add_jk((i,j,k,l),v,Dfs,Js,Ks,doJ,doK,nbf):
+    """\
+    Add the contributions of the unique integrals v = (ij|kl) to the
+    flattened J and K matrices for each of the flattened densities Dfs.
+    Each integral is scaled by its degeneracy and applied to all eight
+    of its permutations.
+    """
+    v = v*degeneracy_scale(i,j,k,l)
+    for a,b,c,d in [(i,j,k,l),(j,i,k,l),(i,j,l,k),(j,i,l,k)]:
+        # (ab|cd) and (cd|ab)
+        for Df,J,K in zip(Dfs,Js,Ks):
+            if doJ:
+                J += bincount(a*nbf+b,v*Df[c*nbf+d],nbf*nbf)
+                J += bincount(c*nbf+d,v*Df[a*nbf+b],nbf*nbf)
+            if doK:
+                K += bincount(a*nbf+d,v*Df[b*nbf+c],nbf*nbf)
+                K += bincount(c*nbf+b,v*Df[d*nbf+a],nbf*nbf)
+    return
+
+def finish_jk(Js,Ks,doJ,doK,nbf):
+    "Reshape the flattened J and K of add_jk into the lists getJK returns"
+    Js = [reshape(J,(nbf,nbf)) for J in Js]
+    Ks = [reshape(K,(nbf,nbf)) for K in Ks]
+    if not doJ: Js = []
+    if not doK: Ks = []
+    return Js,Ks
+
+def unpack_pair(n):
+    "Invert n = i*(i+1)/2+j, i>=j, for an integer array n"
+    i = floor((sqrt(8*n+1.)-1)/2).astype(n.dtype)
+    # Guard against rounding in the square root
+    i = where(i*(i+1)/2 > n,i-1,i)
+    i = where((i+1)*(i+2)/2 <= n,i+1,i)
+    return i,n-i*(i+1)/2
+
+def unpack_indices(start,n):
+    "The i,j,k,l of the packed integrals start..start+n-1"
+    return index_quartets(arange(start,start+n,dtype=int64))
+
+def index_quartets(index):
+    "The i,j,k,l of the packed integrals with the integer array index"
+    ij,kl = unpack_pair(asarray(index,int64))
+    i,j = unpack_pair(ij)
+    k,l = unpack_pair(kl)
+    return i,j,k,l
+
+# The vectorized counterparts of ijkl2intindex. Consumers that need many
+#  integrals build an array of their indices once, and use it to index
+#  the packed integrals (see ints_view) in a single operation.
+
+def pair_index(i,j):
+    "i*(i+1)/2+j, with i and j swapped if j>i, for integer arrays"
+    big = maximum(i,j)
+    return big*(big+1)/2+minimum(i,j)
+
+def intindices(i,j,k,l):
+    """\
+    The ijkl2intindex of (ij|kl) for integer arrays i,j,k,l, which are
+    broadcast against each other
+    """
+    return pair_index(pair_index(asarray(i,int64),asarray(j,int64)),
+                      pair_index(asarray(k,int64),asarray(l,int64)))
+
+def slice_indices(nbf,i=None,j=None,k=None,l=None):
+    """\
+    The indices of a slice of the integrals (ij|kl). Each of i,j,k,l
+    is either an index, a sequence of indices, or None for all nbf of
+    them; the result has an axis for each one that isn't an index, in
+    order. E.g. slice_indices(nbf,i,j) gives the (nbf,nbf) indices of
+    (ij|kl) over k,l, and slice_indices(nbf,i,None,j) those of (ik|jl).
+    """
+    axes = [a for a in (i,j,k,l) if not isinstance(a,(int,long,integer))]
+    n,args = 0,[]
+    for a in (i,j,k,l):
+        if isinstance(a,(int,long,integer)):
+            args.append(a)
+            continue
+        if a is None: a = arange(nbf)
+        shape = [1]*len(axes)
+        shape[n] = len(a)
+        args.append(reshape(asarray(a,int64),shape))
+        n += 1
+    return intindices(*args)
+
+def ints_view(Ints):
+    """\
+    The packed integrals as an array that can be indexed by arrays:
+    a plain ndarray view of an array (e.g. an ERIArray), a numpy view
+    of an array('d') or RawArray, the memmap of an ERIFile, a
+    PackedBlock, or a CompressedERIs (which can't be sliced or written
+    to)
+    """
+    if isinstance(Ints,ERIFile): return Ints.data
+    if isinstance(Ints,(CompressedERIs,PackedBlock)): return Ints
+    if isinstance(Ints,ndarray): return Ints.view(ndarray)
+    if isinstance(Ints,(list,tuple)): return array(Ints,'d')
+    return frombuffer(Ints,'d')
+
+def unpack_full(Ints,nbf):
+    """\
+    The integrals as the full (nbf,nbf,nbf,nbf) array of (ij|kl),
+    unpacked afresh on each call; where a block at a time will do, use
+    unpack_block instead.
+    """
+    return ints_view(Ints)[slice_indices(nbf)]
+
+def unpack_block(Ints,nbf,start,stop):
+    """\
+    The (stop-start,nbf,nbf,nbf) block of the full integrals (ij|kl)
+    with start <= i < stop
+    """
+    values = ints_view(Ints)
+    if not isinstance(values,ndarray):
+        return values[slice_indices(nbf,arange(start,stop))]
+    # The packed integrals are the lower triangle of the symmetric
+    #  matrix over pairs, (ij|kl) = Gp[ij,kl], so the block is gathered
+    #  from the rows of Gp for the pairs ij with i in the block
+    n = arange(nbf,dtype=int64)
+    pairs = pair_index(n[:,newaxis],n)
+    rows = pair_rows(values,pairs[start:stop].ravel(),nbf*(nbf+1)/2)
+    return reshape(rows.take(pairs.ravel(),1),(stop-start,nbf,nbf,nbf))
+
+def pair_rows(values,ps,npair):
+    """\
+    The rows ps of the (npair,npair) symmetric matrix of the packed
+    integrals values, Gp[ij,kl] = (ij|kl), where ij and kl are the
+    pair indices i*(i+1)/2+j. Row p is the contiguous run of integrals
+    (p|q) with q <= p, followed by a column of the lower triangle.
+    """
+    tri = arange(npair,dtype=int64)
+    tri = tri*(tri+1)/2
+    rows = empty((len(ps),npair),'d')
+    for r,p in enumerate(ps):
+        rows[r,:p+1] = values[tri[p]:tri[p]+p+1]
+        rows[r,p+1:] = values[tri[p+1:]+p]
+    return rows
@@ -27,8 +27,9 @@ Correcting orbital 10, HF Eorb = 0.539609
 from hartree_fock import scf
 from Ints import getbasis, getints
 from CI import TransformInts
-from PyQuante.cints import ijkl2intindex
-from NumWrap import zeros
+from PyQuante.ERIStore import intindices
+from NumWrap import zeros,arange,reshape
+from numpy import asarray,newaxis
 from NumWrap import det
 
 class Sigma2:
@@ -44,23 +45,19 @@ class Sigma2:
 
     def eval0(self,i,E):
         # just do the simple approximation, S/A eqs 7.44-7.46
-        term = 0.
-        occs = range(self.nocc)
-        virts = range(self.nocc,self.norb)
-        for a in occs:
-            for r in virts:
-                for s in virts:
-                    iras = self.moints[ijkl2intindex(i,r,a,s)]
-                    isar = self.moints[ijkl2intindex(i,s,a,r)]
-                    term += iras*(2*iras-isar)/(
-                        E+self.e0[a]-self.e0[r]-self.e0[s])
-        for a in occs:
-            for b in occs:
-                for r in virts:
-                    iabr = self.moints[ijkl2intindex(i,a,b,r)]
-                    ibar = self.moints[ijkl2intindex(i,b,a,r)]
-                    term += iabr*(2*iabr-ibar)/(
-                        E+self.e0[r]-self.e0[a]-self.e0[b])
+        e0 = asarray(self.e0)
+        occs = arange(self.nocc)
+        virts = arange(self.nocc,self.norb)
+        a,r,s = occs[:,newaxis,newaxis],virts[newaxis,:,newaxis],\
+                virts[newaxis,newaxis,:]
+        iras = self.moints[intindices(i,r,a,s)]
+        isar = self.moints[intindices(i,s,a,r)]
+        term = (iras*(2*iras-isar)/(E+e0[a]-e0[r]-e0[s])).sum()
+        a,b,r = occs[:,newaxis,newaxis],occs[newaxis,:,newaxis],\
+                virts[newaxis,newaxis,:]
+        iabr = self.moints[intindices(i,a,b,r)]
+        ibar = self.moints[intindices(i,b,a,r)]
+        term += (iabr*(2*iabr-ibar)/(E+e0[r]-e0[a]-e0[b])).sum()
         return term
 
     def eval(self,i):
@@ -82,24 +79,21 @@ class Sigma2:
         occs = range(self.nocc)
         virts = range(self.nocc,self.norb)
         term = 0.
+        e0 = asarray(self.e0)
+        a1,r1,s1 = reshape(occs,(-1,1,1)),reshape(virts,(1,-1,1)),\
+                   reshape(virts,(1,1,-1))
+        a2,b2,r2 = reshape(occs,(-1,1,1)),reshape(occs,(1,-1,1)),\
+                   reshape(virts,(1,1,-1))
         for i in orbs:
             for j in orbs:
-                for a in occs:
-                    for r in virts:
-                        for s in virts:
-                            iras = self.moints[ijkl2intindex(i,r,a,s)]
-                            jras = self.moints[ijkl2intindex(j,r,a,s)]
-                            jsar = self.moints[ijkl2intindex(j,s,a,r)]
-                            term += iras*(2*jras-jsar)/(
-                                E+self.e0[a]-self.e0[r]-self.e0[s])
-                for a in occs:
-                    for b in occs:
-                        for r in virts:
-                            iabr = self.moints[ijkl2intindex(i,a,b,r)]
-                            jabr = self.moints[ijkl2intindex(j,a,b,r)]
-                            jbar = self.moints[ijkl2intindex(j,b,a,r)]
-                            term += iabr*(2*jabr-jbar)/(
-                                E+self.e0[r]-self.e0[a]-self.e0[b])
+                iras = self.moints[intindices(i,r1,a1,s1)]
+                jras = self.moints[intindices(j,r1,a1,s1)]
+                jsar = self.moints[intindices(j,s1,a1,r1)]
+                term += (iras*(2*jras-jsar)/(E+e0[a1]-e0[r1]-e0[s1])).sum()
+                iabr = self.moints[intindices(i,a2,b2,r2)]
+                jabr = self.moints[intindices(j,a2,b2,r2)]
+                jbar = self.moints[intindices(j,b2,a2,r2)]
+                term += (iabr*(2*jabr-jbar)/(E+e0[r2]-e0[a2]-e0[b2])).sum()
                 g[i,j] = -term
         for i in orbs:
             g[i,i] += E - self.e0[i]
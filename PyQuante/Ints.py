@@ -10,10 +10,20 @@
  distribution. 
 """
 
+import logging
 from CGBF import CGBF,coulomb
-from NumWrap import zeros,dot,reshape
+from Shell import getshells,shell_kernel,coulomb as shell_coulomb
+from NumWrap import zeros,dot,reshape,ravel
+from numpy import newaxis,tensordot,ndarray,asarray,frombuffer,memmap
+from ERIStore import ints_view,pair_index,nbf_from_totlen
+from array import array
 from PyQuante.cints import ijkl2intindex as intindex
+from PyQuante.cints import overlap_matrix,kinetic_matrix,nuclear_matrix
+from PyQuante.cints import packed_basis
+from PyQuante.chgp import prim_screening_stats,shell_coulomb_batch
 from PyQuante.Basis.Tools import get_basis_data
+from Spherical import SphericalBF,solid_harmonics,cart2sph,expand,transform,\
+     shell_transforms
 
 sym2powerlist = {
     'S' : [(0,0,0)],
@@ -23,19 +33,23 @@ sym2powerlist = {
            (0,3,0),(0,2,1),(0,1,2), (0,0,3)]
     }
 
-sorted = True
-jints = {}
-kints = {}
-
 def getbasis(atoms,basis_data=None,**opts):
     """\
     bfs = getbasis(atoms,basis_data=None)
     
     Given a Molecule object and a basis library, form a basis set
     constructed as a list of CGBF basis functions objects.
+
+    Options:      Value   Description
+    --------      -----   -----------
+    omit_f        False   Omit the f functions of the basis set
+    spherical     False   Build 5 d and 7 f pure spherical functions
+                          (SphericalBF objects, see Spherical.py) in
+                          place of the 6 d and 10 f Cartesian ones
     """
     # Option to omit f basis functions from imported basis sets
     omit_f = opts.get('omit_f',False)
+    spherical = opts.get('spherical',False)
     if not basis_data:
         from PyQuante.Basis.p631ss import basis_data
     elif type(basis_data) == type(''):
@@ -47,160 +61,667 @@ def getbasis(atoms,basis_data=None,**opts):
         bs = basis_data[atom.atno]
         for sym,prims in bs:
             if omit_f and sym == "F": continue
+            shell = []
             for power in sym2powerlist[sym]:
                 bf = CGBF(atom.pos(),power,atom.atid)
                 for expnt,coef in prims:
                     bf.add_primitive(expnt,coef)
                 bf.normalize()
-                bfs.append(bf)
+                shell.append(bf)
+            if spherical and sym in solid_harmonics:
+                shell = [SphericalBF(shell,row)
+                         for row in cart2sph(sym,sym2powerlist[sym])]
+            bfs.extend(shell)
     return bfs
 
-def getints(bfs,atoms):
+def getints(bfs,atoms,**opts):
+    """\
+    S,h,Ints = getints(bfs,atoms,**opts)
+
+    The one- and two-electron integrals. Options are passed on to
+    get2ints, apart from:
+
+    Options:      Value   Description
+    --------      -----   -----------
+    density_fitting False Approximate the two-electron integrals by
+                          density fitting (see DensityFitting.py). Ints
+                          is then a DFJK object, which provides J and
+                          K, but can't be indexed like the integrals
+    symmetry      False   If True, find the point group of the atoms,
+                          and pass it on to get2ints
+    """
     S,h = get1ints(bfs,atoms)
-    Ints = get2ints(bfs)
+    if opts.get('density_fitting') and expand(bfs)[1] is not None:
+        raise ValueError("Density fitting needs Cartesian basis functions")
+    if opts.get('symmetry') is True:
+        from Symmetry import PointGroup
+        opts['symmetry'] = PointGroup(atoms)
+    if opts.get('density_fitting'):
+        from DensityFitting import DFJK
+        Ints = DFJK(bfs,atoms,**opts)
+    else:
+        Ints = get2ints(bfs,**opts)
     return S,h,Ints
 
 def get1ints(bfs,atoms):
     "Form the overlap S and h=t+vN one-electron Hamiltonian matrices"
-    nbf = len(bfs)
-    S = zeros((nbf,nbf),'d')
-    h = zeros((nbf,nbf),'d')
-
-    for i in range(nbf):
-        bfi = bfs[i]
-        for j in range(nbf):
-            bfj = bfs[j]
-            S[i,j] = bfi.overlap(bfj)
-            h[i,j] = bfi.kinetic(bfj)
-            for atom in atoms:
-                h[i,j] = h[i,j] + atom.atno*bfi.nuclear(bfj,atom.pos())
-    return S,h
+    cbfs,T = expand(bfs)
+    basis = pack_basis(cbfs)
+    S = tri2full(overlap_matrix(basis),len(cbfs))
+    h = tri2full(kinetic_matrix(basis),len(cbfs)) \
+        + tri2full(nuclear_matrix(basis,*pack_nuclei(atoms)),len(cbfs))
+    return transform(S,T),transform(h,T)
 
 def getT(bfs):
     "Form the kinetic energy matrix"
-    nbf = len(bfs)
-    T = zeros((nbf,nbf),'d')
-
-    for i in range(nbf):
-        bfi = bfs[i]
-        for j in range(nbf):
-            bfj = bfs[j]
-            T[i,j] = bfi.kinetic(bfj)
-    return T
+    cbfs,T = expand(bfs)
+    return transform(tri2full(kinetic_matrix(pack_basis(cbfs)),len(cbfs)),T)
 
 def getS(bfs):
     "Form the overlap matrix"
-    nbf = len(bfs)
-    S = zeros((nbf,nbf),'d')
-
-    for i in range(nbf):
-        bfi = bfs[i]
-        for j in range(nbf):
-            bfj = bfs[j]
-            S[i,j] = bfi.overlap(bfj)
-    return S
+    cbfs,T = expand(bfs)
+    return transform(tri2full(overlap_matrix(pack_basis(cbfs)),len(cbfs)),T)
 
 def getV(bfs,atoms):
     "Form the nuclear attraction matrix V"
-    nbf = len(bfs)
-    V = zeros((nbf,nbf),'d')
+    cbfs,T = expand(bfs)
+    return transform(tri2full(nuclear_matrix(pack_basis(cbfs),
+                                             *pack_nuclei(atoms)),
+                              len(cbfs)),T)
+
+def pack_basis(bfs):
+    """\
+    basis = pack_basis(bfs)
 
-    for i in range(nbf):
-        bfi = bfs[i]
-        for j in range(nbf):
-            bfj = bfs[j]
-            for atom in atoms:
-                V[i,j] = V[i,j] + atom.atno*bfi.nuclear(bfj,atom.pos())
-    return V
+    Flatten a list of CGBFs into the (xyz,lmn,norms,pstart,exps,coefs,
+    pnorms) lists, in which the primitives of function i are
+    pstart[i]..pstart[i+1]-1 of exps,coefs,pnorms, and parse them once
+    into the C arrays taken by the one-electron matrix builders and the
+    coulomb_block kernels of cints, chgp and crys. The result is an
+    opaque handle; the kernels also take the tuple of lists itself, but
+    then parse it again on every call.
+    """
+    xyz,lmn,norms,pstart = [],[],[],[0]
+    exps,coefs,pnorms = [],[],[]
+    for bf in bfs:
+        xyz.extend(bf.origin())
+        lmn.extend(bf.powers())
+        norms.append(bf.norm())
+        exps.extend(bf.exps())
+        coefs.extend(bf.coefs())
+        pnorms.extend(bf.pnorms())
+        pstart.append(len(exps))
+    return packed_basis((xyz,lmn,norms,pstart,exps,coefs,pnorms))
+
+def pack_nuclei(atoms):
+    "Flattened centers and the charges of atoms, for nuclear_matrix"
+    xyz = []
+    for atom in atoms: xyz.extend(atom.pos())
+    return xyz,[atom.atno for atom in atoms]
 
-def get2ints(bfs):
+def tri2full(vals,nbf):
+    "Unpack a lower triangle, stored row by row, into a symmetric matrix"
+    A = zeros((nbf,nbf),'d')
+    ij = 0
+    for i in xrange(nbf):
+        A[i,:i+1] = vals[ij:ij+i+1]
+        A[:i+1,i] = vals[ij:ij+i+1]
+        ij += i+1
+    return A
+
+def get2ints(bfs,**opts):
     """Store integrals in a long array in the form (ij|kl) (chemists
-    notation. We only need i>=j, k>=l, and ij <= kl"""
-    from array import array
+    notation. We only need i>=j, k>=l, and ij <= kl
+
+    The integrals are computed a shell quartet at a time (see Shell.py),
+    so that all of the components of the shells share a single call.
+
+    Options:      Value   Description
+    --------      -----   -----------
+    schwarz_tol   1e-12   Skip shell quartets whose Schwarz bound is
+                          below this value. 0 or None turns off screening
+    pair_tol      1e-15   Drop primitive pairs whose prefactor (with the
+                          contraction coefficients) is below this value
+                          (see PairData.py)
+    prim_tol      1e-15   Skip primitive quartets whose estimated size
+                          is below this value (see Src/prim_screen.h)
+    nproc         1       Number of processes to compute the integrals
+                          with. The ij shell pairs are split into chunks
+                          of about equal work, which a pool of worker
+                          processes writes into a shared array
+    nthreads      1       Number of threads to compute the integrals
+                          with, when nproc is 1. The C integral kernels
+                          release the GIL, so the threads run in them
+                          at the same time, and write straight into the
+                          integral array (see threaded_shell_ints)
+    eri_file      None    If not None, keep the integrals in this file
+                          (see ERIStore.py) instead of in memory. If the
+                          file already holds the integrals for this
+                          basis set, they are read rather than computed
+    direct        False   If True, don't compute or store the integrals
+                          now. Return a DirectJK object that recomputes
+                          them, incrementally, each time J or K is
+                          formed (see DirectJK.py)
+    symmetry      None    The PointGroup of the molecule (see
+                          Symmetry.py, Molecule.point_group). Only the
+                          symmetry-unique shell quartets are computed,
+                          and the rest are copied from them
+    eri_compress  None    'mixed' or 'sparse': keep the integrals in
+                          reduced precision (see ERIStore.CompressedERIs).
+                          Without eri_file, each block of integrals is
+                          compressed as soon as it is computed (see
+                          compressed_shell_ints), so this can't be used
+                          with nproc or symmetry, which need the full
+                          array
+    single_tol    1e-4    With eri_compress, keep the integrals below
+                          this in single precision
+    drop_tol      1e-12   With eri_compress='sparse', drop the
+                          integrals below this
+
+    If bfs holds spherical functions (see Spherical.py), the integrals
+    of each shell quartet are computed over the Cartesian functions of
+    the shells, and transformed into the spherical ones.
+    """
+    from Screening import Schwarz
+    from PairData import PairData
+    schwarz_tol = opts.get('schwarz_tol',1e-12)
+    pair_tol = opts.get('pair_tol',1e-15)
+    prim_tol = opts.get('prim_tol',1e-15)
+    nproc = opts.get('nproc',1)
+    nthreads = opts.get('nthreads',1)
+    eri_file = opts.get('eri_file')
+    group = opts.get('symmetry')
+    if group:
+        from Symmetry import PointGroup
+        if not isinstance(group,PointGroup):
+            raise ValueError("get2ints needs the PointGroup of the molecule "
+                             "as symmetry, not %r: use PointGroup(atoms), "
+                             "or getints(bfs,atoms,symmetry=True)" % group)
+    if opts.get('eri_compress') and not eri_file and (nproc > 1 or group):
+        raise ValueError("eri_compress with nproc or symmetry needs an "
+                         "eri_file to hold the full integrals")
+    cbfs,T = expand(bfs)
+    if T is not None and (opts.get('direct') or opts.get('symmetry')):
+        raise ValueError("Integral-direct and symmetry-unique integrals "
+                         "need Cartesian basis functions")
+    if opts.get('direct'):
+        from DirectJK import DirectJK
+        return DirectJK(bfs,**opts)
     nbf = len(bfs)
     totlen = nbf*(nbf+1)*(nbf*nbf+nbf+2)/8
-    Ints = array('d',[0]*totlen)
-    for i in xrange(nbf):
-        for j in xrange(i+1):
-            ij = i*(i+1)/2+j
-            for k in xrange(nbf):
-                for l in xrange(k+1):
-                    kl = k*(k+1)/2+l
-                    if ij >= kl:
-                        Ints[intindex(i,j,k,l)] = coulomb(bfs[i],bfs[j],
-                                                          bfs[k],bfs[l])
-    if sorted:
-        sortints(nbf,Ints)
+    if eri_file:
+        from ERIStore import ERIFile
+        Ints = ERIFile(eri_file,bfs,schwarz_tol,pair_tol,prim_tol)
+        if Ints.complete: return compress_ints(Ints,**opts)
+    shells = getshells(cbfs)
+    if T is not None: shell_transforms(shells,T)
+    nsh = len(shells)
+    pairdata = PairData(shells,pair_tol)
+    pairdata.report()
+    screen = None
+    if schwarz_tol: screen = Schwarz(cbfs,schwarz_tol,shells,pairdata)
+    pairs = [(i,j) for i in xrange(nsh) for j in xrange(i+1)]
+    sym = None
+    if group and group.order() > 1:
+        from Symmetry import UniqueQuartets
+        sym = UniqueQuartets(group,shells)
+    prim_screening_stats(True)
+    if eri_file:
+        # The file is mapped shared, so forked workers can write to it
+        if nproc > 1:
+            prim_counts = parallel_shell_ints(Ints.data,shells,pairs,screen,
+                                              nproc,pairdata,sym,prim_tol)
+        elif nthreads > 1:
+            threaded_shell_ints(Ints.data,shells,pairs,screen,nthreads,
+                                pairdata,sym,prim_tol)
+        else:
+            shell_pair_ints(Ints.data,shells,pairs,screen,pairdata,sym,
+                            prim_tol)
+        if sym: sym.fill(Ints.data)
+        Ints.finish()
+    elif opts.get('eri_compress'):
+        Ints = compressed_shell_ints(shells,nbf,screen,nthreads,pairdata,
+                                     prim_tol,*compress_tols(opts))
+    elif nproc > 1:
+        from multiprocessing.sharedctypes import RawArray
+        shared = RawArray('d',totlen)
+        prim_counts = parallel_shell_ints(shared,shells,pairs,screen,nproc,
+                                          pairdata,sym,prim_tol)
+        if sym: sym.fill(shared)
+        # A view of the shared memory, not a copy of it
+        Ints = frombuffer(shared,'d').view(ERIArray)
+    else:
+        Ints = ERIArray(zeros(totlen,'d'))
+        if nthreads > 1:
+            threaded_shell_ints(Ints,shells,pairs,screen,nthreads,pairdata,
+                                sym,prim_tol)
+        else:
+            shell_pair_ints(Ints,shells,pairs,screen,pairdata,sym,prim_tol)
+        if sym: sym.fill(Ints)
+    if nproc == 1: prim_counts = prim_screening_stats()
+    if screen: screen.report('shell quartets')
+    if sym: sym.report()
+    logging.info("Primitive screening (tol=%g) skipped %d of %d primitive "
+                 "quartets" % ((prim_tol,)+tuple(prim_counts)))
+    if eri_file: return compress_ints(Ints,**opts)
+    if opts.get('eri_compress'): Ints.report()
     return Ints
 
-def sortints(nbf,Ints):
-    for i in range(nbf):
-        for j in range(i+1):
-            jints[i,j] = fetch_jints(Ints,i,j,nbf)
-            kints[i,j] = fetch_kints(Ints,i,j,nbf)
+def compress_tols(opts):
+    "The single_tol and drop_tol of the eri_compress option (see get2ints)"
+    layout = opts.get('eri_compress')
+    if layout == 'mixed':
+        drop_tol = None
+    elif layout == 'sparse':
+        drop_tol = opts.get('drop_tol',1e-12)
+    else:
+        raise ValueError("Unknown eri_compress %s" % layout)
+    return opts.get('single_tol',1e-4),drop_tol
+
+def compress_ints(Ints,**opts):
+    """\
+    The integrals in the reduced-precision storage that the eri_compress
+    option asks for, if any (see get2ints)
+    """
+    if not opts.get('eri_compress'): return Ints
+    from ERIStore import CompressedERIs
+    Ints = CompressedERIs(Ints,*compress_tols(opts))
+    Ints.report()
+    return Ints
+
+def compressed_shell_ints(shells,nbf,screen,nthreads,pairdata=None,
+                          prim_tol=None,single_tol=1e-4,drop_tol=None):
+    """\
+    Ints = compressed_shell_ints(shells,nbf,screen,nthreads,pairdata=None,
+                                 prim_tol=None,single_tol=1e-4,drop_tol=None)
+
+    Compute the integrals straight into a CompressedERIs, one outer
+    shell at a time. The shell quartets of the shell pairs (i,j) with
+    i the same shell fill a contiguous range of the packed array: that
+    of the function pairs with their first function in shell i. Each
+    range is computed into a PackedBlock, of O(nbf**3) integrals, and
+    compressed before the next, so the array of all the integrals in
+    double precision is never made.
+    """
+    from ERIStore import CompressedERIs,PackedBlock
+    def packed_start(n):
+        # The first packed index of the function pairs ij with i >= n
+        npair = n*(n+1)/2
+        return npair*(npair+1)/2
+    Ints = CompressedERIs(None,single_tol,drop_tol,
+                          totlen=packed_start(nbf))
+    for i,shell in enumerate(shells):
+        out = shell.out_indices()
+        block = PackedBlock(packed_start(out[0]),packed_start(out[-1]+1))
+        pairs = [(i,j) for j in xrange(i+1)]
+        if nthreads > 1:
+            threaded_shell_ints(block,shells,pairs,screen,nthreads,pairdata,
+                                None,prim_tol)
+        else:
+            shell_pair_ints(block,shells,pairs,screen,pairdata,None,
+                            prim_tol)
+        Ints.add(block.values)
+    Ints.finish()
+    return Ints
+
+def shell_pair_ints(Ints,shells,pairs,screen=None,pairdata=None,sym=None,
+                    prim_tol=None):
+    """\
+    Compute all of the shell quartets (ij|kl) with kl <= ij for each
+    shell pair (i,j) in pairs, and store them in Ints. pairdata is the
+    optional PairData of the shells. If sym (a Symmetry.UniqueQuartets)
+    is given, only the symmetry-unique quartets are computed; sym.fill
+    copies them into the rest afterwards. prim_tol is the primitive
+    screening tolerance of the kernels (see Shell.coulomb).
+    """
+    values = ints_view(Ints)
+    for i,j,k,l in shell_quartets(pairs,screen,sym):
+        store_shell_ints(Ints,shells[i],shells[j],shells[k],shells[l],
+                         pairdata,values,prim_tol)
+    return
+
+def shell_quartets(pairs,screen=None,sym=None):
+    """\
+    The shell quartets (i,j,k,l) with kl <= ij of each shell pair (i,j)
+    in pairs, leaving out those that screen skips, and if sym is given,
+    those that aren't symmetry-unique
+    """
+    for i,j in pairs:
+        ij = i*(i+1)/2+j
+        for k in xrange(i+1):
+            for l in xrange(k+1):
+                kl = k*(k+1)/2+l
+                if kl > ij: break
+                if sym and not sym.unique(i,j,k,l): continue
+                if screen and screen.skip_shells(i,j,k,l): continue
+                yield i,j,k,l
+    return
+
+def pair_chunks(shells,pairs,nchunks):
+    """\
+    Split the shell pairs into nchunks lists of about equal work. The
+    work for pair ij is taken to be the number of kl <= ij times the
+    number of components in i and j. The pairs are dealt out largest
+    first to whichever chunk currently has the least work.
+    """
+    def work((i,j)):
+        return (i*(i+1)/2+j+1)*shells[i].nbf*shells[j].nbf
+    chunks = [[] for n in xrange(nchunks)]
+    loads = [0]*nchunks
+    for pair in sorted(pairs,key=work,reverse=True):
+        n = loads.index(min(loads))
+        chunks[n].append(pair)
+        loads[n] += work(pair)
+    return [chunk for chunk in chunks if chunk]
+
+# The data of each worker process of parallel_shell_ints, set by the
+#  pool initializer, so it is passed along whether the workers are
+#  forked or spawned
+_worker_data = {}
+
+def _init_worker(Ints,shells,screen,pairdata,sym,prim_tol):
+    # A memmap is sent as its file, since pickling would copy it
+    if isinstance(Ints,tuple): Ints = memmap(*Ints)
+    _worker_data.update(Ints=Ints,shells=shells,screen=screen,
+                        pairdata=pairdata,sym=sym,prim_tol=prim_tol)
+    return
+
+def _shell_pair_worker(chunk):
+    screen = _worker_data['screen']
+    if screen: screen.reset()
+    prim_screening_stats(True)
+    shell_pair_ints(_worker_data['Ints'],_worker_data['shells'],chunk,screen,
+                    _worker_data['pairdata'],_worker_data['sym'],
+                    _worker_data['prim_tol'])
+    prim_counts = prim_screening_stats()
+    if screen: return (screen.nskipped,screen.ntested)+prim_counts
+    return (0,0)+prim_counts
+
+def parallel_shell_ints(Ints,shells,pairs,screen,nproc,pairdata=None,
+                        sym=None,prim_tol=None):
+    """\
+    parallel_shell_ints(Ints,shells,pairs,screen,nproc,pairdata=None,
+                        sym=None,prim_tol=None)
+
+    Compute the shell pair integrals with a pool of nproc processes.
+    Ints must be memory shared with the workers (a RawArray or a
+    memmap of a file), in the ijkl2intindex packed layout. Returns the
+    number of primitive quartets skipped and tested by the workers.
+    """
+    from multiprocessing import Pool
+    shared = Ints
+    if isinstance(Ints,memmap):
+        shared = (Ints.filename,'d','r+',Ints.offset,Ints.shape)
+    # More chunks than processes, so that an unlucky chunk doesn't
+    #  leave the other processes waiting
+    chunks = pair_chunks(shells,pairs,4*nproc)
+    pool = Pool(nproc,_init_worker,
+                (shared,shells,screen,pairdata,sym,prim_tol))
+    pskipped = ptested = 0
+    try:
+        for nskipped,ntested,np,nt in pool.imap_unordered(_shell_pair_worker,
+                                                           chunks):
+            if screen:
+                screen.nskipped += nskipped
+                screen.ntested += ntested
+            pskipped += np
+            ptested += nt
+        pool.close()
+    except:
+        pool.terminate()
+        raise
+    pool.join()
+    return pskipped,ptested
+
+def threaded_shell_ints(Ints,shells,pairs,screen,nthreads,pairdata=None,
+                        sym=None,prim_tol=None):
+    """\
+    threaded_shell_ints(Ints,shells,pairs,screen,nthreads,pairdata=None,
+                        sym=None,prim_tol=None)
+
+    Compute the shell pair integrals with a pool of nthreads threads.
+    The shell quartets of each chunk of shell pairs are listed and
+    screened first, and a thread then computes all of them in a single
+    chgp.shell_coulomb_batch call, which holds the GIL only while it
+    reads its arguments. For Cartesian shells the call writes the
+    integrals straight into Ints, so the threads run no Python at all;
+    the integrals of spherical shells, or those going into a
+    PackedBlock, are stored by the calling thread as the chunks come
+    back. Nothing has to be
+    shared between processes. The quartets that the Backends registry
+    sends to another module than chgp (see Shell.shell_kernel) are
+    computed by the calling thread once the chunks are done.
+    """
+    from multiprocessing.pool import ThreadPool
+    nsh = len(shells)
+    data = [shell.data() for shell in shells]
+    starts = [shell.start for shell in shells]
+    pair_list = None
+    if pairdata:
+        pair_list = [pairdata.get(shells[i],shells[j])
+                     for i in xrange(nsh) for j in xrange(i+1)]
+    from ERIStore import PackedBlock
+    direct = not [shell for shell in shells if shell.transform] \
+             and not isinstance(Ints,PackedBlock)
+    def work(quartets):
+        if direct:
+            shell_coulomb_batch(data,quartets,pair_list,Ints,prim_tol,starts)
+            return None
+        size = 0
+        for n in xrange(0,len(quartets),4):
+            size += shell_size(shells,quartets[n:n+4])
+        out = zeros(size,'d')
+        shell_coulomb_batch(data,quartets,pair_list,out,prim_tol)
+        return quartets,out
+    routed = []
+    def chunk_quartets(chunk):
+        quartets = array('i')
+        for quartet in shell_quartets(chunk,screen,sym):
+            if shell_kernel(*[shells[i] for i in quartet]):
+                quartets.extend(quartet)
+            else:
+                routed.append(quartet)
+        return quartets
+    # The pool lists the quartets of the next chunks in a thread of its
+    #  own, while the workers are computing
+    chunks = (chunk_quartets(chunk)
+              for chunk in pair_chunks(shells,pairs,4*nthreads))
+    values = ints_view(Ints)
+    pool = ThreadPool(nthreads)
+    try:
+        for result in pool.imap_unordered(work,chunks):
+            if result is None: continue
+            quartets,out = result
+            offset = 0
+            for n in xrange(0,len(quartets),4):
+                a,b,c,d = [shells[i] for i in quartets[n:n+4]]
+                size = shell_size(shells,quartets[n:n+4])
+                vals = out[offset:offset+size]
+                if a.transform: vals = spherical_ints(a,b,c,d,vals)
+                put_shell_ints(Ints,a,b,c,d,vals,values)
+                offset += size
+    finally:
+        pool.close()
+        pool.join()
+    for i,j,k,l in routed:
+        store_shell_ints(Ints,shells[i],shells[j],shells[k],shells[l],
+                         pairdata,values,prim_tol)
     return
 
+def shell_size(shells,quartet):
+    "The number of Cartesian integrals of a shell quartet"
+    i,j,k,l = quartet
+    return shells[i].nbf*shells[j].nbf*shells[k].nbf*shells[l].nbf
+
+def get2ints_block(basis,start,stop,out=None,module=None,prim_tol=None):
+    """\
+    out = get2ints_block(basis,start,stop,out=None,module=None,
+                         prim_tol=None)
+
+    Compute the two-electron integrals with ijkl2intindex indices
+    start..stop-1 in a single C call, over a basis packed once by
+    pack_basis, and write them into out[0:stop-start]. out may be any
+    writable buffer of doubles, e.g. a numpy array or a slice of one;
+    if it is None, a numpy array is made. module is the integral
+    module to use (cints, chgp or crys), by default cints, and prim_tol
+    its primitive screening tolerance, by default that of set_prim_tol.
+    """
+    if module is None:
+        from PyQuante import cints as module
+    if out is None: out = zeros(stop-start,'d')
+    module.coulomb_block(basis,start,stop,out,prim_tol)
+    return out
+
+def store_shell_ints(Ints,a,b,c,d,pairdata=None,values=None,prim_tol=None):
+    """\
+    Compute the integrals of a shell quartet and put them into Ints.
+    values is a numpy view of Ints (see ERIStore.ints_view); the larger
+    quartets are stored through it all at once.
+    """
+    vals = shell_coulomb(a,b,c,d,pairdata,prim_tol)
+    if a.transform: vals = spherical_ints(a,b,c,d,vals)
+    put_shell_ints(Ints,a,b,c,d,vals,values)
+    return
+
+def put_shell_ints(Ints,a,b,c,d,vals,values=None):
+    "Put the integrals vals of a shell quartet into Ints"
+    if values is None: values = ints_view(Ints)
+    if len(vals) < 64:
+        # Too few for the index arrays to pay off
+        n = 0
+        for i in a.out_indices():
+            for j in b.out_indices():
+                for k in c.out_indices():
+                    for l in d.out_indices():
+                        Ints[intindex(i,j,k,l)] = vals[n]
+                        n += 1
+        return
+    values[pair_index(a.pair_indices(b)[:,newaxis],
+                    c.pair_indices(d)[newaxis,:]).ravel()] = vals
+    return
+
+def spherical_ints(a,b,c,d,vals):
+    """\
+    Transform the Cartesian integrals vals of a shell quartet into the
+    spherical functions made from the shells (see Spherical.py)
+    """
+    if [s for s in (a,b,c,d) if s.transform[1] is not None]:
+        vals = reshape(vals,(a.nbf,b.nbf,c.nbf,d.nbf))
+        # Each step transforms the last index, and moves it first
+        for shell in (d,c,b,a):
+            UT = shell.transform[1]
+            if UT is not None: vals = dot(vals,UT)
+            vals = vals.transpose((3,0,1,2))
+        vals = ravel(vals)
+    return vals
+
+class ERIArray(ndarray):
+    """\
+    ERIArray(values=()) - Packed two-electron integrals with a J/K engine
+
+    A numpy array of the integrals in the ijkl2intindex packed layout,
+    which is what get2ints returns, so it is indexed just as before.
+    Any array of doubles (e.g. one on shared memory) can be viewed as
+    an ERIArray without copying it: values.view(ERIArray).
+
+    J and K are formed from a block of the integrals (ij|kl), for a
+    range of i, at a time: each block is unpacked from the packed array, used in
+    a few large matrix products for all of the density matrices, and
+    dropped, so there is never more than blocksize unpacked integrals.
+    """
+    def __new__(cls,values=()):
+        return asarray(values,'d').view(cls)
+
+    def getJ(self,D): return self.getJK([D],doK=False)[0][0]
+    def getK(self,D): return self.getJK([D],doJ=False)[1][0]
+
+    def get2JmK(self,D):
+        Js,Ks = self.getJK([D])
+        return 2*Js[0]-Ks[0]
+
+    def getJK(self,Ds,doJ=True,doK=True,blocksize=2**20):
+        """\
+        Js,Ks = getJK(Ds)
+
+        Lists of the Coulomb and exchange matrices for each of the
+        density matrices in Ds. If doJ (doK) is False, Js (Ks) is empty.
+        """
+        from ERIStore import unpack_block
+        nbf = nbf_from_totlen(len(self))
+        nD = len(Ds)
+        Dstack = zeros((nD,nbf,nbf),'d')
+        for n,D in enumerate(Ds): Dstack[n] = D
+        J = zeros((nbf,nbf,nD),'d')
+        K = zeros((nbf,nbf,nD),'d')
+        step = max(1,blocksize/nbf**3)
+        for start in xrange(0,nbf,step):
+            stop = min(nbf,start+step)
+            G = unpack_block(self,nbf,start,stop)
+            # J[i,j] = sum_kl (ij|kl) D[k,l]
+            if doJ: J[start:stop] = tensordot(G,Dstack,((2,3),(1,2)))
+            # K[i,l] = sum_jk (ij|kl) D[j,k]
+            if doK: K[start:stop] = tensordot(G,Dstack,((1,2),(1,2)))
+        Js = Ks = []
+        if doJ: Js = [J[:,:,n].copy() for n in xrange(nD)]
+        if doK: Ks = [K[:,:,n].copy() for n in xrange(nD)]
+        return Js,Ks
+
 def fetch_jints(Ints,i,j,nbf):
-    temp = zeros(nbf*nbf,'d')
-    kl = 0
-    for k in xrange(nbf):
-        for l in xrange(nbf):
-            index = intindex(i,j,k,l)
-            temp[kl] = Ints[index]
-            kl += 1
-    return temp
+    "The (ij|kl) for all k,l, as a vector"
+    from ERIStore import ints_view,slice_indices
+    return ravel(ints_view(Ints)[slice_indices(nbf,i,j)])
 
 def fetch_kints(Ints,i,j,nbf):
-    temp = zeros(nbf*nbf,'d')
-    kl = 0
-    for k in xrange(nbf):
-        for l in xrange(nbf):
-            temp[kl] = Ints[intindex(i,k,j,l)]
-            kl += 1
-    return temp
+    "The (ik|jl) for all k,l, as a vector"
+    from ERIStore import ints_view,slice_indices
+    return ravel(ints_view(Ints)[slice_indices(nbf,i,None,j)])
 
 def getJ(Ints,D):
     "Form the Coulomb operator corresponding to a density matrix D"
+    if hasattr(Ints,'getJ'): return Ints.getJ(D)
     nbf = D.shape[0]
     D1d = reshape(D,(nbf*nbf,)) #1D version of Dens
     J = zeros((nbf,nbf),'d')
     for i in xrange(nbf):
         for j in xrange(i+1):
-            if sorted:
-                temp = jints[i,j]
-            else:
-                temp = fetch_jints(Ints,i,j,nbf)
+            temp = fetch_jints(Ints,i,j,nbf)
             J[i,j] = dot(temp,D1d)
             J[j,i] = J[i,j]
     return J
 
 def getK(Ints,D):
     "Form the exchange operator corresponding to a density matrix D"
+    if hasattr(Ints,'getK'): return Ints.getK(D)
     nbf = D.shape[0]
     D1d = reshape(D,(nbf*nbf,)) #1D version of Dens
     K = zeros((nbf,nbf),'d')
     for i in xrange(nbf):
         for j in xrange(i+1):
-            if sorted:
-                temp = kints[i,j]
-            else:
-                temp = fetch_kints(Ints,i,j,nbf)
+            temp = fetch_kints(Ints,i,j,nbf)
             K[i,j] = dot(temp,D1d)
             K[j,i] = K[i,j]
     return K
 
 def get2JmK(Ints,D):
     "Form the 2J-K integrals corresponding to a density matrix D"
+    if hasattr(Ints,'get2JmK'): return Ints.get2JmK(D)
     nbf = D.shape[0]
     D1d = reshape(D,(nbf*nbf,)) #1D version of Dens
     G = zeros((nbf,nbf),'d')
     for i in xrange(nbf):
         for j in xrange(i+1):
-            if sorted:
-                temp = 2*jints[i,j]-kints[i,j]
-            else:
-                temp = 2*fetch_jints(Ints,i,j,nbf)-fetch_kints(Ints,i,j,nbf)
+            temp = 2*fetch_jints(Ints,i,j,nbf)-fetch_kints(Ints,i,j,nbf)
             G[i,j] = dot(temp,D1d)
             G[j,i] = G[i,j]
     return G
 
+def getJK(Ints,Ds):
+    """\
+    Js,Ks = getJK(Ints,Ds)
+
+    Lists of the Coulomb and exchange matrices for each of the density
+    matrices in Ds (e.g. [Da,Db] for UHF), formed together where the
+    integral storage allows it.
+    """
+    if hasattr(Ints,'getJK'): return Ints.getJK(Ds)
+    return [getJ(Ints,D) for D in Ds],[getK(Ints,D) for D in Ds]
@@ -19,10 +19,9 @@ from NumWrap import matrixmultiply,identity,zeros,eigh,cholesky,inv
 
 # Note: to be really smart in a quantum chemistry program, we would
 #  want to only symmetrically orthogonalize the S matrix once, since
-#  the matrix doesn't change during the SCF procedure. Thus, we would
-#  want to call X = SymOrth(S), and then geighD(H,X), rather
-#  than calling geigh(H,S) every time, since the latter
-#  recomputes the symmetric orthogonalization every SCF cycle.
+#  the matrix doesn't change during the SCF procedure. geigh(H,S)
+#  recomputes the orthogonalization every SCF cycle, so the SCF
+#  drivers make an Orthogonalizer(S) once and call its geigh(H).
 
 def norm(vec):
     "val = norm(vec) : Return the 2-norm of a vector"
@@ -55,25 +54,58 @@ def geigh(H,A,**opts):
                'Can'   Use Canonical Orthogonalization
                'Chol'  Use a Cholesky decomposition
                'Cut'   Use a symmetric orthogonalization with a cutoff
-                
+    scut       None    The cutoff on the eigenvalues of S for 'Can' and
+                       'Cut' (see get_xfrm)
+
+    With have_xfrm, A may have fewer columns than rows, as the X of
+    get_xfrm(S,'Can',scut) does; there are then only as many
+    eigenvalues and eigenvectors as A has columns.
     """
     have_xfrm = opts.get('have_xfrm',False)
     orthog = opts.get('orthog','Chol') 
     if not have_xfrm:
-        if orthog == 'Can':
-            X = CanOrth(A)
-        elif orthog == 'Chol':
-            X = CholOrth(A)
-        elif orthog == 'Cut':
-            X = SymOrthCutoff(A)
-        else:
-            X = SymOrth(A)
+        X = get_xfrm(A,orthog,opts.get('scut'))
         opts['have_xfrm'] = True
         return geigh(H,X,**opts)
     val,vec = eigh(simx(H,A))
     vec = matrixmultiply(A,vec)
     return val,vec
 
+def get_xfrm(S,orthog='Chol',scut=None):
+    """\
+    X = get_xfrm(S,orthog='Chol',scut=None)
+
+    The transformation X, with X'*S*X = 1, of the orthog option of
+    geigh. Given scut, 'Can' and 'Cut' drop the eigenvectors of S with
+    eigenvalues below it; 'Can' leaves them out of X, which then has
+    fewer columns than S. Without it 'Can' keeps them all, and 'Cut'
+    uses the 1e-5 default of SymOrthCutoff.
+    """
+    if orthog == 'Can':
+        if scut is None: return CanOrth(S)
+        return CanOrth(S,scut)
+    if orthog == 'Chol': return CholOrth(S)
+    if orthog == 'Cut':
+        if scut is None: return SymOrthCutoff(S)
+        return SymOrthCutoff(S,scut)
+    return SymOrth(S)
+
+class Orthogonalizer:
+    """\
+    Orthogonalizer(S,orthog='Chol',scut=None) - geigh for a fixed S
+
+    The transformation X of S (see get_xfrm) is formed once, so that
+    each geigh(H) is a single eigh of X'*H*X. Make one per geometry,
+    and use it for all of the generalized eigenproblems of an SCF.
+    Pass scut with 'Can' to drop the linear dependencies of the basis.
+    """
+    def __init__(self,S,orthog='Chol',scut=None):
+        self.S = S
+        self.X = get_xfrm(S,orthog,scut)
+        return
+
+    def geigh(self,H): return geigh(H,self.X,have_xfrm=True)
+
 def SymOrth(S):
     """Symmetric orthogonalization of the real symmetric matrix S.
     This is given by Ut(1/sqrt(lambda))U, where lambda,U are the
@@ -106,14 +138,18 @@ def SymOrthCutoff(S,scut=1e-5):
     X = simx(shalf,vec,'T')
     return X
 
-def CanOrth(S): 
+def CanOrth(S,scut=0): 
     """Canonical orthogonalization of matrix S. This is given by
-    U(1/sqrt(lambda)), where lambda,U are the eigenvalues/vectors."""
+    U(1/sqrt(lambda)), where lambda,U are the eigenvalues/vectors.
+
+    Eigenvectors with eigenvalues not above scut are left out, which
+    removes linear dependencies from the basis set."""
     val,vec = eigh(S)
-    n = vec.shape[0]
-    for i in range(n):
-        vec[:,i] = vec[:,i] / sqrt(val[i])
-    return vec
+    keep = [i for i in range(len(val)) if val[i] > scut]
+    X = vec[:,keep]
+    for j in range(len(keep)):
+        X[:,j] = X[:,j] / sqrt(val[keep[j]])
+    return X
 
 def CholOrth(S):
     """Cholesky orthogonalization of matrix X. This is given by
@@ -12,8 +12,9 @@
  distribution. 
 """
 
-from PyQuante.cints import ijkl2intindex
-from NumWrap import zeros,dot
+from PyQuante.ERIStore import intindices,unpack_block
+from NumWrap import zeros,reshape,transpose,arange
+from numpy import tensordot,multiply,asarray
 
 VERBOSE=0
 
@@ -22,76 +23,52 @@ def TransformIntsMP2(Ints,orbs,nclosed):
     O(N^5) 4-index transformation of the two-electron integrals.
     Only transform the ones needed for MP2, which reduces the
     scaling to O(nN^4), where n are the occs (<<N).
-    """
-
-    from time import time
-
-    t0 = time()
 
+    The AO integrals are unpacked a block of (mu nu|sigma eta) at a
+    time, with the vectorized indices of ERIStore, and each transform
+    is a single tensordot.
+    """
     nbf,nmo = orbs.shape
     totlen = nmo*(nmo+1)*(nmo*nmo+nmo+2)/8
-
-    occs = range(nclosed)
-    mos = range(nmo)
-    bfs = range(nbf)
-
-    # Start with (mu,nu|sigma,eta)
-    # Unpack aoints and transform sigma -> b
-    temp = zeros((nbf,nbf,nclosed,nbf),'d')
-    tempvec = zeros(nbf,'d')
-    for mu in bfs:
-        for nu in bfs:
-            for eta in bfs:
-                for b in occs:
-                    for sigma in bfs:
-                        tempvec[sigma] = Ints[ijkl2intindex(mu,nu,sigma,eta)]
-                    temp[mu,nu,b,eta] = dot(orbs[:,b],tempvec)
-
-    temp2 = zeros((nclosed,nbf,nclosed,nbf),'d')
-    for nu in bfs:
-        for eta in bfs:
-            for b in occs:
-                for a in occs:
-                    temp2[a,nu,b,eta] = dot(orbs[:,a],temp[:,nu,b,eta])
-
-    temp = zeros((nclosed,nbf,nclosed,nmo),'d')
-    for a in occs:
-        for nu in bfs:
-            for b in occs:
-                for j in mos:
-                    temp[a,nu,b,j] = dot(orbs[:,j],temp2[a,nu,b,:])
-
-    # Transform mu -> i and repack integrals:
+    occ = orbs[:,:nclosed]
+
+    # (a nu|b eta), from the blocks of (mu nu|sigma eta) for each mu
+    temp = zeros((nclosed,nbf,nclosed,nbf),'d')
+    for mu in xrange(nbf):
+        block = unpack_block(Ints,nbf,mu,mu+1)[0]
+        # Transform sigma -> b, then mu -> a
+        half = transpose(tensordot(occ,block,(0,1)),(1,0,2))
+        temp += multiply.outer(occ[mu],half)
+
+    # Transform nu -> i and eta -> j, giving temp[i,a,b,j] = (ai|bj)
+    temp = tensordot(tensordot(orbs,temp,(0,1)),orbs,(3,0))
+
+    # Repack the integrals
+    i = reshape(arange(nmo),(nmo,1,1,1))
+    a = reshape(arange(nclosed),(1,nclosed,1,1))
+    b = reshape(arange(nclosed),(1,1,nclosed,1))
+    j = reshape(arange(nmo),(1,1,1,nmo))
     MOInts = zeros(totlen,'d')
-    for a in occs:
-        for j in mos:
-            for b in occs:
-                for i in mos:
-                    aibj = ijkl2intindex(a,i,b,j)
-                    MOInts[aibj] = dot(orbs[:,i],temp[a,:,b,j])
-
-    #print "Integral transform time = ",time()-t0
-    del temp,temp2,tempvec #force garbage collection now
+    MOInts[intindices(a,i,b,j)] = temp
     return MOInts
 
+def pair_energies(moints,orbe,nclosed,nvirt):
+    "The MP2 pair energies, from the (ar|bs) of TransformIntsMP2"
+    orbe = asarray(orbe)
+    a = reshape(arange(nclosed),(nclosed,1,1,1))
+    b = reshape(arange(nclosed),(1,nclosed,1,1))
+    r = reshape(arange(nclosed,nclosed+nvirt),(1,1,nvirt,1))
+    s = reshape(arange(nclosed,nclosed+nvirt),(1,1,1,nvirt))
+    arbs = moints[intindices(a,r,b,s)]
+    asbr = moints[intindices(a,s,b,r)]
+    terms = arbs*(2*arbs-asbr)/(orbe[a]+orbe[b]-orbe[r]-orbe[s])
+    return terms.sum(3).sum(2)
+
 def MP2(aoints,orbs,orbe,nclosed,nvirt):
     #moints = TransformInts(aoints,orbs)
     moints = TransformIntsMP2(aoints,orbs,nclosed)
-    occs = range(nclosed)
-    unoccs = range(nclosed,nclosed+nvirt)
-    nocc = len(occs)
-
-    Epairs = zeros((nocc,nocc),'d')
-
-    Emp2 = 0
-    for a in occs:
-        for b in occs:
-            for r in unoccs:
-                for s in unoccs:
-                    arbs = moints[ijkl2intindex(a,r,b,s)]
-                    asbr = moints[ijkl2intindex(a,s,b,r)]
-                    Epairs[a,b] += arbs*(2*arbs-asbr)/\
-                                   (orbe[a]+orbe[b]-orbe[r]-orbe[s])
+    nocc = nclosed
+    Epairs = pair_energies(moints,orbe,nclosed,nvirt)
     if VERBOSE:
         print "MP2 pair energies"
         for a in range(nocc):
@@ -102,21 +79,8 @@ def MP2(aoints,orbs,orbe,nclosed,nvirt):
 
 def EN2(aoints,orbs,orbe,nclosed,nvirt):
     moints = TransformIntsMP2(aoints,orbs,nclosed)
-    occs = range(nclosed)
-    unoccs = range(nclosed,nclosed+nvirt)
-    nocc = len(occs)
-
-    Epairs = zeros((nocc,nocc),'d')
-
-    Emp2 = 0
-    for a in occs:
-        for b in occs:
-            for r in unoccs:
-                for s in unoccs:
-                    arbs = moints[ijkl2intindex(a,r,b,s)]
-                    asbr = moints[ijkl2intindex(a,s,b,r)]
-                    Epairs[a,b] += arbs*(2*arbs-asbr)/\
-                                   (orbe[a]+orbe[b]-orbe[r]-orbe[s])
+    nocc = nclosed
+    Epairs = pair_energies(moints,orbe,nclosed,nvirt)
     if VERBOSE:
         print "EN2 pair energies"
         for a in range(nocc):
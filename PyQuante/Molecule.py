@@ -205,6 +205,11 @@ class Molecule:
         for atom in self: atom.urotate(U)
         return
 
+    def point_group(self,tol=1e-6):
+        "The Abelian point group of the molecule (see Symmetry.py)"
+        from PyQuante.Symmetry import PointGroup
+        return PointGroup(self.atoms,tol)
+
     # These two overloads let the molecule act as a list of atoms
     def __getitem__(self,i):return self.atoms[i]
     def __len__(self): return len(self.atoms)
@@ -4,7 +4,7 @@ from math import sqrt
 from PyQuante.NumWrap import zeros,matrixmultiply,transpose,dot,identity,\
      array,solve
 from PyQuante.Ints import getbasis, getints, getJ,get2JmK,getK
-from PyQuante.LA2 import geigh,mkdens,trace2,simx
+from PyQuante.LA2 import geigh,mkdens,trace2,simx,Orthogonalizer
 from PyQuante.hartree_fock import get_fock
 from PyQuante.CGBF import three_center
 from PyQuante.optimize import fminBFGS
@@ -23,6 +23,7 @@ class EXXSolver:
         self.bfs = self.solver.bfs
         self.nbf = len(self.bfs)
         self.S = self.solver.S
+        self.orth = Orthogonalizer(self.S)
         self.h = self.solver.h
         self.Ints = self.solver.Ints
         self.molecule = self.solver.molecule
@@ -62,7 +63,7 @@ class EXXSolver:
     def get_energy(self,b):
         self.iter += 1
         self.Hoep = get_Hoep(b,self.H0,self.Gij)
-        self.orbe,self.orbs = geigh(self.Hoep,self.S)
+        self.orbe,self.orbs = self.orth.geigh(self.Hoep)
         if self.etemp:
             self.D,self.entropy = mkdens_fermi(self.nel,self.orbe,self.orbs,
                                                self.etemp)
@@ -103,6 +104,7 @@ class UEXXSolver:
         self.bfs = self.solver.bfs
         self.nbf = len(self.bfs)
         self.S = self.solver.S
+        self.orth = Orthogonalizer(self.S)
         self.h = self.solver.h
         self.Ints = self.solver.Ints
         self.molecule = self.solver.molecule
@@ -147,8 +149,8 @@ class UEXXSolver:
         bb = b[self.nbf:]
         self.Hoepa = get_Hoep(ba,self.H0,self.Gij)
         self.Hoepb = get_Hoep(bb,self.H0,self.Gij)
-        self.orbea,self.orbsa = geigh(self.Hoepa,self.S)
-        self.orbeb,self.orbsb = geigh(self.Hoepb,self.S)
+        self.orbea,self.orbsa = self.orth.geigh(self.Hoepa)
+        self.orbeb,self.orbsb = self.orth.geigh(self.Hoepb)
         if self.etemp:
             self.Da,entropya = mkdens_fermi(2*self.nalpha,self.orbea,self.orbsa,
                                             self.etemp)
@@ -482,9 +484,10 @@ def oep_hf_an(atoms,orbs,**opts):
     b = zeros(nbf,'d')
     eold = 0
 
+    orth = Orthogonalizer(S)
     for iter in range(maxiter):
         Hoep = get_Hoep(b,H0,Gij)
-        orbe,orbs = geigh(Hoep,S)
+        orbe,orbs = orth.geigh(Hoep)
         
         D = mkdens(orbs,0,nocc)
         Vhf = get2JmK(Ints,D)
@@ -604,12 +607,13 @@ def oep_uhf_an(atoms,orbsa,orbsb,**opts):
 
     eold = 0
 
+    orth = Orthogonalizer(S)
     for iter in range(maxiter):
         Hoepa = get_Hoep(ba,H0,Gij)
         Hoepb = get_Hoep(ba,H0,Gij)
 
-        orbea,orbsa = geigh(Hoepa,S)
-        orbeb,orbsb = geigh(Hoepb,S)
+        orbea,orbsa = orth.geigh(Hoepa)
+        orbeb,orbsb = orth.geigh(Hoepb)
 
         if ETemp:
             efermia = get_efermi(2*nalpha,orbea,ETemp)
@@ -0,0 +1,77 @@
+"""\
+ PairData.py Precomputed primitive pair data for the shell pairs
+
+ For each pair of primitives in a shell pair (ab|, the two-electron
+ integrals need the exponent sum zeta = alpha_a+alpha_b, the Gaussian
+ product center P = (alpha_a A + alpha_b B)/zeta, and the prefactor
+
+   w = c_a c_b sqrt(2) pi^(5/4)/zeta exp(-alpha_a alpha_b/zeta |A-B|^2)
+
+ These only depend upon the pair, but are needed by every quartet the
+ pair is part of. A PairData object computes them once for all of the
+ shell pairs of a basis set, and chgp.shell_coulomb takes them in
+ place of recomputing them. Primitive pairs whose prefactor is
+ negligible are dropped.
+
+ This program is part of the PyQuante quantum chemistry program suite.
+
+ Copyright (c) 2004, Richard P. Muller. All Rights Reserved.
+
+ PyQuante version 1.2 and later is covered by the modified BSD
+ license. Please see the file LICENSE that is part of this
+ distribution.
+"""
+
+import logging
+from array import array
+from math import sqrt,exp,pi
+
+class PairData:
+    """\
+    PairData(shells,tol=1e-15) - Primitive pair data for each shell pair
+
+    shells  The shells of the basis set, from Shell.getshells
+    tol     Primitive pairs with |w| < tol are dropped
+
+    get(a,b) returns the data for shells a and b (in either order) as
+    an array('d') holding the n kept primitive pairs as n zetas, then
+    n (Px,Py,Pz) triples, then n prefactors w; the c_a are the shell
+    coefficients (Shell.pcoefs). The nkept/ntotal counters hold the
+    number of primitive pairs kept, out of all of them.
+    """
+    def __init__(self,shells,tol=1e-15):
+        self.tol = tol
+        self.data = {}
+        self.nkept = self.ntotal = 0
+        for I in xrange(len(shells)):
+            for J in xrange(I+1):
+                a,b = shells[I],shells[J]
+                self.data[a.start,b.start] = self.make_pair(a,b)
+        return
+
+    def make_pair(self,a,b):
+        A,B = a.origin(),b.origin()
+        rab2 = sum([(A[i]-B[i])**2 for i in xrange(3)])
+        zetas,Ps,ws = [],[],[]
+        for alpha,ca in zip(a.exps(),a.pcoefs):
+            for beta,cb in zip(b.exps(),b.pcoefs):
+                zeta = alpha+beta
+                w = ca*cb*sqrt(2.)*pi**1.25/zeta*exp(-alpha*beta/zeta*rab2)
+                self.ntotal += 1
+                if abs(w) < self.tol: continue
+                zetas.append(zeta)
+                Ps.extend([(alpha*A[i]+beta*B[i])/zeta for i in xrange(3)])
+                ws.append(w)
+        self.nkept += len(zetas)
+        return array('d',zetas+Ps+ws)
+
+    def get(self,a,b):
+        "The data for the shell pair a,b"
+        if a.start < b.start: a,b = b,a
+        return self.data[a.start,b.start]
+
+    def report(self):
+        "Log how many primitive pairs were dropped"
+        logging.info("Kept %d of %d primitive pairs (tol=%g)"
+                     % (self.nkept,self.ntotal,self.tol))
+        return
@@ -18,11 +18,56 @@ method        HF      Use the HF method for the calculation
               
 bfs           None    The basis functions to use. List of CGBF's
 basis_data    None    The basis data to use to construct bfs
+spherical     False   Construct bfs with 5 d and 7 f spherical
+                      functions (see Spherical.py)
 basis         None    The name of a basis set, e.g. '6-31g**',
                       'sto-3g','cc-pVTZ'
 integrals     None    The one- and two-electron integrals to use
                       If not None, S,h,Ints
+schwarz_tol   1e-12   Schwarz screening threshold for the
+                      two-electron integrals (see Ints.get2ints)
+pair_tol      1e-15   Primitive pair threshold for the
+                      two-electron integrals (see PairData.py)
+prim_tol      1e-15   Primitive quartet threshold for the
+                      two-electron integrals (see Ints.get2ints)
+symmetry      False   Compute only the symmetry-unique
+                      two-electron integrals, using the point
+                      group of the molecule (see Symmetry.py)
+eri_compress  None    Keep the two-electron integrals in reduced
+                      precision, 'mixed' or 'sparse' (see
+                      Ints.get2ints)
+nproc         1       Number of processes used to compute the
+                      two-electron integrals (see Ints.get2ints)
+nthreads      1       Number of threads used to compute the
+                      two-electron integrals (see Ints.get2ints)
+eri_file      None    Keep the two-electron integrals in this
+                      memory-mapped file (see ERIStore.py)
+direct        False   Integral-direct SCF: recompute the
+                      two-electron integrals each iteration (see
+                      DirectJK.py). HF, UHF and ROHF only
+density_fitting False Approximate the two-electron integrals by
+                      density fitting (see DensityFitting.py)
+DoAveraging   True    Use DIIS for accelerated convergence. On by
+                      default for HF; UHF and DFT use it only when
+                      it is asked for
+diis_size     8       The most Fock matrices DIIS keeps
+diis_evict    age     Which Fock matrix DIIS drops when it has
+                      diis_size: 'age' the oldest, 'error' the one
+                      with the largest error (see Convergence.DIIS)
+adiis         False   Use ADIIS in the early iterations, blended
+                      into DIIS near convergence (see
+                      Convergence.ADIIS)
+second_order  True    Switch to the second-order solver
+                      (AugmentedHessianSolver) when the DIIS
+                      error stalls. HF, closed-shell only
+orthog        Chol    The orthogonalization of the basis for the
+                      eigenproblems, formed once: 'Chol', 'Sym',
+                      'Can' or 'Cut' (see LA2.get_xfrm)
 orbs          None    If not none, the guess orbitals
+guess         core    The initial guess: 'core' the core
+                      Hamiltonian, 'sad' the superposition of
+                      atomic densities (see SAD.py). HF, UHF,
+                      ROHF and DFT
 
 Options passed into solver.iterate(**options):
 
@@ -86,7 +131,8 @@ class Integrals:
         if integrals:
             self.S, self.h, self.ERI = integrals
         else:
-            self.S, self.h, self.ERI = getints(basis_set.get(),molecule)
+            self.S, self.h, self.ERI = getints(basis_set.get(),molecule,
+                                               **opts)
         return
     
 
@@ -109,7 +155,8 @@ class BasisSet:
                 basis = opts.get('basis')
                 if basis:
                     basis_data = get_basis_data(basis)
-            self.bfs = getbasis(molecule,basis_data)
+            self.bfs = getbasis(molecule,basis_data,
+                                spherical=opts.get('spherical',False))
         logging.info("%d basis functions" % len(self.bfs))
         return
     def __repr__(self): return 'Gaussian basis set with %d bfns' %  len(self.bfs)
@@ -149,7 +196,8 @@ class AbstractHamiltonian:
 class HFHamiltonian(AbstractHamiltonian):
     method='HF'
     def __init__(self,molecule,**opts):
-        from PyQuante.Convergence import DIIS
+        from PyQuante.Convergence import DIIS,ADIIS
+        from PyQuante.SAD import sad_fock
         self.molecule = molecule
         logging.info("HF calculation on system %s" % self.molecule.name)
         self.basis_set = BasisSet(molecule,**opts)
@@ -160,15 +208,22 @@ class HFHamiltonian(AbstractHamiltonian):
         self.ERI = self.integrals.get_ERI()
         self.Enuke = molecule.get_enuke()
         self.F = self.h
+        if opts.get('guess') == 'sad':
+            self.F = sad_fock(molecule,self.basis_set.get(),self.h,self.ERI)
         self.dmat = None
         self.entropy = None
         self.DoAveraging = opts.get('DoAveraging',True)
         if self.DoAveraging:
-            self.Averager = DIIS(self.S)
+            Averager = opts.get('adiis') and ADIIS or DIIS
+            self.Averager = Averager(self.S,opts.get('diis_size',8),
+                                     opts.get('diis_evict','age'))
+        self.second_order = opts.get('second_order',True)
+        self.solver_opts = opts
         nel = molecule.get_nel()
         nclosed,nopen = molecule.get_closedopen()
         logging.info("Nclosed/open = %d, %d" % (nclosed,nopen))
-        self.solver = SolverFactory(nel,nclosed,nopen,self.S,**opts)
+        self.solver = SolverFactory(nel,nclosed,nopen,self.S,ERI=self.ERI,
+                                    **opts)
         return
 
     def __repr__(self):
@@ -186,7 +241,17 @@ class HFHamiltonian(AbstractHamiltonian):
         from PyQuante.Ints import getJ,getK
 
         if self.DoAveraging and self.dmat is not None:
-            self.F = self.Averager.getF(self.F,self.dmat)
+            if self.second_order and self.solver.__class__ == BasicSolver \
+                   and not self.solver.nopen and self.Averager.stalled():
+                logging.info("DIIS stalled: switching to the second-order "
+                             "solver")
+                # With the user's maxstep, max_davidson and orthog
+                opts = dict(self.solver_opts,ERI=self.ERI,
+                            orbs=self.solver.orbs)
+                self.solver = AugmentedHessianSolver(
+                    self.solver.nel,self.solver.nclosed,0,self.S,**opts)
+            if not isinstance(self.solver,AugmentedHessianSolver):
+                self.F = self.Averager.getF(self.F,self.dmat)
         self.dmat,self.entropy = self.solver.solve(self.F,**opts)
         D = self.dmat
         
@@ -203,6 +268,8 @@ class DFTHamiltonian(AbstractHamiltonian):
     method='DFT'
     def __init__(self,molecule,**opts):
         from PyQuante.DFunctionals import need_gradients
+        from PyQuante.Convergence import DIIS,ADIIS
+        from PyQuante.SAD import sad_fock
         self.molecule = molecule
         logging.info("DFT calculation on system %s" % self.molecule.name)
         self.basis_set = BasisSet(molecule,**opts)
@@ -214,11 +281,18 @@ class DFTHamiltonian(AbstractHamiltonian):
         self.Enuke = molecule.get_enuke()
         self.nel = molecule.get_nel()
         self.F = self.h
+        if opts.get('guess') == 'sad':
+            self.F = sad_fock(molecule,self.basis_set.get(),self.h,self.ERI)
         self.functional = opts.get('functional','SVWN')
         opts['do_grad_dens'] = need_gradients[self.functional]
         self.setup_grid(molecule,self.basis_set.get(),**opts)
         self.dmat = None
         self.entropy = None
+        self.DoAveraging = opts.get('DoAveraging',False)
+        if self.DoAveraging:
+            Averager = opts.get('adiis') and ADIIS or DIIS
+            self.Averager = Averager(self.S,opts.get('diis_size',8),
+                                     opts.get('diis_evict','age'))
         nel = molecule.get_nel()
         nclosed,nopen = molecule.get_closedopen()
         logging.info("Nclosed/open = %d, %d" % (nclosed,nopen))
@@ -249,6 +323,8 @@ class DFTHamiltonian(AbstractHamiltonian):
         from PyQuante.Ints import getJ
         from PyQuante.dft import getXC
 
+        if self.DoAveraging and self.dmat is not None:
+            self.F = self.Averager.getF(self.F,self.dmat)
         self.dmat,self.entropy = self.solver.solve(self.F,**opts)
         D = self.dmat
         
@@ -268,6 +344,8 @@ class DFTHamiltonian(AbstractHamiltonian):
 class UHFHamiltonian(AbstractHamiltonian):
     method='UHF'
     def __init__(self,molecule,**opts):
+        from PyQuante.Convergence import DIIS,ADIIS
+        from PyQuante.SAD import sad_fock
         self.molecule = molecule
         logging.info("UHF calculation on system %s" % self.molecule.name)
         self.basis_set = BasisSet(molecule,**opts)
@@ -280,10 +358,18 @@ class UHFHamiltonian(AbstractHamiltonian):
 
         self.Fa = self.h
         self.Fb = self.h
+        if opts.get('guess') == 'sad':
+            self.Fa = self.Fb = sad_fock(molecule,self.basis_set.get(),
+                                         self.h,self.ERI)
 
         self.amat = None
         self.bmat = None
         self.entropy = None
+        self.DoAveraging = opts.get('DoAveraging',False)
+        if self.DoAveraging:
+            Averager = opts.get('adiis') and ADIIS or DIIS
+            self.Averager = Averager(self.S,opts.get('diis_size',8),
+                                     opts.get('diis_evict','age'))
         nalpha,nbeta = molecule.get_alphabeta()
         logging.info("Nalpha/beta = %d, %d" % (nalpha,nbeta))
         self.solvera = SolverFactory(2*nalpha,nalpha,0,self.S,**opts)
@@ -302,8 +388,11 @@ class UHFHamiltonian(AbstractHamiltonian):
 
     def update(self,**opts):
         from PyQuante.LA2 import trace2
-        from PyQuante.Ints import getJ,getK
+        from PyQuante.Ints import getJK
 
+        if self.DoAveraging and self.amat is not None:
+            self.Fa,self.Fb = self.Averager.getFs([self.Fa,self.Fb],
+                                                  [self.amat,self.bmat])
         self.amat,entropya = self.solvera.solve(self.Fa)
         self.bmat,entropyb = self.solverb.solve(self.Fb)
 
@@ -313,10 +402,9 @@ class UHFHamiltonian(AbstractHamiltonian):
         D = Da+Db
         self.entropy = 0.5*(entropya+entropyb)
 
-        self.J = getJ(self.ERI,D)
+        (Ja,Jb),(self.Ka,self.Kb) = getJK(self.ERI,[Da,Db])
+        self.J = Ja+Jb
         self.Ej = 0.5*trace2(D,self.J)
-        self.Ka = getK(self.ERI,Da)
-        self.Kb = getK(self.ERI,Db)
         self.Exc = -0.5*(trace2(Da,self.Ka)+trace2(Db,self.Kb))
         self.Eone = trace2(D,self.h)
         self.Fa = self.h + self.J - self.Ka
@@ -327,6 +415,8 @@ class UHFHamiltonian(AbstractHamiltonian):
 class ROHFHamiltonian(AbstractHamiltonian):
     method='ROHF'
     def __init__(self,molecule,**opts):
+        from PyQuante.SAD import sad_guess
+        from PyQuante.LA2 import Orthogonalizer
         self.molecule = molecule
         logging.info("ROHF calculation on system %s" % self.molecule.name)
         self.basis_set = BasisSet(molecule,**opts)
@@ -337,7 +427,11 @@ class ROHFHamiltonian(AbstractHamiltonian):
         self.ERI = self.integrals.get_ERI()
         self.Enuke = molecule.get_enuke()
 
+        self.orth = Orthogonalizer(self.S,opts.get('orthog','Chol'))
         self.orbs = None
+        if opts.get('guess') == 'sad':
+            self.orbe,self.orbs = sad_guess(molecule,self.basis_set.get(),
+                                            self.h,self.orth,self.ERI)
         self.norbs = len(self.basis_set)
 
         self.nalpha,self.nbeta = molecule.get_alphabeta()
@@ -355,21 +449,18 @@ class ROHFHamiltonian(AbstractHamiltonian):
     def iterate(self,**opts): return self.iterator.iterate(self,**opts)
 
     def update(self,**opts):
-        from PyQuante.Ints import getJ,getK
-        from PyQuante.LA2 import geigh,mkdens
+        from PyQuante.Ints import getJK
+        from PyQuante.LA2 import mkdens
         from PyQuante.rohf import ao2mo
         from PyQuante.hartree_fock import get_energy
         from PyQuante.NumWrap import eigh,matrixmultiply
 
         if self.orbs is None:
-            self.orbe,self.orbs = geigh(self.h, self.S)
+            self.orbe,self.orbs = self.orth.geigh(self.h)
         Da = mkdens(self.orbs,0,self.nalpha)
         Db = mkdens(self.orbs,0,self.nbeta)
 
-        Ja = getJ(self.ERI,Da)
-        Jb = getJ(self.ERI,Db)
-        Ka = getK(self.ERI,Da)
-        Kb = getK(self.ERI,Db)
+        (Ja,Jb),(Ka,Kb) = getJK(self.ERI,[Da,Db])
         Fa = self.h+Ja+Jb-Ka
         Fb = self.h+Ja+Jb-Kb
         energya = get_energy(self.h,Fa,Da)
@@ -571,22 +662,26 @@ class AbstractSolver:
 
 class BasicSolver(AbstractSolver):
     def __init__(self,nel,nclosed,nopen,S,**opts):
+        from PyQuante.LA2 import Orthogonalizer
         self.S = S
+        self.orth = Orthogonalizer(S,opts.get('orthog','Chol'))
         self.nel = nel
         self.nclosed = nclosed
         self.nopen = nopen
         return
 
     def solve(self,H,**opts):
-        from PyQuante.LA2 import geigh,mkdens_spinavg
-        self.orbe,self.orbs = geigh(H,self.S)
+        from PyQuante.LA2 import mkdens_spinavg
+        self.orbe,self.orbs = self.orth.geigh(H)
         self.D = mkdens_spinavg(self.orbs,self.nclosed,self.nopen)
         self.entropy = 0
         return self.D,self.entropy
 
 class FermiDiracSolver(AbstractSolver):
     def __init__(self,nel,nclosed,nopen,S,**opts):
+        from PyQuante.LA2 import Orthogonalizer
         self.S = S
+        self.orth = Orthogonalizer(S,opts.get('orthog','Chol'))
         self.nel = nel
         self.nclosed = nclosed
         self.nopen = nopen
@@ -594,16 +689,17 @@ class FermiDiracSolver(AbstractSolver):
         return
 
     def solve(self,H,**opts):
-        from PyQuante.LA2 import geigh
         from PyQuante.fermi_dirac import mkdens_fermi
-        self.orbe,self.orbs = geigh(H,self.S)
+        self.orbe,self.orbs = self.orth.geigh(H)
         self.D,self.entropy = mkdens_fermi(self.nel,self.orbe,
                                            self.orbs,self.etemp)
         return self.D,self.entropy
 
 class SubspaceSolver(AbstractSolver):
     def __init__(self,nel,nclosed,nopen,S,**opts):
+        from PyQuante.LA2 import Orthogonalizer
         self.S = S
+        self.orth = Orthogonalizer(S,opts.get('orthog','Chol'))
         self.nel = nel
         self.nclosed = nclosed
         self.nopen = nopen
@@ -621,11 +717,11 @@ class SubspaceSolver(AbstractSolver):
         return
 
     def solve(self,H,**opts):
-        from PyQuante.LA2 import mkdens_spinavg,simx,geigh
+        from PyQuante.LA2 import mkdens_spinavg,simx
         from PyQuante.NumWrap import matrixmultiply,eigh
         if self.first_iteration:
             self.first_iteration = False
-            self.orbe,self.orbs = geigh(H,self.S)
+            self.orbe,self.orbs = self.orth.geigh(H)
         else:
             Ht = simx(H,self.orbs)
             if self.pass_nroots:
@@ -656,6 +752,132 @@ class DmatSolver(AbstractSolver):
         self.D = solver.D
         return self.D,self.entropy
 
+class AugmentedHessianSolver(AbstractSolver):
+    """\
+    Second-order closed-shell SCF. Rather than diagonalizing the Fock
+    matrix, the solver rotates the occupied orbitals C_o into the
+    virtual ones C_v by C -> C exp(K), with K_ai = x_ai, K_ia = -x_ai
+    (rohf.expmat). With the Fock matrix F of the orbitals in the MO
+    basis, the gradient and Hessian of the energy in x are (up to a
+    factor of 4)
+
+      g = F_vo
+      H x = F_vv x - x F_oo + C_v^T G(C_v x C_o^T + C_o x^T C_v^T) C_o
+
+    where G(D) = 2J(D)-K(D), so a Hessian-vector product costs one
+    J/K build. The step x is the lowest eigenvector (1,x) of the
+    augmented Hessian [[0,g^T],[g,H]], which Davidson iterations
+    find from these products. Near convergence this is the Newton
+    step, and far from it the lowest eigenvalue shifts the Hessian
+    to keep the step downhill; steps longer than maxstep are scaled
+    back. The new orbitals are orthonormalized, and made canonical
+    within the occupied and the virtual spaces.
+
+    The solver needs the two-electron integrals, in the ERI option.
+    Until it has orbitals to rotate it diagonalizes H like
+    BasicSolver; HFHamiltonian starts one from its orbitals when the
+    DIIS error stalls.
+    """
+    def __init__(self,nel,nclosed,nopen,S,**opts):
+        from PyQuante.LA2 import Orthogonalizer
+        self.S = S
+        self.orth = Orthogonalizer(S,opts.get('orthog','Chol'))
+        self.nel = nel
+        self.nclosed = nclosed
+        self.nopen = nopen
+        self.ERI = opts['ERI']
+        self.orbs = opts.get('orbs')
+        self.maxstep = opts.get('maxstep',0.5)
+        self.max_davidson = opts.get('max_davidson',12)
+        assert nopen == 0, "AugmentedHessianSolver is closed-shell only"
+        return
+
+    def solve(self,H,**opts):
+        from PyQuante.LA2 import mkdens
+        if self.orbs is None:
+            self.orbe,self.orbs = self.orth.geigh(H)
+        else:
+            self.orbe,self.orbs = self.rotate(H,self.step(H))
+        self.D = mkdens(self.orbs,0,self.nclosed)
+        self.entropy = 0
+        return self.D,self.entropy
+
+    def hessian_vector(self,x,Fmo):
+        "The product of the orbital Hessian with the rotation x"
+        from PyQuante.Ints import get2JmK
+        from PyQuante.NumWrap import dot,transpose
+        no = self.nclosed
+        Co,Cv = self.orbs[:,:no],self.orbs[:,no:]
+        Dx = dot(Cv,dot(x,transpose(Co)))
+        G = get2JmK(self.ERI,Dx+transpose(Dx))
+        return dot(Fmo[no:,no:],x)-dot(x,Fmo[:no,:no]) \
+               + dot(transpose(Cv),dot(G,Co))
+
+    def step(self,H):
+        "The augmented-Hessian rotation x of the orbitals, for Fock matrix H"
+        from PyQuante.LA2 import simx
+        from PyQuante.NumWrap import dot,zeros,eigh,reshape
+        from math import sqrt
+        no = self.nclosed
+        Fmo = simx(H,self.orbs)
+        shape = Fmo[no:,:no].shape
+        g = Fmo[no:,:no].ravel()
+        gnorm = sqrt(dot(g,g))
+        if gnorm < 1e-12: return zeros(shape,'d')
+        diag = (Fmo.diagonal()[no:,None]-Fmo.diagonal()[None,:no]).ravel()
+        # Davidson iterations for the lowest eigenvector of the AH matrix
+        bs,Hbs = [],[]
+        x = trial = -g/diag.clip(1e-2)
+        for it in range(self.max_davidson):
+            for b in bs: trial = trial - dot(b,trial)*b
+            tnorm = sqrt(dot(trial,trial))
+            if tnorm < 1e-10: break
+            bs.append(trial/tnorm)
+            Hbs.append(self.hessian_vector(reshape(bs[-1],shape),
+                                           Fmo).ravel())
+            n = len(bs)
+            A = zeros((n+1,n+1),'d')
+            for i in range(n):
+                A[0,i+1] = A[i+1,0] = dot(g,bs[i])
+                for j in range(i+1):
+                    A[i+1,j+1] = A[j+1,i+1] = 0.5*(dot(bs[i],Hbs[j])
+                                                   +dot(bs[j],Hbs[i]))
+            vals,vecs = eigh(A)
+            lam,v = vals[0],vecs[:,0]
+            if abs(v[0]) < 1e-8: break
+            x = dot(v[1:],bs)/v[0]
+            r = dot(v[1:],Hbs)/v[0]+g-lam*x
+            if sqrt(dot(r,r)) < max(min(0.1,gnorm)*gnorm,1e-10): break
+            shift = diag-lam
+            shift[abs(shift) < 1e-4] = 1e-4
+            trial = -r/shift
+        xnorm = sqrt(dot(x,x))
+        if xnorm > self.maxstep: x *= self.maxstep/xnorm
+        return reshape(x,shape)
+
+    def rotate(self,H,x):
+        """\
+        The orbitals rotated by x, orthonormalized, and made canonical
+        for H within the occupied and the virtual spaces, and their
+        energies
+        """
+        from PyQuante.LA2 import simx,SymOrth
+        from PyQuante.NumWrap import dot,zeros,eigh
+        from PyQuante.rohf import expmat
+        no = self.nclosed
+        nmo = self.orbs.shape[1]
+        K = zeros((nmo,nmo),'d')
+        K[no:,:no] = x
+        K[:no,no:] = -x.T
+        C = dot(self.orbs,expmat(K))
+        C = dot(C,SymOrth(simx(self.S,C)))
+        orbe = zeros(nmo,'d')
+        Fmo = simx(H,C)
+        for block in [slice(0,no),slice(no,nmo)]:
+            orbe[block],U = eigh(Fmo[block,block])
+            C[:,block] = dot(C[:,block],U)
+        return orbe,C
+
 class UnitTests(unittest.TestCase):
     def setUp(self):
         from PyQuante.Molecule import Molecule
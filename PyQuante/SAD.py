@@ -0,0 +1,134 @@
+"""\
+ SAD.py The superposition of atomic densities (SAD) initial guess
+
+ The density of a molecule is guessed as the sum of the densities of
+ its free atoms, each from a spin-restricted SCF calculation on the
+ atom in its own basis functions. The electrons of a partly filled
+ shell are spread evenly over its orbitals, so the atomic densities
+ are spherical and the guess doesn't depend on how the atoms are
+ oriented. The guess density is block diagonal, with a block for each
+ atom, and the orbitals of the Fock matrix it gives are a much better
+ start than those of the core Hamiltonian, geigh(h,S).
+
+ The density of an atom depends only on the element and its basis
+ functions, so it is computed once for each and kept in a cache.
+
+ This program is part of the PyQuante quantum chemistry program suite.
+
+ Copyright (c) 2004, Richard P. Muller. All Rights Reserved.
+
+ PyQuante version 1.2 and later is covered by the modified BSD
+ license. Please see the file LICENSE that is part of this
+ distribution.
+"""
+
+import logging
+from NumWrap import zeros,dot,transpose
+from LA2 import trace2,Orthogonalizer
+from Ints import getints,get2JmK
+from Convergence import DIIS
+from Molecule import Molecule
+
+# The density of each atom, keyed by atom_key
+_densities = {}
+
+def atom_key(atno,bfs):
+    "The key of the density of element atno in the basis functions bfs"
+    return (atno,tuple([(bf.powers(),tuple(bf.exps()),tuple(bf.coefs()))
+                        for bf in bfs]))
+
+def average_occs(orbe,nocc,tol=1e-5):
+    """\
+    The occupations, between 0 and 1, of the orbitals with energies
+    orbe (in increasing order) for nocc electrons of each spin. The
+    orbitals are filled from the bottom, and the electrons of the last,
+    partly filled, shell are shared evenly by its degenerate orbitals.
+    """
+    occs = zeros(len(orbe),'d')
+    i = 0
+    while nocc > 0 and i < len(orbe):
+        j = i+1
+        while j < len(orbe) and orbe[j]-orbe[i] < tol: j += 1
+        n = min(nocc,j-i)
+        occs[i:j] = n/float(j-i)
+        nocc -= n
+        i = j
+    return occs
+
+def atomic_density(atom,bfs,**opts):
+    """\
+    D = atomic_density(atom,bfs)
+
+    The spin-averaged density (of each spin, as from mkdens) of the
+    free atom in the basis functions bfs, which are centered on it.
+
+    Options:      Value   Description
+    --------      -----   -----------
+    ConvCriteria  1e-6    Convergence Criteria of the atomic SCF
+    MaxIter       50      Maximum iterations of the atomic SCF
+    """
+    key = atom_key(atom.atno,bfs)
+    if key in _densities: return _densities[key]
+    ConvCriteria = opts.get('ConvCriteria',1e-6)
+    MaxIter = opts.get('MaxIter',50)
+
+    free_atom = Molecule('atom %d' % atom.atno,[(atom.atno,atom.pos())])
+    S,h,Ints = getints(bfs,free_atom)
+    nocc = 0.5*atom.get_nel()
+    avg = DIIS(S)
+    orth = Orthogonalizer(S)
+    orbe,orbs = orth.geigh(h)
+    eold = 0.
+    for i in range(MaxIter):
+        occs = average_occs(orbe,nocc)
+        D = dot(orbs*occs,transpose(orbs))
+        F = h+get2JmK(Ints,D)
+        energy = trace2(D,h)+trace2(D,F)
+        F = avg.getF(F,D)
+        orbe,orbs = orth.geigh(F)
+        if abs(energy-eold) < ConvCriteria: break
+        eold = energy
+    else:
+        logging.warning("SAD: the SCF of atom %d failed to converge"
+                        % atom.atno)
+    _densities[key] = D
+    return D
+
+def sad_density(atoms,bfs):
+    """\
+    D = sad_density(atoms,bfs)
+
+    The block diagonal guess density (of each spin) of the molecule,
+    scaled to the number of electrons of the molecule if it is charged
+    """
+    nbf = len(bfs)
+    D = zeros((nbf,nbf),'d')
+    atom_bfs = {}
+    for i,bf in enumerate(bfs):
+        atom_bfs.setdefault(bf.atid,[]).append(i)
+    nel = 0
+    for atom in atoms:
+        index = atom_bfs.get(atom.atid,[])
+        nel += atom.get_nel()
+        if not index: continue
+        Dat = atomic_density(atom,[bfs[i] for i in index])
+        for p,i in enumerate(index):
+            for q,j in enumerate(index):
+                D[i,j] = Dat[p,q]
+    if nel != atoms.get_nel():
+        D *= atoms.get_nel()/float(nel)
+    return D
+
+def sad_fock(atoms,bfs,h,Ints):
+    "The HF Fock matrix of the superposition of atomic densities"
+    return h+get2JmK(Ints,sad_density(atoms,bfs))
+
+def sad_guess(atoms,bfs,h,orth,Ints):
+    """\
+    orbe,orbs = sad_guess(atoms,bfs,h,orth,Ints)
+
+    The guess orbitals: the eigenvectors of the Fock matrix of the
+    superposition of atomic densities, from the Orthogonalizer orth
+    of the overlap matrix
+    """
+    return orth.geigh(sad_fock(atoms,bfs,h,Ints))
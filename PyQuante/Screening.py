@@ -0,0 +1,91 @@
+"""\
+ Screening.py Cauchy-Schwarz screening of two-electron integrals
+
+ The Schwarz inequality |(ij|kl)| <= sqrt((ij|ij))*sqrt((kl|kl)) gives a
+ cheap upper bound to every integral once the diagonal (ij|ij) are
+ known. Quartets whose bound is below the threshold are skipped.
+
+ This program is part of the PyQuante quantum chemistry program suite.
+
+ Copyright (c) 2004, Richard P. Muller. All Rights Reserved.
+
+ PyQuante version 1.2 and later is covered by the modified BSD
+ license. Please see the file LICENSE that is part of this
+ distribution.
+"""
+
+import logging
+from math import sqrt
+from NumWrap import zeros
+from Shell import getshells,coulomb
+
+class Schwarz:
+    """\
+    Schwarz(bfs,tol=1e-12,shells=None,pairdata=None) - Schwarz bounds
+
+    bfs       The list of CGBFs
+    tol       Quartets with bounds smaller than tol are skipped
+    shells    The shells of bfs, if they have already been formed
+    pairdata  The PairData of the shells, if it has been formed
+
+    The diagonal (ij|ij) are computed once, at construction. Q[i,j]
+    holds sqrt(|(ij|ij)|) for basis functions i,j, and Qshell[I,J]
+    the largest of these over the components of shells I,J. The
+    nskipped/ntested counters accumulate over calls to skip() and
+    skip_shells().
+    """
+    def __init__(self,bfs,tol=1e-12,shells=None,pairdata=None):
+        if shells is None: shells = getshells(bfs)
+        self.tol = tol
+        self.shells = shells
+        nbf = len(bfs)
+        nsh = len(shells)
+        self.Q = zeros((nbf,nbf),'d')
+        self.Qshell = zeros((nsh,nsh),'d')
+        for I in xrange(nsh):
+            a = shells[I]
+            for J in xrange(I+1):
+                b = shells[J]
+                vals = coulomb(a,b,a,b,pairdata)
+                na,nb = a.nbf,b.nbf
+                qmax = 0
+                for ia,i in enumerate(a.indices()):
+                    for ib,j in enumerate(b.indices()):
+                        q = sqrt(abs(vals[((ia*nb+ib)*na+ia)*nb+ib]))
+                        self.Q[i,j] = self.Q[j,i] = q
+                        qmax = max(qmax,q)
+                self.Qshell[I,J] = self.Qshell[J,I] = qmax
+        self.reset()
+        return
+
+    def reset(self):
+        "Zero the skipped/tested counters"
+        self.nskipped = 0
+        self.ntested = 0
+        return
+
+    def bound(self,i,j,k,l):
+        "Upper bound to |(ij|kl)|"
+        return self.Q[i,j]*self.Q[k,l]
+
+    def skip(self,i,j,k,l):
+        "Can the basis function quartet (ij|kl) be neglected?"
+        self.ntested += 1
+        if self.Q[i,j]*self.Q[k,l] < self.tol:
+            self.nskipped += 1
+            return True
+        return False
+
+    def skip_shells(self,I,J,K,L):
+        "Can every integral in the shell quartet (IJ|KL) be neglected?"
+        self.ntested += 1
+        if self.Qshell[I,J]*self.Qshell[K,L] < self.tol:
+            self.nskipped += 1
+            return True
+        return False
+
+    def report(self,what='quartets'):
+        "Log how many quartets have been skipped"
+        logging.info("Schwarz screening (tol=%g) skipped %d of %d %s"
+                     % (self.tol,self.nskipped,self.ntested,what))
+        return
@@ -0,0 +1,141 @@
+"""\
+ Shell.py Shells of contracted gaussian basis functions
+
+ A shell is the set of CGBFs that getbasis builds from a single
+ (sym,prims) basis set entry: the functions share a center, exponents
+ and contraction coefficients, and differ only in their powers. The
+ two-electron integrals of a shell quartet are computed together by
+ chgp.shell_coulomb, which shares the Gaussian product data and the
+ recursion intermediates between all of the components. Quartets whose
+ angular momentum class the Backends registry sends to another module
+ are computed a component at a time by that module instead.
+
+ This program is part of the PyQuante quantum chemistry program suite
+
+ Copyright (c) 2004, Richard P. Muller. All Rights Reserved.
+
+ PyQuante version 1.2 and later is covered by the modified BSD
+ license. Please see the file LICENSE that is part of this
+ distribution.
+"""
+
+from math import sqrt
+from PyQuante.cints import fact2
+from PyQuante.chgp import shell_coulomb
+from PyQuante.Backends import contr_coulomb
+from PyQuante.CGBF import coulomb as cgbf_coulomb
+from PyQuante.ERIStore import pair_index
+from numpy import array,newaxis
+
+class Shell:
+    "Class for a shell of contracted Gaussian basis functions"
+    def __init__(self,bfs,start=0):
+        self.bfs = bfs
+        self.start = start
+        self.nbf = len(bfs)
+        bf = bfs[0]
+        self.atid = bf.atid
+        self.L = sum(bf.powers())
+        # The primitive norms factor into a part that depends only
+        #  upon the exponent and L, and an angular part; the former
+        #  goes into the contraction coefficients, the latter into
+        #  the component norms
+        ang = angular_norm(bf.powers())
+        self.pcoefs = [c*n/ang for c,n in zip(bf.coefs(),bf.pnorms())]
+        self.comp_norms = [b.norm()*angular_norm(b.powers()) for b in bfs]
+        self._data = (bf.origin(),bf.exps(),self.pcoefs,
+                      [b.powers() for b in bfs],self.comp_norms)
+        # The (indices,UT) of the spherical functions made from the
+        #  shell, if any (see Spherical.shell_transforms)
+        self.transform = None
+        self._pair_indices = {}
+        return
+
+    def __repr__(self):
+        return "<shell L=%d atomid=%d start=%d nbf=%d>" % \
+               (self.L,self.atid,self.start,self.nbf)
+
+    def __len__(self): return self.nbf
+    def origin(self): return self.bfs[0].origin()
+    def exps(self): return self.bfs[0].exps()
+    def indices(self): return range(self.start,self.start+self.nbf)
+    def data(self): return self._data
+
+    def pair_indices(self,other):
+        """\
+        The packed pair indices i*(i+1)/2+j (i >= j) of the functions of
+        self and other, in the order shell_coulomb gives them. For a
+        shell with a spherical transform, these are the indices of the
+        functions made from the shell.
+        """
+        if other.start not in self._pair_indices:
+            i = array(self.out_indices())
+            j = array(other.out_indices())
+            self._pair_indices[other.start] = \
+                pair_index(i[:,newaxis],j[newaxis,:]).ravel()
+        return self._pair_indices[other.start]
+
+    def out_indices(self):
+        "The indices of the functions the integrals of the shell go into"
+        if self.transform: return self.transform[0]
+        return self.indices()
+
+def angular_norm((l,m,n)):
+    "The part of the primitive normalization depending only on the powers"
+    return 1/sqrt(fact2(2*l-1)*fact2(2*m-1)*fact2(2*n-1))
+
+def same_shell(a,b):
+    "Can CGBFs a and b be components of the same shell?"
+    return a.origin() == b.origin() and a.exps() == b.exps() \
+           and a.coefs() == b.coefs() \
+           and sum(a.powers()) == sum(b.powers())
+
+def getshells(bfs):
+    """\
+    shells = getshells(bfs)
+
+    Group a list of CGBFs into shells. Consecutive functions with
+    the same center, exponents, coefficients and total angular
+    momentum go into the same shell, which is what getbasis builds
+    from each (sym,prims) entry.
+    """
+    shells = []
+    start = 0
+    nbf = len(bfs)
+    while start < nbf:
+        bf = bfs[start]
+        L = sum(bf.powers())
+        powers = [bf.powers()]
+        stop = start+1
+        while stop < nbf and len(powers) < (L+1)*(L+2)/2 \
+                  and same_shell(bf,bfs[stop]) \
+                  and bfs[stop].powers() not in powers:
+            powers.append(bfs[stop].powers())
+            stop += 1
+        shells.append(Shell(bfs[start:stop],start))
+        start = stop
+    return shells
+
+def shell_kernel(a,b,c,d):
+    """\
+    Does the Backends registry send the class of the quartet to chgp,
+    so that chgp.shell_coulomb can do all of its components at once?
+    """
+    return contr_coulomb.module((a.L+b.L,c.L+d.L)) == 'chgp'
+
+def coulomb(a,b,c,d,pairdata=None,prim_tol=None):
+    """\
+    Coulomb interactions between all of the components of 4 shells,
+    returned as a flat list ordered (a,b,c,d) with d running fastest.
+    pairdata is an optional PairData object for the basis set, which
+    holds the primitive pair data of (ab| and |cd). prim_tol is the
+    primitive screening tolerance, by default that of chgp.set_prim_tol.
+    """
+    if not shell_kernel(a,b,c,d):
+        return [cgbf_coulomb(p,q,r,s) for p in a.bfs for q in b.bfs
+                for r in c.bfs for s in d.bfs]
+    if pairdata is None:
+        return shell_coulomb(a.data(),b.data(),c.data(),d.data(),
+                             None,None,prim_tol)
+    return shell_coulomb(a.data(),b.data(),c.data(),d.data(),
+                         pairdata.get(a,b),pairdata.get(c,d),prim_tol)
@@ -0,0 +1,163 @@
+"""\
+ Spherical.py Pure spherical-harmonic (5d/7f) basis functions
+
+ getbasis builds 6 Cartesian functions for each D shell and 10 for each
+ F shell. With spherical=True, each D and F shell instead gives the 5
+ and 7 real solid harmonics r^l Y_lm, which are fixed combinations of
+ the normalized Cartesian functions of the shell:
+
+   S_lm = sum_p U_lm,p cart_p
+
+ The Cartesian integrals are still what is computed; get1ints and
+ get2ints form them over the Cartesian functions of the shells and
+ transform them, a matrix or a shell quartet at a time, into the
+ spherical functions. The components are in the order m = 0,+1,-1,
+ +2,-2,+3,-3.
+
+ This program is part of the PyQuante quantum chemistry program suite.
+
+ Copyright (c) 2004, Richard P. Muller. All Rights Reserved.
+
+ PyQuante version 1.2 and later is covered by the modified BSD
+ license. Please see the file LICENSE that is part of this
+ distribution.
+"""
+
+from math import sqrt
+from NumWrap import zeros,dot,transpose,identity
+from PyQuante.cints import fact2
+
+# The real solid harmonics, as polynomials {(l,m,n) : coefficient}
+solid_harmonics = {
+    'D' : [{(0,0,2):2,(2,0,0):-1,(0,2,0):-1},    # 3z^2-r^2
+           {(1,0,1):1},                          # xz
+           {(0,1,1):1},                          # yz
+           {(2,0,0):1,(0,2,0):-1},               # x^2-y^2
+           {(1,1,0):1}],                         # xy
+    'F' : [{(0,0,3):2,(2,0,1):-3,(0,2,1):-3},    # z(5z^2-3r^2)
+           {(1,0,2):4,(3,0,0):-1,(1,2,0):-1},    # x(5z^2-r^2)
+           {(0,1,2):4,(2,1,0):-1,(0,3,0):-1},    # y(5z^2-r^2)
+           {(2,0,1):1,(0,2,1):-1},               # z(x^2-y^2)
+           {(1,1,1):1},                          # xyz
+           {(3,0,0):1,(1,2,0):-3},               # x(x^2-3y^2)
+           {(2,1,0):3,(0,3,0):-1}],              # y(3x^2-y^2)
+    }
+
+def angular_overlap(p,q):
+    """\
+    The overlap of x^l y^m z^n exp(-a r^2) for powers p and q, apart
+    from a factor that only depends upon a and l+m+n
+    """
+    val = 1
+    for i in xrange(3):
+        if (p[i]+q[i]) % 2: return 0
+        val *= fact2(p[i]+q[i]-1)
+    return val
+
+def cart2sph(sym,powers):
+    """\
+    The coefficients of the normalized solid harmonics of shell type
+    sym over the normalized Cartesian functions with powers, one row
+    per harmonic
+    """
+    rows = []
+    for poly in solid_harmonics[sym]:
+        norm2 = 0
+        for p,cp in poly.items():
+            for q,cq in poly.items():
+                norm2 += cp*cq*angular_overlap(p,q)
+        rows.append([poly.get(p,0)*sqrt(angular_overlap(p,p)/float(norm2))
+                     for p in powers])
+    return rows
+
+class SphericalBF:
+    """\
+    SphericalBF(cgbfs,coefs) - A spherical basis function
+
+    cgbfs  The normalized Cartesian CGBFs of the shell
+    coefs  The coefficient of each of them
+
+    The function can be evaluated on a grid like a CGBF, but its
+    integrals are formed from those of the Cartesian functions (see
+    expand).
+    """
+    def __init__(self,cgbfs,coefs):
+        self.cgbfs = cgbfs
+        self.ccoefs = coefs
+        self.atid = cgbfs[0].atid
+        return
+
+    def __repr__(self):
+        return "<sphericalbf atomid=%d %s>" % \
+               (self.atid,' '.join(["%.4f%s" % (c,bf.powers()) for c,bf
+                                    in zip(self.ccoefs,self.cgbfs) if c]))
+
+    def origin(self): return self.cgbfs[0].origin()
+    def exps(self): return self.cgbfs[0].exps()
+    def coefs(self): return self.cgbfs[0].coefs()
+    def powers(self):
+        "The (coefficient,powers) of the Cartesian components"
+        return tuple([(c,bf.powers()) for c,bf in zip(self.ccoefs,self.cgbfs)
+                      if c])
+
+    def amp(self,x,y,z):
+        "Compute the amplitude of the function at point x,y,z"
+        val = 0.
+        for c,bf in zip(self.ccoefs,self.cgbfs):
+            if c: val += c*bf.amp(x,y,z)
+        return val
+
+    def grad(self,x,y,z):
+        "Evaluate the grad of the function at pos=x,y,z"
+        val = zeros(3,'d')
+        for c,bf in zip(self.ccoefs,self.cgbfs):
+            if c: val += c*bf.grad(x,y,z)
+        return val
+
+def expand(bfs):
+    """\
+    cbfs,T = expand(bfs)
+
+    The Cartesian CGBFs that make up the functions of bfs, and the
+    len(bfs) x len(cbfs) matrix T of their coefficients. T is None if
+    bfs are all Cartesian.
+    """
+    if not [bf for bf in bfs if isinstance(bf,SphericalBF)]: return bfs,None
+    cbfs = []
+    index = {}
+    for bf in bfs:
+        for cbf in getattr(bf,'cgbfs',[bf]):
+            if id(cbf) not in index:
+                index[id(cbf)] = len(cbfs)
+                cbfs.append(cbf)
+    T = zeros((len(bfs),len(cbfs)),'d')
+    for i,bf in enumerate(bfs):
+        if isinstance(bf,SphericalBF):
+            for c,cbf in zip(bf.ccoefs,bf.cgbfs):
+                T[i,index[id(cbf)]] = c
+        else:
+            T[i,index[id(bf)]] = 1
+    return cbfs,T
+
+def transform(M,T):
+    "T M T^T, or M if T is None"
+    if T is None: return M
+    return dot(T,dot(M,transpose(T)))
+
+def shell_transforms(shells,T):
+    """\
+    Set the transform of each of the Cartesian shells to (indices,UT):
+    the indices of the functions made from the shell, and the transpose
+    of the rows of T for them, restricted to the shell. UT is None if
+    the functions are the Cartesian ones.
+    """
+    for shell in shells:
+        start,stop = shell.start,shell.start+shell.nbf
+        indices = [i for i in xrange(T.shape[0])
+                   if abs(T[i,start:stop]).max() > 0]
+        U = T[indices,start:stop]
+        if len(indices) == shell.nbf and (U == identity(shell.nbf)).all():
+            shell.transform = (indices,None)
+        else:
+            shell.transform = (indices,transpose(U))
+    return
@@ -0,0 +1,203 @@
+"""\
+ Symmetry.py Abelian point groups, and the symmetry-unique two-electron
+ integrals
+
+ The Abelian point group D2h and its subgroups D2, C2v, C2h, C2, Cs,
+ Ci and C1 are made of operations that change the signs of some of
+ the Cartesian axes, (x,y,z) -> (sx x,sy y,sz z). A molecule's group
+ is found from these, with the symmetry elements along the coordinate
+ axes through the center of nuclear charge; Molecule.inertial turns
+ a molecule into such an orientation.
+
+ An operation takes a Cartesian basis function with powers (l,m,n) on
+ one atom into the same function on the image atom, times
+ sx^l sy^m sz^n, and leaves the integrals unchanged, so
+
+   (ij|kl) = s_i s_j s_k s_l (g(i) g(j)|g(k) g(l))
+
+ Of each set of shell quartets that the operations take into one
+ another, only one needs to be computed; the rest are copies, with
+ the signs changed. This cuts the work by up to the order of the group.
+
+ This program is part of the PyQuante quantum chemistry program suite.
+
+ Copyright (c) 2004, Richard P. Muller. All Rights Reserved.
+
+ PyQuante version 1.2 and later is covered by the modified BSD
+ license. Please see the file LICENSE that is part of this
+ distribution.
+"""
+
+import logging
+from numpy import array,zeros,arange,int64
+from PyQuante.cints import ijkl2intindex as intindex,symmetry_fill
+from PyQuante.ERIStore import unpack_indices,intindices
+
+# The operations of D2h, and the signs they give x,y,z
+operations = [('E',(1,1,1)),('C2z',(-1,-1,1)),('C2y',(-1,1,-1)),
+              ('C2x',(1,-1,-1)),('i',(-1,-1,-1)),('sxy',(1,1,-1)),
+              ('sxz',(1,-1,1)),('syz',(-1,1,1))]
+
+def group_name(labels):
+    "The name of the group with the operations labels"
+    if len(labels) == 8: return 'D2h'
+    if len(labels) == 4:
+        if 'i' in labels: return 'C2h'
+        if 'C2x' in labels and 'C2y' in labels: return 'D2'
+        return 'C2v'
+    if len(labels) == 2:
+        if 'i' in labels: return 'Ci'
+        if 'sxy' in labels or 'sxz' in labels or 'syz' in labels:
+            return 'Cs'
+        return 'C2'
+    return 'C1'
+
+def center_of_charge(atoms):
+    ztot = 0
+    center = [0.,0.,0.]
+    for atom in atoms:
+        pos = atom.pos()
+        for i in xrange(3): center[i] += atom.atno*pos[i]
+        ztot += atom.atno
+    return [c/ztot for c in center]
+
+def image_atoms(atoms,center,signs,tol):
+    """\
+    The index of the image of each atom under the operation with signs,
+    or None if the operation isn't a symmetry of the atoms
+    """
+    amap = []
+    for atom in atoms:
+        pos = atom.pos()
+        image = [center[i]+signs[i]*(pos[i]-center[i]) for i in xrange(3)]
+        for b,other in enumerate(atoms):
+            if other.atno != atom.atno: continue
+            opos = other.pos()
+            if max([abs(image[i]-opos[i]) for i in xrange(3)]) < tol:
+                amap.append(b)
+                break
+        else:
+            return None
+    return amap
+
+class PointGroup:
+    """\
+    PointGroup(atoms,tol=1e-6) - The Abelian point group of the atoms
+
+    name       The name of the group, e.g. 'C2v'
+    labels     The labels of its operations (see operations)
+    signs      The (sx,sy,sz) of each operation
+    atom_maps  The index of the image of each atom, for each operation
+
+    The atoms are taken to be symmetric under an operation if each
+    image is within tol (bohr) of an atom of the same element.
+    """
+    def __init__(self,atoms,tol=1e-6):
+        self.center = center_of_charge(atoms)
+        self.labels,self.signs,self.atom_maps = [],[],[]
+        for label,signs in operations:
+            amap = image_atoms(atoms,self.center,signs,tol)
+            if amap is None: continue
+            self.labels.append(label)
+            self.signs.append(signs)
+            self.atom_maps.append(amap)
+        self.name = group_name(self.labels)
+        return
+
+    def __repr__(self): return "<PointGroup %s>" % self.name
+    def order(self): return len(self.labels)
+
+    def bf_maps(self,bfs):
+        """\
+        For each operation, the image of each basis function, and the
+        sign it picks up. The functions of equivalent atoms must come
+        in the same order, as getbasis makes them.
+        """
+        atom_bfs = {}
+        for i,bf in enumerate(bfs):
+            atom_bfs.setdefault(bf.atid,[]).append(i)
+        maps = []
+        for signs,amap in zip(self.signs,self.atom_maps):
+            images,bfsigns = [],[]
+            for i,bf in enumerate(bfs):
+                mine = atom_bfs[bf.atid]
+                theirs = atom_bfs.get(amap[bf.atid],[])
+                if len(theirs) != len(mine):
+                    raise ValueError("The basis set doesn't have the "
+                                     "symmetry of the molecule")
+                j = theirs[mine.index(i)]
+                if bfs[j].powers() != bf.powers() \
+                       or bfs[j].exps() != bf.exps() \
+                       or bfs[j].coefs() != bf.coefs():
+                    raise ValueError("The basis set doesn't have the "
+                                     "symmetry of the molecule")
+                l,m,n = bf.powers()
+                images.append(j)
+                bfsigns.append(signs[0]**l*signs[1]**m*signs[2]**n)
+            maps.append((images,bfsigns))
+        return maps
+
+class UniqueQuartets:
+    """\
+    UniqueQuartets(group,shells) - The symmetry-unique shell quartets
+
+    Of each set of shell quartets that the operations of the group take
+    into one another, the one with the lowest ijkl2intindex is computed.
+    unique(I,J,K,L) tells whether the shell quartet (IJ|KL) is one of
+    these, and fill(Ints) then copies their integrals into the rest.
+    """
+    def __init__(self,group,shells,blocksize=1000000):
+        self.group = group
+        bfs = []
+        shell_of = []
+        for n,shell in enumerate(shells):
+            bfs.extend(shell.bfs)
+            shell_of.extend([n]*shell.nbf)
+        self.nbf = len(bfs)
+        self.shell_of = array(shell_of)
+        self.maps = [(array(images),array(signs))
+                     for images,signs in group.bf_maps(bfs)]
+        smaps = [self.shell_of[images[[shell.start for shell in shells]]]
+                 for images,signs in self.maps]
+        # The operation that takes each shell quartet into the one that
+        #  is computed, with 0 (E) for those that are computed
+        npair = len(shells)*(len(shells)+1)/2
+        nquartet = npair*(npair+1)/2
+        self.rep_op = zeros(nquartet,'b')
+        for start in xrange(0,nquartet,blocksize):
+            n = min(blocksize,nquartet-start)
+            I,J,K,L = unpack_indices(start,n)
+            best = arange(start,start+n,dtype=int64)
+            rep_op = zeros(n,'b')
+            for g in xrange(1,len(smaps)):
+                smap = smaps[g]
+                image = intindices(smap[I],smap[J],smap[K],smap[L])
+                better = image < best
+                rep_op[better] = g
+                best[better] = image[better]
+            self.rep_op[start:start+n] = rep_op
+        return
+
+    def unique(self,I,J,K,L):
+        "Is the shell quartet (IJ|KL) computed?"
+        return not self.rep_op[intindex(I,J,K,L)]
+
+    def fill(self,Ints):
+        """\
+        Copy the integrals of the computed shell quartets into the rest.
+        Ints is a writable buffer of the integrals (an ERIArray, RawArray
+        or memmap), in the ijkl2intindex packed layout.
+        """
+        images,signs = [],[]
+        for image,sign in self.maps:
+            images.extend(image.tolist())
+            signs.extend(sign.tolist())
+        symmetry_fill(Ints,self.shell_of.tolist(),self.rep_op,images,signs)
+        return
+
+    def report(self):
+        "Log how many shell quartets are copies"
+        logging.info("Point group %s: copied %d of %d shell quartets"
+                     % (self.group.name,(self.rep_op != 0).sum(),
+                        len(self.rep_op)))
+        return
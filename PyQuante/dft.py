@@ -13,12 +13,13 @@
 #from math import *
 from Ints import getbasis,getJ,getints
 from MolecularGrid import MolecularGrid
-from LA2 import geigh,mkdens,mkdens_spinavg,trace2
+from LA2 import geigh,mkdens,mkdens_spinavg,trace2,Orthogonalizer
 from fermi_dirac import get_efermi, get_fermi_occs,mkdens_occs, get_entropy
 from NumWrap import zeros,dot,ravel,transpose,sum
 from DFunctionals import XC,need_gradients
 from time import time
-from Convergence import DIIS
+from Convergence import DIIS,ADIIS
+from hartree_fock import guess_orbs
 from PyQuante.cints import dist
 import logging
 
@@ -130,13 +131,42 @@ def dft(atoms,**opts):
     MaxIter       20      Maximum SCF iterations
     DoAveraging   True    Use DIIS for accelerated convergence (default)
                   False   No convergence acceleration
+    DIISSize      8       The most Fock matrices DIIS keeps
+    DIISEvict     age     Which Fock matrix DIIS drops when it has
+                          DIISSize: 'age' the oldest, 'error' the one
+                          with the largest error (see Convergence.DIIS)
+    ADIIS         False   Use ADIIS in the early iterations, blended
+                          into DIIS near convergence (see
+                          Convergence.ADIIS)
     ETemp         False   Use ETemp value for finite temperature DFT (default)
                   float   Use (float) for the electron temperature
     bfs           None    The basis functions to use. List of CGBF's
     basis_data    None    The basis data to use to construct bfs
+    spherical     False   Construct bfs with 5 d and 7 f spherical
+                          functions (see Spherical.py)
     integrals     None    The one- and two-electron integrals to use
                           If not None, S,h,Ints
+    schwarz_tol   1e-12   Schwarz screening threshold for the
+                          two-electron integrals (see Ints.get2ints)
+    pair_tol      1e-15   Primitive pair threshold for the
+                          two-electron integrals (see PairData.py)
+    prim_tol      1e-15   Primitive quartet threshold for the
+                          two-electron integrals (see Ints.get2ints)
+    symmetry      False   Compute only the symmetry-unique
+                          two-electron integrals, using the point
+                          group of the molecule (see Symmetry.py)
+    eri_compress  None    Keep the two-electron integrals in reduced
+                          precision, 'mixed' or 'sparse' (see
+                          Ints.get2ints)
+    density_fitting False Approximate the two-electron integrals by
+                          density fitting (see DensityFitting.py)
     orbs          None    If not none, the guess orbitals
+    guess         core    The guess when orbs isn't given: 'core' the
+                          orbitals of h, 'sad' those of the superposition
+                          of atomic densities (see SAD.py)
+    orthog        Chol    The orthogonalization of the basis for the
+                          eigenproblems, formed once: 'Chol', 'Sym',
+                          'Can' or 'Cut' (see LA2.get_xfrm)
     functional    SVWN    Use the SVWN (LDA) DFT functional (default)
                   S0      Use the Slater Xalpha DFT functional
                   BLYP    Use the BLYP GGA DFT functional
@@ -156,16 +186,17 @@ def dft(atoms,**opts):
     functional = opts.get('functional','SVWN')
     opts['do_grad_dens'] = need_gradients[functional]
 
-    bfs = opts.get('bfs',None)
+    bfs = opts.pop('bfs',None)
     if not bfs:
         basis_data = opts.get('basis_data',None)
-        bfs = getbasis(atoms,basis_data)
+        bfs = getbasis(atoms,basis_data,
+                       spherical=opts.get('spherical',False))
 
     integrals = opts.get('integrals',None)
     if integrals:
         S,h,Ints = integrals
     else:
-        S,h,Ints = getints(bfs,atoms)
+        S,h,Ints = getints(bfs,atoms,**opts)
 
     nel = atoms.get_nel()
     enuke = atoms.get_enuke()
@@ -181,8 +212,9 @@ def dft(atoms,**opts):
 
     # It would be nice to have a more intelligent treatment of the guess
     # so that I could pass in a density rather than a set of orbs.
+    orth = Orthogonalizer(S,opts.get('orthog','Chol'))
     orbs = opts.get('orbs',None)
-    if orbs is None: orbe,orbs = geigh(h,S)
+    if orbs is None: orbe,orbs = guess_orbs(atoms,bfs,h,orth,Ints,**opts)
 
     nclosed,nopen = atoms.get_closedopen()
 
@@ -197,7 +229,9 @@ def dft(atoms,**opts):
     eold = 0.
     if DoAveraging:
         if verbose: print"Using DIIS averaging"
-        avg=DIIS(S)
+        Averager = opts.get('ADIIS') and ADIIS or DIIS
+        avg=Averager(S,opts.get('DIISSize',8),
+                     opts.get('DIISEvict','age'))
 
     # Converge the LDA density for the system:
     if verbose: print "Optimization of DFT density"
@@ -219,7 +253,7 @@ def dft(atoms,**opts):
         F = h+2*J+XC
         if DoAveraging: F = avg.getF(F,D)
         
-        orbe,orbs = geigh(F,S)
+        orbe,orbs = orth.geigh(F)
         
         Ej = 2*trace2(D,J)
         Eone = 2*trace2(D,h)
@@ -250,9 +284,29 @@ def udft(atoms,**opts):
                   float   Use (float) for the electron temperature
     bfs           None    The basis functions to use. List of CGBF's
     basis_data    None    The basis data to use to construct bfs
+    spherical     False   Construct bfs with 5 d and 7 f spherical
+                          functions (see Spherical.py)
     integrals     None    The one- and two-electron integrals to use
                           If not None, S,h,Ints
+    schwarz_tol   1e-12   Schwarz screening threshold for the
+                          two-electron integrals (see Ints.get2ints)
+    pair_tol      1e-15   Primitive pair threshold for the
+                          two-electron integrals (see PairData.py)
+    prim_tol      1e-15   Primitive quartet threshold for the
+                          two-electron integrals (see Ints.get2ints)
+    symmetry      False   Compute only the symmetry-unique
+                          two-electron integrals, using the point
+                          group of the molecule (see Symmetry.py)
+    eri_compress  None    Keep the two-electron integrals in reduced
+                          precision, 'mixed' or 'sparse' (see
+                          Ints.get2ints)
     orbs          None    If not none, the guess orbitals
+    guess         core    The guess when orbs isn't given: 'core' the
+                          orbitals of h, 'sad' those of the superposition
+                          of atomic densities (see SAD.py)
+    orthog        Chol    The orthogonalization of the basis for the
+                          eigenproblems, formed once: 'Chol', 'Sym',
+                          'Can' or 'Cut' (see LA2.get_xfrm)
     functional    SVWN    Use the SVWN (LDA) DFT functional (default)
                   S0      Use the Slater Xalpha DFT functional
                   BLYP    Use the BLYP GGA DFT functional
@@ -268,16 +322,17 @@ def udft(atoms,**opts):
     functional = opts.get('functional','SVWN')
     opts['do_grad_dens'] = need_gradients[functional]
 
-    bfs = opts.get('bfs',None)
+    bfs = opts.pop('bfs',None)
     if not bfs:
         basis_data = opts.get('basis_data',None)
-        bfs = getbasis(atoms,basis_data)
+        bfs = getbasis(atoms,basis_data,
+                       spherical=opts.get('spherical',False))
 
     integrals = opts.get('integrals',None)
     if integrals:
         S,h,Ints = integrals
     else:
-        S,h,Ints = getints(bfs,atoms)
+        S,h,Ints = getints(bfs,atoms,**opts)
 
     nel = atoms.get_nel()
     enuke = atoms.get_enuke()
@@ -293,8 +348,9 @@ def udft(atoms,**opts):
 
     # It would be nice to have a more intelligent treatment of the guess
     # so that I could pass in a density rather than a set of orbs.
+    orth = Orthogonalizer(S,opts.get('orthog','Chol'))
     orbs = opts.get('orbs',None)
-    if not orbs: orbe,orbs = geigh(h,S)
+    if not orbs: orbe,orbs = guess_orbs(atoms,bfs,h,orth,Ints,**opts)
     orbsa = orbsb = orbs
 
     nalpha,nbeta = atoms.get_alphabeta()
@@ -324,8 +380,8 @@ def udft(atoms,**opts):
         Fa = h+Ja+Jb-Ka
         Fb = h+Ja+Jb-Kb
         
-        orbea,orbsa = geigh(Fa,S)
-        orbeb,orbsb = geigh(Fb,S)
+        orbea,orbsa = orth.geigh(Fa)
+        orbeb,orbsb = orth.geigh(Fb)
         
         Eja = trace2(D,Ja)
         Ejb = trace2(D,Jb)
@@ -376,13 +432,40 @@ def dft_fixed_occ(atoms,occs,**opts):
     MaxIter       20      Maximum SCF iterations
     DoAveraging   True    Use DIIS for accelerated convergence (default)
                   False   No convergence acceleration
+    DIISSize      8       The most Fock matrices DIIS keeps
+    DIISEvict     age     Which Fock matrix DIIS drops when it has
+                          DIISSize: 'age' the oldest, 'error' the one
+                          with the largest error (see Convergence.DIIS)
+    ADIIS         False   Use ADIIS in the early iterations, blended
+                          into DIIS near convergence (see
+                          Convergence.ADIIS)
     ETemp         False   Use ETemp value for finite temperature DFT (default)
                   float   Use (float) for the electron temperature
     bfs           None    The basis functions to use. List of CGBF's
     basis_data    None    The basis data to use to construct bfs
+    spherical     False   Construct bfs with 5 d and 7 f spherical
+                          functions (see Spherical.py)
     integrals     None    The one- and two-electron integrals to use
                           If not None, S,h,Ints
+    schwarz_tol   1e-12   Schwarz screening threshold for the
+                          two-electron integrals (see Ints.get2ints)
+    pair_tol      1e-15   Primitive pair threshold for the
+                          two-electron integrals (see PairData.py)
+    prim_tol      1e-15   Primitive quartet threshold for the
+                          two-electron integrals (see Ints.get2ints)
+    symmetry      False   Compute only the symmetry-unique
+                          two-electron integrals, using the point
+                          group of the molecule (see Symmetry.py)
+    eri_compress  None    Keep the two-electron integrals in reduced
+                          precision, 'mixed' or 'sparse' (see
+                          Ints.get2ints)
     orbs          None    If not none, the guess orbitals
+    guess         core    The guess when orbs isn't given: 'core' the
+                          orbitals of h, 'sad' those of the superposition
+                          of atomic densities (see SAD.py)
+    orthog        Chol    The orthogonalization of the basis for the
+                          eigenproblems, formed once: 'Chol', 'Sym',
+                          'Can' or 'Cut' (see LA2.get_xfrm)
     functional    SVWN    Use the SVWN (LDA) DFT functional (default)
                   S0      Use the Slater Xalpha DFT functional
                   BLYP    Use the BLYP GGA DFT functional
@@ -402,16 +485,17 @@ def dft_fixed_occ(atoms,occs,**opts):
     functional = opts.get('functional','SVWN')
     opts['do_grad_dens'] = need_gradients[functional]
 
-    bfs = opts.get('bfs',None)
+    bfs = opts.pop('bfs',None)
     if not bfs:
         basis_data = opts.get('basis_data',None)
-        bfs = getbasis(atoms,basis_data)
+        bfs = getbasis(atoms,basis_data,
+                       spherical=opts.get('spherical',False))
 
     integrals = opts.get('integrals',None)
     if integrals:
         S,h,Ints = integrals
     else:
-        S,h,Ints = getints(bfs,atoms)
+        S,h,Ints = getints(bfs,atoms,**opts)
 
     nel = atoms.get_nel()
     enuke = atoms.get_enuke()
@@ -427,8 +511,9 @@ def dft_fixed_occ(atoms,occs,**opts):
 
     # It would be nice to have a more intelligent treatment of the guess
     # so that I could pass in a density rather than a set of orbs.
+    orth = Orthogonalizer(S,opts.get('orthog','Chol'))
     orbs = opts.get('orbs',None)
-    if orbs is None: orbe,orbs = geigh(h,S)
+    if orbs is None: orbe,orbs = guess_orbs(atoms,bfs,h,orth,Ints,**opts)
 
     nclosed,nopen = atoms.get_closedopen()
 
@@ -443,7 +528,9 @@ def dft_fixed_occ(atoms,occs,**opts):
     eold = 0.
     if DoAveraging:
         print "Using DIIS averaging"
-        avg=DIIS(S)
+        Averager = opts.get('ADIIS') and ADIIS or DIIS
+        avg=Averager(S,opts.get('DIISSize',8),
+                     opts.get('DIISEvict','age'))
 
     # Converge the LDA density for the system:
     if verbose: print "Optimization of DFT density"
@@ -469,7 +556,7 @@ def dft_fixed_occ(atoms,occs,**opts):
         F = h+2*J+XC
         if DoAveraging: F = avg.getF(F,D)
         
-        orbe,orbs = geigh(F,S)
+        orbe,orbs = orth.geigh(F)
         #pad_out(orbs)
         #save the new eigenstates of the fock operator F
         neworbs=orbs
@@ -511,9 +598,29 @@ def udft_fixed_occ(atoms,occa, occb, **opts):
                   float   Use (float) for the electron temperature
     bfs           None    The basis functions to use. List of CGBF's
     basis_data    None    The basis data to use to construct bfs
+    spherical     False   Construct bfs with 5 d and 7 f spherical
+                          functions (see Spherical.py)
     integrals     None    The one- and two-electron integrals to use
                           If not None, S,h,Ints
+    schwarz_tol   1e-12   Schwarz screening threshold for the
+                          two-electron integrals (see Ints.get2ints)
+    pair_tol      1e-15   Primitive pair threshold for the
+                          two-electron integrals (see PairData.py)
+    prim_tol      1e-15   Primitive quartet threshold for the
+                          two-electron integrals (see Ints.get2ints)
+    symmetry      False   Compute only the symmetry-unique
+                          two-electron integrals, using the point
+                          group of the molecule (see Symmetry.py)
+    eri_compress  None    Keep the two-electron integrals in reduced
+                          precision, 'mixed' or 'sparse' (see
+                          Ints.get2ints)
     orbs          None    If not none, the guess orbitals
+    guess         core    The guess when orbs isn't given: 'core' the
+                          orbitals of h, 'sad' those of the superposition
+                          of atomic densities (see SAD.py)
+    orthog        Chol    The orthogonalization of the basis for the
+                          eigenproblems, formed once: 'Chol', 'Sym',
+                          'Can' or 'Cut' (see LA2.get_xfrm)
     functional    SVWN    Use the SVWN (LDA) DFT functional (default)
                   S0      Use the Slater Xalpha DFT functional
                   BLYP    Use the BLYP GGA DFT functional
@@ -532,16 +639,17 @@ def udft_fixed_occ(atoms,occa, occb, **opts):
     
     opts['do_grad_dens'] = need_gradients[functional]
 
-    bfs = opts.get('bfs',None)
+    bfs = opts.pop('bfs',None)
     if not bfs:
         basis_data = opts.get('basis_data',None)
-        bfs = getbasis(atoms,basis_data)
+        bfs = getbasis(atoms,basis_data,
+                       spherical=opts.get('spherical',False))
 
     integrals = opts.get('integrals',None)
     if integrals:
         S,h,Ints = integrals
     else:
-        S,h,Ints = getints(bfs,atoms)
+        S,h,Ints = getints(bfs,atoms,**opts)
 
     nel = atoms.get_nel()
     enuke = atoms.get_enuke()
@@ -557,8 +665,9 @@ def udft_fixed_occ(atoms,occa, occb, **opts):
 
     # It would be nice to have a more intelligent treatment of the guess
     # so that I could pass in a density rather than a set of orbs.
+    orth = Orthogonalizer(S,opts.get('orthog','Chol'))
     orbs = opts.get('orbs',None)
-    if not orbs: orbe,orbs = geigh(h,S)
+    if not orbs: orbe,orbs = guess_orbs(atoms,bfs,h,orth,Ints,**opts)
     orbsa = orbsb = orbs
 
     nalpha,nbeta = atoms.get_alphabeta()
@@ -599,8 +708,8 @@ def udft_fixed_occ(atoms,occa, occb, **opts):
         Fa = h+Ja+Jb+XCa
         Fb = h+Ja+Jb+XCb
         
-        orbea,orbsa = geigh(Fa,S)
-        orbeb,orbsb = geigh(Fb,S)
+        orbea,orbsa = orth.geigh(Fa)
+        orbeb,orbsb = orth.geigh(Fb)
         
         Eone = trace2(Dab,h)
         Ej   = 0.5*trace2(Dab,Ja+Jb)
@@ -21,35 +21,76 @@ COPYRIGHT
 
 """
 
-from NumWrap import array,array2string,zeros,reshape,dot
-from Ints import getbasis
+from NumWrap import array,array2string,zeros,reshape,dot,ravel,transpose
+from numpy import bincount
+from Ints import getbasis,pack_basis
 from LA2 import trace2
 from math import sqrt
 from PyQuante.cints import ijkl2intindex
-from AnalyticDerivatives import der_Hcore_element,der_overlap_element,der_Jints
+from AnalyticDerivatives import der_Hcore_element,der_overlap_element,der_Jints,\
+     der_Jints_center,DerivInts,have_cderivs
+from Screening import Schwarz
+from ERIStore import unpack_indices,ints_view,slice_indices
 
-def hf_force(mol,wf,bname):
+def hf_force(mol,wf,bname,**opts):
 # calculates Hartree-Fock derived atomic forces through
 # analytic derivatives of the HF energy.  Stores the forces 
 # the atom class which can later be accessed through 
 # atomlist[j].forces[i] which would give you component i
 # of the force on atom j
+# The derivative integrals come from the cints kernels when they are
+# available; cderivs=False uses the Python code of AnalyticDerivatives
+# instead. The schwarz_tol option sets the threshold used to screen the
+# derivative integrals, in the kernels and in the Python code (see
+# get_screen)
     bset = getbasis(mol.atoms,bname)
      
     if wf.restricted:
-        rhf_force(mol,wf,bset)
+        rhf_force(mol,wf,bset,**opts)
     if wf.unrestricted:
-        uhf_force(mol,wf,bset)
+        uhf_force(mol,wf,bset,**opts)
     if wf.fixedocc:
-        fixedocc_uhf_force(mol,wf,bset)
+        fixedocc_uhf_force(mol,wf,bset,**opts)
         
     return
 
-def rhf_force(mol,wf,bset):
+def get_screen(bset,**opts):
+    """
+    Schwarz screening for the derivative integrals. The bounds come from
+    the undifferentiated (ij|ij), so this is a heuristic rather than a
+    strict bound on the derivatives; schwarz_tol=0 turns it off.
+    """
+    schwarz_tol = opts.get('schwarz_tol',1e-12)
+    if schwarz_tol: return Schwarz(bset,schwarz_tol)
+    return None
+
+def get_derivs(bset,atoms,**opts):
+    """
+    The derivative one-electron integrals of all atoms from the cints
+    kernels, or None if the Python code is to be used, because the
+    kernels are not available or the cderivs option is False.
+    """
+    if opts.get('cderivs',True) and have_cderivs:
+        return DerivInts(bset,atoms)
+    return None
+
+def twoe_gradient(natoms,bset,DJ,cJ,DKs,cK,derivs=None,**opts):
+    "The two-electron gradient of all atoms; see der_twoeE_all"
+    screen = get_screen(bset,**opts)
+    if derivs:
+        dE = der_twoeE_cints(natoms,bset,DJ,cJ,DKs,cK,screen)
+    else:
+        dE = der_twoeE_all(natoms,bset,DJ,cJ,DKs,cK,screen)
+    if screen: screen.report()
+    return dE
+
+def rhf_force(mol,wf,bset,**opts):
     #need to check if this still works for restricted
     #open shell calculations
     Dmat = wf.mkdens()
     Qmat = wf.mkQmatrix()
+    derivs = get_derivs(bset,mol.atoms,**opts)
+    dtwoe = twoe_gradient(len(mol.atoms),bset,Dmat,2,[Dmat],1,derivs,**opts)
     
     #compute the force on each atom
     for atom in mol.atoms:
@@ -58,29 +99,31 @@ def rhf_force(mol,wf,bset):
         #dE/dRa = d(one electron)/dRa + d(two electron)/dRa 
         #        + d(density matrix)/dRa + d(nuclear repulsion)/dRa
         #the names for these terms are probably open for dispute...
-        dE_dRa =   2*der_oneeE(atom.atid,Dmat,bset,mol.atoms) \
-                 + der_twoeE(atom.atid,Dmat,bset) \
-                 - 2*der_dmat(atom.atid,Qmat,bset) \
+        dE_dRa =   2*der_oneeE(atom.atid,Dmat,bset,mol.atoms,derivs) \
+                 + dtwoe[atom.atid] \
+                 - 2*der_dmat(atom.atid,Qmat,bset,derivs) \
                  + der_enuke(atom.atid,mol.atoms)
 
         fa = -dE_dRa
 
         atom.set_force(fa)
-
     return
     
-def uhf_force(mol,wf,bset):
+def uhf_force(mol,wf,bset,**opts):
     Da,Db = wf.mkdens()
     Qa,Qb = wf.mkQmatrix()
+    derivs = get_derivs(bset,mol.atoms,**opts)
+    dtwoe_all = twoe_gradient(len(mol.atoms),bset,Da+Db,0.5,[Da,Db],0.5,
+                              derivs,**opts)
     
     for atom in mol.atoms:
-        dEa_dR =   der_oneeE(atom.atid,Da,bset,mol.atoms) \
-                 - der_dmat(atom.atid,Qa,bset)
+        dEa_dR =   der_oneeE(atom.atid,Da,bset,mol.atoms,derivs) \
+                 - der_dmat(atom.atid,Qa,bset,derivs)
                  
-        dEb_dR =   der_oneeE(atom.atid,Db,bset,mol.atoms) \
-                 - der_dmat(atom.atid,Qb,bset) 
+        dEb_dR =   der_oneeE(atom.atid,Db,bset,mol.atoms,derivs) \
+                 - der_dmat(atom.atid,Qb,bset,derivs) 
 
-        dtwoe  =  der_twoeE_uhf(atom.atid,Da,Db,bset)
+        dtwoe  =  dtwoe_all[atom.atid]
 
         denuke = der_enuke(atom.atid,mol.atoms)
         
@@ -89,18 +132,21 @@ def uhf_force(mol,wf,bset):
         atom.set_force(f)
     return
 
-def fixedocc_uhf_force(mol,wf,bset):
+def fixedocc_uhf_force(mol,wf,bset,**opts):
     Da,Db = wf.mk_auger_dens()
     Qa,Qb = wf.mk_auger_Qmatrix()
+    derivs = get_derivs(bset,mol.atoms,**opts)
+    dtwoe_all = twoe_gradient(len(mol.atoms),bset,Da+Db,0.5,[Da,Db],0.5,
+                              derivs,**opts)
     
     for atom in mol.atoms:
-        dEa_dR =   der_oneeE(atom.atid,Da,bset,mol.atoms) \
-                 - der_dmat(atom.atid,Qa,bset)
+        dEa_dR =   der_oneeE(atom.atid,Da,bset,mol.atoms,derivs) \
+                 - der_dmat(atom.atid,Qa,bset,derivs)
                  
-        dEb_dR =   der_oneeE(atom.atid,Db,bset,mol.atoms) \
-                 - der_dmat(atom.atid,Qb,bset) 
+        dEb_dR =   der_oneeE(atom.atid,Db,bset,mol.atoms,derivs) \
+                 - der_dmat(atom.atid,Qb,bset,derivs) 
 
-        dtwoe  =  der_twoeE_uhf(atom.atid,Da,Db,bset)
+        dtwoe  =  dtwoe_all[atom.atid]
 
         denuke = der_enuke(atom.atid,mol.atoms)
         
@@ -109,9 +155,12 @@ def fixedocc_uhf_force(mol,wf,bset):
         atom.set_force(f)
     return
         
-def der_oneeE(a,D,bset,atoms):
+def der_oneeE(a,D,bset,atoms,derivs=None):
 
-    dH_dXa,dH_dYa,dH_dZa = der_Hcore_matrix(a,bset,atoms)
+    if derivs:
+        dH_dXa,dH_dYa,dH_dZa = derivs.hcore(a)
+    else:
+        dH_dXa,dH_dYa,dH_dZa = der_Hcore_matrix(a,bset,atoms)
     
     doneE_Xa = trace2(D,dH_dXa)
     doneE_Ya = trace2(D,dH_dYa)
@@ -120,8 +169,109 @@ def der_oneeE(a,D,bset,atoms):
     #print doneE_Xa,doneE_Ya,doneE_Za
     return array([doneE_Xa,doneE_Ya,doneE_Za],'d')
 
-def der_twoeE(a,D,bset):
-    d2Ints_dXa,d2Ints_dYa,d2Ints_dZa  = der2Ints(a,bset)
+def der_twoeE_all(natoms,bset,DJ,cJ,DKs,cK,screen=None):
+    """
+    The derivatives of the two-electron energy with respect to the
+    coordinates of all natoms atoms, as a (natoms,3) array, from a single
+    sweep over the unique quartets i>=j, k>=l, ij>=kl. Each derivative
+    integral is contracted with the density as soon as it is formed,
+    and added into the gradient of the atoms involved, so no derivative
+    integrals are stored. The energy is taken to be
+
+      E2 = sum_ijkl (ij|kl) [cJ DJ_ij DJ_kl
+                             - cK/2 sum_D (D_ik D_jl + D_il D_jk)]
+
+    over the matrices D in DKs, so that RHF has DJ=D, cJ=2, DKs=[D], cK=1,
+    and UHF has DJ=Da+Db, cJ=1/2, DKs=[Da,Db], cK=1/2. By translational
+    invariance, the derivatives with respect to the atoms of a quartet
+    sum to zero, so quartets on a single atom are skipped, and the last
+    atom of each quartet gets minus the sum of the others.
+    """
+    nbf = len(bset)
+    dE = zeros((natoms,3),'d')
+    for i in range(nbf):
+        for j in range(i+1):
+            ij = i*(i+1)/2+j
+            for k in range(i+1):
+                for l in range(k+1):
+                    kl = k*(k+1)/2+l
+                    if ij < kl: continue
+                    bfs = (bset[i],bset[j],bset[k],bset[l])
+                    atids = []
+                    for bf in bfs:
+                        if bf.atid not in atids: atids.append(bf.atid)
+                    if len(atids) == 1: continue
+                    if screen and screen.skip(i,j,k,l): continue
+                    dens = cJ*DJ[i,j]*DJ[k,l]
+                    for D in DKs:
+                        dens -= 0.5*cK*(D[i,k]*D[j,l]+D[i,l]*D[j,k])
+                    # The number of distinct permutations of (ij|kl)
+                    degen = 8
+                    if i == j: degen /= 2
+                    if k == l: degen /= 2
+                    if ij == kl: degen /= 2
+                    dens *= degen
+                    if dens == 0: continue
+                    for a in atids[:-1]:
+                        for n in range(4):
+                            if bfs[n].atid != a: continue
+                            dJint = der_Jints_center(bfs,n)
+                            for d in range(3):
+                                dE[a,d] += dens*dJint[d]
+                                dE[atids[-1],d] -= dens*dJint[d]
+    return dE
+
+def der_twoeE_cints(natoms,bset,DJ,cJ,DKs,cK,screen=None,blocksize=65536):
+    """
+    der_twoeE_all from the cints kernel coulomb_deriv_block, which gives
+    the derivatives of blocks of the unique integrals with respect to
+    the centers of i, j and k (that of l is minus their sum). Each block
+    is contracted with the density into the gradient with respect to
+    the center of each basis function before the next is computed, and
+    these are summed over the functions of each atom at the end. If
+    screen (a Screening.Schwarz object) is given, its pair bounds are
+    passed to the kernel, which skips the quartets below screen.tol.
+    """
+    from PyQuante.cints import coulomb_deriv_block
+    nbf = len(bset)
+    basis = pack_basis(bset)
+    npair = nbf*(nbf+1)/2
+    totlen = npair*(npair+1)/2
+    if screen:
+        bounds = [screen.Q[i,j] for i in xrange(nbf) for j in xrange(i+1)]
+    dEbf = zeros((nbf,3),'d')
+    buf = zeros(9*blocksize,'d')
+    for start in xrange(0,totlen,blocksize):
+        n = min(blocksize,totlen-start)
+        if screen:
+            screen.ntested += n
+            screen.nskipped += coulomb_deriv_block(basis,start,start+n,buf,
+                                                   bounds,screen.tol)
+        else:
+            coulomb_deriv_block(basis,start,start+n,buf)
+        dA = reshape(buf[:9*n],(n,3,3))
+        i,j,k,l = unpack_indices(start,n)
+        dens = cJ*DJ[i,j]*DJ[k,l]
+        for D in DKs:
+            dens -= 0.5*cK*(D[i,k]*D[j,l]+D[i,l]*D[j,k])
+        # The number of distinct permutations of (ij|kl)
+        dens *= 8./((1+(i==j))*(1+(k==l))*(1+((i==k)&(j==l))))
+        dD = -dA.sum(1)
+        for f,df in [(i,dA[:,0]),(j,dA[:,1]),(k,dA[:,2]),(l,dD)]:
+            for d in range(3):
+                dEbf[:,d] += bincount(f,dens*df[:,d],nbf)
+    dE = zeros((natoms,3),'d')
+    for f in range(nbf):
+        dE[bset[f].atid] += dEbf[f]
+    return dE
+
+def der_twoeE(a,D,bset,screen=None):
+    """
+    The two-electron derivative for atom a alone, from per-atom arrays
+    of derivative integrals. der_twoeE_all does all atoms at once; this
+    is kept as a reference.
+    """
+    d2Ints_dXa,d2Ints_dYa,d2Ints_dZa  = der2Ints(a,bset,screen)
 
     Gx,Gy,Gz = der2JmK(D,d2Ints_dXa,d2Ints_dYa,d2Ints_dZa)
     
@@ -132,8 +282,9 @@ def der_twoeE(a,D,bset):
     #print dtwoeE_Xa,dtwoeE_Ya,dtwoeE_Za
     return array([dtwoeE_Xa,dtwoeE_Ya,dtwoeE_Za],'d')
     
-def der_twoeE_uhf(a,Da,Db,bset):
-    d2Ints_dXa,d2Ints_dYa,d2Ints_dZa  = der2Ints(a,bset)
+def der_twoeE_uhf(a,Da,Db,bset,screen=None):
+    "The UHF counterpart of der_twoeE, kept as a reference"
+    d2Ints_dXa,d2Ints_dYa,d2Ints_dZa  = der2Ints(a,bset,screen)
 
     dJax,dJay,dJaz = derJ(Da,d2Ints_dXa,d2Ints_dYa,d2Ints_dZa)
     dJbx,dJby,dJbz = derJ(Db,d2Ints_dXa,d2Ints_dYa,d2Ints_dZa)
@@ -149,7 +300,7 @@ def der_twoeE_uhf(a,Da,Db,bset):
     
     return array([dtwoeE_Xa,dtwoeE_Ya,dtwoeE_Za],'d')
 
-def der_dmat(a,Qmat,bset):
+def der_dmat(a,Qmat,bset,derivs=None):
     """
     Looking at Szabo's equation C.12 you can see that this term results 
     from adding up the terms that involve derivatives of the density matrix
@@ -157,9 +308,13 @@ def der_dmat(a,Qmat,bset):
       sum_mu,nu Q_mu,nu dS_mu,nu / dRa
     where the Q matrix is essentially a density matrix that is weighted by 
     the orbital eigenvalues.  Computing the derivative of the overlap integrals
-    is done in the der_overlap_matrix function later in this module.
+    is done in the der_overlap_matrix function later in this module, or
+    by the cints kernels if derivs (from get_derivs) is given.
     """
-    dS_dXa,dS_dYa,dS_dZa = der_overlap_matrix(a,bset)
+    if derivs:
+        dS_dXa,dS_dYa,dS_dZa = derivs.overlap(a)
+    else:
+        dS_dXa,dS_dYa,dS_dZa = der_overlap_matrix(a,bset)
     
     dDmat_Xa = trace2(Qmat,dS_dXa)
     dDmat_Ya = trace2(Qmat,dS_dYa)
@@ -229,10 +384,13 @@ def der_overlap_matrix(a,bset):
     #if a==1: print "dS_dXa"; pad_out(dS_dXa); print "dS_dYa"; pad_out(dS_dYa); print "dS_dZa"; pad_out(dS_dZa);
     return dS_dXa,dS_dYa,dS_dZa
 
-def der2Ints(a,bset):
+def der2Ints(a,bset,screen=None):
     #modified from Ints.py -> get2ints
     """Store integrals in a long array in the form (ij|kl) (chemists
-    notation. We only need i>=j, k>=l, and ij <= kl"""
+    notation. We only need i>=j, k>=l, and ij <= kl
+
+    If screen (a Screening.Schwarz object) is given, quartets that
+    it flags as negligible are skipped."""
     from array import array
     nbf = len(bset)
     totlen = nbf*(nbf+1)*(nbf*nbf+nbf+2)/8
@@ -246,6 +404,7 @@ def der2Ints(a,bset):
                 for l in range(k+1):
                     kl = k*(k+1)/2+l
                     if ij >= kl:
+                        if screen and screen.skip(i,j,k,l): continue
                         ijkl = ijkl2intindex(i,j,k,l)
                         d2Ints_dXa[ijkl],d2Ints_dYa[ijkl],d2Ints_dZa[ijkl] =\
                                  der_Jints(a,bset[i],bset[j],bset[k],bset[l])
@@ -256,63 +415,40 @@ def derJ(D,d2Ints_dXa,d2Ints_dYa,d2Ints_dZa):
     "Form the Coulomb operator corresponding to a density matrix D"
     nbf = D.shape[0]
     D1d = reshape(D,(nbf*nbf,)) #1D version of Dens
+    dX,dY,dZ = [ints_view(d) for d in (d2Ints_dXa,d2Ints_dYa,d2Ints_dZa)]
     dJx = zeros((nbf,nbf),'d')
     dJy = zeros((nbf,nbf),'d')
     dJz = zeros((nbf,nbf),'d')
 
     for i in range(nbf):
         for j in range(i+1):
-            xtemp = zeros(nbf*nbf,'d')
-            ytemp = zeros(nbf*nbf,'d')
-            ztemp = zeros(nbf*nbf,'d')
-            kl = 0
-            for k in range(nbf):
-                for l in range(nbf):
-                    index = ijkl2intindex(i,j,k,l)
-                    xtemp[kl] = d2Ints_dXa[index]
-                    ytemp[kl] = d2Ints_dYa[index]
-                    ztemp[kl] = d2Ints_dZa[index]
-                    kl += 1
-            dJx[i,j] = dot(xtemp,D1d)
-            dJx[j,i] = dJx[i,j]
-            
-            dJy[i,j] = dot(ytemp,D1d)
-            dJy[j,i] = dJy[i,j]
-            
-            dJz[i,j] = dot(ztemp,D1d)
-            dJz[j,i] = dJz[i,j]
+            # (ij|kl) for all k,l
+            index = ravel(slice_indices(nbf,i,j))
+            dJx[i,j] = dJx[j,i] = dot(dX[index],D1d)
+            dJy[i,j] = dJy[j,i] = dot(dY[index],D1d)
+            dJz[i,j] = dJz[j,i] = dot(dZ[index],D1d)
     return dJx,dJy,dJz
 
+def kints_indices(nbf,i,j):
+    "The indices of (ik|jl) and (il|kj) for all k,l, as vectors"
+    return ravel(slice_indices(nbf,i,None,j)),\
+           ravel(transpose(slice_indices(nbf,i,None,None,j)))
+
 def derK(D,d2Ints_dXa,d2Ints_dYa,d2Ints_dZa):
     #modified from Ints.py -> getK
     "Form the exchange operator corresponding to a density matrix D"
     nbf = D.shape[0]
     D1d = reshape(D,(nbf*nbf,)) #1D version of Dens
+    dX,dY,dZ = [ints_view(d) for d in (d2Ints_dXa,d2Ints_dYa,d2Ints_dZa)]
     dKx = zeros((nbf,nbf),'d')
     dKy = zeros((nbf,nbf),'d')
     dKz = zeros((nbf,nbf),'d')
     for i in range(nbf):
         for j in range(i+1):
-            xtemp = zeros(nbf*nbf,'d')
-            ytemp = zeros(nbf*nbf,'d')
-            ztemp = zeros(nbf*nbf,'d')
-            kl = 0
-            for k in range(nbf):
-                for l in range(nbf):
-                    index_k1 = ijkl2intindex(i,k,j,l)
-                    index_k2 = ijkl2intindex(i,l,k,j)
-                    xtemp[kl] = 0.5*(d2Ints_dXa[index_k1]+d2Ints_dXa[index_k2])
-                    ytemp[kl] = 0.5*(d2Ints_dYa[index_k1]+d2Ints_dYa[index_k2])
-                    ztemp[kl] = 0.5*(d2Ints_dZa[index_k1]+d2Ints_dZa[index_k2])
-                    kl += 1
-            dKx[i,j] = dot(xtemp,D1d)
-            dKx[j,i] = dKx[i,j]
-            
-            dKy[i,j] = dot(ytemp,D1d)
-            dKy[j,i] = dKy[i,j]
-            
-            dKz[i,j] = dot(ztemp,D1d)
-            dKz[j,i] = dKz[i,j]
+            index_k1,index_k2 = kints_indices(nbf,i,j)
+            dKx[i,j] = dKx[j,i] = 0.5*dot(dX[index_k1]+dX[index_k2],D1d)
+            dKy[i,j] = dKy[j,i] = 0.5*dot(dY[index_k1]+dY[index_k2],D1d)
+            dKz[i,j] = dKz[j,i] = 0.5*dot(dZ[index_k1]+dZ[index_k2],D1d)
     return dKx,dKy,dKz
     
 def der2JmK(D,d2Ints_dXa,d2Ints_dYa,d2Ints_dZa):
@@ -320,39 +456,20 @@ def der2JmK(D,d2Ints_dXa,d2Ints_dYa,d2Ints_dZa):
     "Form the 2J-K integrals corresponding to a density matrix D"
     nbf = D.shape[0]
     D1d = reshape(D,(nbf*nbf,)) #1D version of Dens
+    dX,dY,dZ = [ints_view(d) for d in (d2Ints_dXa,d2Ints_dYa,d2Ints_dZa)]
     Gx = zeros((nbf,nbf),'d')
     Gy = zeros((nbf,nbf),'d')
     Gz = zeros((nbf,nbf),'d')
     
     for i in range(nbf):
         for j in range(i+1):
-            xtemp = zeros(nbf*nbf,'d')
-            ytemp = zeros(nbf*nbf,'d')
-            ztemp = zeros(nbf*nbf,'d')
-            kl = 0
-            for k in range(nbf):
-                for l in range(nbf):
-                    index_j = ijkl2intindex(i,j,k,l)
-                    index_k1 = ijkl2intindex(i,k,j,l)
-                    index_k2 = ijkl2intindex(i,l,k,j)
-                    xtemp[kl] = 2.*d2Ints_dXa[index_j]-0.5*d2Ints_dXa[index_k1]\
-                               -0.5*d2Ints_dXa[index_k2]
-                               
-                    ytemp[kl] = 2.*d2Ints_dYa[index_j]-0.5*d2Ints_dYa[index_k1]\
-                               -0.5*d2Ints_dYa[index_k2]
-                               
-                    ztemp[kl] = 2.*d2Ints_dZa[index_j]-0.5*d2Ints_dZa[index_k1]\
-                               -0.5*d2Ints_dZa[index_k2]                    
-                    kl += 1
-
-            Gx[i,j] = dot(xtemp,D1d)
-            Gx[j,i] = Gx[i,j]
-            
-            Gy[i,j] = dot(ytemp,D1d)
-            Gy[j,i] = Gy[i,j]            
-            
-            Gz[i,j] = dot(ztemp,D1d)
-            Gz[j,i] = Gz[i,j]
-
+            index_j = ravel(slice_indices(nbf,i,j))
+            index_k1,index_k2 = kints_indices(nbf,i,j)
+            Gx[i,j] = Gx[j,i] = dot(2.*dX[index_j]-0.5*dX[index_k1]
+                                    -0.5*dX[index_k2],D1d)
+            Gy[i,j] = Gy[j,i] = dot(2.*dY[index_j]-0.5*dY[index_k1]
+                                    -0.5*dY[index_k2],D1d)
+            Gz[i,j] = Gz[j,i] = dot(2.*dZ[index_j]-0.5*dZ[index_k1]
+                                    -0.5*dZ[index_k2],D1d)
     return Gx,Gy,Gz
     
@@ -13,9 +13,10 @@
 import string,sys,time
 
 from fermi_dirac import get_efermi, get_fermi_occs,mkdens_occs,get_entropy
-from LA2 import geigh,mkdens,trace2
-from Ints import get2JmK,getbasis,getints,getJ,getK
-from Convergence import DIIS
+from LA2 import geigh,mkdens,trace2,Orthogonalizer
+from Ints import get2JmK,getbasis,getints,getJ,getK,getJK
+from Convergence import DIIS,ADIIS
+from SAD import sad_guess
 import logging
 
 from math import sqrt,pow
@@ -40,6 +41,20 @@ def get_guess(h,S):
     evals,evecs = geigh(h,S)
     return evecs
 
+def guess_orbs(atoms,bfs,h,orth,Ints,**opts):
+    """\
+    orbe,orbs = guess_orbs(atoms,bfs,h,orth,Ints,guess='core')
+
+    The initial guess orbitals: for guess='core' the eigenvectors of the
+    one-electron Hamiltonian, for guess='sad' those of the Fock matrix
+    of the superposition of atomic densities (see SAD.py). orth is the
+    Orthogonalizer of the overlap matrix.
+    """
+    guess = opts.get('guess','core')
+    if guess == 'sad': return sad_guess(atoms,bfs,h,orth,Ints)
+    if guess != 'core': raise ValueError("Unknown guess %s" % guess)
+    return orth.geigh(h)
+
 def get_nel(atoms,charge=0):
     print "Warning, hartree_fock.get_nel deprecated"
     print "Use the Molecular instance function"
@@ -73,34 +88,67 @@ def rhf(atoms,**opts):
     MaxIter       20      Maximum SCF iterations
     DoAveraging   True    Use DIIS for accelerated convergence (default)
                   False   No convergence acceleration
+    DIISSize      8       The most Fock matrices DIIS keeps
+    DIISEvict     age     Which Fock matrix DIIS drops when it has
+                          DIISSize: 'age' the oldest, 'error' the one
+                          with the largest error (see Convergence.DIIS)
+    ADIIS         False   Use ADIIS in the early iterations, blended
+                          into DIIS near convergence (see
+                          Convergence.ADIIS)
     ETemp         False   Use ETemp value for finite temperature DFT (default)
                   float   Use (float) for the electron temperature
     bfs           None    The basis functions to use. List of CGBF's
     basis_data    None    The basis data to use to construct bfs
+    spherical     False   Construct bfs with 5 d and 7 f spherical
+                          functions (see Spherical.py)
     integrals     None    The one- and two-electron integrals to use
                           If not None, S,h,Ints
+    schwarz_tol   1e-12   Schwarz screening threshold for the
+                          two-electron integrals (see Ints.get2ints)
+    pair_tol      1e-15   Primitive pair threshold for the
+                          two-electron integrals (see PairData.py)
+    prim_tol      1e-15   Primitive quartet threshold for the
+                          two-electron integrals (see Ints.get2ints)
+    symmetry      False   Compute only the symmetry-unique
+                          two-electron integrals, using the point
+                          group of the molecule (see Symmetry.py)
+    eri_compress  None    Keep the two-electron integrals in reduced
+                          precision, 'mixed' or 'sparse' (see
+                          Ints.get2ints)
+    direct        False   Integral-direct SCF: recompute the integrals
+                          each iteration rather than storing them
+    density_fitting False Approximate the two-electron integrals by
+                          density fitting (see DensityFitting.py)
     orbs          None    If not none, the guess orbitals
+    guess         core    The guess when orbs isn't given: 'core' the
+                          orbitals of h, 'sad' those of the superposition
+                          of atomic densities (see SAD.py)
+    orthog        Chol    The orthogonalization of the basis for the
+                          eigenproblems, formed once: 'Chol', 'Sym',
+                          'Can' or 'Cut' (see LA2.get_xfrm)
     """
     ConvCriteria = opts.get('ConvCriteria',1e-4)
     MaxIter = opts.get('MaxIter',20)
     DoAveraging = opts.get('DoAveraging',False)
     ETemp = opts.get('ETemp',False)
 
-    bfs = opts.get('bfs',None)
+    bfs = opts.pop('bfs',None)
     if not bfs:
         basis_data = opts.get('basis_data',None)
-        bfs = getbasis(atoms,basis_data)
+        bfs = getbasis(atoms,basis_data,
+                       spherical=opts.get('spherical',False))
 
     integrals = opts.get('integrals', None)
     if integrals:
         S,h,Ints = integrals
     else:
-        S,h,Ints = getints(bfs,atoms)
+        S,h,Ints = getints(bfs,atoms,**opts)
 
     nel = atoms.get_nel()
 
+    orth = Orthogonalizer(S,opts.get('orthog','Chol'))
     orbs = opts.get('orbs',None)
-    if orbs is None: orbe,orbs = geigh(h,S)
+    if orbs is None: orbe,orbs = guess_orbs(atoms,bfs,h,orth,Ints,**opts)
 
     nclosed,nopen = atoms.get_closedopen()
     nocc = nclosed
@@ -114,7 +162,9 @@ def rhf(atoms,**opts):
 
     if DoAveraging:
         logging.info("Using DIIS averaging")
-        avg = DIIS(S)
+        Averager = opts.get('ADIIS') and ADIIS or DIIS
+        avg = Averager(S,opts.get('DIISSize',8),
+                       opts.get('DIISEvict','age'))
     logging.debug("Optimization of HF orbitals")
     for i in range(MaxIter):
         if ETemp:
@@ -127,7 +177,7 @@ def rhf(atoms,**opts):
         G = get2JmK(Ints,D)
         F = h+G
         if DoAveraging: F = avg.getF(F,D)
-        orbe,orbs = geigh(F,S)
+        orbe,orbs = orth.geigh(F)
         energy = get_energy(h,F,D,enuke)
         if ETemp:
             energy += entropy
@@ -152,42 +202,78 @@ def uhf(atoms,**opts):
     ConvCriteria  1e-4    Convergence Criteria
     MaxIter       20      Maximum SCF iterations
     DoAveraging   True    Use DIIS averaging for convergence acceleration
+    DoDIIS        False   Use DIIS on the alpha and beta Fock matrices,
+                          with one set of coefficients, rather than
+                          averaging the densities
+    DIISSize      8       The most Fock matrices DIIS keeps
+    DIISEvict     age     Which Fock matrix DIIS drops when it has
+                          DIISSize: 'age' the oldest, 'error' the one
+                          with the largest error (see Convergence.DIIS)
+    ADIIS         False   Use ADIIS in the early iterations, blended
+                          into DIIS near convergence (see
+                          Convergence.ADIIS)
     bfs           None    The basis functions to use. List of CGBF's
     basis_data    None    The basis data to use to construct bfs
+    spherical     False   Construct bfs with 5 d and 7 f spherical
+                          functions (see Spherical.py)
     integrals     None    The one- and two-electron integrals to use
                           If not None, S,h,Ints
+    schwarz_tol   1e-12   Schwarz screening threshold for the
+                          two-electron integrals (see Ints.get2ints)
+    pair_tol      1e-15   Primitive pair threshold for the
+                          two-electron integrals (see PairData.py)
+    prim_tol      1e-15   Primitive quartet threshold for the
+                          two-electron integrals (see Ints.get2ints)
+    symmetry      False   Compute only the symmetry-unique
+                          two-electron integrals, using the point
+                          group of the molecule (see Symmetry.py)
+    eri_compress  None    Keep the two-electron integrals in reduced
+                          precision, 'mixed' or 'sparse' (see
+                          Ints.get2ints)
+    direct        False   Integral-direct SCF: recompute the integrals
+                          each iteration rather than storing them
+    density_fitting False Approximate the two-electron integrals by
+                          density fitting (see DensityFitting.py)
     orbs          None    If not None, the guess orbitals
+    guess         core    The guess when orbs isn't given: 'core' the
+                          orbitals of h, 'sad' those of the superposition
+                          of atomic densities (see SAD.py)
+    orthog        Chol    The orthogonalization of the basis for the
+                          eigenproblems, formed once: 'Chol', 'Sym',
+                          'Can' or 'Cut' (see LA2.get_xfrm)
     """
     ConvCriteria = opts.get('ConvCriteria',1e-5)
     MaxIter = opts.get('MaxIter',40)
     DoAveraging = opts.get('DoAveraging',True)
+    DoDIIS = opts.get('DoDIIS',False)
     averaging = opts.get('averaging',0.5)
     ETemp = opts.get('ETemp',False)
     verbose = opts.get('verbose',False)
 
-    bfs = opts.get('bfs',None)
+    bfs = opts.pop('bfs',None)
     if not bfs:
         basis_data = opts.get('basis_data',None)
-        bfs = getbasis(atoms,basis_data)
+        bfs = getbasis(atoms,basis_data,
+                       spherical=opts.get('spherical',False))
 
     integrals = opts.get('integrals', None)
     if integrals:
         S,h,Ints = integrals
     else:
-        S,h,Ints = getints(bfs,atoms)
+        S,h,Ints = getints(bfs,atoms,**opts)
 
     nel = atoms.get_nel()
 
     nalpha,nbeta = atoms.get_alphabeta() #pass in opts for multiplicity
-    S,h,Ints = getints(bfs,atoms)
 
+    orth = Orthogonalizer(S,opts.get('orthog','Chol'))
     orbs = opts.get('orbs',None)
     if orbs!=None:
         #orbsa = orbsb = orbs
         orbsa = orbs[0]
         orbsb = orbs[1]
     else:
-        orbe,orbs = geigh(h,S)
+        orbe,orbs = guess_orbs(atoms,bfs,h,orth,Ints,**opts)
         orbea = orbeb = orbe
         orbsa = orbsb = orbs
 
@@ -198,6 +284,12 @@ def uhf(atoms,**opts):
     logging.info("Nbf = %d" % len(bfs))
     logging.info("Nalpha = %d" % nalpha)
     logging.info("Nbeta = %d" % nbeta)
+    if DoDIIS:
+        logging.info("Using DIIS averaging")
+        DoAveraging = False
+        Averager = opts.get('ADIIS') and ADIIS or DIIS
+        avg = Averager(S,opts.get('DIISSize',8),
+                       opts.get('DIISEvict','age'))
     logging.info("Averaging = %s" % DoAveraging)
     logging.debug("Optimization of HF orbitals")
     for i in range(MaxIter):
@@ -224,14 +316,15 @@ def uhf(atoms,**opts):
             Da0 = Da
             Db0 = Db
 
-        Ja = getJ(Ints,Da)
-        Jb = getJ(Ints,Db)
-        Ka = getK(Ints,Da)
-        Kb = getK(Ints,Db)
+        (Ja,Jb),(Ka,Kb) = getJK(Ints,[Da,Db])
         Fa = h+Ja+Jb-Ka
         Fb = h+Ja+Jb-Kb
-        orbea,orbsa = geigh(Fa,S)
-        orbeb,orbsb = geigh(Fb,S)
+        if DoDIIS:
+            Fa_avg,Fb_avg = avg.getFs([Fa,Fb],[Da,Db])
+        else:
+            Fa_avg,Fb_avg = Fa,Fb
+        orbea,orbsa = orth.geigh(Fa_avg)
+        orbeb,orbsb = orth.geigh(Fb_avg)
         energya = get_energy(h,Fa,Da)
         energyb = get_energy(h,Fb,Db)
         energy = (energya+energyb)/2+enuke
@@ -273,9 +366,29 @@ def uhf_fixed_occ(atoms,occa, occb,**opts):
     DoAveraging   True    Use DIIS averaging for convergence acceleration
     bfs           None    The basis functions to use. List of CGBF's
     basis_data    None    The basis data to use to construct bfs
+    spherical     False   Construct bfs with 5 d and 7 f spherical
+                          functions (see Spherical.py)
     integrals     None    The one- and two-electron integrals to use
                           If not None, S,h,Ints
+    schwarz_tol   1e-12   Schwarz screening threshold for the
+                          two-electron integrals (see Ints.get2ints)
+    pair_tol      1e-15   Primitive pair threshold for the
+                          two-electron integrals (see PairData.py)
+    prim_tol      1e-15   Primitive quartet threshold for the
+                          two-electron integrals (see Ints.get2ints)
+    symmetry      False   Compute only the symmetry-unique
+                          two-electron integrals, using the point
+                          group of the molecule (see Symmetry.py)
+    eri_compress  None    Keep the two-electron integrals in reduced
+                          precision, 'mixed' or 'sparse' (see
+                          Ints.get2ints)
     orbs          None    If not None, the guess orbitals
+    guess         core    The guess when orbs isn't given: 'core' the
+                          orbitals of h, 'sad' those of the superposition
+                          of atomic densities (see SAD.py)
+    orthog        Chol    The orthogonalization of the basis for the
+                          eigenproblems, formed once: 'Chol', 'Sym',
+                          'Can' or 'Cut' (see LA2.get_xfrm)
     """
 
     from biorthogonal import biorthogonalize,pad_out
@@ -286,29 +399,30 @@ def uhf_fixed_occ(atoms,occa, occb,**opts):
     averaging = opts.get('averaging',0.5)
     ETemp = opts.get('ETemp',False)
     
-    bfs = opts.get('bfs',None)
+    bfs = opts.pop('bfs',None)
     if not bfs:
         basis_data = opts.get('basis_data',None)
-        bfs = getbasis(atoms,basis_data)
+        bfs = getbasis(atoms,basis_data,
+                       spherical=opts.get('spherical',False))
 
     integrals = opts.get('integrals', None)
     if integrals:
         S,h,Ints = integrals
     else:
-        S,h,Ints = getints(bfs,atoms)
+        S,h,Ints = getints(bfs,atoms,**opts)
 
     nel = atoms.get_nel()
 
     nalpha,nbeta = atoms.get_alphabeta() #pass in opts for multiplicity
-    S,h,Ints = getints(bfs,atoms)
 
+    orth = Orthogonalizer(S,opts.get('orthog','Chol'))
     orbsa = opts.get('orbsa',None)
     orbsb = opts.get('orbsb',None)
     if (orbsa!=None and orbsb!=None):
         orbsa = orbsa
         orbsb = orbsb
     else:
-        orbe,orbs = geigh(h,S)
+        orbe,orbs = guess_orbs(atoms,bfs,h,orth,Ints,**opts)
         orbea = orbeb = orbe
         orbsa = orbsb = orbs
     
@@ -339,15 +453,12 @@ def uhf_fixed_occ(atoms,occa, occb,**opts):
         #pad_out(Db - Db_std )
         
         
-        Ja = getJ(Ints,Da)
-        Jb = getJ(Ints,Db)
-        Ka = getK(Ints,Da)
-        Kb = getK(Ints,Db)
+        (Ja,Jb),(Ka,Kb) = getJK(Ints,[Da,Db])
         Fa = h+Ja+Jb-Ka
         Fb = h+Ja+Jb-Kb
 
-        orbea,orbsa = geigh(Fa,S)
-        orbeb,orbsb = geigh(Fb,S)
+        orbea,orbsa = orth.geigh(Fa)
+        orbeb,orbsb = orth.geigh(Fb)
         
         #save the new orbitals
         neworbs_a=orbsa
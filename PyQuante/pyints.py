@@ -55,12 +55,58 @@ def binomial(a,b):
     "Binomial coefficient"
     return fact(a)/fact(b)/fact(a-b)
 
+# The Boys function is tabulated the same way as in Src/boys.h, which
+#  describes the method: Taylor series about a grid point for x<boys_xmax
+#  and upward recursion from F_0 for larger x, with the grid filled from
+#  the convergent series
+boys_mmax = 32
+boys_ntaylor = 8
+boys_dx = 0.1
+boys_xmax = 40.0
+boys_grid = []
+
+def boys_series(m,x):
+    "F_m(x) = exp(-x) sum_i (2x)^i/((2m+1)(2m+3)...(2m+2i+1))"
+    term = sum = 1./(2*m+1)
+    i = 1
+    while term > 1e-17*sum:
+        term = term*2*x/(2*m+2*i+1)
+        sum = sum+term
+        i = i+1
+    return exp(-x)*sum
+
+def boys_init():
+    "Fill boys_grid[k][m] = F_m(k*boys_dx)"
+    ncol = boys_mmax+boys_ntaylor
+    for k in range(int(boys_xmax/boys_dx)+1):
+        x = k*boys_dx
+        ex = exp(-x)
+        F = [0]*ncol
+        F[-1] = boys_series(ncol-1,x)
+        for m in range(ncol-2,-1,-1):
+            F[m] = (2*x*F[m+1]+ex)/(2*m+1)
+        boys_grid.append(F)
+    return
+
 def Fgamma(m,x):
-    "Incomplete gamma function"
-    SMALL=0.00000001
-    x = max(abs(x),SMALL)
-    val = gamm_inc(m+0.5,x)
-    return 0.5*pow(x,-m-0.5)*val;
+    "Boys function F_m(x) = int_0^1 t^2m exp(-x t^2) dt"
+    m = int(m)
+    x = max(x,0)
+    if x < boys_xmax and m <= boys_mmax:
+        if not boys_grid: boys_init()
+        k = int(x/boys_dx+0.5)
+        d = k*boys_dx-x
+        F = boys_grid[k]
+        sum = F[m+boys_ntaylor-1]
+        for j in range(boys_ntaylor-2,-1,-1):
+            sum = F[m+j] + sum*d/(j+1)
+        return sum
+    if x < boys_xmax or m >= x: return boys_series(m,x)
+    ex = exp(-x)
+    F = 0.5*sqrt(pi/x)
+    for i in range(m):
+        F = ((2*i+1)*F-ex)/(2*x)
+    return F
 
 def gammln(x):
     "Numerical recipes, section 6.1"
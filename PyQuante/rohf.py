@@ -130,7 +130,7 @@ def expmat(A,**kwargs):
     for i in range(1,nmax):
         D = matrixmultiply(D,A)/i
         E += D
-        maxel = D.max()
+        maxel = abs(D).max()
         if abs(maxel) < cut:
             break
     else:
@@ -221,7 +221,8 @@ def rohf_wag(atoms,noccsh=None,f=None,a=None,b=None,**kwargs):
     bfs = kwargs.get('bfs',None)
     if not bfs:
         basis_data = kwargs.get('basis_data',None)
-        bfs = getbasis(atoms,basis_data)
+        bfs = getbasis(atoms,basis_data,
+                       spherical=kwargs.get('spherical',False))
 
     integrals = kwargs.get('integrals', None)
     if integrals:
@@ -289,7 +290,8 @@ def rohf(atoms,**opts):
     bfs = opts.get('bfs',None)
     if not bfs:
         basis_data = opts.get('basis_data',None)
-        bfs = getbasis(atoms,basis_data)
+        bfs = getbasis(atoms,basis_data,
+                       spherical=opts.get('spherical',False))
     nbf = len(bfs)
 
     integrals = opts.get('integrals', None)
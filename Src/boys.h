@@ -0,0 +1,120 @@
+/*************************************************************************
+ This program is part of the PyQuante quantum chemistry program suite.
+
+ Copyright (c) 2004, Richard P. Muller. All Rights Reserved.
+
+ PyQuante version 1.2 and later is covered by the modified BSD
+ license. Please see the file LICENSE that is part of this
+ distribution.
+ **************************************************************************/
+
+/* The Boys function F_m(x) = int_0^1 t^2m exp(-x t^2) dt, shared by the
+   cints, chgp and crys modules, and mirrored by pyints.Fgamma.
+
+   For x < BOYS_XMAX, F_m is a Taylor series about the nearest point x_k
+   of a grid with spacing BOYS_DX,
+
+     F_m(x) = sum_j F_{m+j}(x_k) (x_k-x)^j/j!
+
+   since dF_m/dx = -F_{m+1}. With |x_k-x| <= BOYS_DX/2, BOYS_NTAYLOR
+   terms are good to better than 1e-15. When several orders are needed,
+   only the highest is interpolated, and the rest come from the stable
+   downward recursion
+
+     F_m(x) = (2x F_{m+1}(x) + exp(-x))/(2m+1)
+
+   For x >= BOYS_XMAX, F_0 = sqrt(pi/x)/2 to machine precision, and the
+   upward recursion is stable while m < x. The grid is filled by
+   boys_init(), from the convergent series
+
+     F_m(x) = exp(-x) sum_i (2x)^i/((2m+1)(2m+3)...(2m+2i+1))
+
+   which is also used directly for orders beyond the table. Call
+   boys_init() from the module init function. */
+
+#ifndef BOYS_H
+#define BOYS_H
+
+#include <math.h>
+
+#ifndef M_PI
+#define M_PI 3.14159265358979323846
+#endif
+
+#define BOYS_MMAX 32      /* Largest order that is interpolated */
+#define BOYS_NTAYLOR 8    /* Terms in the Taylor series */
+#define BOYS_DX 0.1
+#define BOYS_XMAX 40.0
+#define BOYS_NGRID 401    /* BOYS_XMAX/BOYS_DX+1 */
+#define BOYS_NCOL (BOYS_MMAX+BOYS_NTAYLOR)
+
+static double boys_grid[BOYS_NGRID][BOYS_NCOL];
+
+static double boys_series(int m, double x){
+  double term,sum;
+  int i;
+  term = sum = 1./(2*m+1);
+  for (i=1; term > 1e-17*sum; i++){
+    term *= 2*x/(2*m+2*i+1);
+    sum += term;
+  }
+  return exp(-x)*sum;
+}
+
+static void boys_init(void){
+  int k,m;
+  double x,ex;
+  for (k=0; k<BOYS_NGRID; k++){
+    x = k*BOYS_DX;
+    ex = exp(-x);
+    boys_grid[k][BOYS_NCOL-1] = boys_series(BOYS_NCOL-1,x);
+    for (m=BOYS_NCOL-2; m>=0; m--)
+      boys_grid[k][m] = (2*x*boys_grid[k][m+1]+ex)/(2*m+1);
+  }
+}
+
+/* F_m(x) from the grid, for m <= BOYS_MMAX and 0 <= x < BOYS_XMAX */
+static double boys_taylor(int m, double x){
+  int k,j;
+  double d,sum,*F;
+  k = (int)(x/BOYS_DX+0.5);
+  d = k*BOYS_DX-x;
+  F = boys_grid[k]+m;
+  sum = F[BOYS_NTAYLOR-1];
+  for (j=BOYS_NTAYLOR-2; j>=0; j--) sum = F[j] + sum*d/(j+1);
+  return sum;
+}
+
+/* F[0..mmax] = F_0(x)..F_mmax(x) */
+static void boys_array(int mmax, double x, double *F){
+  int m;
+  double ex;
+  if (x < 0) x = 0;
+  ex = exp(-x);
+  if (x >= BOYS_XMAX && mmax < x){
+    F[0] = 0.5*sqrt(M_PI/x);
+    for (m=0; m<mmax; m++) F[m+1] = ((2*m+1)*F[m]-ex)/(2*x);
+    return;
+  }
+  if (x < BOYS_XMAX && mmax <= BOYS_MMAX)
+    F[mmax] = boys_taylor(mmax,x);
+  else
+    F[mmax] = boys_series(mmax,x);
+  for (m=mmax-1; m>=0; m--) F[m] = (2*x*F[m+1]+ex)/(2*m+1);
+}
+
+/* F_m(x) alone. Inline (__inline is taken by gcc, clang and msvc
+   alike), since not every module that includes this uses it */
+static __inline double boys_function(int m, double x){
+  int i;
+  double F,ex;
+  if (x < 0) x = 0;
+  if (x < BOYS_XMAX && m <= BOYS_MMAX) return boys_taylor(m,x);
+  if (x < BOYS_XMAX || m >= x) return boys_series(m,x);
+  ex = exp(-x);
+  F = 0.5*sqrt(M_PI/x);
+  for (i=0; i<m; i++) F = ((2*i+1)*F-ex)/(2*x);
+  return F;
+}
+
+#endif
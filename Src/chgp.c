@@ -19,61 +19,20 @@
  **********************************************************************/
 
 #include "Python.h"
+#include "packed_basis.h"
+#include "boys.h"
+#include "prim_screen.h"
 #include "chgp.h"
 #include <assert.h>
 #include <math.h>
 
-// Not required for MSVC since the code is included below
-#if defined(_WIN32) && !defined(_MSC_VER)
-double lgamma(double x);
-#endif
-
 #ifndef M_PI
 #define M_PI 3.14159265358979323846
 #endif
 
-#define ITMAX 100
-#define EPS 3.0e-7
-#define FPMIN 1.0e-30
-#define SMALL 0.00000001
-
-/* MAXAM is one more than the maximum value of an AM (l,m,n) */
-#define MAXAM 5
-#define MAXMTOT 12
-
-double vrr_terms[MAXAM*MAXAM*MAXAM*MAXAM*MAXAM*MAXAM*MAXMTOT];
-double Fgterms[100];
-
-// lgamma not included in ANSI standard and so not available in MSVC
-#if defined(_MSC_VER)
-double lgamma(double z) {
-    double c[7];
-    double x,y ,tmp, ser, v;
-    int i;
-
-    if (z<=0) return 0;
-
-    c[0]=2.5066282746310005;
-    c[1]=76.18009172947146;
-    c[2]=-86.50532032941677;
-    c[3]=24.01409824083091;
-    c[4]=-1.231739572450155;
-    c[5]=0.1208650973866179e-2;
-    c[6]=-0.5395239384953e-5;
-   
-    x   = z;
-    y   = x;
-    tmp = x+5.5;
-    tmp = (x+0.5)*log(tmp)-tmp;
-    ser = 1.000000000190015;
-    for (i=1; i<7; i++) {
-        y   += 1.0;
-        ser += c[i]/y;
-        }
-    v = tmp+log(c[0]*ser/x);
-    return v;
-    }
-#endif
+/* The number of vrr terms that vrr keeps on the stack; larger
+   recursions get theirs from malloc */
+#define VRR_STACK_TERMS 2048
 
 static double contr_hrr(int lena, double xa, double ya, double za, double *anorms,
 		 int la, int ma, int na, double *aexps, double *acoefs,
@@ -82,66 +41,67 @@ static double contr_hrr(int lena, double xa, double ya, double za, double *anorm
 		 int lenc, double xc, double yc, double zc, double *cnorms,
 		 int lc, int mc, int nc, double *cexps, double *ccoefs,
 		 int lend, double xd, double yd, double zd, double *dnorms,
-		 int ld, int md, int nd, double *dexps, double *dcoefs){
+		 int ld, int md, int nd, double *dexps, double *dcoefs,
+		 PrimCounts *counts){
   if (lb > 0) {
     return contr_hrr(lena,xa,ya,za,anorms,la+1,ma,na,aexps,acoefs,
 		     lenb,xb,yb,zb,bnorms,lb-1,mb,nb,bexps,bcoefs,
 		     lenc,xc,yc,zc,cnorms,lc,mc,nc,cexps,ccoefs,
-		     lend,xd,yd,zd,dnorms,ld,md,nd,dexps,dcoefs)
+		     lend,xd,yd,zd,dnorms,ld,md,nd,dexps,dcoefs,counts)
       + (xa-xb)*contr_hrr(lena,xa,ya,za,anorms,la,ma,na,aexps,acoefs,
 			  lenb,xb,yb,zb,bnorms,lb-1,mb,nb,bexps,bcoefs,
 			  lenc,xc,yc,zc,cnorms,lc,mc,nc,cexps,ccoefs,
-			  lend,xd,yd,zd,dnorms,ld,md,nd,dexps,dcoefs);
+			  lend,xd,yd,zd,dnorms,ld,md,nd,dexps,dcoefs,counts);
   }else if (mb > 0){
     return contr_hrr(lena,xa,ya,za,anorms,la,ma+1,na,aexps,acoefs,
 		     lenb,xb,yb,zb,bnorms,lb,mb-1,nb,bexps,bcoefs,
 		     lenc,xc,yc,zc,cnorms,lc,mc,nc,cexps,ccoefs,
-		     lend,xd,yd,zd,dnorms,ld,md,nd,dexps,dcoefs)
+		     lend,xd,yd,zd,dnorms,ld,md,nd,dexps,dcoefs,counts)
       + (ya-yb)*contr_hrr(lena,xa,ya,za,anorms,la,ma,na,aexps,acoefs,
 			  lenb,xb,yb,zb,bnorms,lb,mb-1,nb,bexps,bcoefs,
 			  lenc,xc,yc,zc,cnorms,lc,mc,nc,cexps,ccoefs,
-			  lend,xd,yd,zd,dnorms,ld,md,nd,dexps,dcoefs);
+			  lend,xd,yd,zd,dnorms,ld,md,nd,dexps,dcoefs,counts);
   }else if (nb > 0){
     return contr_hrr(lena,xa,ya,za,anorms,la,ma,na+1,aexps,acoefs,
 		     lenb,xb,yb,zb,bnorms,lb,mb,nb-1,bexps,bcoefs,
 		     lenc,xc,yc,zc,cnorms,lc,mc,nc,cexps,ccoefs,
-		     lend,xd,yd,zd,dnorms,ld,md,nd,dexps,dcoefs)
+		     lend,xd,yd,zd,dnorms,ld,md,nd,dexps,dcoefs,counts)
       + (za-zb)*contr_hrr(lena,xa,ya,za,anorms,la,ma,na,aexps,acoefs,
 			  lenb,xb,yb,zb,bnorms,lb,mb,nb-1,bexps,bcoefs,
 			  lenc,xc,yc,zc,cnorms,lc,mc,nc,cexps,ccoefs,
-			  lend,xd,yd,zd,dnorms,ld,md,nd,dexps,dcoefs);
+			  lend,xd,yd,zd,dnorms,ld,md,nd,dexps,dcoefs,counts);
   }else if (ld > 0){
     return contr_hrr(lena,xa,ya,za,anorms,la,ma,na,aexps,acoefs,
 		     lenb,xb,yb,zb,bnorms,lb,mb,nb,bexps,bcoefs,
 		     lenc,xc,yc,zc,cnorms,lc+1,mc,nc,cexps,ccoefs,
-		     lend,xd,yd,zd,dnorms,ld-1,md,nd,dexps,dcoefs)
+		     lend,xd,yd,zd,dnorms,ld-1,md,nd,dexps,dcoefs,counts)
       + (xc-xd)*contr_hrr(lena,xa,ya,za,anorms,la,ma,na,aexps,acoefs,
 			  lenb,xb,yb,zb,bnorms,lb,mb,nb,bexps,bcoefs,
 			  lenc,xc,yc,zc,cnorms,lc,mc,nc,cexps,ccoefs,
-			  lend,xd,yd,zd,dnorms,ld-1,md,nd,dexps,dcoefs);
+			  lend,xd,yd,zd,dnorms,ld-1,md,nd,dexps,dcoefs,counts);
   }else if (md > 0){
     return contr_hrr(lena,xa,ya,za,anorms,la,ma,na,aexps,acoefs,
 		     lenb,xb,yb,zb,bnorms,lb,mb,nb,bexps,bcoefs,
 		     lenc,xc,yc,zc,cnorms,lc,mc+1,nc,cexps,ccoefs,
-		     lend,xd,yd,zd,dnorms,ld,md-1,nd,dexps,dcoefs)
+		     lend,xd,yd,zd,dnorms,ld,md-1,nd,dexps,dcoefs,counts)
       + (yc-yd)*contr_hrr(lena,xa,ya,za,anorms,la,ma,na,aexps,acoefs,
 			  lenb,xb,yb,zb,bnorms,lb,mb,nb,bexps,bcoefs,
 			  lenc,xc,yc,zc,cnorms,lc,mc,nc,cexps,ccoefs,
-			  lend,xd,yd,zd,dnorms,ld,md-1,nd,dexps,dcoefs);
+			  lend,xd,yd,zd,dnorms,ld,md-1,nd,dexps,dcoefs,counts);
   }else if (nd > 0){
     return contr_hrr(lena,xa,ya,za,anorms,la,ma,na,aexps,acoefs,
 		     lenb,xb,yb,zb,bnorms,lb,mb,nb,bexps,bcoefs,
 		     lenc,xc,yc,zc,cnorms,lc,mc,nc+1,cexps,ccoefs,
-		     lend,xd,yd,zd,dnorms,ld,md,nd-1,dexps,dcoefs)
+		     lend,xd,yd,zd,dnorms,ld,md,nd-1,dexps,dcoefs,counts)
       + (zc-zd)*contr_hrr(lena,xa,ya,za,anorms,la,ma,na,aexps,acoefs,
 			  lenb,xb,yb,zb,bnorms,lb,mb,nb,bexps,bcoefs,
 			  lenc,xc,yc,zc,cnorms,lc,mc,nc,cexps,ccoefs,
-			  lend,xd,yd,zd,dnorms,ld,md,nd-1,dexps,dcoefs);
+			  lend,xd,yd,zd,dnorms,ld,md,nd-1,dexps,dcoefs,counts);
   }
   return contr_vrr(lena,xa,ya,za,anorms,la,ma,na,aexps,acoefs,
 		   lenb,xb,yb,zb,bnorms,bexps,bcoefs,
 		   lenc,xc,yc,zc,cnorms,lc,mc,nc,cexps,ccoefs,
-		   lend,xd,yd,zd,dnorms,dexps,dcoefs);
+		   lend,xd,yd,zd,dnorms,dexps,dcoefs,counts);
 }
 
 static double contr_vrr(int lena, double xa, double ya, double za,
@@ -153,18 +113,35 @@ static double contr_vrr(int lena, double xa, double ya, double za,
 			double *cnorms, int lc, int mc, int nc,
 			double *cexps, double *ccoefs,
 			int lend, double xd, double yd, double zd,
-			double *dnorms, double *dexps, double *dcoefs){
+			double *dnorms, double *dexps, double *dcoefs,
+			PrimCounts *counts){
   int i,j,k,l;
   double val=0.;
+  double wab_stack[PRIM_PAIR_STACK],wcd_stack[PRIM_PAIR_STACK],*wab,*wcd;
+  wab = prim_pair_weights(lena,aexps,acoefs,anorms,xa,ya,za,
+			  lenb,bexps,bcoefs,bnorms,xb,yb,zb,wab_stack,counts);
+  wcd = prim_pair_weights(lenc,cexps,ccoefs,cnorms,xc,yc,zc,
+			  lend,dexps,dcoefs,dnorms,xd,yd,zd,wcd_stack,counts);
+  if (!wab || !wcd) {
+    prim_free_weights(wab,wab_stack);
+    prim_free_weights(wcd,wcd_stack);
+    return 0.;
+  }
   for (i=0; i<lena; i++)
     for (j=0; j<lenb; j++)
       for (k=0; k<lenc; k++)
-	for (l=0; l<lend; l++)
+	for (l=0; l<lend; l++){
+	  if (prim_skip(wab[i*lenb+j]*wcd[k*lend+l]
+			/sqrt(aexps[i]+bexps[j]+cexps[k]+dexps[l]),counts))
+	    continue;
 	  val += acoefs[i]*bcoefs[j]*ccoefs[k]*dcoefs[l]*
 	    vrr(xa,ya,za,anorms[i],la,ma,na,aexps[i],
 		xb,yb,zb,bnorms[j],bexps[j],
 		xc,yc,zc,cnorms[k],lc,mc,nc,cexps[k],
-		xd,yd,zd,dnorms[l],dexps[l],0);
+		xd,yd,zd,dnorms[l],dexps[l],0,&counts->nomem);
+	}
+  prim_free_weights(wab,wab_stack);
+  prim_free_weights(wcd,wcd_stack);
   return val;
 }
 
@@ -176,61 +153,61 @@ static double hrr(double xa, double ya, double za, double norma,
 	   double xc, double yc, double zc, double normc,
 	   int lc, int mc, int nc, double alphac,
 	   double xd, double yd, double zd, double normd,
-	   int ld, int md, int nd, double alphad){
+	   int ld, int md, int nd, double alphad, int *nomem){
   if (lb > 0) {
     return hrr(xa,ya,za,norma,la+1,ma,na,alphaa,
 	       xb,yb,zb,normb,lb-1,mb,nb,alphab,
 	       xc,yc,zc,normc,lc,mc,nc,alphac,
-	       xd,yd,zd,normd,ld,md,nd,alphad)
+	       xd,yd,zd,normd,ld,md,nd,alphad,nomem)
       + (xa-xb)*hrr(xa,ya,za,norma,la,ma,na,alphaa,
 		    xb,yb,zb,normb,lb-1,mb,nb,alphab,
 		    xc,yc,zc,normc,lc,mc,nc,alphac,
-		    xd,yd,zd,normd,ld,md,nd,alphad);
+		    xd,yd,zd,normd,ld,md,nd,alphad,nomem);
   }else if (mb > 0){
     return hrr(xa,ya,za,norma,la,ma+1,na,alphaa,
 	       xb,yb,zb,normb,lb,mb-1,nb,alphab,
 	       xc,yc,zc,normc,lc,mc,nc,alphac,
-	       xd,yd,zd,normd,ld,md,nd,alphad)
+	       xd,yd,zd,normd,ld,md,nd,alphad,nomem)
       + (ya-yb)*hrr(xa,ya,za,norma,la,ma,na,alphaa,
 		    xb,yb,zb,normb,lb,mb-1,nb,alphab,
 		    xc,yc,zc,normc,lc,mc,nc,alphac,
-		    xd,yd,zd,normd,ld,md,nd,alphad);
+		    xd,yd,zd,normd,ld,md,nd,alphad,nomem);
   }else if (nb > 0){
     return hrr(xa,ya,za,norma,la,ma,na+1,alphaa,
 	       xb,yb,zb,normb,lb,mb,nb-1,alphab,
 	       xc,yc,zc,normc,lc,mc,nc,alphac,
-	       xd,yd,zd,normd,ld,md,nd,alphad)
+	       xd,yd,zd,normd,ld,md,nd,alphad,nomem)
       + (za-zb)*hrr(xa,ya,za,norma,la,ma,na,alphaa,
 		    xb,yb,zb,normb,lb,mb,nb-1,alphab,
 		    xc,yc,zc,normc,lc,mc,nc,alphac,
-		    xd,yd,zd,normd,ld,md,nd,alphad);
+		    xd,yd,zd,normd,ld,md,nd,alphad,nomem);
   }else if (ld > 0){
     return hrr(xa,ya,za,norma,la,ma,na,alphaa,
 	       xb,yb,zb,normb,lb,mb,nb,alphab,
 	       xc,yc,zc,normc,lc+1,mc,nc,alphac,
-	       xd,yd,zd,normd,ld-1,md,nd,alphad)
+	       xd,yd,zd,normd,ld-1,md,nd,alphad,nomem)
       + (xc-xd)*hrr(xa,ya,za,norma,la,ma,na,alphaa,
 		    xb,yb,zb,normb,lb,mb,nb,alphab,
 		    xc,yc,zc,normc,lc,mc,nc,alphac,
-		    xd,yd,zd,normd,ld-1,md,nd,alphad);
+		    xd,yd,zd,normd,ld-1,md,nd,alphad,nomem);
   }else if (md > 0){
     return hrr(xa,ya,za,norma,la,ma,na,alphaa,
 	       xb,yb,zb,normb,lb,mb,nb,alphab,
 	       xc,yc,zc,normc,lc,mc+1,nc,alphac,
-	       xd,yd,zd,normd,ld,md-1,nd,alphad)
+	       xd,yd,zd,normd,ld,md-1,nd,alphad,nomem)
       + (yc-yd)*hrr(xa,ya,za,norma,la,ma,na,alphaa,
 		    xb,yb,zb,normb,lb,mb,nb,alphab,
 		    xc,yc,zc,normc,lc,mc,nc,alphac,
-		    xd,yd,zd,normd,ld,md-1,nd,alphad);
+		    xd,yd,zd,normd,ld,md-1,nd,alphad,nomem);
   }else if (nd > 0){
     return hrr(xa,ya,za,norma,la,ma,na,alphaa,
 	       xb,yb,zb,normb,lb,mb,nb,alphab,
 	       xc,yc,zc,normc,lc,mc,nc+1,alphac,
-	       xd,yd,zd,normd,ld,md,nd-1,alphad)
+	       xd,yd,zd,normd,ld,md,nd-1,alphad,nomem)
       + (zc-zd)*hrr(xa,ya,za,norma,la,ma,na,alphaa,
 		    xb,yb,zb,normb,lb,mb,nb,alphab,
 		    xc,yc,zc,normc,lc,mc,nc,alphac,
-		    xd,yd,zd,normd,ld,md,nd-1,alphad);
+		    xd,yd,zd,normd,ld,md,nd-1,alphad,nomem);
   }
   /* Implicit else: */
   /* When we expand hrr to handle contracted functions as well, */
@@ -238,7 +215,7 @@ static double hrr(double xa, double ya, double za, double norma,
   return vrr(xa,ya,za,norma,la,ma,na,alphaa,
 	     xb,yb,zb,normb,alphab,
 	     xc,yc,zc,normc,lc,mc,nc,alphac,
-	     xd,yd,zd,normd,alphad,0);
+	     xd,yd,zd,normd,alphad,0,nomem);
 }
 
 static double vrr(double xa, double ya, double za, double norma,
@@ -247,12 +224,12 @@ static double vrr(double xa, double ya, double za, double norma,
 	   double xc, double yc, double zc, double normc,
 	   int lc, int mc, int nc, double alphac,
 	   double xd, double yd, double zd, double normd, double alphad,
-	   int m){
+	   int m, int *nomem){
 
   double px,py,pz,qx,qy,qz,zeta,eta,wx,wy,wz,rab2,rcd2,Kcd,rpq2,T,Kab,val;
-  /* double *vrr_terms; */
+  double Fgterms[100],stack_terms[VRR_STACK_TERMS],*vrr_terms;
 
-  int i,j,k,q,r,s,im,mtot;
+  int i,j,k,q,r,s,im,mtot,nterms,dims[7];
 
   px = product_center_1D(alphaa,xa,alphab,xb);
   py = product_center_1D(alphaa,ya,alphab,yb);
@@ -280,30 +257,38 @@ static double vrr(double xa, double ya, double za, double norma,
 
   mtot = la+ma+na+lc+mc+nc+m;
 
-  if (la*ma*na*lc*mc*nc*mtot>pow(MAXAM,6)*MAXMTOT) {
-    printf("Buffer not large enough in vrr\n");
-    printf(" increase MAXAM or MAXMTOT\n");
-    exit(1);
+  dims[0] = la+1; dims[1] = ma+1; dims[2] = na+1;
+  dims[3] = lc+1; dims[4] = mc+1; dims[5] = nc+1;
+  dims[6] = mtot+1;
+  nterms = dims[0]*dims[1]*dims[2]*dims[3]*dims[4]*dims[5]*dims[6];
+  if (nterms <= VRR_STACK_TERMS)
+    vrr_terms = stack_terms;
+  else {
+    vrr_terms = (double *)malloc(nterms*sizeof(double));
+    if (!vrr_terms) {
+      /* No GIL here to raise with, so flag it for the caller */
+      *nomem = 1;
+      return 0;
+    }
   }
 
-  Fgterms[mtot] = Fgamma(mtot,T);
-  for (im=mtot-1; im>=0; im--)
-    Fgterms[im]=(2.*T*Fgterms[im+1]+exp(-T))/(2.*im+1);
+  boys_array(mtot,T,Fgterms);
 
   for (im=0; im<mtot+1; im++)
-    vrr_terms[iindex(0,0,0,0,0,0,im)] = 
+    vrr_terms[iindex(dims,0,0,0,0,0,0,im)] = 
       norma*normb*normc*normd*Kab*Kcd/sqrt(zeta+eta)*Fgterms[im];
 
   for (i=0; i<la; i++){
     for (im=0; im<mtot-i; im++) {
-      vrr_terms[iindex(i+1,0,0, 0,0,0, im)] = 
-	(px-xa)*vrr_terms[iindex(i,0,0, 0,0,0, im)]
-	+ (wx-px)*vrr_terms[iindex(i,0,0, 0,0,0, im+1)];
+      vrr_terms[iindex(dims,i+1,0,0, 0,0,0, im)] = 
+	(px-xa)*vrr_terms[iindex(dims,i,0,0, 0,0,0, im)]
+	+ (wx-px)*vrr_terms[iindex(dims,i,0,0, 0,0,0, im+1)];
       
       if (i>0)
-	vrr_terms[iindex(i+1,0,0, 0,0,0, im)] += 
-	  i/2./zeta*( vrr_terms[iindex(i-1,0,0, 0,0,0, im)]
-		      - eta/(zeta+eta)*vrr_terms[iindex(i-1,0,0, 0,0,0, im+1)]);
+	vrr_terms[iindex(dims,i+1,0,0, 0,0,0, im)] += 
+	  i/2./zeta*( vrr_terms[iindex(dims,i-1,0,0, 0,0,0, im)]
+		      - eta/(zeta+eta)
+		      *vrr_terms[iindex(dims,i-1,0,0, 0,0,0, im+1)]);
     }
   }  
 
@@ -311,15 +296,15 @@ static double vrr(double xa, double ya, double za, double norma,
   for (j=0; j<ma; j++){
     for (i=0; i<la+1; i++){
       for (im=0; im<mtot-i-j; im++){
-	vrr_terms[iindex(i,j+1,0, 0,0,0, im)] = 
-	  (py-ya)*vrr_terms[iindex(i,j,0, 0,0,0, im)]
-	  + (wy-py)*vrr_terms[iindex(i,j,0, 0,0,0, im+1)];
+	vrr_terms[iindex(dims,i,j+1,0, 0,0,0, im)] = 
+	  (py-ya)*vrr_terms[iindex(dims,i,j,0, 0,0,0, im)]
+	  + (wy-py)*vrr_terms[iindex(dims,i,j,0, 0,0,0, im+1)];
 
 	if (j>0)
-	  vrr_terms[iindex(i,j+1,0, 0,0,0, im)] +=
-	    j/2./zeta*(vrr_terms[iindex(i,j-1,0, 0,0,0, im)]
+	  vrr_terms[iindex(dims,i,j+1,0, 0,0,0, im)] +=
+	    j/2./zeta*(vrr_terms[iindex(dims,i,j-1,0, 0,0,0, im)]
 		       - eta/(zeta+eta)
-		       *vrr_terms[iindex(i,j-1,0, 0,0,0, im+1)]);
+		       *vrr_terms[iindex(dims,i,j-1,0, 0,0,0, im+1)]);
       }
     }
   }
@@ -328,14 +313,14 @@ static double vrr(double xa, double ya, double za, double norma,
     for (j=0; j<ma+1; j++){
       for (i=0; i<la+1; i++){
 	for (im=0; im<mtot-i-j-k; im++){
-	  vrr_terms[iindex(i,j,k+1, 0,0,0, im)] = 
-	    (pz-za)*vrr_terms[iindex(i,j,k, 0,0,0, im)]
-	    + (wz-pz)*vrr_terms[iindex(i,j,k, 0,0,0, im+1)];
+	  vrr_terms[iindex(dims,i,j,k+1, 0,0,0, im)] = 
+	    (pz-za)*vrr_terms[iindex(dims,i,j,k, 0,0,0, im)]
+	    + (wz-pz)*vrr_terms[iindex(dims,i,j,k, 0,0,0, im+1)];
 	  if (k>0)
-	    vrr_terms[iindex(i,j,k+1, 0,0,0, im)] += 
-	      k/2./zeta*(vrr_terms[iindex(i,j,k-1, 0,0,0, im)]
+	    vrr_terms[iindex(dims,i,j,k+1, 0,0,0, im)] += 
+	      k/2./zeta*(vrr_terms[iindex(dims,i,j,k-1, 0,0,0, im)]
 			 - eta/(zeta+eta)
-			 *vrr_terms[iindex(i,j,k-1, 0,0,0, im+1)]);
+			 *vrr_terms[iindex(dims,i,j,k-1, 0,0,0, im+1)]);
 	}
       }
     }
@@ -346,17 +331,17 @@ static double vrr(double xa, double ya, double za, double norma,
       for (j=0; j<ma+1; j++){
 	for (i=0; i<la+1; i++){
 	  for (im=0; im<mtot-i-j-k-q; im++){
-	    vrr_terms[iindex(i,j,k, q+1,0,0, im)] = 
-	      (qx-xc)*vrr_terms[iindex(i,j,k, q,0,0, im)]
-	      + (wx-qx)*vrr_terms[iindex(i,j,k, q,0,0, im+1)];
+	    vrr_terms[iindex(dims,i,j,k, q+1,0,0, im)] = 
+	      (qx-xc)*vrr_terms[iindex(dims,i,j,k, q,0,0, im)]
+	      + (wx-qx)*vrr_terms[iindex(dims,i,j,k, q,0,0, im+1)];
 	    if (q>0)
-	      vrr_terms[iindex(i,j,k, q+1,0,0, im)] += 
-		q/2./eta*(vrr_terms[iindex(i,j,k, q-1,0,0, im)]
+	      vrr_terms[iindex(dims,i,j,k, q+1,0,0, im)] += 
+		q/2./eta*(vrr_terms[iindex(dims,i,j,k, q-1,0,0, im)]
 			  - zeta/(zeta+eta)
-			  *vrr_terms[iindex(i,j,k, q-1,0,0, im+1)]);
+			  *vrr_terms[iindex(dims,i,j,k, q-1,0,0, im+1)]);
 	    if (i>0)
-	      vrr_terms[iindex(i,j,k, q+1,0,0, im)] += 
-		i/2./(zeta+eta)*vrr_terms[iindex(i-1,j,k, q,0,0, im+1)];
+	      vrr_terms[iindex(dims,i,j,k, q+1,0,0, im)] += 
+		i/2./(zeta+eta)*vrr_terms[iindex(dims,i-1,j,k, q,0,0, im+1)];
 	  }
 	}
       }
@@ -369,17 +354,17 @@ static double vrr(double xa, double ya, double za, double norma,
 	for (j=0; j<ma+1; j++){
 	  for (i=0; i<la+1; i++){
 	    for (im=0; im<mtot-i-j-k-q-r; im++){
-	      vrr_terms[iindex(i,j,k, q,r+1,0, im)] = 
-		(qy-yc)*vrr_terms[iindex(i,j,k, q,r,0, im)]
-		+ (wy-qy)*vrr_terms[iindex(i,j,k, q,r,0, im+1)];
+	      vrr_terms[iindex(dims,i,j,k, q,r+1,0, im)] = 
+		(qy-yc)*vrr_terms[iindex(dims,i,j,k, q,r,0, im)]
+		+ (wy-qy)*vrr_terms[iindex(dims,i,j,k, q,r,0, im+1)];
 	      if (r>0)
-		vrr_terms[iindex(i,j,k, q,r+1,0, im)] += 
-		  r/2./eta*(vrr_terms[iindex(i,j,k, q,r-1,0, im)]
+		vrr_terms[iindex(dims,i,j,k, q,r+1,0, im)] += 
+		  r/2./eta*(vrr_terms[iindex(dims,i,j,k, q,r-1,0, im)]
 			    - zeta/(zeta+eta)
-			    *vrr_terms[iindex(i,j,k, q,r-1,0, im+1)]);
+			    *vrr_terms[iindex(dims,i,j,k, q,r-1,0, im+1)]);
 	      if (j>0)
-		vrr_terms[iindex(i,j,k, q,r+1,0, im)] += 
-		  j/2./(zeta+eta)*vrr_terms[iindex(i,j-1,k,q,r,0,im+1)];
+		vrr_terms[iindex(dims,i,j,k, q,r+1,0, im)] += 
+		  j/2./(zeta+eta)*vrr_terms[iindex(dims,i,j-1,k,q,r,0,im+1)];
 	    }
 	  }
 	}
@@ -394,17 +379,17 @@ static double vrr(double xa, double ya, double za, double norma,
 	  for (j=0; j<ma+1; j++){
 	    for (i=0; i<la+1; i++){
 	      for (im=0; im<mtot-i-j-k-q-r-s; im++){
-		vrr_terms[iindex(i,j,k,q,r,s+1,im)] = 
-		  (qz-zc)*vrr_terms[iindex(i,j,k,q,r,s,im)]
-		  + (wz-qz)*vrr_terms[iindex(i,j,k,q,r,s,im+1)];
+		vrr_terms[iindex(dims,i,j,k,q,r,s+1,im)] = 
+		  (qz-zc)*vrr_terms[iindex(dims,i,j,k,q,r,s,im)]
+		  + (wz-qz)*vrr_terms[iindex(dims,i,j,k,q,r,s,im+1)];
 		if (s>0)
-		  vrr_terms[iindex(i,j,k,q,r,s+1,im)] += 
-		    s/2./eta*(vrr_terms[iindex(i,j,k,q,r,s-1,im)]
+		  vrr_terms[iindex(dims,i,j,k,q,r,s+1,im)] += 
+		    s/2./eta*(vrr_terms[iindex(dims,i,j,k,q,r,s-1,im)]
 			      - zeta/(zeta+eta)
-			      *vrr_terms[iindex(i,j,k,q,r,s-1,im+1)]);
+			      *vrr_terms[iindex(dims,i,j,k,q,r,s-1,im+1)]);
 		if (k>0)
-		  vrr_terms[iindex(i,j,k,q,r,s+1,im)] += 
-		    k/2./(zeta+eta)*vrr_terms[iindex(i,j,k-1,q,r,s,im+1)];
+		  vrr_terms[iindex(dims,i,j,k,q,r,s+1,im)] += 
+		    k/2./(zeta+eta)*vrr_terms[iindex(dims,i,j,k-1,q,r,s,im+1)];
 	      }
 	    }
 	  }
@@ -412,24 +397,23 @@ static double vrr(double xa, double ya, double za, double norma,
       }
     }
   }
-  val = vrr_terms[iindex(la,ma,na,lc,mc,nc,m)];
+  val = vrr_terms[iindex(dims,la,ma,na,lc,mc,nc,m)];
+  if (vrr_terms != stack_terms) free(vrr_terms);
 
   return val;
 
 }
 
 
-/* These iindexing functions are wasteful: they simply allocate an array
-   of dimension MAXAM^6*mtot. Once this is working I'll look to 
-   actually implement the correct size array la*ma*na*lc*mc*nc*mtot */
+/* The vrr terms of a primitive quartet are kept in an array of just
+   the size the recursion needs, (la+1)(ma+1)(na+1)(lc+1)(mc+1)(nc+1)
+   (mtot+1), with dims holding these 7 dimensions */
 
-static int iindex(int la, int ma, int na, int lc, int mc, int nc, int m){
+static int iindex(int *dims, int la, int ma, int na, int lc, int mc, int nc,
+		  int m){
   /* Convert the 7-dimensional indices to a 1d iindex */
-  int ival=0;
-  ival = la + ma*MAXAM + na*MAXAM*MAXAM + lc*MAXAM*MAXAM*MAXAM +
-    nc*MAXAM*MAXAM*MAXAM*MAXAM + mc*MAXAM*MAXAM*MAXAM*MAXAM*MAXAM +
-    m*MAXAM*MAXAM*MAXAM*MAXAM*MAXAM*MAXAM;
-  return ival;
+  return la + dims[0]*(ma + dims[1]*(na + dims[2]*(lc + dims[3]*
+	 (mc + dims[4]*(nc + dims[5]*m)))));
 }
 
 static double vrr_recursive(double xa, double ya, double za, double norma,
@@ -438,7 +422,7 @@ static double vrr_recursive(double xa, double ya, double za, double norma,
 	   double xc, double yc, double zc, double normc,
 	   int lc, int mc, int nc, double alphac,
 	   double xd, double yd, double zd, double normd, double alphad,
-	   int m){
+	   int m, int *nomem){
 
   double px,py,pz,qx,qy,qz,zeta,eta,wx,wy,wz,rab2,rcd2,Kcd,rpq2,T,Kab,val;
 
@@ -462,137 +446,137 @@ static double vrr_recursive(double xa, double ya, double za, double norma,
     val = (qz-zc)*vrr(xa,ya,za,norma,la,ma,na,alphaa,
 		      xb,yb,zb,normb,alphab,
 		      xc,yc,zc,normc,lc,mc,nc-1,alphac,
-		      xd,yd,zd,normd,alphad,m) 
+		      xd,yd,zd,normd,alphad,m,nomem) 
       + (wz-qz)*vrr(xa,ya,za,norma,la,ma,na,alphaa,
 		    xb,yb,zb,normb,alphab,
 		    xc,yc,zc,normc,lc,mc,nc-1,alphac,
-		    xd,yd,zd,normd,alphad,m+1);
+		    xd,yd,zd,normd,alphad,m+1,nomem);
     if (nc > 1)
       val += 0.5*(nc-1)/eta*(vrr(xa,ya,za,norma,la,ma,na,alphaa,
 				 xb,yb,zb,normb,alphab,
 				 xc,yc,zc,normc,lc,mc,nc-2,alphac,
-				 xd,yd,zd,normd,alphad,m)
+				 xd,yd,zd,normd,alphad,m,nomem)
 			     -zeta/(zeta+eta)* 
 			     vrr(xa,ya,za,norma,la,ma,na,alphaa,
 				 xb,yb,zb,normb,alphab,
 				 xc,yc,zc,normc,lc,mc,nc-2,alphac,
-				 xd,yd,zd,normd,alphad,m+1) );
+				 xd,yd,zd,normd,alphad,m+1,nomem) );
     if (na > 0)
       val += 0.5*na/(zeta+eta)*vrr(xa,ya,za,norma,la,ma,na-1,alphaa,
 				   xb,yb,zb,normb,alphab,
 				   xc,yc,zc,normc,lc,mc,nc-1,alphac,
-				   xd,yd,zd,normd,alphad,m+1);
+				   xd,yd,zd,normd,alphad,m+1,nomem);
     return val;
   }else if (mc > 0){
     val = (qy-yc)*vrr(xa,ya,za,norma,la,ma,na,alphaa,
 		      xb,yb,zb,normb,alphab,
 		      xc,yc,zc,normc,lc,mc-1,nc,alphac,
-		      xd,yd,zd,normd,alphad,m) 
+		      xd,yd,zd,normd,alphad,m,nomem) 
       + (wy-qy)*vrr(xa,ya,za,norma,la,ma,na,alphaa,
 		    xb,yb,zb,normb,alphab,
 		    xc,yc,zc,normc,lc,mc-1,nc,alphac,
-		    xd,yd,zd,normd,alphad,m+1);
+		    xd,yd,zd,normd,alphad,m+1,nomem);
     if (mc > 1)
       val += 0.5*(mc-1)/eta*(vrr(xa,ya,za,norma,la,ma,na,alphaa,
 				 xb,yb,zb,normb,alphab,
 				 xc,yc,zc,normc,lc,mc-2,nc,alphac,
-				 xd,yd,zd,normd,alphad,m)
+				 xd,yd,zd,normd,alphad,m,nomem)
 			     -zeta/(zeta+eta)* 
 			     vrr(xa,ya,za,norma,la,ma,na,alphaa,
 				 xb,yb,zb,normb,alphab,
 				 xc,yc,zc,normc,lc,mc-2,nc,alphac,
-				 xd,yd,zd,normd,alphad,m+1) );
+				 xd,yd,zd,normd,alphad,m+1,nomem) );
     if (ma > 0)
       val += 0.5*ma/(zeta+eta)*vrr(xa,ya,za,norma,la,ma-1,na,alphaa,
 				   xb,yb,zb,normb,alphab,
 				   xc,yc,zc,normc,lc,mc-1,nc,alphac,
-				   xd,yd,zd,normd,alphad,m+1);
+				   xd,yd,zd,normd,alphad,m+1,nomem);
     return val;
   }else if (lc > 0){
     val = (qx-xc)*vrr(xa,ya,za,norma,la,ma,na,alphaa,
 		      xb,yb,zb,normb,alphab,
 		      xc,yc,zc,normc,lc-1,mc,nc,alphac,
-		      xd,yd,zd,normd,alphad,m) 
+		      xd,yd,zd,normd,alphad,m,nomem) 
       + (wx-qx)*vrr(xa,ya,za,norma,la,ma,na,alphaa,
 		    xb,yb,zb,normb,alphab,
 		    xc,yc,zc,normc,lc-1,mc,nc,alphac,
-		    xd,yd,zd,normd,alphad,m+1);
+		    xd,yd,zd,normd,alphad,m+1,nomem);
     if (lc > 1)
       val += 0.5*(lc-1)/eta*(vrr(xa,ya,za,norma,la,ma,na,alphaa,
 				 xb,yb,zb,normb,alphab,
 				 xc,yc,zc,normc,lc-2,mc,nc,alphac,
-				 xd,yd,zd,normd,alphad,m)
+				 xd,yd,zd,normd,alphad,m,nomem)
 			     -zeta/(zeta+eta)* 
 			     vrr(xa,ya,za,norma,la,ma,na,alphaa,
 				 xb,yb,zb,normb,alphab,
 				 xc,yc,zc,normc,lc-2,mc,nc,alphac,
-				 xd,yd,zd,normd,alphad,m+1) );
+				 xd,yd,zd,normd,alphad,m+1,nomem) );
     if (la > 0)
       val += 0.5*la/(zeta+eta)*vrr(xa,ya,za,norma,la-1,ma,na,alphaa,
 				   xb,yb,zb,normb,alphab,
 				   xc,yc,zc,normc,lc-1,mc,nc,alphac,
-				   xd,yd,zd,normd,alphad,m+1);
+				   xd,yd,zd,normd,alphad,m+1,nomem);
     return val;
   }else if (na > 0) {
     val = (pz-za)*vrr(xa,ya,za,norma,la,ma,na-1,alphaa,
 		      xb,yb,zb,normb,alphab,
 		      xc,yc,zc,normc,lc,mc,nc,alphac,
-		      xd,yd,zd,normd,alphad,m) 
+		      xd,yd,zd,normd,alphad,m,nomem) 
       + (wz-pz)*vrr(xa,ya,za,norma,la,ma,na-1,alphaa,
 		    xb,yb,zb,normb,alphab,
 		    xc,yc,zc,normc,lc,mc,nc,alphac,
-		    xd,yd,zd,normd,alphad,m+1);
+		    xd,yd,zd,normd,alphad,m+1,nomem);
         
     if (na > 1)
       val +=  0.5*(na-1)/zeta*(vrr(xa,ya,za,norma,la,ma,na-2,alphaa,
 				   xb,yb,zb,normb,alphab,
 				   xc,yc,zc,normc,lc,mc,nc,alphac,
-				   xd,yd,zd,normd,alphad,m)
+				   xd,yd,zd,normd,alphad,m,nomem)
 			       -eta/(zeta+eta)* 
 			       vrr(xa,ya,za,norma,la,ma,na-2,alphaa,
 				   xb,yb,zb,normb,alphab,
 				   xc,yc,zc,normc,lc,mc,nc,alphac,
-				   xd,yd,zd,normd,alphad,m+1) );
+				   xd,yd,zd,normd,alphad,m+1,nomem) );
     return val;
   }else if (ma > 0) {
     val = (py-ya)*vrr(xa,ya,za,norma,la,ma-1,na,alphaa,
 		      xb,yb,zb,normb,alphab,
 		      xc,yc,zc,normc,lc,mc,nc,alphac,
-		      xd,yd,zd,normd,alphad,m) 
+		      xd,yd,zd,normd,alphad,m,nomem) 
       + (wy-py)*vrr(xa,ya,za,norma,la,ma-1,na,alphaa,
 		    xb,yb,zb,normb,alphab,
 		    xc,yc,zc,normc,lc,mc,nc,alphac,
-		    xd,yd,zd,normd,alphad,m+1);
+		    xd,yd,zd,normd,alphad,m+1,nomem);
     if (ma > 1)
       val +=  0.5*(ma-1)/zeta*(vrr(xa,ya,za,norma,la,ma-2,na,alphaa,
 				   xb,yb,zb,normb,alphab,
 				   xc,yc,zc,normc,lc,mc,nc,alphac,
-				   xd,yd,zd,normd,alphad,m)
+				   xd,yd,zd,normd,alphad,m,nomem)
 			       -eta/(zeta+eta)* 
 			       vrr(xa,ya,za,norma,la,ma-2,na,alphaa,
 				   xb,yb,zb,normb,alphab,
 				   xc,yc,zc,normc,lc,mc,nc,alphac,
-				   xd,yd,zd,normd,alphad,m+1) );
+				   xd,yd,zd,normd,alphad,m+1,nomem) );
     return val;
   }else if (la > 0) {
     val = (px-xa)*vrr(xa,ya,za,norma,la-1,ma,na,alphaa,
 		      xb,yb,zb,normb,alphab,
 		      xc,yc,zc,normc,lc,mc,nc,alphac,
-		      xd,yd,zd,normd,alphad,m) 
+		      xd,yd,zd,normd,alphad,m,nomem) 
       + (wx-px)*vrr(xa,ya,za,norma,la-1,ma,na,alphaa,
 		    xb,yb,zb,normb,alphab,
 		    xc,yc,zc,normc,lc,mc,nc,alphac,
-		    xd,yd,zd,normd,alphad,m+1);
+		    xd,yd,zd,normd,alphad,m+1,nomem);
     if (la > 1)
       val +=  0.5*(la-1)/zeta*(vrr(xa,ya,za,norma,la-2,ma,na,alphaa,
 				   xb,yb,zb,normb,alphab,
 				   xc,yc,zc,normc,lc,mc,nc,alphac,
-				   xd,yd,zd,normd,alphad,m)
+				   xd,yd,zd,normd,alphad,m,nomem)
 			       -eta/(zeta+eta)* 
 			       vrr(xa,ya,za,norma,la-2,ma,na,alphaa,
 				   xb,yb,zb,normb,alphab,
 				   xc,yc,zc,normc,lc,mc,nc,alphac,
-				   xd,yd,zd,normd,alphad,m+1) );
+				   xd,yd,zd,normd,alphad,m+1,nomem) );
     return val;
   }
   
@@ -604,7 +588,7 @@ static double vrr_recursive(double xa, double ya, double za, double norma,
     *exp(-alphac*alphad/(alphac+alphad)*rcd2);
   rpq2 = dist2(px,py,pz,qx,qy,qz);
   T = zeta*eta/(zeta+eta)*rpq2;
-  val = norma*normb*normc*normd*Kab*Kcd/sqrt(zeta+eta)*Fgamma(m,T);
+  val = norma*normb*normc*normd*Kab*Kcd/sqrt(zeta+eta)*boys_function(m,T);
   return val;
 }
 
@@ -616,87 +600,309 @@ static double product_center_1D(double alphaa, double xa,
 			 double alphab, double xb){
   return (alphaa*xa+alphab*xb)/(alphaa+alphab);
 }
-static double Fgamma(double m, double x){
-  double val;
-  if (fabs(x) < SMALL) x = SMALL;
-  val = gamm_inc(m+0.5,x);
-  /* if (val < SMALL) return 0.; */ /* Gives a bug for D orbitals. */
-  return 0.5*pow(x,-m-0.5)*val; 
+/* Shell-quartet routines
+
+   These compute all of the cartesian components of a shell quartet
+   (ab|cd) at once. The vertical recursion is run once per primitive
+   quartet over every [e0|f0] with |e| <= la+lb, |f| <= lc+ld, the
+   results are contracted, and the horizontal recursion is then applied
+   to the contracted quantities, so that the Gaussian product data and
+   the Fgamma values are shared by every component of the quartet. */
+
+static int cart_index[MAXLSUM+1][MAXLSUM+1][MAXLSUM+1];
+static int cart_powers[NCARTMAX][3];
+
+static void init_cart_tables(void){
+  /* Cartesian components are ordered by total angular momentum L, and
+     within each L by decreasing powers of x, then y */
+  int L,l,m,n,idx=0;
+  for (L=0; L<=MAXLSUM; L++){
+    for (l=L; l>=0; l--){
+      for (m=L-l; m>=0; m--){
+	n = L-l-m;
+	cart_index[l][m][n] = idx;
+	cart_powers[idx][0] = l;
+	cart_powers[idx][1] = m;
+	cart_powers[idx][2] = n;
+	idx++;
+      }
+    }
+  }
 }
 
-static double gamm_inc(double a, double x){ /* Taken from NR routine gammap */
-  double gamser,gammcf,gln;
-  
-  assert (x >= 0.);
-  assert (a > 0.);
-  if (x < (a+1.0)) {
-    gser(&gamser,a,x,&gln);
-    return exp(gln)*gamser;
-  } else {
-    gcf(&gammcf,a,x,&gln);
-    return exp(gln)*(1.0-gammcf);
-  }
+/* Number of cartesian components with total angular momentum <= L */
+static int ncart_upto(int L){ return (L+1)*(L+2)*(L+3)/6; }
+/* Number of cartesian components with total angular momentum == L */
+static int ncart(int L){ return (L+1)*(L+2)/2; }
+
+/* The direction (0,1,2) of the first nonzero power of component e */
+static int cart_dir(int e){
+  if (cart_powers[e][0]) return 0;
+  if (cart_powers[e][1]) return 1;
+  return 2;
 }
- 
-static void gser(double *gamser, double a, double x, double *gln){
-  int n;
-  double sum,del,ap;
-
-  *gln=lgamma(a);
-  if (x <= 0.0) {
-    assert(x>=0.);
-    *gamser=0.0;
-    return;
-  } else {
-    ap=a;
-    del=sum=1.0/a;
-    for (n=1;n<=ITMAX;n++) {
-      ++ap;
-      del *= x/ap;
-      sum += del;
-      if (fabs(del) < fabs(sum)*EPS) {
-	*gamser=sum*exp(-x+a*log(x)-(*gln));
-	return;
+
+/* Index of component e with its power in direction i lowered (inc=-1)
+   or raised (inc=1) by one */
+static int cart_shift(int e, int i, int inc){
+  int p[3];
+  p[0] = cart_powers[e][0];
+  p[1] = cart_powers[e][1];
+  p[2] = cart_powers[e][2];
+  p[i] += inc;
+  return cart_index[p[0]][p[1]][p[2]];
+}
+
+static void shell_vrr(double *V, int Lab, int Lcd,
+		      double *A, double *C, double *P, double *Q, double *W,
+		      double zeta, double eta, double pref, double T){
+  /* Fill V[e,f,m] = [e0|f0]^(m) for one primitive quartet */
+  int ne,nf,nm,mtot,e,f,m,i,em,emm,fm,fmm,ep,Le,Lf,pe,pf;
+  double Fg[2*MAXLSUM+1];
+  double PA[3],WP[3],QC[3],WQ[3];
+  double rz,re,rze;
+
+  ne = ncart_upto(Lab);
+  nf = ncart_upto(Lcd);
+  mtot = Lab+Lcd;
+  nm = mtot+1;
+
+  for (i=0; i<3; i++){
+    PA[i] = P[i]-A[i];
+    WP[i] = W[i]-P[i];
+    QC[i] = Q[i]-C[i];
+    WQ[i] = W[i]-Q[i];
+  }
+  rz = eta/(zeta+eta);
+  re = zeta/(zeta+eta);
+  rze = 0.5/(zeta+eta);
+
+  boys_array(mtot,T,Fg);
+
+  for (m=0; m<nm; m++) V[m] = pref*Fg[m];
+
+  for (e=1; e<ne; e++){
+    Le = cart_powers[e][0]+cart_powers[e][1]+cart_powers[e][2];
+    i = cart_dir(e);
+    em = cart_shift(e,i,-1);
+    pe = cart_powers[em][i];
+    for (m=0; m<=mtot-Le; m++){
+      V[e*nf*nm+m] = PA[i]*V[em*nf*nm+m] + WP[i]*V[em*nf*nm+m+1];
+      if (pe > 0) {
+	emm = cart_shift(em,i,-1);
+	V[e*nf*nm+m] += 0.5*pe/zeta*(V[emm*nf*nm+m]-rz*V[emm*nf*nm+m+1]);
+      }
+    }
+  }
+
+  for (f=1; f<nf; f++){
+    Lf = cart_powers[f][0]+cart_powers[f][1]+cart_powers[f][2];
+    i = cart_dir(f);
+    fm = cart_shift(f,i,-1);
+    pf = cart_powers[fm][i];
+    fmm = (pf > 0) ? cart_shift(fm,i,-1) : 0;
+    for (e=0; e<ne; e++){
+      Le = cart_powers[e][0]+cart_powers[e][1]+cart_powers[e][2];
+      pe = cart_powers[e][i];
+      ep = (pe > 0) ? cart_shift(e,i,-1) : 0;
+      for (m=0; m<=mtot-Le-Lf; m++){
+	V[(e*nf+f)*nm+m] = QC[i]*V[(e*nf+fm)*nm+m] 
+	  + WQ[i]*V[(e*nf+fm)*nm+m+1];
+	if (pf > 0)
+	  V[(e*nf+f)*nm+m] += 0.5*pf/eta*(V[(e*nf+fmm)*nm+m]
+					  -re*V[(e*nf+fmm)*nm+m+1]);
+	if (pe > 0)
+	  V[(e*nf+f)*nm+m] += pe*rze*V[(ep*nf+fm)*nm+m+1];
       }
     }
-    printf("a too large, ITMAX too small in routine gser");
-    return;
   }
 }
- 
-static void gcf(double *gammcf, double a, double x, double *gln){
-  int i;
-  double an,b,c,d,del,h;
-  
-  *gln=lgamma(a);
-  b=x+1.0-a;
-  c=1.0/FPMIN;
-  d=1.0/b;
-  h=d;
-  for (i=1;i<=ITMAX;i++) {
-    an = -i*(i-a);
-    b += 2.0;
-    d=an*d+b;
-    if (fabs(d) < FPMIN) d=FPMIN;
-    c=b+an/c;
-    if (fabs(c) < FPMIN) c=FPMIN;
-    d=1.0/d;
-    del=d*c;
-    h *= del;
-    if (fabs(del-1.0) < EPS) break;
-  }
-  assert(i<=ITMAX);
-  *gammcf=exp(-x+a*log(x)-(*gln))*h;
+
+static int shell_hrr(double *X, int La, int Lb, double *AB, int ncol,
+		      double *out){
+  /* Transfer angular momentum from a to b:
+       (a,b+1_i| = (a+1_i,b| + AB_i (a,b|
+     X holds (e0| for La <= |e| <= La+Lb, one row of length ncol per e.
+     out receives (ab| for |a| == La, |b| == Lb. Returns 0 if it runs
+     out of memory. */
+  int e0,b0,nx,nbt,na,nb,a,b,bm,ap,i,k,La1,Lbb;
+  double *H;
+
+  e0 = ncart_upto(La-1);
+  nx = ncart_upto(La+Lb)-e0;
+  nbt = ncart_upto(Lb);
+  na = ncart(La);
+  nb = ncart(Lb);
+
+  if (Lb == 0) {
+    for (k=0; k<na*ncol; k++) out[k] = X[k];
+    return 1;
+  }
+
+  H = (double *)malloc(nx*nbt*ncol*sizeof(double));
+  if (!H) return 0;
+  for (a=0; a<nx; a++)
+    for (k=0; k<ncol; k++)
+      H[(a*nbt)*ncol+k] = X[a*ncol+k];
+
+  for (b=1; b<nbt; b++){
+    Lbb = cart_powers[b][0]+cart_powers[b][1]+cart_powers[b][2];
+    i = cart_dir(b);
+    bm = cart_shift(b,i,-1);
+    for (a=0; a<nx; a++){
+      La1 = cart_powers[a+e0][0]+cart_powers[a+e0][1]+cart_powers[a+e0][2];
+      if (La1 > La+Lb-Lbb) break;
+      ap = cart_shift(a+e0,i,1)-e0;
+      for (k=0; k<ncol; k++)
+	H[(a*nbt+b)*ncol+k] = H[(ap*nbt+bm)*ncol+k] 
+	  + AB[i]*H[(a*nbt+bm)*ncol+k];
+    }
+  }
+
+  b0 = ncart_upto(Lb-1);
+  for (a=0; a<na; a++)
+    for (b=0; b<nb; b++)
+      for (k=0; k<ncol; k++)
+	out[(a*nb+b)*ncol+k] = H[(a*nbt+b+b0)*ncol+k];
+  free(H);
+  return 1;
+}
+
+static void make_shell_pair(Shell *sa, Shell *sb, double *buf,
+			    ShellPair *pair){
+  /* Fill pair with every primitive pair of sa,sb, using buf, which
+     must hold 5*sa->nprim*sb->nprim doubles */
+  int i,j,n,np;
+  double rab2,zeta;
+
+  np = sa->nprim*sb->nprim;
+  pair->n = np;
+  pair->zeta = buf;
+  pair->P = buf+np;
+  pair->w = buf+4*np;
+  rab2 = dist2(sa->xyz[0],sa->xyz[1],sa->xyz[2],
+	       sb->xyz[0],sb->xyz[1],sb->xyz[2]);
+  for (i=0; i<sa->nprim; i++){
+    for (j=0; j<sb->nprim; j++){
+      zeta = sa->exps[i]+sb->exps[j];
+      pair->zeta[i*sb->nprim+j] = zeta;
+      for (n=0; n<3; n++)
+	pair->P[3*(i*sb->nprim+j)+n] = 
+	  product_center_1D(sa->exps[i],sa->xyz[n],sb->exps[j],sb->xyz[n]);
+      pair->w[i*sb->nprim+j] = sa->coefs[i]*sb->coefs[j]
+	*sqrt(2.)*pow(M_PI,1.25)/zeta
+	*exp(-sa->exps[i]*sb->exps[j]/zeta*rab2);
+    }
+  }
+}
+
+static void shell_coulomb(Shell *sa, Shell *sb, Shell *sc, Shell *sd,
+			  ShellPair *ab, ShellPair *cd, double *result,
+			  PrimCounts *counts){
+  /* Compute all components of the shell quartet (ab|cd), storing them
+     in result in the order of the components of a,b,c,d. ab and cd
+     hold the primitive pair data of the bra and ket. The primitive
+     screening is counted into counts, which is flagged if the work
+     arrays can't be allocated. */
+  int La,Lb,Lc,Ld,Lab,Lcd,ne,nf,nm,e0,f0,nex,nfx,nab,ncd,na,nb,nc,nd;
+  int i,k,n,e,f,ia,ib,ic,id,ea,eb,ec,ed;
+  double W[3],AB[3],CD[3];
+  double zeta,eta,rpq2,T;
+  double *P,*Q,*V,*X,*Y,*Z,*R;
+
+  La = sa->L; Lb = sb->L; Lc = sc->L; Ld = sd->L;
+  Lab = La+Lb;
+  Lcd = Lc+Ld;
+  ne = ncart_upto(Lab);
+  nf = ncart_upto(Lcd);
+  nm = Lab+Lcd+1;
+  e0 = ncart_upto(La-1);
+  f0 = ncart_upto(Lc-1);
+  nex = ne-e0;
+  nfx = nf-f0;
+  na = ncart(La); nb = ncart(Lb); nc = ncart(Lc); nd = ncart(Ld);
+  nab = na*nb;
+  ncd = nc*nd;
+
+  V = (double *)malloc(ne*nf*nm*sizeof(double));
+  X = (double *)malloc(nex*nfx*sizeof(double));
+  Y = (double *)malloc(nab*nfx*sizeof(double));
+  Z = (double *)malloc(nab*nfx*sizeof(double));
+  R = (double *)malloc(ncd*nab*sizeof(double));
+  if (!(V && X && Y && Z && R)) {
+    counts->nomem = 1;
+    goto done;
+  }
+
+  for (k=0; k<nex*nfx; k++) X[k] = 0.;
+
+  for (i=0; i<ab->n; i++){
+    zeta = ab->zeta[i];
+    P = ab->P+3*i;
+    for (k=0; k<cd->n; k++){
+      eta = cd->zeta[k];
+      if (prim_skip(fabs(ab->w[i]*cd->w[k])/sqrt(zeta+eta),counts))
+	continue;
+      Q = cd->P+3*k;
+      for (n=0; n<3; n++) W[n] = product_center_1D(zeta,P[n],eta,Q[n]);
+      rpq2 = dist2(P[0],P[1],P[2],Q[0],Q[1],Q[2]);
+      T = zeta*eta/(zeta+eta)*rpq2;
+      shell_vrr(V,Lab,Lcd,sa->xyz,sc->xyz,P,Q,W,zeta,eta,
+		ab->w[i]*cd->w[k]/sqrt(zeta+eta),T);
+      for (e=0; e<nex; e++)
+	for (f=0; f<nfx; f++)
+	  X[e*nfx+f] += V[((e+e0)*nf+f+f0)*nm];
+    }
+  }
+
+  for (n=0; n<3; n++){
+    AB[n] = sa->xyz[n]-sb->xyz[n];
+    CD[n] = sc->xyz[n]-sd->xyz[n];
+  }
+
+  /* (e0|f0) -> (ab|f0), then transpose to (f0|ab) -> (cd|ab) */
+  if (!shell_hrr(X,La,Lb,AB,nfx,Y)) {
+    counts->nomem = 1;
+    goto done;
+  }
+  for (e=0; e<nab; e++)
+    for (f=0; f<nfx; f++)
+      Z[f*nab+e] = Y[e*nfx+f];
+  if (!shell_hrr(Z,Lc,Ld,CD,nab,R)) {
+    counts->nomem = 1;
+    goto done;
+  }
+
+  e = 0;
+  for (ia=0; ia<sa->ncomp; ia++){
+    ea = sa->comps[ia]-ncart_upto(La-1);
+    for (ib=0; ib<sb->ncomp; ib++){
+      eb = sb->comps[ib]-ncart_upto(Lb-1);
+      for (ic=0; ic<sc->ncomp; ic++){
+	ec = sc->comps[ic]-ncart_upto(Lc-1);
+	for (id=0; id<sd->ncomp; id++){
+	  ed = sd->comps[id]-ncart_upto(Ld-1);
+	  result[e++] = sa->norms[ia]*sb->norms[ib]*sc->norms[ic]
+	    *sd->norms[id]*R[(ec*nd+ed)*nab+ea*nb+eb];
+	}
+      }
+    }
+  }
+ done:
+  free(V);
+  free(X);
+  free(Y);
+  free(Z);
+  free(R);
 }
 
 /* chgp_wrap */
 
-/* work is the work space for the various exponents, contraction */
-/*  coefficients, etc., used by the contracted code. Decided to  */
-/*  allocate this all at once rather than doing mallocs/frees. */
-/*  Only speeds things up a little, but every little bit counts, I guess. */
+/* work, in contr_coulomb_wrap, is the work space for the various */
+/*  exponents, contraction coefficients, etc., used by the contracted */
+/*  code. It lives on the stack of each call rather than in a global, */
+/*  so that calls from different threads don't share it. */
 #define MAX_PRIMS_PER_CONT (30)
-double work[12*MAX_PRIMS_PER_CONT];
 
 static PyObject *contr_coulomb_wrap(PyObject *self,PyObject *args){
   int ok=0;
@@ -715,13 +921,18 @@ static PyObject *contr_coulomb_wrap(PyObject *self,PyObject *args){
     *dexps,*dcoefs,*dnorms;
   int i;
   double Jij=0; /* return value */
+  double work[12*MAX_PRIMS_PER_CONT];
+  PrimCounts counts;
+  double tol=prim_tol;
 
-  ok = PyArg_ParseTuple(args,"OOOOOOOOOOOOOOOOOOOO",
+  ok = PyArg_ParseTuple(args,"OOOOOOOOOOOOOOOOOOOO|d",
 			&aexps_obj,&acoefs_obj,&anorms_obj,&xyza_obj,&lmna_obj,
 			&bexps_obj,&bcoefs_obj,&bnorms_obj,&xyzb_obj,&lmnb_obj,
 			&cexps_obj,&ccoefs_obj,&cnorms_obj,&xyzc_obj,&lmnc_obj,
-			&dexps_obj,&dcoefs_obj,&dnorms_obj,&xyzd_obj,&lmnd_obj);
+			&dexps_obj,&dcoefs_obj,&dnorms_obj,&xyzd_obj,&lmnd_obj,
+			&tol);
   if (!ok) return NULL;
+  prim_counts_init(&counts,tol);
 
 
   ok=PyArg_ParseTuple(xyza_obj,"ddd",&xa,&ya,&za);
@@ -810,10 +1021,13 @@ static PyObject *contr_coulomb_wrap(PyObject *self,PyObject *args){
     dcoefs[i] = PyFloat_AS_DOUBLE(PySequence_GetItem(dcoefs_obj,i));
     dnorms[i] = PyFloat_AS_DOUBLE(PySequence_GetItem(dnorms_obj,i));
   }
+  Py_BEGIN_ALLOW_THREADS
   Jij = contr_hrr(lena,xa,ya,za,anorms,la,ma,na,aexps,acoefs,
 		  lenb,xb,yb,zb,bnorms,lb,mb,nb,bexps,bcoefs,
 		  lenc,xc,yc,zc,cnorms,lc,mc,nc,cexps,ccoefs,
-		  lend,xd,yd,zd,dnorms,ld,md,nd,dexps,dcoefs);
+		  lend,xd,yd,zd,dnorms,ld,md,nd,dexps,dcoefs,&counts);
+  Py_END_ALLOW_THREADS
+  if (!prim_add_counts(&counts)) return NULL;
   return Py_BuildValue("d", Jij);
 }
 
@@ -821,7 +1035,8 @@ static PyObject *hrr_wrap(PyObject *self,PyObject *args){
   int ok=0;
   double norma,alphaa,normb,alphab,normc,alphac,normd,alphad,
     xa,ya,za,xb,yb,zb,xc,yc,zc,xd,yd,zd;
-  int la,ma,na,lb,mb,nb,lc,mc,nc,ld,md,nd;
+  int la,ma,na,lb,mb,nb,lc,mc,nc,ld,md,nd,nomem=0;
+  double val;
   PyObject *A,*B,*C,*D,*powa,*powb,*powc,*powd;
 
   ok=PyArg_ParseTuple(args,"OdOdOdOdOdOdOdOd",&A,&norma,&powa,&alphaa,
@@ -847,18 +1062,20 @@ static PyObject *hrr_wrap(PyObject *self,PyObject *args){
   ok=PyArg_ParseTuple(powd,"iii",&ld,&md,&nd);
   if (!ok) return NULL;
   
-  return Py_BuildValue("d", 
-		       hrr(xa,ya,za,norma,la,ma,na,alphaa,
-			   xb,yb,zb,normb,lb,mb,nb,alphab,
-			   xc,yc,zc,normc,lc,mc,nc,alphac,
-			   xd,yd,zd,normd,ld,md,nd,alphad));
+  val = hrr(xa,ya,za,norma,la,ma,na,alphaa,
+	    xb,yb,zb,normb,lb,mb,nb,alphab,
+	    xc,yc,zc,normc,lc,mc,nc,alphac,
+	    xd,yd,zd,normd,ld,md,nd,alphad,&nomem);
+  if (nomem) return PyErr_NoMemory();
+  return Py_BuildValue("d",val);
 }
 
 static PyObject *vrr_wrap(PyObject *self,PyObject *args){
   int ok=0;
   double norma,alphaa,normb,alphab,normc,alphac,normd,alphad,
     xa,ya,za,xb,yb,zb,xc,yc,zc,xd,yd,zd;
-  int la,ma,na,lc,mc,nc,m;
+  int la,ma,na,lc,mc,nc,m,nomem=0;
+  double val;
   PyObject *A,*B,*C,*D,*powa,*powc;
 
   ok=PyArg_ParseTuple(args,"OdOdOddOdOdOddi",
@@ -882,11 +1099,352 @@ static PyObject *vrr_wrap(PyObject *self,PyObject *args){
   ok=PyArg_ParseTuple(powc,"iii",&lc,&mc,&nc);
   if (!ok) return NULL;
   
-  return Py_BuildValue("d", 
-		       vrr(xa,ya,za,norma,la,ma,na,alphaa,
-			   xb,yb,zb,normb,alphab,
-			   xc,yc,zc,normc,lc,mc,nc,alphac,
-			   xd,yd,zd,normd,alphad,m));
+  val = vrr(xa,ya,za,norma,la,ma,na,alphaa,
+	    xb,yb,zb,normb,alphab,
+	    xc,yc,zc,normc,lc,mc,nc,alphac,
+	    xd,yd,zd,normd,alphad,m,&nomem);
+  if (nomem) return PyErr_NoMemory();
+  return Py_BuildValue("d",val);
+}
+
+static int parse_shell(PyObject *obj, Shell *sh){
+  /* Unpack a (origin,exps,coefs,powers,norms) tuple into a Shell */
+  PyObject *xyz_obj,*exps_obj,*coefs_obj,*powers_obj,*norms_obj,*item;
+  int i,l,m,n,ok;
+
+  ok = PyArg_ParseTuple(obj,"OOOOO",&xyz_obj,&exps_obj,&coefs_obj,
+			&powers_obj,&norms_obj);
+  if (!ok) return 0;
+  ok = PyArg_ParseTuple(xyz_obj,"ddd",&sh->xyz[0],&sh->xyz[1],&sh->xyz[2]);
+  if (!ok) return 0;
+
+  sh->nprim = PySequence_Size(exps_obj);
+  if (sh->nprim < 0) return 0;
+  if (sh->nprim != PySequence_Size(coefs_obj) 
+      || sh->nprim > MAX_SHELL_PRIMS) {
+    PyErr_SetString(PyExc_ValueError,"Bad primitive data in shell");
+    return 0;
+  }
+  for (i=0; i<sh->nprim; i++){
+    item = PySequence_GetItem(exps_obj,i);
+    if (!item) return 0;
+    sh->exps[i] = PyFloat_AsDouble(item);
+    Py_DECREF(item);
+    item = PySequence_GetItem(coefs_obj,i);
+    if (!item) return 0;
+    sh->coefs[i] = PyFloat_AsDouble(item);
+    Py_DECREF(item);
+  }
+
+  sh->ncomp = PySequence_Size(powers_obj);
+  if (sh->ncomp < 0) return 0;
+  if (sh->ncomp != PySequence_Size(norms_obj) || sh->ncomp < 1
+      || sh->ncomp > MAX_SHELL_COMPS) {
+    PyErr_SetString(PyExc_ValueError,"Bad component data in shell");
+    return 0;
+  }
+  for (i=0; i<sh->ncomp; i++){
+    item = PySequence_GetItem(powers_obj,i);
+    if (!item) return 0;
+    ok = PyArg_ParseTuple(item,"iii",&l,&m,&n);
+    Py_DECREF(item);
+    if (!ok) return 0;
+    if (i == 0) sh->L = l+m+n;
+    if (l+m+n != sh->L || sh->L > MAX_SHELL_L || l<0 || m<0 || n<0) {
+      PyErr_SetString(PyExc_ValueError,"Bad powers in shell");
+      return 0;
+    }
+    sh->comps[i] = cart_index[l][m][n];
+    item = PySequence_GetItem(norms_obj,i);
+    if (!item) return 0;
+    sh->norms[i] = PyFloat_AsDouble(item);
+    Py_DECREF(item);
+  }
+  if (PyErr_Occurred()) return 0;
+  return 1;
+}
+
+static int parse_shell_pair(PyObject *obj, ShellPair *pair){
+  /* Point pair at the data in an array('d') made by PairData */
+  const void *buf;
+  Py_ssize_t buflen;
+
+  if (PyObject_AsReadBuffer(obj,&buf,&buflen)) return 0;
+  if (buflen % (5*sizeof(double))) {
+    PyErr_SetString(PyExc_ValueError,"Bad primitive pair data");
+    return 0;
+  }
+  pair->n = buflen/(5*sizeof(double));
+  pair->zeta = (double *)buf;
+  pair->P = pair->zeta+pair->n;
+  pair->w = pair->zeta+4*pair->n;
+  return 1;
+}
+
+static PyObject *shell_coulomb_wrap(PyObject *self,PyObject *args){
+  /* shell_coulomb(a,b,c,d,ab=None,cd=None,tol=None), where ab and cd
+     are the optional primitive pair data of the bra and ket from
+     PairData, and tol the primitive screening tolerance, by default
+     that of set_prim_tol */
+  PyObject *a_obj,*b_obj,*c_obj,*d_obj,*ab_obj=Py_None,*cd_obj=Py_None;
+  PyObject *tol_obj=Py_None,*result;
+  Shell sa,sb,sc,sd;
+  ShellPair ab,cd;
+  PrimCounts counts;
+  double abbuf[5*MAX_SHELL_PRIMS*MAX_SHELL_PRIMS];
+  double cdbuf[5*MAX_SHELL_PRIMS*MAX_SHELL_PRIMS];
+  double *vals;
+  int i,n,ok;
+
+  ok = PyArg_ParseTuple(args,"OOOO|OOO",&a_obj,&b_obj,&c_obj,&d_obj,
+			&ab_obj,&cd_obj,&tol_obj);
+  if (!ok) return NULL;
+  prim_counts_init(&counts,prim_tol);
+  if (tol_obj != Py_None) {
+    counts.tol = PyFloat_AsDouble(tol_obj);
+    if (PyErr_Occurred()) return NULL;
+  }
+  if (!parse_shell(a_obj,&sa)) return NULL;
+  if (!parse_shell(b_obj,&sb)) return NULL;
+  if (!parse_shell(c_obj,&sc)) return NULL;
+  if (!parse_shell(d_obj,&sd)) return NULL;
+  if (ab_obj == Py_None)
+    make_shell_pair(&sa,&sb,abbuf,&ab);
+  else if (!parse_shell_pair(ab_obj,&ab))
+    return NULL;
+  if (cd_obj == Py_None)
+    make_shell_pair(&sc,&sd,cdbuf,&cd);
+  else if (!parse_shell_pair(cd_obj,&cd))
+    return NULL;
+
+  n = sa.ncomp*sb.ncomp*sc.ncomp*sd.ncomp;
+  vals = (double *)malloc(n*sizeof(double));
+  if (!vals) return PyErr_NoMemory();
+  Py_BEGIN_ALLOW_THREADS
+  shell_coulomb(&sa,&sb,&sc,&sd,&ab,&cd,vals,&counts);
+  Py_END_ALLOW_THREADS
+  if (!prim_add_counts(&counts)) {
+    free(vals);
+    return NULL;
+  }
+
+  result = PyList_New(n);
+  if (result)
+    for (i=0; i<n; i++) PyList_SET_ITEM(result,i,PyFloat_FromDouble(vals[i]));
+  free(vals);
+  return result;
+}
+
+static long quartet_index(long i, long j, long k, long l){
+  /* The ijkl2intindex index of (ij|kl) */
+  long t,ij,kl;
+  if (i < j) { t = i; i = j; j = t; }
+  if (k < l) { t = k; k = l; l = t; }
+  ij = i*(i+1)/2+j;
+  kl = k*(k+1)/2+l;
+  if (ij < kl) { t = ij; ij = kl; kl = t; }
+  return ij*(ij+1)/2+kl;
+}
+
+static PyObject *shell_coulomb_batch_wrap(PyObject *self,PyObject *args){
+  /* shell_coulomb_batch(shells,quartets,pairs,out,tol=None,starts=None)
+
+     Compute a batch of shell quartets in one call, which holds the GIL
+     only while it reads its arguments. shells is a sequence of the
+     shell data tuples (Shell.data) of a basis set, and quartets a
+     buffer of 4*n C ints, the shell indices (i,j,k,l) of each quartet.
+     pairs is None, or the primitive pair data (from PairData) of each
+     shell pair i>=j, at i*(i+1)/2+j. tol is the primitive screening
+     tolerance, by default that of set_prim_tol.
+
+     If starts, the index of the first function of each shell, is None,
+     the integrals of the quartets are written one quartet after
+     another into out, a writable buffer of doubles, each in the order
+     of shell_coulomb. Otherwise out is the packed integral array, and
+     each integral is written at its ijkl2intindex index. */
+  PyObject *shells_obj,*quartets_obj,*pairs_obj,*out_obj;
+  PyObject *tol_obj=Py_None,*starts_obj=Py_None,*seq;
+  Shell *shells=NULL;
+  ShellPair *pairs=NULL,ab,cd,*pab,*pcd;
+  PrimCounts counts;
+  const void *qbuf;
+  const int *quartets;
+  double *out,*abbuf=NULL,*cdbuf,*vals=NULL;
+  long *starts=NULL,need,offset;
+  Py_ssize_t qlen,outlen;
+  int nsh,nq,n,m,q,i,j,k,l,ia,ib,ic,id,size,maxsize=0,ok=0;
+
+  if (!PyArg_ParseTuple(args,"OOOO|OO",&shells_obj,&quartets_obj,&pairs_obj,
+			&out_obj,&tol_obj,&starts_obj))
+    return NULL;
+  prim_counts_init(&counts,prim_tol);
+  if (tol_obj != Py_None) {
+    counts.tol = PyFloat_AsDouble(tol_obj);
+    if (PyErr_Occurred()) return NULL;
+  }
+  if (PyObject_AsReadBuffer(quartets_obj,&qbuf,&qlen)) return NULL;
+  if (qlen % (4*sizeof(int))) {
+    PyErr_SetString(PyExc_ValueError,"Bad shell quartets");
+    return NULL;
+  }
+  quartets = (const int *)qbuf;
+  nq = qlen/(4*sizeof(int));
+  if (PyObject_AsWriteBuffer(out_obj,(void **)&out,&outlen)) return NULL;
+
+  seq = PySequence_Fast(shells_obj,"expected a sequence of shells");
+  if (!seq) return NULL;
+  nsh = PySequence_Fast_GET_SIZE(seq);
+  shells = (Shell *)malloc((nsh+1)*sizeof(Shell));
+  if (!shells) {
+    Py_DECREF(seq);
+    return PyErr_NoMemory();
+  }
+  for (i=0; i<nsh; i++)
+    if (!parse_shell(PySequence_Fast_GET_ITEM(seq,i),&shells[i])) break;
+  Py_DECREF(seq);
+  if (i < nsh) goto done;
+
+  if (starts_obj != Py_None) {
+    seq = PySequence_Fast(starts_obj,"expected a sequence of ints");
+    if (!seq) goto done;
+    starts = (long *)malloc((nsh+1)*sizeof(long));
+    if (!starts) {
+      Py_DECREF(seq);
+      PyErr_NoMemory();
+      goto done;
+    }
+    if (PySequence_Fast_GET_SIZE(seq) != nsh) {
+      Py_DECREF(seq);
+      PyErr_SetString(PyExc_ValueError,"Need the start of every shell");
+      goto done;
+    }
+    for (i=0; i<nsh; i++)
+      starts[i] = PyInt_AsLong(PySequence_Fast_GET_ITEM(seq,i));
+    Py_DECREF(seq);
+    if (PyErr_Occurred()) goto done;
+  }
+
+  if (pairs_obj != Py_None) {
+    seq = PySequence_Fast(pairs_obj,"expected a sequence of pair data");
+    if (!seq) goto done;
+    pairs = (ShellPair *)malloc((nsh*(nsh+1)/2+1)*sizeof(ShellPair));
+    if (!pairs) {
+      Py_DECREF(seq);
+      PyErr_NoMemory();
+      goto done;
+    }
+    if (PySequence_Fast_GET_SIZE(seq) != nsh*(nsh+1)/2) {
+      Py_DECREF(seq);
+      PyErr_SetString(PyExc_ValueError,"Need the data of every shell pair");
+      goto done;
+    }
+    for (n=0; n<nsh*(nsh+1)/2; n++)
+      if (!parse_shell_pair(PySequence_Fast_GET_ITEM(seq,n),&pairs[n])) break;
+    Py_DECREF(seq);
+    if (n < nsh*(nsh+1)/2) goto done;
+  } else {
+    abbuf = (double *)malloc(10*MAX_SHELL_PRIMS*MAX_SHELL_PRIMS
+			     *sizeof(double));
+    if (!abbuf) {
+      PyErr_NoMemory();
+      goto done;
+    }
+  }
+  cdbuf = abbuf+5*MAX_SHELL_PRIMS*MAX_SHELL_PRIMS;
+
+  /* Check the quartets, and that out has room for them: need is the
+     number of integrals, or with starts, of functions, they span */
+  need = 0;
+  for (n=0; n<nq; n++){
+    size = 1;
+    for (m=0; m<4; m++){
+      q = quartets[4*n+m];
+      if (q < 0 || q >= nsh || (starts && starts[q] < 0)) {
+	PyErr_SetString(PyExc_ValueError,"Bad shell index");
+	goto done;
+      }
+      size *= shells[q].ncomp;
+      if (starts && starts[q]+shells[q].ncomp > need)
+	need = starts[q]+shells[q].ncomp;
+    }
+    if (size > maxsize) maxsize = size;
+    if (!starts) need += size;
+  }
+  if (starts && need > 0) need = quartet_index(need-1,need-1,need-1,need-1)+1;
+  if ((Py_ssize_t)(need*sizeof(double)) > outlen) {
+    PyErr_SetString(PyExc_ValueError,"Buffer too small for the integrals");
+    goto done;
+  }
+  if (starts) {
+    vals = (double *)malloc((maxsize+1)*sizeof(double));
+    if (!vals) {
+      PyErr_NoMemory();
+      goto done;
+    }
+  }
+
+  Py_BEGIN_ALLOW_THREADS
+  offset = 0;
+  for (n=0; n<nq && !counts.nomem; n++){
+    i = quartets[4*n]; j = quartets[4*n+1];
+    k = quartets[4*n+2]; l = quartets[4*n+3];
+    if (pairs) {
+      pab = pairs + (i >= j ? i*(i+1)/2+j : j*(j+1)/2+i);
+      pcd = pairs + (k >= l ? k*(k+1)/2+l : l*(l+1)/2+k);
+    } else {
+      make_shell_pair(&shells[i],&shells[j],abbuf,&ab);
+      make_shell_pair(&shells[k],&shells[l],cdbuf,&cd);
+      pab = &ab;
+      pcd = &cd;
+    }
+    if (!starts) {
+      shell_coulomb(&shells[i],&shells[j],&shells[k],&shells[l],pab,pcd,
+		    out+offset,&counts);
+      offset += shells[i].ncomp*shells[j].ncomp*shells[k].ncomp
+	*shells[l].ncomp;
+      continue;
+    }
+    shell_coulomb(&shells[i],&shells[j],&shells[k],&shells[l],pab,pcd,
+		  vals,&counts);
+    m = 0;
+    for (ia=0; ia<shells[i].ncomp; ia++)
+      for (ib=0; ib<shells[j].ncomp; ib++)
+	for (ic=0; ic<shells[k].ncomp; ic++)
+	  for (id=0; id<shells[l].ncomp; id++)
+	    out[quartet_index(starts[i]+ia,starts[j]+ib,
+			      starts[k]+ic,starts[l]+id)] = vals[m++];
+  }
+  Py_END_ALLOW_THREADS
+  ok = prim_add_counts(&counts);
+
+ done:
+  free(shells);
+  free(starts);
+  free(pairs);
+  free(abbuf);
+  free(vals);
+  if (!ok) return NULL;
+  Py_INCREF(Py_None);
+  return Py_None;
+}
+
+static double packed_coulomb(PackedBasis *b, int i, int j, int k, int l,
+			     PrimCounts *counts){
+  return b->norms[i]*b->norms[j]*b->norms[k]*b->norms[l]*
+    contr_hrr(PB_NPRIM(b,i),PB_X(b,i),PB_Y(b,i),PB_Z(b,i),PB_PNORMS(b,i),
+	      PB_L(b,i),PB_M(b,i),PB_N(b,i),PB_EXPS(b,i),PB_COEFS(b,i),
+	      PB_NPRIM(b,j),PB_X(b,j),PB_Y(b,j),PB_Z(b,j),PB_PNORMS(b,j),
+	      PB_L(b,j),PB_M(b,j),PB_N(b,j),PB_EXPS(b,j),PB_COEFS(b,j),
+	      PB_NPRIM(b,k),PB_X(b,k),PB_Y(b,k),PB_Z(b,k),PB_PNORMS(b,k),
+	      PB_L(b,k),PB_M(b,k),PB_N(b,k),PB_EXPS(b,k),PB_COEFS(b,k),
+	      PB_NPRIM(b,l),PB_X(b,l),PB_Y(b,l),PB_Z(b,l),PB_PNORMS(b,l),
+	      PB_L(b,l),PB_M(b,l),PB_N(b,l),PB_EXPS(b,l),PB_COEFS(b,l),
+	      counts);
+}
+
+static PyObject *coulomb_block_wrap(PyObject *self,PyObject *args){
+  /* coulomb_block(basis,start,stop,buffer,tol=None): see packed_basis.h */
+  return coulomb_block(args,packed_coulomb);
 }
 
 /* Python interface */
@@ -895,11 +1453,18 @@ static PyMethodDef chgp_methods[] = {
   {"coulomb_repulsion",hrr_wrap,METH_VARARGS},
   {"hrr",hrr_wrap,METH_VARARGS},
   {"vrr",vrr_wrap,METH_VARARGS},
+  {"shell_coulomb",shell_coulomb_wrap,METH_VARARGS},
+  {"shell_coulomb_batch",shell_coulomb_batch_wrap,METH_VARARGS},
+  {"coulomb_block",coulomb_block_wrap,METH_VARARGS},
+  {"set_prim_tol",set_prim_tol_wrap,METH_VARARGS},
+  {"prim_screening_stats",prim_screening_stats_wrap,METH_VARARGS},
   {NULL,NULL} /* Sentinel */
 };
 
 static void module_init(char* name)
 {
+  init_cart_tables();
+  boys_init();
   (void) Py_InitModule(name,chgp_methods);
 }
 
@@ -911,9 +1476,3 @@ void initpyquante_chgp_ext(){module_init("pyquante_chgp_ext");}
 #else
 void initchgp(){module_init("chgp");}
 #endif
-
-#undef ITMAX
-#undef EPS
-#undef FPMIN
-#undef SMALL
-
@@ -8,9 +8,26 @@
  distribution. 
  **************************************************************************/
 
-#ifdef _MSC_VER
-double lgamma(double);
-#endif
+/* Limits for the shell-quartet routines: shells up to g functions */
+#define MAX_SHELL_L 4
+#define MAXLSUM (2*MAX_SHELL_L)
+#define NCARTMAX ((MAXLSUM+1)*(MAXLSUM+2)*(MAXLSUM+3)/6)
+#define MAX_SHELL_COMPS ((MAX_SHELL_L+1)*(MAX_SHELL_L+2)/2)
+#define MAX_SHELL_PRIMS 30
+
+typedef struct {
+  double xyz[3];
+  int L, nprim, ncomp;
+  double exps[MAX_SHELL_PRIMS], coefs[MAX_SHELL_PRIMS];
+  int comps[MAX_SHELL_COMPS];
+  double norms[MAX_SHELL_COMPS];
+} Shell;
+
+/* The primitive pair data of a shell pair, laid out as in PairData.py */
+typedef struct {
+  int n;
+  double *zeta, *P, *w; /* n zetas, n (Px,Py,Pz), n prefactors */
+} ShellPair;
 
 static double contr_hrr(int lena, double xa, double ya, double za, double *anorms,
 		 int la, int ma, int na, double *aexps, double *acoefs,
@@ -19,7 +36,8 @@ static double contr_hrr(int lena, double xa, double ya, double za, double *anorm
 		 int lenc, double xc, double yc, double zc, double *cnorms,
 		 int lc, int mc, int nc, double *cexps, double *ccoefs,
 		 int lend, double xd, double yd, double zd, double *dnorms,
-		 int ld, int md, int nd, double *dexps, double *dcoefs);
+		 int ld, int md, int nd, double *dexps, double *dcoefs,
+		 PrimCounts *counts);
 
 static double contr_vrr(int lena, double xa, double ya, double za,
 			double *anorms, int la, int ma, int na,
@@ -30,7 +48,8 @@ static double contr_vrr(int lena, double xa, double ya, double za,
 			double *cnorms, int lc, int mc, int nc,
 			double *cexps, double *ccoefs,
 			int lend, double xd, double yd, double zd,
-			double *dnorms, double *dexps, double *dcoef);
+			double *dnorms, double *dexps, double *dcoef,
+			PrimCounts *counts);
 
 static double hrr(double xa, double ya, double za, double norma,
 	   int la, int ma, int na, double alphaa,
@@ -39,7 +58,7 @@ static double hrr(double xa, double ya, double za, double norma,
 	   double xc, double yc, double zc, double normc,
 	   int lc, int mc, int nc, double alphac,
 	   double xd, double yd, double zd, double normd,
-	   int ld, int md, int nd, double alphad);
+	   int ld, int md, int nd, double alphad, int *nomem);
 
 static double vrr_recursive(double xa, double ya, double za, double norma,
 	   int la, int ma, int na, double alphaa,
@@ -47,7 +66,7 @@ static double vrr_recursive(double xa, double ya, double za, double norma,
 	   double xc, double yc, double zc, double normc,
 	   int lc, int mc, int nc, double alphac,
 	   double xd, double yd, double zd, double normd, double alphad,
-	   int m);
+	   int m, int *nomem);
 
 static double vrr(double xa, double ya, double za, double norma,
 	   int la, int ma, int na, double alphaa,
@@ -55,22 +74,43 @@ static double vrr(double xa, double ya, double za, double norma,
 	   double xc, double yc, double zc, double normc,
 	   int lc, int mc, int nc, double alphac,
 	   double xd, double yd, double zd, double normd, double alphad,
-	   int m);
+	   int m, int *nomem);
 
-static int iindex(int la, int ma, int na, int lc, int mc, int nc, int m);
+static int iindex(int *dims, int la, int ma, int na, int lc, int mc, int nc,
+		  int m);
 
 static double dist2(double x1, double y1, double z1, 
 		    double x2, double y2, double z2);
 static double product_center_1D(double alphaa, double xa, 
 				double alphab, double xb);
-static double Fgamma(double m, double x);
-static double gamm_inc(double a, double x);
-static void gser(double *gamser, double a, double x, double *gln);
-static void gcf(double *gammcf, double a, double x, double *gln);
+
+static void init_cart_tables(void);
+static int ncart_upto(int L);
+static int ncart(int L);
+static int cart_dir(int e);
+static int cart_shift(int e, int i, int inc);
+static void shell_vrr(double *V, int Lab, int Lcd,
+		      double *A, double *C, double *P, double *Q, double *W,
+		      double zeta, double eta, double pref, double T);
+static int shell_hrr(double *X, int La, int Lb, double *AB, int ncol,
+		      double *out);
+static void make_shell_pair(Shell *sa, Shell *sb, double *buf,
+			    ShellPair *pair);
+static void shell_coulomb(Shell *sa, Shell *sb, Shell *sc, Shell *sd,
+			  ShellPair *ab, ShellPair *cd, double *result,
+			  PrimCounts *counts);
+static int parse_shell(PyObject *obj, Shell *sh);
+static int parse_shell_pair(PyObject *obj, ShellPair *pair);
 
 static PyObject *contr_coulomb_wrap(PyObject *self,PyObject *args);
+static PyObject *coulomb_block_wrap(PyObject *self,PyObject *args);
+static double packed_coulomb(PackedBasis *b, int i, int j, int k, int l,
+			     PrimCounts *counts);
 static PyObject *hrr_wrap(PyObject *self,PyObject *args);
 static PyObject *vrr_wrap(PyObject *self,PyObject *args);
+static PyObject *shell_coulomb_wrap(PyObject *self,PyObject *args);
+static PyObject *shell_coulomb_batch_wrap(PyObject *self,PyObject *args);
+static long quartet_index(long i, long j, long k, long l);
 
 
 
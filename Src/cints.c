@@ -17,57 +17,19 @@
 
 
 #include "Python.h"
+#include "packed_basis.h"
+#include "boys.h"
+#include "prim_screen.h"
 #include "cints.h"
 #include <assert.h>
 #include <math.h>
 #include <stdio.h>
 #include <stdlib.h>
 
-// Not required for MSVC since the code is included below
-#if defined(_WIN32) && !defined(_MSC_VER)
-double lgamma(double x);
-#endif
-
 #ifndef M_PI
 #define M_PI 3.14159265358979323846
 #endif
 
-#define ITMAX 100
-#define EPS 3.0e-7
-#define FPMIN 1.0e-30
-#define SMALL 0.00000001
-
-// lgamma not included in ANSI standard and so not available in MSVC
-#if defined(_MSC_VER)
-double lgamma(double z) {
-    double c[7];
-    double x,y ,tmp, ser, v;
-    int i;
-
-    if (z<=0) return 0;
-
-    c[0]=2.5066282746310005;
-    c[1]=76.18009172947146;
-    c[2]=-86.50532032941677;
-    c[3]=24.01409824083091;
-    c[4]=-1.231739572450155;
-    c[5]=0.1208650973866179e-2;
-    c[6]=-0.5395239384953e-5;
-   
-    x   = z;
-    y   = x;
-    tmp = x+5.5;
-    tmp = (x+0.5)*log(tmp)-tmp;
-    ser = 1.000000000190015;
-    for (i=1; i<7; i++) {
-        y   += 1.0;
-        ser += c[i]/y;
-        }
-    v = tmp+log(c[0]*ser/x);
-    return v;
-    }
-#endif
-
 static double fB(int i, int l1, int l2, double px, double ax, double bx, 
 		 int r, double g){
   return binomial_prefactor(i,l1,l2,px-ax,px-bx)*Bfunc(i,r,g);
@@ -88,15 +50,29 @@ static double contr_coulomb(int lena, double *aexps, double *acoefs,
 			    int lc, int mc, int nc, 
 			    int lend, double *dexps, double *dcoefs,
 			    double *dnorms, double xd, double yd, double zd,
-			    int ld, int md, int nd){
+			    int ld, int md, int nd, PrimCounts *counts){
 
   int i,j,k,l;
   double Jij = 0.,incr=0.;
+  double wab_stack[PRIM_PAIR_STACK],wcd_stack[PRIM_PAIR_STACK],*wab,*wcd;
+
+  wab = prim_pair_weights(lena,aexps,acoefs,anorms,xa,ya,za,
+			  lenb,bexps,bcoefs,bnorms,xb,yb,zb,wab_stack,counts);
+  wcd = prim_pair_weights(lenc,cexps,ccoefs,cnorms,xc,yc,zc,
+			  lend,dexps,dcoefs,dnorms,xd,yd,zd,wcd_stack,counts);
+  if (!wab || !wcd) {
+    prim_free_weights(wab,wab_stack);
+    prim_free_weights(wcd,wcd_stack);
+    return 0.;
+  }
 
   for (i=0; i<lena; i++)
     for (j=0; j<lenb; j++)
       for (k=0; k<lenc; k++)
 	for (l=0; l<lend; l++){
+	  if (prim_skip(wab[i*lenb+j]*wcd[k*lend+l]
+			/sqrt(aexps[i]+bexps[j]+cexps[k]+dexps[l]),counts))
+	    continue;
 	  incr = coulomb_repulsion(xa,ya,za,anorms[i],la,ma,na,aexps[i],
 			      xb,yb,zb,bnorms[j],lb,mb,nb,bexps[j],
 			      xc,yc,zc,cnorms[k],lc,mc,nc,cexps[k],
@@ -104,6 +80,8 @@ static double contr_coulomb(int lena, double *aexps, double *acoefs,
 	  
 	  Jij += acoefs[i]*bcoefs[j]*ccoefs[k]*dcoefs[l]*incr;
 	}
+  prim_free_weights(wab,wab_stack);
+  prim_free_weights(wcd,wcd_stack);
   return Jij;
 }
 
@@ -117,8 +95,8 @@ static double coulomb_repulsion(double xa, double ya, double za, double norma,
 				int ld, int md, int nd, double alphad){
 
   double rab2, rcd2,rpq2,xp,yp,zp,xq,yq,zq,gamma1,gamma2,delta,sum;
-  double *Bx, *By, *Bz;
-  int I,J,K;
+  double *Bx, *By, *Bz, *Fg, Fbuf[BOYS_MMAX+1];
+  int I,J,K,Ltot;
 
   rab2 = dist2(xa,ya,za,xb,yb,zb);
   rcd2 = dist2(xc,yc,zc,xd,yd,zd);
@@ -137,15 +115,20 @@ static double coulomb_repulsion(double xa, double ya, double za, double norma,
   By = B_array(ma,mb,mc,md,yp,ya,yb,yq,yc,yd,gamma1,gamma2,delta);
   Bz = B_array(na,nb,nc,nd,zp,za,zb,zq,zc,zd,gamma1,gamma2,delta);
 
+  Ltot = la+lb+lc+ld+ma+mb+mc+md+na+nb+nc+nd;
+  Fg = Ltot > BOYS_MMAX ? (double *)malloc((Ltot+1)*sizeof(double)) : Fbuf;
+  boys_array(Ltot,0.25*rpq2/delta,Fg);
+
   sum = 0.;
   for (I=0; I<la+lb+lc+ld+1;I++)
     for (J=0; J<ma+mb+mc+md+1;J++)
       for (K=0; K<na+nb+nc+nd+1;K++)
-	sum += Bx[I]*By[J]*Bz[K]*Fgamma(I+J+K,0.25*rpq2/delta);
+	sum += Bx[I]*By[J]*Bz[K]*Fg[I+J+K];
 
   free(Bx);
   free(By);
   free(Bz);  
+  if (Fg != Fbuf) free(Fg);
   
   return 2.*pow(M_PI,2.5)/(gamma1*gamma2*sqrt(gamma1+gamma2))
     *exp(-alphaa*alphab*rab2/gamma1) 
@@ -252,7 +235,7 @@ static double nuclear_attraction(double x1, double y1, double z1, double norm1,
 				 double x3, double y3, double z3){
   int I,J,K;
   double gamma,xp,yp,zp,sum,rab2,rcp2;
-  double *Ax,*Ay,*Az;
+  double *Ax,*Ay,*Az,Fg[BOYS_MMAX+1];
 
   gamma = alpha1+alpha2;
 
@@ -267,11 +250,14 @@ static double nuclear_attraction(double x1, double y1, double z1, double norm1,
   Ay = A_array(m1,m2,yp-y1,yp-y2,yp-y3,gamma);
   Az = A_array(n1,n2,zp-z1,zp-z2,zp-z3,gamma);
 
+  /* One-electron functions never come near BOYS_MMAX/2 */
+  boys_array(l1+l2+m1+m2+n1+n2,rcp2*gamma,Fg);
+
   sum = 0.;
   for (I=0; I<l1+l2+1; I++)
     for (J=0; J<m1+m2+1; J++)
       for (K=0; K<n1+n2+1; K++)
-	sum += Ax[I]*Ay[J]*Az[K]*Fgamma(I+J+K,rcp2*gamma);
+	sum += Ax[I]*Ay[J]*Az[K]*Fg[I+J+K];
 
   free(Ax);
   free(Ay);
@@ -337,79 +323,6 @@ static double binomial_prefactor(int s, int ia, int ib, double xpa, double xpb){
 
 static int binomial(int a, int b){return fact(a)/(fact(b)*fact(a-b));}
 
-static double Fgamma(double m, double x){
-  double val;
-  if (fabs(x) < SMALL) x = SMALL;
-  val = gamm_inc(m+0.5,x);
-  /* if (val < SMALL) return 0.; */ /* Gives a bug for D orbitals. */
-  return 0.5*pow(x,-m-0.5)*val; 
-}
-
-static double gamm_inc(double a, double x){ /* Taken from NR routine gammap */
-  double gamser,gammcf,gln;
-  
-  assert (x >= 0.);
-  assert (a > 0.);
-  if (x < (a+1.0)) {
-    gser(&gamser,a,x,&gln);
-    return exp(gln)*gamser;
-  } else {
-    gcf(&gammcf,a,x,&gln);
-    return exp(gln)*(1.0-gammcf);
-  }
-}
- 
-static void gser(double *gamser, double a, double x, double *gln){
-  int n;
-  double sum,del,ap;
-
-  *gln=lgamma(a);
-  if (x <= 0.0) {
-    assert(x>=0.);
-    *gamser=0.0;
-    return;
-  } else {
-    ap=a;
-    del=sum=1.0/a;
-    for (n=1;n<=ITMAX;n++) {
-      ++ap;
-      del *= x/ap;
-      sum += del;
-      if (fabs(del) < fabs(sum)*EPS) {
-	*gamser=sum*exp(-x+a*log(x)-(*gln));
-	return;
-      }
-    }
-    printf("a too large, ITMAX too small in routine gser");
-    return;
-  }
-}
- 
-static void gcf(double *gammcf, double a, double x, double *gln){
-  int i;
-  double an,b,c,d,del,h;
-  
-  *gln=lgamma(a);
-  b=x+1.0-a;
-  c=1.0/FPMIN;
-  d=1.0/b;
-  h=d;
-  for (i=1;i<=ITMAX;i++) {
-    an = -i*(i-a);
-    b += 2.0;
-    d=an*d+b;
-    if (fabs(d) < FPMIN) d=FPMIN;
-    c=b+an/c;
-    if (fabs(c) < FPMIN) c=FPMIN;
-    d=1.0/d;
-    del=d*c;
-    h *= del;
-    if (fabs(del-1.0) < EPS) break;
-  }
-  assert(i<=ITMAX);
-  *gammcf=exp(-x+a*log(x)-(*gln))*h;
-}
-
 static int ijkl2intindex(int i, int j, int k, int l){
   int tmp,ij,kl;
   if (i<j) return ijkl2intindex(j,i,k,l);
@@ -486,12 +399,80 @@ static double three_center_1D(double xi, int ai, double alphai,
 }
 
 
-/* work is the work space for the various exponents, contraction */
-/*  coefficients, etc., used by the contracted code. Decided to  */
-/*  allocate this all at once rather than doing mallocs/frees. */
-/*  Only speeds things up a little, but every little bit counts, I guess. */
+/* Routines that build whole one-electron matrices from a packed
+   description of the basis set (see Ints.pack_basis), computing the
+   lower triangle only: element (i,j), i>=j, is stored at i*(i+1)/2+j */
+
+static double contr_one_int(int type, PackedBasis *b, int i, int j,
+			    int ncenters, double *cxyz, double *cq){
+  /* One contracted one-electron integral between functions i and j */
+  int p,q,k,li,mi,ni,lj,mj,nj;
+  double xi,yi,zi,xj,yj,zj,val=0,incr;
+
+  xi = b->xyz[3*i]; yi = b->xyz[3*i+1]; zi = b->xyz[3*i+2];
+  xj = b->xyz[3*j]; yj = b->xyz[3*j+1]; zj = b->xyz[3*j+2];
+  li = b->lmn[3*i]; mi = b->lmn[3*i+1]; ni = b->lmn[3*i+2];
+  lj = b->lmn[3*j]; mj = b->lmn[3*j+1]; nj = b->lmn[3*j+2];
+
+  for (p=b->pstart[i]; p<b->pstart[i+1]; p++){
+    for (q=b->pstart[j]; q<b->pstart[j+1]; q++){
+      if (type == ONE_OVERLAP)
+	incr = b->pnorms[p]*b->pnorms[q]*
+	  overlap(b->exps[p],li,mi,ni,xi,yi,zi,
+		  b->exps[q],lj,mj,nj,xj,yj,zj);
+      else if (type == ONE_KINETIC)
+	incr = b->pnorms[p]*b->pnorms[q]*
+	  kinetic(b->exps[p],li,mi,ni,xi,yi,zi,
+		  b->exps[q],lj,mj,nj,xj,yj,zj);
+      else {
+	incr = 0;
+	for (k=0; k<ncenters; k++)
+	  incr += cq[k]*
+	    nuclear_attraction(xi,yi,zi,b->pnorms[p],li,mi,ni,b->exps[p],
+			       xj,yj,zj,b->pnorms[q],lj,mj,nj,b->exps[q],
+			       cxyz[3*k],cxyz[3*k+1],cxyz[3*k+2]);
+      }
+      val += b->coefs[p]*b->coefs[q]*incr;
+    }
+  }
+  return b->norms[i]*b->norms[j]*val;
+}
+
+static PyObject *one_ints_matrix(int type, PyObject *basis_obj,
+				 int ncenters, double *cxyz, double *cq){
+  PackedBasis b;
+  PyObject *result;
+  double *vals;
+  int i,j,ij,n,owned;
+
+  if (!get_packed_basis(basis_obj,&b,&owned)) return NULL;
+  n = b.nbf*(b.nbf+1)/2;
+  vals = (double *)malloc((n+1)*sizeof(double));
+  if (!vals) {
+    release_packed_basis(&b,owned);
+    return PyErr_NoMemory();
+  }
+  /* Compute the matrix without the GIL, then make the list */
+  Py_BEGIN_ALLOW_THREADS
+  ij = 0;
+  for (i=0; i<b.nbf; i++)
+    for (j=0; j<=i; j++)
+      vals[ij++] = contr_one_int(type,&b,i,j,ncenters,cxyz,cq);
+  Py_END_ALLOW_THREADS
+  result = PyList_New(n);
+  if (result)
+    for (ij=0; ij<n; ij++)
+      PyList_SET_ITEM(result,ij,PyFloat_FromDouble(vals[ij]));
+  free(vals);
+  release_packed_basis(&b,owned);
+  return result;
+}
+
+/* work, in contr_coulomb_wrap, is the work space for the various */
+/*  exponents, contraction coefficients, etc., used by the contracted */
+/*  code. It lives on the stack of each call rather than in a global, */
+/*  so that calls from different threads don't share it. */
 #define MAX_PRIMS_PER_CONT (10)
-double work[12*MAX_PRIMS_PER_CONT];
 
 static PyObject *fact_wrap(PyObject *self,PyObject *args){
   int ok = 0, n=0;
@@ -547,7 +528,7 @@ static PyObject *Fgamma_wrap(PyObject *self,PyObject *args){
   double m=0.,x=0.;
   ok = PyArg_ParseTuple(args,"dd",&m,&x);
   if (!ok) return NULL;
-  return Py_BuildValue("d",Fgamma(m,x));
+  return Py_BuildValue("d",boys_function((int)m,x));
 }
 static PyObject *ijkl2intindex_wrap(PyObject *self,PyObject *args){
   int ok = 0,i,j,k,l;
@@ -586,13 +567,18 @@ static PyObject *contr_coulomb_wrap(PyObject *self,PyObject *args){
     *dexps,*dcoefs,*dnorms;
   int i;
   double Jij=0; /* return value */
+  double work[12*MAX_PRIMS_PER_CONT];
+  PrimCounts counts;
+  double tol=prim_tol;
 
-  ok = PyArg_ParseTuple(args,"OOOOOOOOOOOOOOOOOOOO",
+  ok = PyArg_ParseTuple(args,"OOOOOOOOOOOOOOOOOOOO|d",
 			&aexps_obj,&acoefs_obj,&anorms_obj,&xyza_obj,&lmna_obj,
 			&bexps_obj,&bcoefs_obj,&bnorms_obj,&xyzb_obj,&lmnb_obj,
 			&cexps_obj,&ccoefs_obj,&cnorms_obj,&xyzc_obj,&lmnc_obj,
-			&dexps_obj,&dcoefs_obj,&dnorms_obj,&xyzd_obj,&lmnd_obj);
+			&dexps_obj,&dcoefs_obj,&dnorms_obj,&xyzd_obj,&lmnd_obj,
+			&tol);
   if (!ok) return NULL;
+  prim_counts_init(&counts,tol);
 
 
   ok=PyArg_ParseTuple(xyza_obj,"ddd",&xa,&ya,&za);
@@ -681,11 +667,13 @@ static PyObject *contr_coulomb_wrap(PyObject *self,PyObject *args){
     dcoefs[i] = PyFloat_AS_DOUBLE(PySequence_GetItem(dcoefs_obj,i));
     dnorms[i] = PyFloat_AS_DOUBLE(PySequence_GetItem(dnorms_obj,i));
   }
+  Py_BEGIN_ALLOW_THREADS
   Jij = contr_coulomb(lena,aexps,acoefs,anorms,xa,ya,za,la,ma,na,
 		      lenb,bexps,bcoefs,bnorms,xb,yb,zb,lb,mb,nb,
 		      lenc,cexps,ccoefs,cnorms,xc,yc,zc,lc,mc,nc,
-		      lend,dexps,dcoefs,dnorms,xd,yd,zd,ld,md,nd);
-
+		      lend,dexps,dcoefs,dnorms,xd,yd,zd,ld,md,nd,&counts);
+  Py_END_ALLOW_THREADS
+  if (!prim_add_counts(&counts)) return NULL;
   return Py_BuildValue("d", Jij);
 }
 
@@ -945,6 +933,408 @@ static PyObject *nuclear_attraction_vec_wrap(PyObject *self,PyObject *args){
 
 
 
+static PyObject *overlap_matrix_wrap(PyObject *self,PyObject *args){
+  PyObject *basis;
+  if (!PyArg_ParseTuple(args,"O",&basis)) return NULL;
+  return one_ints_matrix(ONE_OVERLAP,basis,0,NULL,NULL);
+}
+
+static PyObject *kinetic_matrix_wrap(PyObject *self,PyObject *args){
+  PyObject *basis;
+  if (!PyArg_ParseTuple(args,"O",&basis)) return NULL;
+  return one_ints_matrix(ONE_KINETIC,basis,0,NULL,NULL);
+}
+
+static PyObject *nuclear_matrix_wrap(PyObject *self,PyObject *args){
+  /* nuclear_matrix(basis,cxyz,cq): cxyz is a flat sequence of the
+     x,y,z of each center, and cq the charge of each center */
+  PyObject *basis,*cxyz_obj,*cq_obj,*result;
+  double *cxyz,*cq;
+  int n3,nc;
+
+  if (!PyArg_ParseTuple(args,"OOO",&basis,&cxyz_obj,&cq_obj)) return NULL;
+  cxyz = seq_to_doubles(cxyz_obj,&n3);
+  if (!cxyz) return NULL;
+  cq = seq_to_doubles(cq_obj,&nc);
+  if (!cq) {
+    free(cxyz);
+    return NULL;
+  }
+  if (n3 != 3*nc) {
+    PyErr_SetString(PyExc_ValueError,"Inconsistent nuclear centers");
+    result = NULL;
+  } else
+    result = one_ints_matrix(ONE_NUCLEAR,basis,nc,cxyz,cq);
+  free(cxyz);
+  free(cq);
+  return result;
+}
+
+static double packed_coulomb(PackedBasis *b, int i, int j, int k, int l,
+			     PrimCounts *counts){
+  return b->norms[i]*b->norms[j]*b->norms[k]*b->norms[l]*
+    contr_coulomb(PB_NPRIM(b,i),PB_EXPS(b,i),PB_COEFS(b,i),PB_PNORMS(b,i),
+		  PB_X(b,i),PB_Y(b,i),PB_Z(b,i),PB_L(b,i),PB_M(b,i),PB_N(b,i),
+		  PB_NPRIM(b,j),PB_EXPS(b,j),PB_COEFS(b,j),PB_PNORMS(b,j),
+		  PB_X(b,j),PB_Y(b,j),PB_Z(b,j),PB_L(b,j),PB_M(b,j),PB_N(b,j),
+		  PB_NPRIM(b,k),PB_EXPS(b,k),PB_COEFS(b,k),PB_PNORMS(b,k),
+		  PB_X(b,k),PB_Y(b,k),PB_Z(b,k),PB_L(b,k),PB_M(b,k),PB_N(b,k),
+		  PB_NPRIM(b,l),PB_EXPS(b,l),PB_COEFS(b,l),PB_PNORMS(b,l),
+		  PB_X(b,l),PB_Y(b,l),PB_Z(b,l),PB_L(b,l),PB_M(b,l),PB_N(b,l),
+		  counts);
+}
+
+static void packed_basis_capsule_free(PyObject *capsule){
+  PackedBasis *b;
+  b = (PackedBasis *)PyCapsule_GetPointer(capsule,PACKED_BASIS_NAME);
+  if (!b) return;
+  free_packed_basis(b);
+  free(b);
+}
+
+static PyObject *packed_basis_wrap(PyObject *self,PyObject *args){
+  /* packed_basis((xyz,lmn,norms,pstart,exps,coefs,pnorms)) -> a capsule
+     holding the parsed basis, which the C functions use without
+     parsing it again */
+  PyObject *basis_obj,*capsule;
+  PackedBasis *b;
+
+  if (!PyArg_ParseTuple(args,"O",&basis_obj)) return NULL;
+  b = (PackedBasis *)malloc(sizeof(PackedBasis));
+  if (!b) return PyErr_NoMemory();
+  if (!parse_packed_basis(basis_obj,b)) {
+    free(b);
+    return NULL;
+  }
+  capsule = PyCapsule_New(b,PACKED_BASIS_NAME,packed_basis_capsule_free);
+  if (!capsule) {
+    free_packed_basis(b);
+    free(b);
+  }
+  return capsule;
+}
+
+static PyObject *coulomb_block_wrap(PyObject *self,PyObject *args){
+  /* coulomb_block(basis,start,stop,buffer,tol=None): see packed_basis.h */
+  return coulomb_block(args,packed_coulomb);
+}
+
+/* First derivatives of the integrals over the packed basis, for the
+   analytic gradients of force.py. The derivative of a primitive with
+   respect to its center is
+
+     d/dAx x_A^l exp(-alpha x_A^2) = 2 alpha x_A^(l+1) exp(-alpha x_A^2)
+                                     - l x_A^(l-1) exp(-alpha x_A^2)
+
+   so every derivative integral is a pair of ordinary integrals with
+   one power shifted. These mirror the Python code in
+   AnalyticDerivatives.py, which is kept as the reference. */
+
+static double one_int_lmn(int type, double alpha1, int *p1, double *A,
+			  double alpha2, int *p2, double *B, double *C){
+  if (type == ONE_OVERLAP)
+    return overlap(alpha1,p1[0],p1[1],p1[2],A[0],A[1],A[2],
+		   alpha2,p2[0],p2[1],p2[2],B[0],B[1],B[2]);
+  if (type == ONE_KINETIC)
+    return kinetic(alpha1,p1[0],p1[1],p1[2],A[0],A[1],A[2],
+		   alpha2,p2[0],p2[1],p2[2],B[0],B[1],B[2]);
+  return nuclear_attraction(A[0],A[1],A[2],1.,p1[0],p1[1],p1[2],alpha1,
+			    B[0],B[1],B[2],1.,p2[0],p2[1],p2[2],alpha2,
+			    C[0],C[1],C[2]);
+}
+
+static void contr_one_deriv(int type, PackedBasis *b, int i, int j,
+			    double *C, double *g){
+  /* g[0..2] = the derivative of <i|O|j> with respect to the center of
+     function i, where O is 1, -del^2/2 or 1/|r-C| */
+  int p,q,d,pi[3],pj[3];
+  double c,val;
+
+  for (d=0; d<3; d++){
+    pi[d] = b->lmn[3*i+d];
+    pj[d] = b->lmn[3*j+d];
+    g[d] = 0;
+  }
+  for (p=b->pstart[i]; p<b->pstart[i+1]; p++){
+    for (q=b->pstart[j]; q<b->pstart[j+1]; q++){
+      c = b->coefs[p]*b->coefs[q]*b->pnorms[p]*b->pnorms[q];
+      for (d=0; d<3; d++){
+	pi[d]++;
+	val = 2*b->exps[p]*one_int_lmn(type,b->exps[p],pi,b->xyz+3*i,
+				       b->exps[q],pj,b->xyz+3*j,C);
+	pi[d] -= 2;
+	if (pi[d] >= 0)
+	  val -= (pi[d]+1)*one_int_lmn(type,b->exps[p],pi,b->xyz+3*i,
+				       b->exps[q],pj,b->xyz+3*j,C);
+	pi[d]++;
+	g[d] += c*val;
+      }
+    }
+  }
+  for (d=0; d<3; d++) g[d] *= b->norms[i]*b->norms[j];
+}
+
+static PyObject *one_deriv_array(int type, PyObject *basis_obj,
+				 PyObject *buf_obj, int ncenters,
+				 double *cxyz, double *cq){
+  /* Write the derivatives of <i|O|j> with respect to the center of i
+     into buf[3*(i*nbf+j)+d], or for the nuclear attraction of each
+     center c, times its charge, into buf[3*((c*nbf+i)*nbf+j)+d] */
+  PackedBasis b;
+  double *buf;
+  Py_ssize_t buflen;
+  int c,i,j,nblock,owned;
+
+  if (PyObject_AsWriteBuffer(buf_obj,(void **)&buf,&buflen)) return NULL;
+  if (!get_packed_basis(basis_obj,&b,&owned)) return NULL;
+  nblock = (type == ONE_NUCLEAR) ? ncenters : 1;
+  if (buflen < (Py_ssize_t)(3*nblock*b.nbf*b.nbf*sizeof(double))) {
+    release_packed_basis(&b,owned);
+    PyErr_SetString(PyExc_ValueError,"Buffer too small for the derivatives");
+    return NULL;
+  }
+  Py_BEGIN_ALLOW_THREADS
+  for (c=0; c<nblock; c++)
+    for (i=0; i<b.nbf; i++)
+      for (j=0; j<b.nbf; j++){
+	double *g = buf+3*((c*b.nbf+i)*b.nbf+j);
+	if (type == ONE_NUCLEAR){
+	  contr_one_deriv(type,&b,i,j,cxyz+3*c,g);
+	  g[0] *= cq[c];
+	  g[1] *= cq[c];
+	  g[2] *= cq[c];
+	} else
+	  contr_one_deriv(type,&b,i,j,NULL,g);
+      }
+  Py_END_ALLOW_THREADS
+  release_packed_basis(&b,owned);
+  Py_INCREF(Py_None);
+  return Py_None;
+}
+
+static double prim_coulomb_lmn(double *R, int *p, double *alpha,
+			       double *norm){
+  return coulomb_repulsion(R[0],R[1],R[2],norm[0],p[0],p[1],p[2],alpha[0],
+			   R[3],R[4],R[5],norm[1],p[3],p[4],p[5],alpha[1],
+			   R[6],R[7],R[8],norm[2],p[6],p[7],p[8],alpha[2],
+			   R[9],R[10],R[11],norm[3],p[9],p[10],p[11],alpha[3]);
+}
+
+static void packed_coulomb_deriv(PackedBasis *b, int i, int j, int k,
+				 int l, double *g){
+  /* g[3*n+d] = the derivative of (ij|kl) with respect to coordinate d
+     of the center of function n = i,j,k. By translational invariance
+     the derivative for l is minus their sum. */
+  int f[4],ip[4],p[12],n,d,m;
+  double R[12],alpha[4],norm[4],c,val,scale;
+
+  f[0] = i; f[1] = j; f[2] = k; f[3] = l;
+  for (n=0; n<4; n++)
+    for (d=0; d<3; d++){
+      R[3*n+d] = b->xyz[3*f[n]+d];
+      p[3*n+d] = b->lmn[3*f[n]+d];
+    }
+  for (m=0; m<9; m++) g[m] = 0;
+  for (ip[0]=b->pstart[i]; ip[0]<b->pstart[i+1]; ip[0]++)
+    for (ip[1]=b->pstart[j]; ip[1]<b->pstart[j+1]; ip[1]++)
+      for (ip[2]=b->pstart[k]; ip[2]<b->pstart[k+1]; ip[2]++)
+	for (ip[3]=b->pstart[l]; ip[3]<b->pstart[l+1]; ip[3]++){
+	  c = 1;
+	  for (n=0; n<4; n++){
+	    alpha[n] = b->exps[ip[n]];
+	    norm[n] = b->pnorms[ip[n]];
+	    c *= b->coefs[ip[n]];
+	  }
+	  for (m=0; m<9; m++){
+	    n = m/3;
+	    p[m]++;
+	    val = 2*alpha[n]*prim_coulomb_lmn(R,p,alpha,norm);
+	    p[m] -= 2;
+	    if (p[m] >= 0)
+	      val -= (p[m]+1)*prim_coulomb_lmn(R,p,alpha,norm);
+	    p[m]++;
+	    g[m] += c*val;
+	  }
+	}
+  scale = b->norms[i]*b->norms[j]*b->norms[k]*b->norms[l];
+  for (m=0; m<9; m++) g[m] *= scale;
+}
+
+static PyObject *overlap_deriv_wrap(PyObject *self,PyObject *args){
+  /* overlap_deriv(basis,buffer): see one_deriv_array */
+  PyObject *basis,*buf;
+  if (!PyArg_ParseTuple(args,"OO",&basis,&buf)) return NULL;
+  return one_deriv_array(ONE_OVERLAP,basis,buf,0,NULL,NULL);
+}
+
+static PyObject *kinetic_deriv_wrap(PyObject *self,PyObject *args){
+  /* kinetic_deriv(basis,buffer): see one_deriv_array */
+  PyObject *basis,*buf;
+  if (!PyArg_ParseTuple(args,"OO",&basis,&buf)) return NULL;
+  return one_deriv_array(ONE_KINETIC,basis,buf,0,NULL,NULL);
+}
+
+static PyObject *nuclear_deriv_wrap(PyObject *self,PyObject *args){
+  /* nuclear_deriv(basis,cxyz,cq,buffer): the centers are given as for
+     nuclear_matrix; see one_deriv_array */
+  PyObject *basis,*cxyz_obj,*cq_obj,*buf,*result;
+  double *cxyz,*cq;
+  int n3,nc;
+
+  if (!PyArg_ParseTuple(args,"OOOO",&basis,&cxyz_obj,&cq_obj,&buf))
+    return NULL;
+  cxyz = seq_to_doubles(cxyz_obj,&n3);
+  if (!cxyz) return NULL;
+  cq = seq_to_doubles(cq_obj,&nc);
+  if (!cq) {
+    free(cxyz);
+    return NULL;
+  }
+  if (n3 != 3*nc) {
+    PyErr_SetString(PyExc_ValueError,"Inconsistent nuclear centers");
+    result = NULL;
+  } else
+    result = one_deriv_array(ONE_NUCLEAR,basis,buf,nc,cxyz,cq);
+  free(cxyz);
+  free(cq);
+  return result;
+}
+
+static PyObject *coulomb_deriv_block_wrap(PyObject *self,PyObject *args){
+  /* coulomb_deriv_block(basis,start,stop,buffer[,bounds,tol]): as
+     coulomb_block, but write the 9 derivatives of packed_coulomb_deriv
+     for each integral into buffer[9*(n-start)..9*(n-start)+8]. Given
+     the Schwarz bounds sqrt((ij|ij)) of the packed pairs ij, the
+     integrals with bounds[ij]*bounds[kl] < tol are not computed, and
+     their derivatives are zero. Returns the number skipped. */
+  PyObject *basis_obj,*buf_obj,*bounds_obj=NULL;
+  PackedBasis b;
+  double *buf,*bounds=NULL,tol=0;
+  Py_ssize_t buflen;
+  long start,stop,n,npair,totlen,nskipped=0;
+  int i,j,k,l,ij,kl,m,owned,nbounds;
+
+  if (!PyArg_ParseTuple(args,"OllO|Od",&basis_obj,&start,&stop,&buf_obj,
+			&bounds_obj,&tol))
+    return NULL;
+  if (PyObject_AsWriteBuffer(buf_obj,(void **)&buf,&buflen)) return NULL;
+  if (!get_packed_basis(basis_obj,&b,&owned)) return NULL;
+  npair = (long)b.nbf*(b.nbf+1)/2;
+  totlen = npair*(npair+1)/2;
+  if (start < 0 || stop > totlen || start > stop) {
+    release_packed_basis(&b,owned);
+    PyErr_SetString(PyExc_ValueError,"Integral range out of bounds");
+    return NULL;
+  }
+  if (buflen < (Py_ssize_t)(9*(stop-start)*sizeof(double))) {
+    release_packed_basis(&b,owned);
+    PyErr_SetString(PyExc_ValueError,"Buffer too small for the derivatives");
+    return NULL;
+  }
+  if (bounds_obj && bounds_obj != Py_None) {
+    bounds = seq_to_doubles(bounds_obj,&nbounds);
+    if (!bounds) {
+      release_packed_basis(&b,owned);
+      return NULL;
+    }
+    if (nbounds != npair) {
+      free(bounds);
+      release_packed_basis(&b,owned);
+      PyErr_SetString(PyExc_ValueError,"Need a bound for each pair");
+      return NULL;
+    }
+  }
+  Py_BEGIN_ALLOW_THREADS
+  for (n=start; n<stop; n++){
+    unpack_pair_index(n,&ij,&kl);
+    if (bounds && bounds[ij]*bounds[kl] < tol){
+      for (m=0; m<9; m++) buf[9*(n-start)+m] = 0;
+      nskipped++;
+      continue;
+    }
+    unpack_pair_index(ij,&i,&j);
+    unpack_pair_index(kl,&k,&l);
+    packed_coulomb_deriv(&b,i,j,k,l,buf+9*(n-start));
+  }
+  Py_END_ALLOW_THREADS
+  free(bounds);
+  release_packed_basis(&b,owned);
+  return Py_BuildValue("l",nskipped);
+}
+
+static long pair_index(long i, long j){
+  if (i < j) return j*(j+1)/2+i;
+  return i*(i+1)/2+j;
+}
+
+static PyObject *symmetry_fill_wrap(PyObject *self,PyObject *args){
+  /* symmetry_fill(buffer,shell_of,rep_op,images,signs): copy the packed
+     integrals of the symmetry-unique shell quartets into the rest (see
+     Symmetry.UniqueQuartets). shell_of is the shell of each of the nbf
+     functions, rep_op holds a byte for each shell quartet, the operation
+     that takes it into the computed one (0 if it is computed), and
+     images and signs hold the nbf images and signs of the functions
+     under each operation, one operation after another. */
+  PyObject *buf_obj,*shell_obj,*rep_obj,*image_obj,*sign_obj;
+  double *buf;
+  const char *rep_op;
+  int *shell_of=NULL,*images=NULL,*signs=NULL;
+  int nbf,nimages,nsigns,i,j,k,l,g,*img,*sgn;
+  long ij,kl,n,npair,totlen,nquartet,nshell,src;
+  Py_ssize_t buflen,replen;
+
+  if (!PyArg_ParseTuple(args,"OOOOO",&buf_obj,&shell_obj,&rep_obj,
+			&image_obj,&sign_obj)) return NULL;
+  if (PyObject_AsWriteBuffer(buf_obj,(void **)&buf,&buflen)) return NULL;
+  if (PyObject_AsReadBuffer(rep_obj,(const void **)&rep_op,&replen))
+    return NULL;
+  shell_of = seq_to_ints(shell_obj,&nbf);
+  if (shell_of) images = seq_to_ints(image_obj,&nimages);
+  if (images) signs = seq_to_ints(sign_obj,&nsigns);
+  if (!signs) {
+    free(shell_of);
+    free(images);
+    return NULL;
+  }
+  npair = (long)nbf*(nbf+1)/2;
+  totlen = npair*(npair+1)/2;
+  nshell = nbf ? shell_of[nbf-1]+1 : 0;
+  nquartet = nshell*(nshell+1)/2*(nshell*(nshell+1)/2+1)/2;
+  if (buflen < (Py_ssize_t)(totlen*sizeof(double)) || replen < nquartet
+      || nimages != nsigns || nbf == 0 || nimages % nbf) {
+    free(shell_of);
+    free(images);
+    free(signs);
+    PyErr_SetString(PyExc_ValueError,"Inconsistent symmetry data");
+    return NULL;
+  }
+  Py_BEGIN_ALLOW_THREADS
+  for (i=0; i<nbf; i++)
+    for (j=0; j<=i; j++){
+      ij = pair_index(i,j);
+      for (k=0; k<=i; k++)
+	for (l=0; l<=k; l++){
+	  kl = pair_index(k,l);
+	  if (kl > ij) break;
+	  g = rep_op[pair_index(pair_index(shell_of[i],shell_of[j]),
+				pair_index(shell_of[k],shell_of[l]))];
+	  if (!g) continue;
+	  img = images+g*nbf;
+	  sgn = signs+g*nbf;
+	  n = pair_index(ij,kl);
+	  src = pair_index(pair_index(img[i],img[j]),
+			   pair_index(img[k],img[l]));
+	  buf[n] = sgn[i]*sgn[j]*sgn[k]*sgn[l]*buf[src];
+	}
+    }
+  Py_END_ALLOW_THREADS
+  free(shell_of);
+  free(images);
+  free(signs);
+  Py_INCREF(Py_None);
+  return Py_None;
+}
+
 /* Python interface */
 static PyMethodDef cints_methods[] = {
   {"fact",fact_wrap,METH_VARARGS},
@@ -965,11 +1355,24 @@ static PyMethodDef cints_methods[] = {
   {"nuclear_attraction_vec",nuclear_attraction_vec_wrap,METH_VARARGS},
   {"contr_nuke_vec",contr_nuke_vec_wrap,METH_VARARGS},
   {"three_center_1D",three_center_1D_wrap,METH_VARARGS},
+  {"overlap_matrix",overlap_matrix_wrap,METH_VARARGS},
+  {"kinetic_matrix",kinetic_matrix_wrap,METH_VARARGS},
+  {"nuclear_matrix",nuclear_matrix_wrap,METH_VARARGS},
+  {"coulomb_block",coulomb_block_wrap,METH_VARARGS},
+  {"packed_basis",packed_basis_wrap,METH_VARARGS},
+  {"overlap_deriv",overlap_deriv_wrap,METH_VARARGS},
+  {"kinetic_deriv",kinetic_deriv_wrap,METH_VARARGS},
+  {"nuclear_deriv",nuclear_deriv_wrap,METH_VARARGS},
+  {"coulomb_deriv_block",coulomb_deriv_block_wrap,METH_VARARGS},
+  {"symmetry_fill",symmetry_fill_wrap,METH_VARARGS},
+  {"set_prim_tol",set_prim_tol_wrap,METH_VARARGS},
+  {"prim_screening_stats",prim_screening_stats_wrap,METH_VARARGS},
   {NULL,NULL} /* Sentinel */
 };
 
 static void module_init(char* name)
 {
+  boys_init();
   (void) Py_InitModule(name,cints_methods);
 }
 
@@ -981,7 +1384,3 @@ void initpyquante_cints_ext(){module_init("pyquante_cints_ext");}
 #else
 void initcints(){module_init("cints");}
 #endif
-
-#undef ITMAX
-#undef EPS
-#undef FPMIN
@@ -8,11 +8,9 @@
  license. Please see the file LICENSE that is part of this
  distribution. 
  **************************************************************************/
-/* My routines */
-#ifdef _MSC_VER
-double lgamma(double);
-#endif
+enum { ONE_OVERLAP, ONE_KINETIC, ONE_NUCLEAR };
 
+/* My routines */
 static double fB(int i, int l1, int l2, double px, double ax, double bx, 
 	  int r, double g);
 static double Bfunc(int i, int r, double g);
@@ -23,7 +21,8 @@ static double contr_coulomb(int ia, double *aexps, double *acoefs, double *anorm
 			    int ic, double *cexps, double *ccoefs, double *cnorms,
 			    double xc, double yc, double zc, int lc, int mc, int nc, 
 			    int id, double *dexps, double *dcoefs, double *dnorms,
-			    double xd, double yd, double zd, int ld, int md, int nd);
+			    double xd, double yd, double zd, int ld, int md, int nd,
+			    PrimCounts *counts);
 
 static double coulomb_repulsion(double xa, double ya, double za, double norma,
 				int la, int ma, int na, double alphaa,
@@ -71,9 +70,6 @@ static double dist(double x1, double y1, double z1,
 static double binomial_prefactor(int s, int ia, int ib, double xpa, double xpb);
 static int binomial(int a, int b);
 
-static double Fgamma(double m, double x);
-static double gamm_inc(double a, double x);
-
 static int ijkl2intindex(int i, int j, int k, int l);
 
 static int fact_ratio2(int a, int b);
@@ -85,9 +81,21 @@ static double three_center_1D(double xi, int ai, double alphai,
 			      double xj, int aj, double alphaj,
 			      double xk, int ak, double alphak);
 
-/* Routines from Numerical Recipes */
-static void gser(double *gamser, double a, double x, double *gln);
-static void gcf(double *gammcf, double a, double x, double *gln);
+static double contr_one_int(int type, PackedBasis *b, int i, int j,
+			    int ncenters, double *cxyz, double *cq);
+static PyObject *one_ints_matrix(int type, PyObject *basis_obj,
+				 int ncenters, double *cxyz, double *cq);
+static double one_int_lmn(int type, double alpha1, int *p1, double *A,
+			  double alpha2, int *p2, double *B, double *C);
+static void contr_one_deriv(int type, PackedBasis *b, int i, int j,
+			    double *C, double *g);
+static PyObject *one_deriv_array(int type, PyObject *basis_obj,
+				 PyObject *buf_obj, int ncenters,
+				 double *cxyz, double *cq);
+static double prim_coulomb_lmn(double *R, int *p, double *alpha,
+			       double *norm);
+static void packed_coulomb_deriv(PackedBasis *b, int i, int j, int k,
+				 int l, double *g);
 
 /* Wrappers */
 static PyObject *fact_wrap(PyObject *self,PyObject *args);
@@ -101,10 +109,23 @@ static PyObject *ijkl2intindex_wrap(PyObject *self,PyObject *args);
 static PyObject *fB_wrap(PyObject *self,PyObject *args);
 static PyObject *fact_ratio2_wrap(PyObject *self,PyObject *args);
 static PyObject *contr_coulomb_wrap(PyObject *self,PyObject *args);
+static PyObject *coulomb_block_wrap(PyObject *self,PyObject *args);
+static PyObject *packed_basis_wrap(PyObject *self,PyObject *args);
+static double packed_coulomb(PackedBasis *b, int i, int j, int k, int l,
+			     PrimCounts *counts);
 static PyObject *coulomb_repulsion_wrap(PyObject *self,PyObject *args);
 static PyObject *kinetic_wrap(PyObject *self,PyObject *args);
 static PyObject *overlap_wrap(PyObject *self,PyObject *args);
 static PyObject *nuclear_attraction_wrap(PyObject *self,PyObject *args);
 static PyObject *nuclear_attraction_vec_wrap(PyObject *self,PyObject *args);
 static PyObject *three_center_1D_wrap(PyObject *self,PyObject *args);
+static PyObject *overlap_matrix_wrap(PyObject *self,PyObject *args);
+static PyObject *kinetic_matrix_wrap(PyObject *self,PyObject *args);
+static PyObject *nuclear_matrix_wrap(PyObject *self,PyObject *args);
+static PyObject *overlap_deriv_wrap(PyObject *self,PyObject *args);
+static PyObject *kinetic_deriv_wrap(PyObject *self,PyObject *args);
+static PyObject *nuclear_deriv_wrap(PyObject *self,PyObject *args);
+static PyObject *coulomb_deriv_block_wrap(PyObject *self,PyObject *args);
+static long pair_index(long i, long j);
+static PyObject *symmetry_fill_wrap(PyObject *self,PyObject *args);
 
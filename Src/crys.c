@@ -23,6 +23,9 @@
  */
 
 #include "Python.h"
+#include "packed_basis.h"
+#include "boys.h"
+#include "prim_screen.h"
 #include "crys.h"
 #include <math.h>
 #include <stdio.h>
@@ -38,18 +41,35 @@ static double contr_coulomb(int lena,double *aexps,double *acoefs,double *anorms
 		     int lenc,double *cexps,double *ccoefs,double *cnorms,
 		     double xc,double yc,double zc,int lc,int mc,int nc,
 		     int lend,double *dexps,double *dcoefs,double *dnorms,
-		     double xd,double yd,double zd,int ld,int md,int nd){
+		     double xd,double yd,double zd,int ld,int md,int nd,
+		     PrimCounts *counts){
   double val = 0.;
+  double wab_stack[PRIM_PAIR_STACK],wcd_stack[PRIM_PAIR_STACK],*wab,*wcd;
   int i,j,k,l;
+  wab = prim_pair_weights(lena,aexps,acoefs,anorms,xa,ya,za,
+			  lenb,bexps,bcoefs,bnorms,xb,yb,zb,wab_stack,counts);
+  wcd = prim_pair_weights(lenc,cexps,ccoefs,cnorms,xc,yc,zc,
+			  lend,dexps,dcoefs,dnorms,xd,yd,zd,wcd_stack,counts);
+  if (!wab || !wcd) {
+    prim_free_weights(wab,wab_stack);
+    prim_free_weights(wcd,wcd_stack);
+    return 0.;
+  }
   for (i=0; i<lena; i++)
     for (j=0; j<lenb; j++)
       for (k=0; k<lenc; k++)
-	for (l=0; l<lend; l++)
+	for (l=0; l<lend; l++){
+	  if (prim_skip(wab[i*lenb+j]*wcd[k*lend+l]
+			/sqrt(aexps[i]+bexps[j]+cexps[k]+dexps[l]),counts))
+	    continue;
 	  val += acoefs[i]*bcoefs[j]*ccoefs[k]*dcoefs[l]
 	    *coulomb_repulsion(xa,ya,za,anorms[i],la,ma,na,aexps[i],
 			       xb,yb,zb,bnorms[j],lb,mb,nb,bexps[j],
 			       xc,yc,zc,cnorms[k],lc,mc,nc,cexps[k],
 			       xd,yd,zd,dnorms[l],ld,md,nd,dexps[l]);
+	}
+  prim_free_weights(wab,wab_stack);
+  prim_free_weights(wcd,wcd_stack);
   return val;
 }
     
@@ -64,6 +84,7 @@ static double coulomb_repulsion(double xa,double ya,double za,double norma,
 
   int norder,i;
   double A,B,xp,yp,zp,xq,yq,zq,rpq2,X,rho,sum,t,Ix,Iy,Iz;
+  RysWork w;
   
   norder = (la+ma+na+lb+nb+mb+lc+mc+nc+ld+md+nd)/2 + 1;
   A = alphaa+alphab; 
@@ -80,36 +101,48 @@ static double coulomb_repulsion(double xa,double ya,double za,double norma,
 
   X = rpq2*rho;
 
-  Roots(norder,X); /* Puts currect roots/weights in "common" */
+  Roots(&w,norder,X); /* Puts currect roots/weights in w */
 
   sum = 0.;
   for (i=0; i<norder; i++){
-    t = roots[i];
-    Ix = Int1d(t,la,lb,lc,ld,xa,xb,xc,xd,
+    t = w.roots[i];
+    Ix = Int1d(&w,t,la,lb,lc,ld,xa,xb,xc,xd,
 	       alphaa,alphab,alphac,alphad);
-    Iy = Int1d(t,ma,mb,mc,md,ya,yb,yc,yd,
+    Iy = Int1d(&w,t,ma,mb,mc,md,ya,yb,yc,yd,
 	       alphaa,alphab,alphac,alphad);
-    Iz = Int1d(t,na,nb,nc,nd,za,zb,zc,zd,
+    Iz = Int1d(&w,t,na,nb,nc,nd,za,zb,zc,zd,
 	       alphaa,alphab,alphac,alphad);
-    sum = sum + Ix*Iy*Iz*weights[i]; /* ABD eq 5 & 9 */
+    sum = sum + Ix*Iy*Iz*w.weights[i]; /* ABD eq 5 & 9 */
   }
   return 2*sqrt(rho/M_PI)*norma*normb*normc*normd*sum; /* ABD eq 5 & 9 */
 }
 
-static void Roots(int n, double X){
-  if (n <= 3)
-    Root123(n,X);
+static void Roots(RysWork *w, int n, double X){
+  if (n == 1)
+    Root1(w,X);
+  else if (n <= 3)
+    Root123(w,n,X);
   else if (n==4) 
-    Root4(X);
+    Root4(w,X);
   else if (n==5)
-    Root5(X);
+    Root5(w,X);
   else
-    Root6(n,X);
+    Root6(w,n,X);
   return;
 }
 
 
-static void Root123(int n, double X){
+static void Root1(RysWork *w, double X){
+  /* The one-point rule follows from the Boys function: the weight is
+     F0 and the root t^2/(1-t^2) = F1/(F0-F1) */
+  double F[2];
+  boys_array(1,X,F);
+  w->roots[0] = F[1]/(F[0]-F[1]);
+  w->weights[0] = F[0];
+  return;
+}
+
+static void Root123(RysWork *w, int n, double X){
 
   double R12, PIE4, R22, W22, R13, R23, W23, R33, W33;
   double RT1=0,RT2=0,RT3=0,WW1=0,WW2=0,WW3=0;
@@ -553,20 +586,20 @@ static void Root123(int n, double X){
       }
     }
   }
-  roots[0] = RT1;
-  weights[0] = WW1;
+  w->roots[0] = RT1;
+  w->weights[0] = WW1;
   if (n > 1){
-    roots[1] = RT2;
-    weights[1] = WW2;
+    w->roots[1] = RT2;
+    w->weights[1] = WW2;
   }
   if (n > 2) {
-    roots[2] = RT3;
-    weights[2] = WW3;
+    w->roots[2] = RT3;
+    w->weights[2] = WW3;
   }
   return;
 }
 
-static void Root4(double X){
+static void Root4(RysWork *w, double X){
   double R14,PIE4,R24,W24,R34,W34,R44,W44;
   double RT1=0,RT2=0,RT3=0,RT4=0,WW1=0,WW2=0,WW3=0,WW4=0;
   double Y,E;
@@ -921,18 +954,18 @@ static void Root4(double X){
     WW2 = W24*WW1;
     WW1 = WW1-WW2-WW3-WW4;
   }
-  roots[0] = RT1;
-  weights[0] = WW1;
-  roots[1] = RT2;
-  weights[1] = WW2;
-  roots[2] = RT3;
-  weights[2] = WW3;
-  roots[3] = RT4;
-  weights[3] = WW4;
+  w->roots[0] = RT1;
+  w->weights[0] = WW1;
+  w->roots[1] = RT2;
+  w->weights[1] = WW2;
+  w->roots[2] = RT3;
+  w->weights[2] = WW3;
+  w->roots[3] = RT4;
+  w->weights[3] = WW4;
   return;
 }
 
-static void Root5(double X){
+static void Root5(RysWork *w, double X){
   double R15,PIE4,R25,W25,R35,W35,R45,W45,R55,W55;
   double RT1=0,RT2=0,RT3=0,RT4=0,RT5=0,
     WW1=0,WW2=0,WW3=0,WW4=0,WW5=0;
@@ -1424,61 +1457,61 @@ static void Root5(double X){
     WW5 = W55*WW1;
     WW1 = WW1-WW2-WW3-WW4-WW5;
   }
-  roots[0] = RT1;
-  weights[0] = WW1;
-  roots[1] = RT2;
-  weights[1] = WW2;
-  roots[2] = RT3;
-  weights[2] = WW3;
-  roots[3] = RT4;
-  weights[3] = WW4;
-  roots[4] = RT5;
-  weights[4] = WW5;
+  w->roots[0] = RT1;
+  w->weights[0] = WW1;
+  w->roots[1] = RT2;
+  w->weights[1] = WW2;
+  w->roots[2] = RT3;
+  w->weights[2] = WW3;
+  w->roots[3] = RT4;
+  w->weights[3] = WW4;
+  w->roots[4] = RT5;
+  w->weights[4] = WW5;
   return;
 }
 
-static void Root6(int n,double X){
+static void Root6(RysWork *w, int n,double X){
   printf("Root6 not implemented yet\n");
   return ;
 }
 
-static double Int1d(double t,int ix,int jx,int kx, int lx,
+static double Int1d(RysWork *w, double t,int ix,int jx,int kx, int lx,
 	     double xi,double xj, double xk,double xl,
 	     double alphai,double alphaj,double alphak,double alphal){
   double Ix;
-  Recur(t,ix,jx,kx,lx,xi,xj,xk,xl,
+  Recur(w,t,ix,jx,kx,lx,xi,xj,xk,xl,
 	alphai,alphaj,alphak,alphal);
-  Ix = Shift(ix,jx,kx,lx,xi-xj,xk-xl);
+  Ix = Shift(w,ix,jx,kx,lx,xi-xj,xk-xl);
   return Ix;
 }
 
-static void RecurFactors(double t,double A,double B,
+static void RecurFactors(RysWork *w, double t,double A,double B,
 		  double Px,double Qx,double xi,double xk){
   /* ABD eqs 12-14 */
   double fff;
   fff = t/(A+B);
-  B00 = 0.5*fff;
-  B1 = (1-B*fff)/(2*A);
-  B1p = (1-A*fff)/(2*B);
-  C = (Px-xi) + B*(Qx-Px)*fff;
-  Cp = (Qx-xk) + A*(Px-Qx)*fff;
+  w->B00 = 0.5*fff;
+  w->B1 = (1-B*fff)/(2*A);
+  w->B1p = (1-A*fff)/(2*B);
+  w->C = (Px-xi) + B*(Qx-Px)*fff;
+  w->Cp = (Qx-xk) + A*(Px-Qx)*fff;
   return;
 }
 
-static void RecurFactorsGamess(double t,double A,double B,
+static void RecurFactorsGamess(RysWork *w, double t,double A,double B,
 			double Px,double Qx,double xi,double xk){
   /* Analogous versions taken from Gamess source code */
   double fff;
   fff = t/(A+B)/(1+t);
-  B00 = 0.5*fff;
-  B1 = 1/(2*A*(1+t)) + 0.5*fff;
-  B1p = 1/(2*B*(1+t)) + 0.5*fff;
-  C = (Px-xi)/(1+t) + (B*(Qx-xi)+A*(Px-xi))*fff;
-  Cp = (Qx-xk)/(1+t) + (B*(Qx-xk)+A*(Px-xk))*fff;
+  w->B00 = 0.5*fff;
+  w->B1 = 1/(2*A*(1+t)) + 0.5*fff;
+  w->B1p = 1/(2*B*(1+t)) + 0.5*fff;
+  w->C = (Px-xi)/(1+t) + (B*(Qx-xi)+A*(Px-xi))*fff;
+  w->Cp = (Qx-xk)/(1+t) + (B*(Qx-xk)+A*(Px-xk))*fff;
   return;
 }
 
-static void Recur(double t, int i, int j, int k, int l,
+static void Recur(RysWork *w, double t, int i, int j, int k, int l,
 	   double xi, double xj, double xk, double xl,
 	   double alphai, double alphaj, double alphak, double alphal){
   /* Form G(n,m)=I(n,0,m,0) intermediate values for a Rys polynomial */
@@ -1492,30 +1525,34 @@ static void Recur(double t, int i, int j, int k, int l,
   Px = (alphai*xi+alphaj*xj)/A;
   Qx = (alphak*xk+alphal*xl)/B;
 
-  RecurFactorsGamess(t,A,B,Px,Qx,xi,xk);
+  RecurFactorsGamess(w,t,A,B,Px,Qx,xi,xk);
 
   /* ABD eq 11. */
-  G[0][0] = M_PI*exp(-alphai*alphaj*pow(xi-xj,2)/(alphai+alphaj)
+  w->G[0][0] = M_PI*exp(-alphai*alphaj*pow(xi-xj,2)/(alphai+alphaj)
 		     -alphak*alphal*pow(xk-xl,2)/(alphak+alphal))/sqrt(A*B);
 
-    if (n > 0) G[1][0] = C*G[0][0];  /* ABD eq 15 */
-    if (m > 0) G[0][1] = Cp*G[0][0]; /* ABD eq 16 */
+    if (n > 0) w->G[1][0] = w->C*w->G[0][0];  /* ABD eq 15 */
+    if (m > 0) w->G[0][1] = w->Cp*w->G[0][0]; /* ABD eq 16 */
 
-    for (a=2; a<n+1; a++) G[a][0] = B1*(a-1)*G[a-2][0] + C*G[a-1][0];
-    for (b=2; b<m+1; b++) G[0][b] = B1p*(b-1)*G[0][b-2] + Cp*G[0][b-1];
+    for (a=2; a<n+1; a++)
+      w->G[a][0] = w->B1*(a-1)*w->G[a-2][0] + w->C*w->G[a-1][0];
+    for (b=2; b<m+1; b++)
+      w->G[0][b] = w->B1p*(b-1)*w->G[0][b-2] + w->Cp*w->G[0][b-1];
 
     if ((m==0) || (n==0)) return;
     
     for (a=1; a<n+1; a++){
-      G[a][1] = a*B00*G[a-1][0] + Cp*G[a][0];
+      w->G[a][1] = a*w->B00*w->G[a-1][0] + w->Cp*w->G[a][0];
       for (b=2; b<m+1; b++)
-	G[a][b] = B1p*(b-1)*G[a][b-2] + a*B00*G[a-1][b-1] + Cp*G[a][b-1];
+	w->G[a][b] = w->B1p*(b-1)*w->G[a][b-2] + a*w->B00*w->G[a-1][b-1]
+	  + w->Cp*w->G[a][b-1];
     }
 
     return;
 }
 
-static double Shift(int i, int j, int k, int l, double xij, double xkl){
+static double Shift(RysWork *w, int i, int j, int k, int l,
+		    double xij, double xkl){
   /* Compute and  output I(i,j,k,l) from I(i+j,0,k+l,0) (G) */
   /*  xij = xi-xj, xkl = xk-xl */
 
@@ -1526,7 +1563,7 @@ static double Shift(int i, int j, int k, int l, double xij, double xkl){
   for (m=0; m<l+1; m++){
     ijm0 = 0;
     for (n=0; n<j+1; n++) /* I(i,j,m,0)<-I(n,0,m,0)  */
-      ijm0 += binomial(j,n)*pow(xij,j-n)*G[n+i][m+k];
+      ijm0 += binomial(j,n)*pow(xij,j-n)*w->G[n+i][m+k];
     ijkl += binomial(l,m)*pow(xkl,l-m)*ijm0; /* I(i,j,k,l)<-I(i,j,m,0) */
   }
   return ijkl;
@@ -1550,8 +1587,11 @@ static int fact(int n){
 }
 
 /* Start of crys_wrap functions: */
+/* work, in contr_coulomb_wrap, is the work space for the various */
+/*  exponents, contraction coefficients, etc., used by the contracted */
+/*  code. It lives on the stack of each call rather than in a global, */
+/*  so that calls from different threads don't share it. */
 #define MAX_PRIMS_PER_CONT (10)
-double work[12*MAX_PRIMS_PER_CONT];
 
 static PyObject *contr_coulomb_wrap(PyObject *self,PyObject *args){
   int ok=0;
@@ -1570,13 +1610,18 @@ static PyObject *contr_coulomb_wrap(PyObject *self,PyObject *args){
     *dexps,*dcoefs,*dnorms;
   int i;
   double Jij=0; /*  return value */
+  double work[12*MAX_PRIMS_PER_CONT];
+  PrimCounts counts;
+  double tol=prim_tol;
 
-  ok = PyArg_ParseTuple(args,"OOOOOOOOOOOOOOOOOOOO",
+  ok = PyArg_ParseTuple(args,"OOOOOOOOOOOOOOOOOOOO|d",
 			&aexps_obj,&acoefs_obj,&anorms_obj,&xyza_obj,&lmna_obj,
 			&bexps_obj,&bcoefs_obj,&bnorms_obj,&xyzb_obj,&lmnb_obj,
 			&cexps_obj,&ccoefs_obj,&cnorms_obj,&xyzc_obj,&lmnc_obj,
-			&dexps_obj,&dcoefs_obj,&dnorms_obj,&xyzd_obj,&lmnd_obj);
+			&dexps_obj,&dcoefs_obj,&dnorms_obj,&xyzd_obj,&lmnd_obj,
+			&tol);
   if (!ok) return NULL;
+  prim_counts_init(&counts,tol);
 
 
   ok=PyArg_ParseTuple(xyza_obj,"ddd",&xa,&ya,&za);
@@ -1665,11 +1710,13 @@ static PyObject *contr_coulomb_wrap(PyObject *self,PyObject *args){
     dcoefs[i] = PyFloat_AS_DOUBLE(PySequence_GetItem(dcoefs_obj,i));
     dnorms[i] = PyFloat_AS_DOUBLE(PySequence_GetItem(dnorms_obj,i));
   }
+  Py_BEGIN_ALLOW_THREADS
   Jij = contr_coulomb(lena,aexps,acoefs,anorms,xa,ya,za,la,ma,na,
 		      lenb,bexps,bcoefs,bnorms,xb,yb,zb,lb,mb,nb,
 		      lenc,cexps,ccoefs,cnorms,xc,yc,zc,lc,mc,nc,
-		      lend,dexps,dcoefs,dnorms,xd,yd,zd,ld,md,nd);
-
+		      lend,dexps,dcoefs,dnorms,xd,yd,zd,ld,md,nd,&counts);
+  Py_END_ALLOW_THREADS
+  if (!prim_add_counts(&counts)) return NULL;
   return Py_BuildValue("d", Jij);
 }
 
@@ -1710,15 +1757,38 @@ static PyObject *coulomb_repulsion_wrap(PyObject *self,PyObject *args){
 		      xd,yd,zd,normd,ld,md,nd,alphad));
 }
 
+static double packed_coulomb(PackedBasis *b, int i, int j, int k, int l,
+			     PrimCounts *counts){
+  return b->norms[i]*b->norms[j]*b->norms[k]*b->norms[l]*
+    contr_coulomb(PB_NPRIM(b,i),PB_EXPS(b,i),PB_COEFS(b,i),PB_PNORMS(b,i),
+		  PB_X(b,i),PB_Y(b,i),PB_Z(b,i),PB_L(b,i),PB_M(b,i),PB_N(b,i),
+		  PB_NPRIM(b,j),PB_EXPS(b,j),PB_COEFS(b,j),PB_PNORMS(b,j),
+		  PB_X(b,j),PB_Y(b,j),PB_Z(b,j),PB_L(b,j),PB_M(b,j),PB_N(b,j),
+		  PB_NPRIM(b,k),PB_EXPS(b,k),PB_COEFS(b,k),PB_PNORMS(b,k),
+		  PB_X(b,k),PB_Y(b,k),PB_Z(b,k),PB_L(b,k),PB_M(b,k),PB_N(b,k),
+		  PB_NPRIM(b,l),PB_EXPS(b,l),PB_COEFS(b,l),PB_PNORMS(b,l),
+		  PB_X(b,l),PB_Y(b,l),PB_Z(b,l),PB_L(b,l),PB_M(b,l),PB_N(b,l),
+		  counts);
+}
+
+static PyObject *coulomb_block_wrap(PyObject *self,PyObject *args){
+  /* coulomb_block(basis,start,stop,buffer,tol=None): see packed_basis.h */
+  return coulomb_block(args,packed_coulomb);
+}
+
 /* Python interface */
 static PyMethodDef crys_methods[] = {
   {"contr_coulomb",contr_coulomb_wrap,METH_VARARGS},
   {"coulomb_repulsion",coulomb_repulsion_wrap,METH_VARARGS},
+  {"coulomb_block",coulomb_block_wrap,METH_VARARGS},
+  {"set_prim_tol",set_prim_tol_wrap,METH_VARARGS},
+  {"prim_screening_stats",prim_screening_stats_wrap,METH_VARARGS},
   {NULL,NULL} /* Sentinel */
 };
 
 static void module_init(char* name)
 {
+  boys_init();
   (void) Py_InitModule(name,crys_methods);
 }
 
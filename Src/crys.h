@@ -10,8 +10,15 @@
  *
  **************************************************************************/
 #define MAXROOTS 20
-static double roots[MAXROOTS],weights[MAXROOTS],G[MAXROOTS][MAXROOTS];
-static double B00,B1,B1p,C,Cp;
+
+/* The roots and weights of the quadrature, and the recurrence factors
+   and intermediates of the 1d integrals, for one primitive integral.
+   coulomb_repulsion keeps its own on the stack, so that the routines
+   can be called from several threads at once. */
+typedef struct {
+  double roots[MAXROOTS],weights[MAXROOTS],G[MAXROOTS][MAXROOTS];
+  double B00,B1,B1p,C,Cp;
+} RysWork;
 
 static double contr_coulomb(int lena,double *aexps,double *acoefs,double *anorms,
 		     double xa,double ya,double za,int la,int ma,int na,
@@ -20,7 +27,8 @@ static double contr_coulomb(int lena,double *aexps,double *acoefs,double *anorms
 		     int lenc,double *cexps,double *ccoefs,double *cnorms,
 		     double xc,double yc,double zc,int lc,int mc,int nc,
 		     int lend,double *dexps,double *dcoefs,double *dnorms,
-		     double xd,double yd,double zd,int ld,int md,int nd);
+		     double xd,double yd,double zd,int ld,int md,int nd,
+		     PrimCounts *counts);
 
 static double coulomb_repulsion(double xa,double ya,double za,double norma,
 			 int la,int ma,int na,double alphaa,
@@ -31,26 +39,28 @@ static double coulomb_repulsion(double xa,double ya,double za,double norma,
 			 double xd,double yd,double zd,double normd,
 			 int ld,int md,int nd,double alphad);
 
-static void Roots(int n, double X);
-static void Root123(int n, double X);
-static void Root4(double X);
-static void Root5(double X);
-static void Root6(int n,double X);
-static double Int1d(double t,int ix,int jx,int kx, int lx,
+static void Roots(RysWork *w, int n, double X);
+static void Root1(RysWork *w, double X);
+static void Root123(RysWork *w, int n, double X);
+static void Root4(RysWork *w, double X);
+static void Root5(RysWork *w, double X);
+static void Root6(RysWork *w, int n,double X);
+static double Int1d(RysWork *w, double t,int ix,int jx,int kx, int lx,
 	     double xi,double xj, double xk,double xl,
 	     double alphai,double alphaj,double alphak,double alphal);
 
-static void RecurFactors(double t,double A,double B,
+static void RecurFactors(RysWork *w, double t,double A,double B,
 		  double Px,double Qx,double xi,double xk);
 
-static void RecurFactorsGamess(double t,double A,double B,
+static void RecurFactorsGamess(RysWork *w, double t,double A,double B,
 			double Px,double Qx,double xi,double xk);
 
-static void Recur(double t, int i, int j, int k, int l,
+static void Recur(RysWork *w, double t, int i, int j, int k, int l,
 	   double xi, double xj, double xk, double xl,
 	   double alphai, double alphaj, double alphak, double alphal);
 
-static double Shift(int i, int j, int k, int l, double xij, double xkl);
+static double Shift(RysWork *w, int i, int j, int k, int l,
+		    double xij, double xkl);
 
 static double product_center_1D(double alphaa, double xa, 
 				double alphab, double xb);
@@ -60,4 +70,7 @@ static int binomial(int a, int b);
 static int fact(int n);
 
 static PyObject *contr_coulomb_wrap(PyObject *self,PyObject *args);
+static PyObject *coulomb_block_wrap(PyObject *self,PyObject *args);
+static double packed_coulomb(PackedBasis *b, int i, int j, int k, int l,
+			     PrimCounts *counts);
 static PyObject *coulomb_repulsion_wrap(PyObject *self,PyObject *args);
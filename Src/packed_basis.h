@@ -0,0 +1,233 @@
+/*************************************************************************
+ This program is part of the PyQuante quantum chemistry program suite.
+
+ Copyright (c) 2004, Richard P. Muller. All Rights Reserved. 
+
+ PyQuante version 1.2 and later is covered by the modified BSD
+ license. Please see the file LICENSE that is part of this
+ distribution. 
+ **************************************************************************/
+
+/* A basis set packed into flat arrays, and the batch two-electron
+   integral driver shared by the cints, chgp and crys modules. Include
+   after Python.h.
+
+   Ints.pack_basis parses the basis once, with cints.packed_basis, into
+   a PackedBasis held by a capsule, and the C functions taking a basis
+   use the arrays of the capsule as they are. They still accept the
+   (xyz,lmn,norms,pstart,exps,coefs,pnorms) tuple of lists, which is
+   then parsed for that call only. */
+
+#ifndef PACKED_BASIS_H
+#define PACKED_BASIS_H
+
+#include <math.h>
+#include <stdlib.h>
+#include "prim_screen.h"
+
+/* The primitives of function i are pstart[i]..pstart[i+1]-1 */
+typedef struct {
+  int nbf, nprim;
+  double *xyz;    /* 3*nbf centers */
+  int *lmn;       /* 3*nbf powers */
+  double *norms;  /* nbf contracted norms */
+  int *pstart;    /* nbf+1 offsets into the primitive arrays */
+  double *exps, *coefs, *pnorms; /* nprim primitive data */
+} PackedBasis;
+
+/* Shorthand for the data of function i, for calling contr_coulomb */
+#define PB_NPRIM(b,i) ((b)->pstart[(i)+1]-(b)->pstart[i])
+#define PB_EXPS(b,i) ((b)->exps+(b)->pstart[i])
+#define PB_COEFS(b,i) ((b)->coefs+(b)->pstart[i])
+#define PB_PNORMS(b,i) ((b)->pnorms+(b)->pstart[i])
+#define PB_X(b,i) ((b)->xyz[3*(i)])
+#define PB_Y(b,i) ((b)->xyz[3*(i)+1])
+#define PB_Z(b,i) ((b)->xyz[3*(i)+2])
+#define PB_L(b,i) ((b)->lmn[3*(i)])
+#define PB_M(b,i) ((b)->lmn[3*(i)+1])
+#define PB_N(b,i) ((b)->lmn[3*(i)+2])
+
+/* A module's contracted integral (ij|kl) over packed basis functions,
+   including the contracted norms. It mustn't touch any Python objects
+   or global state, since it is called without the GIL; the primitive
+   screening is counted into counts. */
+typedef double (*packed_coulomb_fn)(PackedBasis *b, int i, int j,
+				    int k, int l, PrimCounts *counts);
+
+static void free_packed_basis(PackedBasis *b){
+  free(b->xyz);
+  free(b->lmn);
+  free(b->norms);
+  free(b->pstart);
+  free(b->exps);
+  free(b->coefs);
+  free(b->pnorms);
+}
+
+static double *seq_to_doubles(PyObject *obj, int *n){
+  PyObject *seq;
+  double *vals;
+  int i;
+
+  seq = PySequence_Fast(obj,"expected a sequence of floats");
+  if (!seq) return NULL;
+  *n = PySequence_Fast_GET_SIZE(seq);
+  vals = (double *)malloc((*n+1)*sizeof(double));
+  if (!vals) {
+    Py_DECREF(seq);
+    PyErr_NoMemory();
+    return NULL;
+  }
+  for (i=0; i<*n; i++)
+    vals[i] = PyFloat_AsDouble(PySequence_Fast_GET_ITEM(seq,i));
+  Py_DECREF(seq);
+  if (PyErr_Occurred()) {
+    free(vals);
+    return NULL;
+  }
+  return vals;
+}
+
+static int *seq_to_ints(PyObject *obj, int *n){
+  PyObject *seq;
+  int *vals;
+  int i;
+
+  seq = PySequence_Fast(obj,"expected a sequence of ints");
+  if (!seq) return NULL;
+  *n = PySequence_Fast_GET_SIZE(seq);
+  vals = (int *)malloc((*n+1)*sizeof(int));
+  if (!vals) {
+    Py_DECREF(seq);
+    PyErr_NoMemory();
+    return NULL;
+  }
+  for (i=0; i<*n; i++)
+    vals[i] = (int)PyInt_AsLong(PySequence_Fast_GET_ITEM(seq,i));
+  Py_DECREF(seq);
+  if (PyErr_Occurred()) {
+    free(vals);
+    return NULL;
+  }
+  return vals;
+}
+
+static int parse_packed_basis(PyObject *obj, PackedBasis *b){
+  /* obj is the (xyz,lmn,norms,pstart,exps,coefs,pnorms) tuple made
+     by Ints.pack_basis */
+  PyObject *xyz,*lmn,*norms,*pstart,*exps,*coefs,*pnorms;
+  int n3,nl,nn,np,ne,nc,npn,ok;
+
+  ok = PyArg_ParseTuple(obj,"OOOOOOO",&xyz,&lmn,&norms,&pstart,
+			&exps,&coefs,&pnorms);
+  if (!ok) return 0;
+  b->xyz = seq_to_doubles(xyz,&n3);
+  b->lmn = seq_to_ints(lmn,&nl);
+  b->norms = seq_to_doubles(norms,&nn);
+  b->pstart = seq_to_ints(pstart,&np);
+  b->exps = seq_to_doubles(exps,&ne);
+  b->coefs = seq_to_doubles(coefs,&nc);
+  b->pnorms = seq_to_doubles(pnorms,&npn);
+  b->nbf = nn;
+  b->nprim = ne;
+  if (!(b->xyz && b->lmn && b->norms && b->pstart && b->exps
+	&& b->coefs && b->pnorms)) {
+    free_packed_basis(b);
+    return 0;
+  }
+  if (n3 != 3*nn || nl != 3*nn || np != nn+1 || nc != ne || npn != ne
+      || b->pstart[0] != 0 || b->pstart[nn] != ne) {
+    free_packed_basis(b);
+    PyErr_SetString(PyExc_ValueError,"Inconsistent packed basis");
+    return 0;
+  }
+  return 1;
+}
+
+/* The name of the capsules made by cints.packed_basis */
+#define PACKED_BASIS_NAME "PyQuante.PackedBasis"
+
+static int get_packed_basis(PyObject *obj, PackedBasis *b, int *owned){
+  /* Fill b from a capsule made by packed_basis, sharing its arrays, or
+     else parse the tuple obj into arrays that b owns. Give b back with
+     release_packed_basis. */
+  PackedBasis *pb;
+
+  if (PyCapsule_CheckExact(obj)) {
+    pb = (PackedBasis *)PyCapsule_GetPointer(obj,PACKED_BASIS_NAME);
+    if (!pb) return 0;
+    *b = *pb;
+    *owned = 0;
+    return 1;
+  }
+  *owned = 1;
+  return parse_packed_basis(obj,b);
+}
+
+static void release_packed_basis(PackedBasis *b, int owned){
+  if (owned) free_packed_basis(b);
+}
+
+static void unpack_pair_index(long n, int *i, int *j){
+  /* Invert n = i*(i+1)/2+j, i>=j */
+  long ii = (long)((sqrt(8.0*n+1)-1)/2);
+  while (ii*(ii+1)/2 > n) ii--;
+  while ((ii+1)*(ii+2)/2 <= n) ii++;
+  *i = (int)ii;
+  *j = (int)(n - ii*(ii+1)/2);
+}
+
+static PyObject *coulomb_block(PyObject *args, packed_coulomb_fn coulomb){
+  /* Python arguments (basis,start,stop,buffer,tol=None): compute the
+     integrals with ijkl2intindex indices start..stop-1 over the packed
+     basis, and write them into buffer[0..stop-start-1], which is any
+     writable buffer of doubles (a numpy array, array('d'), ...). tol
+     is the primitive screening tolerance, by default that of
+     set_prim_tol. The GIL is released while the integrals are
+     computed, so other threads may run, but mustn't resize the
+     buffer. */
+  PyObject *basis_obj,*buf_obj,*tol_obj=Py_None;
+  PackedBasis b;
+  PrimCounts counts;
+  double *buf;
+  Py_ssize_t buflen;
+  long start,stop,n,npair,totlen;
+  int i,j,k,l,ij,kl,owned;
+
+  if (!PyArg_ParseTuple(args,"OllO|O",&basis_obj,&start,&stop,&buf_obj,
+			&tol_obj))
+    return NULL;
+  prim_counts_init(&counts,prim_tol);
+  if (tol_obj != Py_None) {
+    counts.tol = PyFloat_AsDouble(tol_obj);
+    if (PyErr_Occurred()) return NULL;
+  }
+  if (PyObject_AsWriteBuffer(buf_obj,(void **)&buf,&buflen)) return NULL;
+  if (!get_packed_basis(basis_obj,&b,&owned)) return NULL;
+  npair = (long)b.nbf*(b.nbf+1)/2;
+  totlen = npair*(npair+1)/2;
+  if (start < 0 || stop > totlen || start > stop) {
+    release_packed_basis(&b,owned);
+    PyErr_SetString(PyExc_ValueError,"Integral range out of bounds");
+    return NULL;
+  }
+  if (buflen < (Py_ssize_t)((stop-start)*sizeof(double))) {
+    release_packed_basis(&b,owned);
+    PyErr_SetString(PyExc_ValueError,"Buffer too small for the integrals");
+    return NULL;
+  }
+  Py_BEGIN_ALLOW_THREADS
+  for (n=start; n<stop; n++){
+    unpack_pair_index(n,&ij,&kl);
+    unpack_pair_index(ij,&i,&j);
+    unpack_pair_index(kl,&k,&l);
+    buf[n-start] = coulomb(&b,i,j,k,l,&counts);
+  }
+  Py_END_ALLOW_THREADS
+  release_packed_basis(&b,owned);
+  if (!prim_add_counts(&counts)) return NULL;
+  Py_INCREF(Py_None);
+  return Py_None;
+}
+
+#endif /* PACKED_BASIS_H */
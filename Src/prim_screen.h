@@ -0,0 +1,140 @@
+/*************************************************************************
+ This program is part of the PyQuante quantum chemistry program suite.
+
+ Copyright (c) 2004, Richard P. Muller. All Rights Reserved.
+
+ PyQuante version 1.2 and later is covered by the modified BSD
+ license. Please see the file LICENSE that is part of this
+ distribution.
+ **************************************************************************/
+
+/* Primitive-quartet screening for the contracted two-electron integral
+   routines of the cints, chgp and crys modules. Include after Python.h.
+
+   The weight of the primitive pair (ab| is
+
+     w_ab = |c_a N_a c_b N_b| sqrt(2) pi^(5/4)/zeta
+              * exp(-alpha beta/zeta R_AB^2)
+
+   and w_ab w_cd/sqrt(zeta+eta) is the size of the primitive quartet
+   (ss|ss) at T=0, which is taken as the size of the primitive quartet.
+   Quartets whose estimate is below the tolerance are skipped. When a
+   diffuse primitive is paired with a tight one on another center, the
+   exponential makes the weight, and hence every quartet with that pair,
+   negligible.
+
+   The kernels run without the GIL, so each call has a PrimCounts of its
+   own, which holds its tolerance, counts the quartets it screens, and
+   flags a failed allocation. The Python entry points take the tolerance
+   as an optional last argument; without it they use the module's
+   default, which set_prim_tol changes. prim_add_counts adds the counts
+   of a call to the module's counters, read by prim_screening_stats,
+   once the GIL is held again. */
+
+#ifndef PRIM_SCREEN_H
+#define PRIM_SCREEN_H
+
+#include <math.h>
+#include <stdlib.h>
+
+#ifndef M_PI
+#define M_PI 3.14159265358979323846
+#endif
+
+static double prim_tol = 1e-15;
+static long prim_nskipped = 0, prim_ntested = 0;
+
+typedef struct {
+  double tol;            /* skip quartets whose estimate is below this */
+  long nskipped, ntested;
+  int nomem;             /* set when a kernel couldn't allocate memory */
+} PrimCounts;
+
+static void prim_counts_init(PrimCounts *counts, double tol){
+  counts->tol = tol;
+  counts->nskipped = counts->ntested = 0;
+  counts->nomem = 0;
+}
+
+/* The primitive pair weights of up to this many pairs are kept on the
+   stack of the kernel */
+#define PRIM_PAIR_STACK 400
+
+/* The weights of all lena*lenb primitive pairs, in stack, which holds
+   PRIM_PAIR_STACK of them, or else in a malloc'ed array. Returns NULL,
+   with counts->nomem set, if that fails. Give the array back with
+   prim_free_weights. */
+static double *prim_pair_weights(int lena, double *aexps, double *acoefs,
+				 double *anorms, double xa, double ya,
+				 double za, int lenb, double *bexps,
+				 double *bcoefs, double *bnorms, double xb,
+				 double yb, double zb, double *stack,
+				 PrimCounts *counts){
+  int i,j;
+  double rab2,zeta,*w;
+  if (lena*lenb <= PRIM_PAIR_STACK)
+    w = stack;
+  else {
+    w = (double *)malloc(lena*lenb*sizeof(double));
+    if (!w) {
+      counts->nomem = 1;
+      return NULL;
+    }
+  }
+  rab2 = (xa-xb)*(xa-xb)+(ya-yb)*(ya-yb)+(za-zb)*(za-zb);
+  for (i=0; i<lena; i++)
+    for (j=0; j<lenb; j++){
+      zeta = aexps[i]+bexps[j];
+      w[i*lenb+j] = fabs(acoefs[i]*anorms[i]*bcoefs[j]*bnorms[j])
+	*sqrt(2.)*pow(M_PI,1.25)/zeta*exp(-aexps[i]*bexps[j]/zeta*rab2);
+    }
+  return w;
+}
+
+static void prim_free_weights(double *w, double *stack){
+  if (w != stack) free(w);
+}
+
+/* Can the primitive quartet with this estimate be skipped? */
+static int prim_skip(double estimate, PrimCounts *counts){
+  counts->ntested++;
+  if (estimate < counts->tol){
+    counts->nskipped++;
+    return 1;
+  }
+  return 0;
+}
+
+/* Add the counts of a call to the module's counters; needs the GIL.
+   Returns 0, with a MemoryError set, if the call ran out of memory. */
+static int prim_add_counts(PrimCounts *counts){
+  prim_nskipped += counts->nskipped;
+  prim_ntested += counts->ntested;
+  if (counts->nomem) {
+    PyErr_NoMemory();
+    return 0;
+  }
+  return 1;
+}
+
+static PyObject *set_prim_tol_wrap(PyObject *self,PyObject *args){
+  /* set_prim_tol(tol) -> the previous default tolerance, used by the
+     calls that aren't given one; 0 turns screening off */
+  double tol,old=prim_tol;
+  if (!PyArg_ParseTuple(args,"d",&tol)) return NULL;
+  prim_tol = tol;
+  return Py_BuildValue("d",old);
+}
+
+static PyObject *prim_screening_stats_wrap(PyObject *self,PyObject *args){
+  /* prim_screening_stats(reset=0) -> (nskipped,ntested) since the last
+     reset, then reset the counters if reset is true */
+  int reset=0;
+  PyObject *result;
+  if (!PyArg_ParseTuple(args,"|i",&reset)) return NULL;
+  result = Py_BuildValue("(ll)",prim_nskipped,prim_ntested);
+  if (reset) prim_nskipped = prim_ntested = 0;
+  return result;
+}
+
+#endif
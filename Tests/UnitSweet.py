@@ -28,13 +28,19 @@ class UnitTests(unittest.TestCase):
 
     def testLiLDA(self):
         li_lda = SCF(li,method='DFT',functional="SVWN")
+        self.assert_(not li_lda.DoAveraging)
         li_lda.iterate()
         self.assertAlmostEqual(li_lda.energy,-7.332050,4)
 
     def testLiUHF(self):
         li_uhf = SCF(li,method='UHF')
+        self.assert_(not li_uhf.DoAveraging)
         li_uhf.iterate()
         self.assertAlmostEqual(li_uhf.energy,-7.431364,4)
+        # DIIS is used when it is asked for
+        li_diis = SCF(li,method='UHF',DoAveraging=True)
+        li_diis.iterate()
+        self.assertAlmostEqual(li_diis.energy,-7.431364,4)
 
     def testLiROHF(self):
         li_uhf = SCF(li,method='ROHF')
@@ -196,6 +202,582 @@ class UnitTests(unittest.TestCase):
         self.assertAlmostEqual(e1[0],e2[0],6)
         self.assertAlmostEqual(e1[0],e3[0],6)
 
+    def testOrthogonalizer(self):
+        from PyQuante.LA2 import Orthogonalizer,geigh
+        from PyQuante.Ints import getbasis,getS,getT
+        bfs = getbasis(h2o,'sto-3g')
+        S,T = getS(bfs),getT(bfs)
+        e0,v0 = geigh(T,S)
+        for orthog in ['Chol','Sym','Can','Cut']:
+            e,v = Orthogonalizer(S,orthog).geigh(T)
+            for i in range(len(e0)):
+                self.assertAlmostEqual(e[i],e0[i],8)
+        # Without a cutoff, 'Can' keeps all of the eigenvectors
+        e,v = geigh(T,S,orthog='Can')
+        self.assertEqual(v.shape,(len(bfs),len(bfs)))
+        # With the first function repeated, 'Can' drops the dependency
+        index = range(len(bfs))+[0]
+        S2,T2 = S[index][:,index],T[index][:,index]
+        orth = Orthogonalizer(S2,'Can',1e-5)
+        self.assertEqual(orth.X.shape,(len(bfs)+1,len(bfs)))
+        e,v = orth.geigh(T2)
+        for i in range(len(e0)):
+            self.assertAlmostEqual(e[i],e0[i],8)
+
+    def testBoys(self):
+        from PyQuante import cints
+        from PyQuante.pyints import Fgamma,boys_series
+        maxerr = 0
+        for m in xrange(40):
+            for x in [0,1e-4,0.05,0.77,3.1,12.25,39.97,40,55.5,300]:
+                ref = boys_series(m,x)
+                for val in [cints.Fgamma(m,x),Fgamma(m,x)]:
+                    maxerr = max(maxerr,abs(val-ref)/ref)
+        self.assert_(maxerr < 1e-14)
+
+    def testOneInts(self):
+        from PyQuante.Ints import getbasis,get1ints
+        bfs = getbasis(h2o,'6-31g**')
+        S,h = get1ints(bfs,h2o)
+        maxerr = 0
+        for i in xrange(len(bfs)):
+            for j in xrange(len(bfs)):
+                Sij = bfs[i].overlap(bfs[j])
+                hij = bfs[i].kinetic(bfs[j])
+                for atom in h2o:
+                    hij += atom.atno*bfs[i].nuclear(bfs[j],atom.pos())
+                maxerr = max(maxerr,abs(S[i,j]-Sij),abs(h[i,j]-hij))
+        self.assertAlmostEqual(maxerr,0,10)
+
+    def testShellInts(self):
+        from PyQuante.Ints import getbasis,get2ints
+        from PyQuante.CGBF import coulomb
+        from PyQuante.cints import ijkl2intindex
+        bfs = getbasis(h2o,'6-31g**')
+        Ints = get2ints(bfs)
+        nbf = len(bfs)
+        maxerr = 0
+        for i in xrange(nbf):
+            for j in xrange(i+1):
+                for k in xrange(i+1):
+                    for l in xrange(k+1):
+                        ref = coulomb(bfs[i],bfs[j],bfs[k],bfs[l])
+                        val = Ints[ijkl2intindex(i,j,k,l)]
+                        maxerr = max(maxerr,abs(ref-val))
+        self.assertAlmostEqual(maxerr,0,6)
+
+    def testPairData(self):
+        from PyQuante.Ints import getbasis
+        from PyQuante.Shell import getshells,coulomb
+        from PyQuante.PairData import PairData
+        bfs = getbasis(h2o,'6-31g**')
+        shells = getshells(bfs)
+        pairdata = PairData(shells,0)
+        self.assertEqual(pairdata.nkept,pairdata.ntotal)
+        maxerr = 0
+        for a,b,c,d in [(0,1,2,3),(4,4,4,4),(5,2,8,7),(8,8,6,0)]:
+            a,b,c,d = shells[a],shells[b],shells[c],shells[d]
+            ref = coulomb(a,b,c,d)
+            vals = coulomb(a,b,c,d,pairdata)
+            maxerr = max([maxerr]+[abs(x-y) for x,y in zip(ref,vals)])
+        self.assertAlmostEqual(maxerr,0,12)
+        self.assert_(PairData(shells,1e-6).nkept < pairdata.nkept)
+
+    def testPrimScreening(self):
+        from PyQuante.Ints import getbasis
+        from PyQuante import cints,chgp,crys
+        bfs = getbasis(h2o,'6-311g++(2d,2p)')
+        args = []
+        for bf in [bfs[0],bfs[7],bfs[0],bfs[7]]:
+            args.extend([bf.exps(),bf.coefs(),bf.pnorms(),bf.origin(),
+                         bf.powers()])
+        for module in [cints,chgp,crys]:
+            ref = module.contr_coulomb(*(args+[0]))
+            module.prim_screening_stats(True)
+            val = module.contr_coulomb(*(args+[1e-8]))
+            nskipped,ntested = module.prim_screening_stats()
+            self.assertAlmostEqual(val,ref,10)
+            self.assert_(0 < nskipped < ntested)
+            # The tolerance of the call, not the module default, is used
+            old = module.set_prim_tol(1e-8)
+            self.assertEqual(module.contr_coulomb(*(args+[0])),ref)
+            module.set_prim_tol(old)
+
+    def testBlockInts(self):
+        from PyQuante.Ints import getbasis,get2ints,pack_basis,get2ints_block
+        from PyQuante import cints,chgp,crys
+        bfs = getbasis(h2o,'sto-3g')
+        Ints = get2ints(bfs)
+        basis = pack_basis(bfs)
+        for module in [cints,chgp,crys]:
+            block = get2ints_block(basis,100,len(Ints),module=module)
+            maxerr = max([abs(a-b) for a,b in zip(block,Ints[100:])])
+            self.assertAlmostEqual(maxerr,0,6)
+
+    def testBackends(self):
+        import os,tempfile
+        from PyQuante.Ints import getbasis,get2ints
+        from PyQuante.Backends import Registry
+        from PyQuante import Backends
+        from PyQuante.cints import contr_coulomb
+        bfs = getbasis(h2o,'6-31g**')
+        registry = Registry('contr_coulomb',(4,9,14,19),tuning=True)
+        maxerr = 0
+        for a,b,c,d in [(0,1,2,3),(5,5,5,5),(2,12,20,24),(24,23,22,21)]:
+            args = []
+            for bf in [bfs[a],bfs[b],bfs[c],bfs[d]]:
+                args.extend([bf.exps(),bf.coefs(),bf.pnorms(),
+                             bf.origin(),bf.powers()])
+            maxerr = max(maxerr,abs(registry(*args)-contr_coulomb(*args)))
+        self.assertAlmostEqual(maxerr,0,6)
+        self.assertEqual(len(registry.choice),4)
+        # The choices only go to a file when asked to
+        fd,fname = tempfile.mkstemp('.json')
+        os.close(fd)
+        try:
+            registry.save(fname)
+            loaded = Registry('contr_coulomb',(4,9,14,19))
+            loaded.load(fname)
+            self.assertEqual(loaded.choice,registry.choice)
+        finally:
+            os.remove(fname)
+        # Untuned classes go to chgp, and a class where no module can
+        #  be timed falls back to it as well
+        untuned = Registry('contr_coulomb',(4,9,14,19))
+        self.assertEqual(untuned.module((3,5)),'chgp')
+        def fails(*args): raise ValueError
+        untuned.tuning = True
+        untuned.funcs = {'chgp':fails,'pyints':fails}
+        self.assertEqual(untuned.tune((0,0),args),'chgp')
+        # The shell quartets of get2ints follow the registry
+        Ints = get2ints(bfs)
+        saved = dict(Backends.contr_coulomb.choice)
+        Backends.contr_coulomb.choice[(1,2)] = 'cints'
+        Backends.contr_coulomb.choice[(2,1)] = 'cints'
+        try:
+            Ints2 = get2ints(bfs)
+            Ints3 = get2ints(bfs,nthreads=2)
+        finally:
+            Backends.contr_coulomb.choice = saved
+        self.assertAlmostEqual(abs(Ints-Ints2).max(),0,10)
+        self.assertAlmostEqual(abs(Ints-Ints3).max(),0,10)
+
+    def testSchwarz(self):
+        from PyQuante.Ints import getbasis,get2ints
+        from PyQuante.Screening import Schwarz
+        from PyQuante.cints import ijkl2intindex
+        bfs = getbasis(h2o,'sto-3g')
+        Ints = get2ints(bfs,schwarz_tol=0)
+        screen = Schwarz(bfs)
+        nbf = len(bfs)
+        for i in xrange(nbf):
+            for j in xrange(i+1):
+                for k in xrange(i+1):
+                    for l in xrange(k+1):
+                        val = abs(Ints[ijkl2intindex(i,j,k,l)])
+                        self.assert_(val <= screen.bound(i,j,k,l)+1e-12)
+
+    def testParallelInts(self):
+        import os,tempfile
+        from PyQuante.Ints import getbasis,get2ints,ERIArray
+        bfs = getbasis(h2o,'6-31g**')
+        Ints1 = get2ints(bfs)
+        Ints2 = get2ints(bfs,nproc=2)
+        self.assert_(isinstance(Ints2,ERIArray))
+        # The result is a view of the shared array, not a copy
+        self.assert_(Ints2.base is not None)
+        maxerr = max([abs(a-b) for a,b in zip(Ints1,Ints2)])
+        self.assertEqual(len(Ints1),len(Ints2))
+        self.assertAlmostEqual(maxerr,0,12)
+        # The workers reopen the file, rather than get a copy of it
+        fd,fname = tempfile.mkstemp('.eri')
+        os.close(fd)
+        try:
+            Ints3 = get2ints(bfs,eri_file=fname,nproc=2)
+            self.assertAlmostEqual(abs(Ints1-Ints3.data).max(),0,12)
+        finally:
+            os.remove(fname)
+
+    def testThreadedInts(self):
+        from array import array
+        from multiprocessing.pool import ThreadPool
+        from PyQuante.NumWrap import zeros
+        from PyQuante.Ints import getbasis,get2ints,pack_basis,get2ints_block
+        from PyQuante.Shell import getshells,coulomb
+        from PyQuante.chgp import shell_coulomb_batch
+        from PyQuante import cints,chgp,crys
+        bfs = getbasis(h2o,'6-31g**')
+        Ints1 = get2ints(bfs)
+        Ints2 = get2ints(bfs,nthreads=3)
+        maxerr = max([abs(a-b) for a,b in zip(Ints1,Ints2)])
+        self.assertEqual(len(Ints1),len(Ints2))
+        self.assertAlmostEqual(maxerr,0,12)
+        # A batch of shell quartets without pair data, one after another
+        shells = getshells(bfs)
+        quartets = [(3,1,2,0),(4,4,3,2),(5,0,5,0)]
+        ref = []
+        for quartet in quartets:
+            ref.extend(coulomb(*[shells[i] for i in quartet]))
+        out = zeros(len(ref),'d')
+        shell_coulomb_batch([shell.data() for shell in shells],
+                            array('i',sum(map(list,quartets),[])),None,out)
+        self.assertAlmostEqual(abs(out-ref).max(),0,12)
+        # Spherical functions, which are transformed and stored outside
+        #  the threads
+        bfs = getbasis(h2o,'cc-pvdz',spherical=True)
+        Ints1 = get2ints(bfs)
+        Ints2 = get2ints(bfs,nthreads=2)
+        maxerr = max([abs(a-b) for a,b in zip(Ints1,Ints2)])
+        self.assertAlmostEqual(maxerr,0,12)
+        # The block kernels of each module, from several threads at once
+        basis = pack_basis(getbasis(h2o,'sto-3g'))
+        pool = ThreadPool(4)
+        for module in [cints,chgp,crys]:
+            ref = get2ints_block(basis,0,406,module=module)
+            blocks = pool.map(lambda start: get2ints_block(basis,start,
+                                  start+58,module=module),range(0,406,58))
+            for start,block in zip(range(0,406,58),blocks):
+                maxerr = abs(block-ref[start:start+58]).max()
+                self.assertAlmostEqual(maxerr,0,12)
+        pool.close()
+        pool.join()
+
+    def testJK(self):
+        from array import array
+        from PyQuante.Ints import getbasis,get2ints,getJ,getK,getJK
+        from PyQuante.NumWrap import identity
+        bfs = getbasis(h2o,'sto-3g')
+        Ints = get2ints(bfs)
+        packed = array('d',Ints)
+        Da = identity(len(bfs),'d')
+        Db = 0.5*Da
+        Db[0,1] = Db[1,0] = 0.25
+        Js,Ks = getJK(Ints,[Da,Db])
+        for J,K,D in zip(Js,Ks,[Da,Db]):
+            self.assertAlmostEqual(abs(J-getJ(packed,D)).max(),0,10)
+            self.assertAlmostEqual(abs(K-getK(packed,D)).max(),0,10)
+        # One row i of the integrals at a time
+        Js2,Ks2 = Ints.getJK([Da,Db],blocksize=len(bfs)**3)
+        for J,K,J2,K2 in zip(Js,Ks,Js2,Ks2):
+            self.assertAlmostEqual(abs(J-J2).max(),0,12)
+            self.assertAlmostEqual(abs(K-K2).max(),0,12)
+
+    def testERIFile(self):
+        import os,tempfile
+        from PyQuante.Ints import getbasis,get2ints,getJ,getK
+        from PyQuante.NumWrap import identity
+        bfs = getbasis(h2o,'6-31g**')
+        Ints = get2ints(bfs)
+        fd,fname = tempfile.mkstemp('.eri')
+        os.close(fd)
+        try:
+            get2ints(bfs,eri_file=fname)
+            Ints2 = get2ints(bfs,eri_file=fname)
+            self.assert_(Ints2.complete)
+            D = identity(len(bfs),'d')
+            D[0,1] = D[1,0] = 0.5
+            self.assertAlmostEqual(abs(getJ(Ints,D)-getJ(Ints2,D)).max(),0,10)
+            self.assertAlmostEqual(abs(getK(Ints,D)-getK(Ints2,D)).max(),0,10)
+        finally:
+            os.remove(fname)
+
+    def testDirectSCF(self):
+        from PyQuante.hartree_fock import rhf
+        en,orbe,orbs = rhf(h2o,basis_data='sto-3g')
+        en_direct,orbe,orbs = rhf(h2o,basis_data='sto-3g',direct=True)
+        self.assertAlmostEqual(en,en_direct,8)
+        en_direct,orbe,orbs = rhf(h2o,basis_data='sto-3g',direct=True,
+                                  direct_rebuild=0)
+        self.assertAlmostEqual(en,en_direct,8)
+
+    def testUHFIntegrals(self):
+        # uhf uses the basis functions and integrals it is given,
+        #  without computing its own
+        import PyQuante.hartree_fock as hartree_fock
+        from PyQuante.Ints import getbasis,getints
+        bfs = getbasis(li,'sto-3g')
+        integrals = getints(bfs,li)
+        en,orbe,orbs = hartree_fock.uhf(li,basis_data='sto-3g')
+        def no_getints(*args,**opts):
+            raise AssertionError("uhf recomputed the integrals")
+        hartree_fock.getints = no_getints
+        try:
+            en2,orbe,orbs = hartree_fock.uhf(li,bfs=bfs,integrals=integrals)
+        finally:
+            hartree_fock.getints = getints
+        self.assertAlmostEqual(en,en2,8)
+        # with only the basis functions, the options still reach getints
+        en2,orbe,orbs = hartree_fock.uhf(li,bfs=bfs,direct=True)
+        self.assertAlmostEqual(en,en2,8)
+
+    def testDensityFitting(self):
+        from PyQuante.hartree_fock import rhf
+        en,orbe,orbs = rhf(h2o,basis_data='6-31g**')
+        en_df,orbe,orbs = rhf(h2o,basis_data='6-31g**',density_fitting=True)
+        self.assertAlmostEqual(en,en_df,4)
+        # Schwarz screening of the (P|Q) and (P|ij)
+        en_all,orbe,orbs = rhf(h2o,basis_data='6-31g**',density_fitting=True,
+                               schwarz_tol=0)
+        self.assertAlmostEqual(en_df,en_all,8)
+
+    def testForceSweep(self):
+        from PyQuante.Ints import getbasis
+        from PyQuante.force import der_twoeE_all,der_twoeE,der_twoeE_uhf
+        from PyQuante.NumWrap import zeros
+        bfs = getbasis(lih,'sto-3g')
+        nbf = len(bfs)
+        Da = zeros((nbf,nbf),'d')
+        Db = zeros((nbf,nbf),'d')
+        for i in xrange(nbf):
+            for j in xrange(nbf):
+                Da[i,j] = 1./(1+i+j)
+                Db[i,j] = 0.3/(2+abs(i-j))
+        dE = der_twoeE_all(2,bfs,Da,2,[Da],1)
+        for a in xrange(2):
+            err = max(abs(dE[a]-der_twoeE(a,Da,bfs)))
+            self.assertAlmostEqual(err,0,10)
+        dE = der_twoeE_all(2,bfs,Da+Db,0.5,[Da,Db],0.5)
+        for a in xrange(2):
+            err = max(abs(dE[a]-der_twoeE_uhf(a,Da,Db,bfs)))
+            self.assertAlmostEqual(err,0,10)
+
+    def testCDerivs(self):
+        from PyQuante.Ints import getbasis,getT,getV
+        from PyQuante.AnalyticDerivatives import DerivInts
+        from PyQuante.force import der_overlap_matrix,der_Hcore_matrix,\
+             der_twoeE_all,der_twoeE_cints
+        from PyQuante.Screening import Schwarz
+        from PyQuante.NumWrap import zeros
+        def water(dz):
+            return Molecule('H2O',[(8,(0,0,dz)),(1,(1.4,0,-1.1)),
+                                   (1,(-1.4,0,-1.1))])
+        bfs = getbasis(water(0),'sto-3g')
+        nbf = len(bfs)
+        derivs = DerivInts(bfs,water(0).atoms)
+        for a in xrange(3):
+            dS = der_overlap_matrix(a,bfs)
+            err = max([abs(x-y).max() for x,y in zip(dS,derivs.overlap(a))])
+            self.assertAlmostEqual(err,0,6)
+        # dH/dZ of the oxygen, against finite differences
+        h = 1e-5
+        H = []
+        for dz in [h,-h]:
+            mol = water(dz)
+            H.append(getT(getbasis(mol,'sto-3g'))
+                     + getV(getbasis(mol,'sto-3g'),mol.atoms))
+        err = abs(derivs.hcore(0)[2]-(H[0]-H[1])/(2*h)).max()
+        self.assertAlmostEqual(err,0,6)
+        D = zeros((nbf,nbf),'d')
+        for i in xrange(nbf):
+            for j in xrange(nbf):
+                D[i,j] = 1./(1+i+j)
+        err = abs(der_twoeE_cints(3,bfs,D,2,[D],1)
+                  -der_twoeE_all(3,bfs,D,2,[D],1)).max()
+        self.assertAlmostEqual(err,0,6)
+        # The kernel skips the same quartets as the Python code
+        screens = [Schwarz(bfs,1e-2),Schwarz(bfs,1e-2)]
+        err = abs(der_twoeE_cints(3,bfs,D,2,[D],1,screens[0])
+                  -der_twoeE_all(3,bfs,D,2,[D],1,screens[1])).max()
+        self.assertAlmostEqual(err,0,6)
+        self.assert_(screens[0].nskipped > 0)
+        # The Python derivatives of H agree with the kernels
+        for a in xrange(3):
+            dH = der_Hcore_matrix(a,bfs,water(0).atoms)
+            err = max([abs(x-y).max() for x,y in zip(dH,derivs.hcore(a))])
+            self.assertAlmostEqual(err,0,6)
+
+    def testForceFiniteDifference(self):
+        from PyQuante.hartree_fock import rhf
+        from PyQuante.Wavefunction import Wavefunction
+        from PyQuante.force import hf_force
+        def water(dz):
+            return Molecule('H2O',[(8,(0,0,dz)),(1,(1.4,0,-1.1)),
+                                   (1,(-1.4,0,-1.1))])
+        h = 1e-4
+        ens = [rhf(water(dz),basis_data='sto-3g',ConvCriteria=1e-11,
+                   MaxIter=50)[0] for dz in [h,-h]]
+        mol = water(0)
+        en,orbe,orbs = rhf(mol,basis_data='sto-3g',ConvCriteria=1e-11,
+                           MaxIter=50)
+        wf = Wavefunction(orbs=orbs,orbe=orbe,nclosed=5,nopen=0,
+                          restricted=True)
+        # The force on the oxygen from the kernels and from the Python
+        #  code, against minus the derivative of the energy
+        for cderivs in [True,False]:
+            hf_force(mol,wf,'sto-3g',cderivs=cderivs)
+            self.assertAlmostEqual(mol.atoms[0].f[2],
+                                   -(ens[0]-ens[1])/(2*h),5)
+
+    def testSymmetry(self):
+        from PyQuante.Ints import getbasis,get2ints
+        from numpy import array
+        self.assertEqual(h2o.point_group().name,'C2v')
+        self.assertEqual(h2.point_group().name,'D2h')
+        bfs = getbasis(h2o,'6-31g**')
+        err = abs(array(get2ints(bfs,symmetry=h2o.point_group()))
+                  -array(get2ints(bfs))).max()
+        self.assertAlmostEqual(err,0,12)
+        # get2ints has no atoms to find the group of
+        self.assertRaises(ValueError,get2ints,bfs,symmetry=True)
+
+    def testSpherical(self):
+        from PyQuante.Ints import getbasis,getS
+        from PyQuante.hartree_fock import rhf
+        from PyQuante.NumWrap import identity
+        bfs = getbasis(h2o,'cc-pvdz',spherical=True)
+        self.assertEqual(len(bfs),24)
+        # The d functions of a shell are orthonormal
+        S = getS(bfs)
+        self.assertAlmostEqual(abs(S[9:14,9:14]-identity(5)).max(),0,12)
+        en,orbe,orbs = rhf(h2o,basis_data='cc-pvdz',spherical=True)
+        self.assertAlmostEqual(en,-76.026970,4)
+
+    def testIntIndices(self):
+        from PyQuante.Ints import getbasis,get2ints
+        from PyQuante.cints import ijkl2intindex
+        from PyQuante.ERIStore import intindices,slice_indices,unpack_full,\
+             unpack_block
+        self.assertEqual(list(intindices([3,0],[1,2],[2,3],[0,1])),
+                         [ijkl2intindex(3,1,2,0),ijkl2intindex(0,2,3,1)])
+        idx = slice_indices(4,2,None,1)
+        self.assertEqual(idx.shape,(4,4))
+        self.assertEqual(idx[3,0],ijkl2intindex(2,3,1,0))
+        bfs = getbasis(h2o,'6-31g**')
+        Ints = get2ints(bfs)
+        full = unpack_full(Ints,len(bfs))
+        self.assertEqual(full[5,2,9,1],Ints[ijkl2intindex(5,2,9,1)])
+        self.assertEqual(full[1,9,2,5],full[5,2,9,1])
+        self.assertEqual(abs(unpack_block(Ints,len(bfs),3,7)-full[3:7]).max(),
+                         0)
+
+    def testCompressedERIs(self):
+        from PyQuante.Ints import getbasis,get2ints,getJ,getK
+        from PyQuante.hartree_fock import rhf
+        from PyQuante.LA2 import mkdens
+        from PyQuante.ERIStore import CompressedERIs
+        from numpy import array
+        bfs = getbasis(h2o,'6-31g**')
+        Ints = get2ints(bfs)
+        en0,orbe,orbs = rhf(h2o,basis_data='6-31g**')
+        D = mkdens(orbs,0,5)
+        for layout in ['mixed','sparse']:
+            C = get2ints(bfs,eri_compress=layout,single_tol=1e-2)
+            self.assert_(C.nbytes() < 8*len(Ints))
+            self.assertAlmostEqual(abs(C[array([0,17,400])]
+                                       -array(Ints)[[0,17,400]]).max(),0,9)
+            self.assertAlmostEqual(abs(getJ(C,D)-getJ(Ints,D)).max(),0,7)
+            self.assertAlmostEqual(abs(getK(C,D)-getK(Ints,D)).max(),0,7)
+            en,orbe,orbs = rhf(h2o,basis_data='6-31g**',eri_compress=layout,
+                               single_tol=1e-2)
+            self.assert_(abs(en-en0) < C.energy_error(D))
+            # Compressed as they are made, a shell at a time, just as
+            #  the full array would be
+            C2 = CompressedERIs(Ints,1e-2,C.drop_tol)
+            C3 = get2ints(bfs,eri_compress=layout,single_tol=1e-2,nthreads=2)
+            for Cn in [C2,C3]:
+                self.assertEqual(list(C.dindex),list(Cn.dindex))
+                self.assertAlmostEqual(C.error_sum,Cn.error_sum,12)
+                self.assertAlmostEqual(abs(C.dvalues-Cn.dvalues).max(),0,12)
+        # The full array is needed for the symmetry copies
+        self.assertRaises(ValueError,get2ints,bfs,eri_compress='mixed',
+                          symmetry=h2o.point_group())
+        # A spherical basis goes by blocks of the spherical functions
+        bfs = getbasis(h2o,'cc-pvdz',spherical=True)
+        C = get2ints(bfs,eri_compress='sparse')
+        C2 = CompressedERIs(get2ints(bfs),1e-4,1e-12)
+        self.assertEqual(list(C.dindex),list(C2.dindex))
+        self.assertEqual(list(C.sindex),list(C2.sindex))
+
+    def testDIIS(self):
+        from PyQuante.hartree_fock import rhf,uhf
+        from PyQuante.Convergence import DIIS
+        from PyQuante.Ints import getbasis,getS,getT
+        from PyQuante.LA2 import geigh,mkdens
+        from PyQuante.NumWrap import dot
+        en0,orbe,orbs = rhf(h2o,basis_data='6-31g**',MaxIter=60,
+                            ConvCriteria=1e-8)
+        for evict in ['age','error']:
+            en,orbe,orbs = rhf(h2o,basis_data='6-31g**',MaxIter=60,
+                               ConvCriteria=1e-8,DoAveraging=True,
+                               DIISSize=3,DIISEvict=evict)
+            self.assertAlmostEqual(en,en0,6)
+        en0,orbe,orbs = uhf(li,basis_data='6-31g**',ConvCriteria=1e-8)
+        en,orbe,orbs = uhf(li,basis_data='6-31g**',ConvCriteria=1e-8,
+                           DoDIIS=True)
+        self.assertAlmostEqual(en,en0,6)
+        # The B matrix built a row at a time matches the error vectors
+        bfs = getbasis(h2o,'sto-3g')
+        S,T = getS(bfs),getT(bfs)
+        orbe,orbs = geigh(T,S)
+        D = mkdens(orbs,0,5)
+        avg = DIIS(S,nmax=3)
+        avg.started = 1
+        for i in range(5):
+            avg.getF(T+0.1*i*T*T,D)
+        self.assertEqual(len(avg.Errs),3)
+        for i in range(3):
+            for j in range(3):
+                self.assertAlmostEqual(avg.B[i,j],
+                                       dot(avg.Errs[i],avg.Errs[j]),12)
+
+    def testADIIS(self):
+        from PyQuante.hartree_fock import rhf,uhf
+        from PyQuante.Convergence import simplex_min
+        from PyQuante.NumWrap import array
+        en0,orbe,orbs = rhf(h2o,basis_data='6-31g**',ConvCriteria=1e-8)
+        en,orbe,orbs = rhf(h2o,basis_data='6-31g**',ConvCriteria=1e-8,
+                           DoAveraging=True,ADIIS=True)
+        self.assertAlmostEqual(en,en0,6)
+        en0,orbe,orbs = uhf(li,basis_data='6-31g**',ConvCriteria=1e-8)
+        en,orbe,orbs = uhf(li,basis_data='6-31g**',ConvCriteria=1e-8,
+                           DoDIIS=True,ADIIS=True)
+        self.assertAlmostEqual(en,en0,6)
+        # min (c0-1)^2+c1^2 on the simplex is at the vertex (1,0); with
+        #  the target at (1/2,1/2) it is in the interior
+        c = simplex_min(array([-2.,0.]),array([[2.,0.],[0.,2.]]))
+        self.assertAlmostEqual(c[0],1.,12)
+        self.assertAlmostEqual(c[1],0.,12)
+        c = simplex_min(array([-1.,-1.,3.]),2*array([[1.,0,0],[0,1,0],[0,0,1]]))
+        self.assertAlmostEqual(c[0],0.5,12)
+        self.assertAlmostEqual(c[2],0.,12)
+
+    def testSAD(self):
+        from PyQuante.hartree_fock import rhf
+        from PyQuante.SAD import sad_density,atomic_density
+        from PyQuante.Ints import getbasis,getS
+        from PyQuante.LA2 import trace2
+        bfs = getbasis(h2o,'6-31g**')
+        D = sad_density(h2o,bfs)
+        self.assertAlmostEqual(trace2(D,getS(bfs)),5,6)
+        # The hydrogens share one cached density
+        hbfs = [bf for bf in bfs if bf.atid == h2o.atoms[1].atid]
+        self.assert_(atomic_density(h2o.atoms[1],hbfs) is
+                     atomic_density(h2o.atoms[2],hbfs))
+        en0,orbe,orbs = rhf(h2o,basis_data='6-31g**',ConvCriteria=1e-8,
+                            DoAveraging=True)
+        en,orbe,orbs = rhf(h2o,basis_data='6-31g**',ConvCriteria=1e-8,
+                           DoAveraging=True,guess='sad')
+        self.assertAlmostEqual(en,en0,6)
+        solver = SCF(oh,basis='6-31g**',method='UHF',guess='sad')
+        solver.iterate()
+        self.assertAlmostEqual(solver.energy,-75.388319,4)
+
+    def testSecondOrder(self):
+        from PyQuante.PyQuante2 import AugmentedHessianSolver
+        solver = SCF(h2o,basis='6-31g**',DoAveraging=False,
+                     SolverConstructor=AugmentedHessianSolver)
+        solver.iterate()
+        self.assertAlmostEqual(solver.energy,-76.023615,4)
+        # DIIS oscillates for water with its bonds stretched 2.5 times
+        f = 2.5
+        water = Molecule('h2o',[(8,(0,0,0)),(1,(0.757*f,0.586*f,0)),
+                                (1,(-0.757*f,0.586*f,0))],units='Angstrom')
+        solver = SCF(water,basis='6-31g**',maxstep=0.4)
+        solver.iterate()
+        self.assert_(isinstance(solver.solver,AugmentedHessianSolver))
+        self.assertEqual(solver.solver.maxstep,0.4)
+        self.assertAlmostEqual(solver.energy,-75.463301,4)
+
     def testMP2(self):
         solv = SCF(h2,method="HF")
         solv.iterate()
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+"""\
+ Benchmark the reduced-precision storage of the two-electron integrals
+ (ERIStore.CompressedERIs) against the array of doubles from get2ints:
+ the memory each takes, the time of an RHF calculation with it, and
+ the error in the energy, next to the bound the storage gives a priori.
+ get2ints with eri_compress compresses each block of integrals as it
+ is made, so its peak memory is measured first, before the array of
+ doubles exists.
+
+"""
+
+from PyQuante.Ints import getbasis,getS,getT,getV,get2ints
+from PyQuante.ERIStore import CompressedERIs
+from PyQuante.hartree_fock import rhf
+from PyQuante.Molecule import Molecule
+
+from time import time
+from resource import getrusage,RUSAGE_SELF
+
+def peak_mb():
+    "The peak memory of the process so far, in MB"
+    return getrusage(RUSAGE_SELF).ru_maxrss/1e3
+
+def water_chain(n,spacing=3.0):
+    "A row of n water molecules, spacing Angstrom apart"
+    atomlist = []
+    for i in range(n):
+        x = i*spacing
+        atomlist.extend([(8,(x,0,0)),(1,(x+0.757,0.586,0)),
+                         (1,(x-0.757,0.586,0))])
+    return Molecule('h2o_%d' % n,atomlist,units='Angstrom')
+
+def test(n=4,basis='6-31g**'):
+    atoms = water_chain(n)
+    bfs = getbasis(atoms,basis)
+    S,h = getS(bfs),getT(bfs)+getV(bfs,atoms)
+    peak0 = peak_mb()
+    t0 = time()
+    C = get2ints(bfs,eri_compress='sparse')
+    print "%d basis functions; sparse integrals in %.2f s, %.1f MB, " \
+          "peak memory up %.1f MB" % (len(bfs),time()-t0,C.nbytes()/1e6,
+                                      peak_mb()-peak0)
+    del C
+    t0 = time()
+    Ints = get2ints(bfs)
+    print "%d basis functions; integrals in %.2f s" % (len(bfs),time()-t0)
+
+    t0 = time()
+    en0,orbe,orbs = rhf(atoms,integrals=(S,h,Ints))
+    print "%-24s %8.1f MB %8.2f s  E = %.8f" % \
+          ("double",8*len(Ints)/1e6,time()-t0,en0)
+
+    for label,single_tol,drop_tol in [("mixed 1e-4",1e-4,None),
+                                      ("mixed 1e-2",1e-2,None),
+                                      ("sparse 1e-4/1e-12",1e-4,1e-12),
+                                      ("sparse 1e-2/1e-10",1e-2,1e-10)]:
+        t0 = time()
+        C = CompressedERIs(Ints,single_tol,drop_tol)
+        tc = time()-t0
+        t0 = time()
+        en,orbe,orbs = rhf(atoms,integrals=(S,h,C))
+        print "%-24s %8.1f MB %8.2f s  dE = %9.2e  bound %8.2e  " \
+              "(compressed in %.2f s)" % (label,C.nbytes()/1e6,time()-t0,
+                                          en-en0,C.energy_error(),tc)
+
+if __name__ == '__main__': test()
+
+# Sample times (4 waters, 6-31G**):
+# 100 basis functions; sparse integrals in 10.67 s, 18.0 MB, peak memory up 56.4 MB
+# 100 basis functions; integrals in 9.51 s
+# double                      102.0 MB    30.98 s  E = -304.04644850
+# mixed 1e-4                   57.7 MB    28.80 s  dE = -3.30e-12  bound 5.16e-06  (compressed in 1.42 s)
+# mixed 1e-2                   52.7 MB    26.62 s  dE = -1.03e-08  bound 4.09e-04  (compressed in 1.68 s)
+# sparse 1e-4/1e-12            18.0 MB    25.88 s  dE = -2.39e-12  bound 5.64e-06  (compressed in 1.27 s)
+# sparse 1e-2/1e-10            15.0 MB    23.88 s  dE = -9.29e-09  bound 5.16e-04  (compressed in 1.42 s)
@@ -0,0 +1,79 @@
+#!/usr/bin/env python
+"""\
+ Benchmark the threaded two-electron integrals (get2ints with nthreads,
+ see Ints.threaded_shell_ints) against the serial ones. The threads
+ only overlap inside chgp.shell_coulomb_batch, which runs without the
+ GIL, so the share of the time spent there bounds the speedup that
+ more cores can give.
+
+"""
+
+import PyQuante.Ints as Ints
+from PyQuante.Ints import getbasis,get2ints
+from PyQuante.Shell import getshells
+from PyQuante.PairData import PairData
+from PyQuante.Screening import Schwarz
+from PyQuante.Molecule import Molecule
+from PyQuante.NumWrap import zeros
+
+from time import time
+
+def water_chain(n,spacing=3.0):
+    "A row of n water molecules, spacing Angstrom apart"
+    atomlist = []
+    for i in range(n):
+        x = i*spacing
+        atomlist.extend([(8,(x,0,0)),(1,(x+0.757,0.586,0)),
+                         (1,(x-0.757,0.586,0))])
+    return Molecule('h2o_%d' % n,atomlist,units='Angstrom')
+
+def batch_share(bfs):
+    """\
+    The time of threaded_shell_ints with a single thread, and the part
+    of it spent in the GIL-free batch calls
+    """
+    shells = getshells(bfs)
+    pairdata = PairData(shells)
+    screen = Schwarz(bfs,1e-12,shells,pairdata)
+    pairs = [(i,j) for i in xrange(len(shells)) for j in xrange(i+1)]
+    nbf = len(bfs)
+    out = zeros(nbf*(nbf+1)*(nbf*nbf+nbf+2)/8,'d')
+    batch = Ints.shell_coulomb_batch
+    spent = [0]
+    def timed_batch(*args):
+        t0 = time()
+        batch(*args)
+        spent[0] += time()-t0
+    Ints.shell_coulomb_batch = timed_batch
+    try:
+        t0 = time()
+        Ints.threaded_shell_ints(out,shells,pairs,screen,1,pairdata)
+        total = time()-t0
+    finally:
+        Ints.shell_coulomb_batch = batch
+    return total,spent[0]
+
+def test(n=2,basis='6-31g**',nthreads=(2,4)):
+    atoms = water_chain(n)
+    bfs = getbasis(atoms,basis)
+    t0 = time()
+    get2ints(bfs)
+    print "%d basis functions; serial integrals in %.2f s" % (len(bfs),
+                                                             time()-t0)
+    for nt in nthreads:
+        t0 = time()
+        get2ints(bfs,nthreads=nt)
+        print "nthreads=%d %28.2f s" % (nt,time()-t0)
+    total,spent = batch_share(bfs)
+    print "one thread %28.2f s, %.2f s (%.0f%%) without the GIL" % \
+          (total,spent,100*spent/total)
+
+if __name__ == '__main__': test()
+
+# Sample times (2 waters, 6-31G**), on a machine with a single core, so
+# that the threads can't overlap; there the gain is from computing each
+# chunk of shell quartets in one C call:
+# 50 basis functions; serial integrals in 1.30 s
+# nthreads=2                         0.50 s
+# nthreads=4                         0.48 s
+# one thread                         0.31 s, 0.23 s (75%) without the GIL
@@ -0,0 +1,146 @@
+#!/usr/bin/env python
+"""\
+ Benchmark the SCF convergence accelerators of Convergence.py: the
+ number of RHF iterations that DIIS and the ADIIS+DIIS hybrid take on
+ some of the TestMolecules, on stretched H2 and LiH, and on water with
+ its bonds stretched, where DIIS oscillates and never converges. A run
+ converges when the energy changes by less than 1e-8 and the largest
+ element of FDS-SDF is below 1e-6. test_second_order
+ runs PyQuante2 on stretched water, where DIIS oscillates, with and
+ without the switch to the second-order solver. PyQuante2 stops when
+ the energy changes by less than 1e-5, which an oscillating DIIS can
+ also reach by chance, so the orbital gradient max|FDS-SDF| of the
+ final density is printed as well, and runs where it is above 1e-3
+ are marked as not converged. Where such a run stops, and at what
+ energy, depends upon the rounding of the machine.
+
+"""
+
+from PyQuante.Ints import getbasis,getints,get2JmK
+from PyQuante.LA2 import geigh,mkdens
+from PyQuante.NumWrap import dot,transpose
+from PyQuante.hartree_fock import get_energy
+from PyQuante.Convergence import DIIS,ADIIS
+from PyQuante.Molecule import Molecule
+from PyQuante.TestMolecules import h2o,lih,co,ch4
+from PyQuante.PyQuante2 import SCF
+
+def niter(atoms,basis,Averager,etol=1e-8,errtol=1e-6,max_iter=100):
+    """\
+    The number of iterations an RHF calculation takes to converge: for
+    the energy to change by less than etol, with the largest element of
+    the error FDS-SDF below errtol, so that an oscillation can't pass
+    """
+    bfs = getbasis(atoms,basis)
+    S,h,Ints = getints(bfs,atoms)
+    orbe,orbs = geigh(h,S)
+    nclosed,nopen = atoms.get_closedopen()
+    enuke = atoms.get_enuke()
+    avg = Averager(S)
+    eold = 0.
+    for i in range(1,max_iter+1):
+        D = mkdens(orbs,0,nclosed)
+        F = h+get2JmK(Ints,D)
+        energy = get_energy(h,F,D,enuke)
+        F = avg.getF(F,D)
+        orbe,orbs = geigh(F,S)
+        if abs(energy-eold) < etol and avg.error() < errtol: break
+        eold = energy
+    return i,energy
+
+def stretched(name,atno,R):
+    return Molecule('%s %.1f' % (name,R),[(1,(0,0,0)),(atno,(0,0,R))],
+                    units='Angstrom')
+
+def test(max_iter=100):
+    cases = [(h2o,'6-31g**'),(lih,'6-31g**'),(co,'6-31g**'),(ch4,'6-31g**')]
+    for R in [1.5,2.5,3.5]:
+        cases.append((stretched('H2',1,R),'6-31g**'))
+    for R in [2.5,3.5,4.5]:
+        cases.append((stretched('LiH',3,R),'6-31g**'))
+    for f in [2.0,2.5,3.0]:
+        cases.append((stretched_water(f),'6-31g**'))
+    totals,nboth = [0,0],0
+    print "%-12s %6s %6s  %-14s %s" % ("","DIIS","ADIIS","E","dE")
+    for atoms,basis in cases:
+        counts,energies = [],[]
+        for Averager in [DIIS,ADIIS]:
+            n,energy = niter(atoms,basis,Averager,max_iter=max_iter)
+            counts.append(n)
+            energies.append(energy)
+        print "%-12s %6s %6s  %.8f %9.1e" % \
+              (atoms.name,counts[0] < max_iter and counts[0] or "-",
+               counts[1] < max_iter and counts[1] or "-",
+               energies[1],energies[1]-energies[0])
+        if max(counts) < max_iter:
+            totals = [t+n for t,n in zip(totals,counts)]
+            nboth += 1
+    print "%-12s %6.1f %6.1f  (where both converge)" % \
+          ("average",totals[0]/float(nboth),totals[1]/float(nboth))
+
+def stretched_water(f):
+    "Water with its bonds f times as long"
+    return Molecule('h2o x%.1f' % f,[(8,(0,0,0)),(1,(0.757*f,0.586*f,0)),
+                                     (1,(-0.757*f,0.586*f,0))],
+                    units='Angstrom')
+
+def orbital_gradient(solver):
+    "max|FDS-SDF| of the final density of a PyQuante2 HF calculation"
+    FDS = dot(solver.F,dot(solver.dmat,solver.S))
+    return abs(FDS-transpose(FDS)).max()
+
+def test_second_order():
+    print "%-12s %-10s %6s  %-14s %s" % ("","solver","iters","E",
+                                         "max|FDS-SDF|")
+    for f in [1.0,2.0,2.5,3.0]:
+        atoms = stretched_water(f)
+        for second_order in [False,True]:
+            solver = SCF(atoms,basis='6-31g**',second_order=second_order)
+            solver.iterate(max_iter=80)
+            grad = orbital_gradient(solver)
+            print "%-12s %-10s %6d  %.8f %9.1e%s" % \
+                  (atoms.name,second_order and "DIIS+AH" or "DIIS",
+                   solver.iterator.iter,solver.energy,grad,
+                   grad > 1e-3 and "  not converged" or "")
+
+if __name__ == '__main__':
+    test()
+    test_second_order()
+
+# Sample output (6-31G**). "-" is no convergence in 100 iterations; E
+#  is the ADIIS energy, dE its difference from the DIIS one:
+#                DIIS  ADIIS  E              dE
+# H2O              10     11  -76.02361502  -1.6e-12
+# LiH               8      8  -7.98134030  -1.7e-13
+# CO               13     11  -112.73787697  -3.4e-13
+# CH4              10      9  -40.20170480   1.3e-12
+# H2 1.5            5      5  -0.99924156   0.0e+00
+# H2 2.5            5      5  -0.85713938   0.0e+00
+# H2 3.5            4      4  -0.78801614   0.0e+00
+# LiH 2.5           8      8  -7.94011658  -4.6e-12
+# LiH 3.5          10      9  -7.88168085   7.4e-12
+# LiH 4.5          10     10  -7.83866191   8.0e-12
+# h2o x2.0         15     13  -75.59268061  -1.2e-12
+# h2o x2.5          -     14  -75.44047585  -3.9e-01
+# h2o x3.0          -     14  -75.33809211  -8.9e-01
+# average         8.9    8.5  (where both converge)
+#
+# With the switch points of Garza and Scuseria, adiis_tol=0.1 and
+#  diis_tol=1e-4, ADIIS took 5 iterations on H2 3.5, 12 on LiH 4.5,
+#  and 12, 15 and 15 on the stretched waters. H2O takes 11 at either
+#  setting: there the 0.5 averaging that DIIS does before errcutoff
+#  happens to land closer than the ADIIS step.
+#
+# test_second_order. The DIIS runs on the x2.5 and x3.0 bonds oscillate
+#  and never converge; they stop wherever the energy change happens to
+#  drop below 1e-5 (on another machine, x2.5 ran to the 80 iteration
+#  limit and stopped at -74.19540528):
+#              solver      iters  E              max|FDS-SDF|
+# h2o x1.0     DIIS            7  -76.02315555   3.3e-04
+# h2o x1.0     DIIS+AH         7  -76.02315555   3.3e-04
+# h2o x2.0     DIIS           11  -75.59267370   2.0e-04
+# h2o x2.0     DIIS+AH        11  -75.59267370   2.0e-04
+# h2o x2.5     DIIS           37  -74.72938915   3.1e-01  not converged
+# h2o x2.5     DIIS+AH        16  -75.46330116   1.1e-06
+# h2o x3.0     DIIS           25  -74.45124522   3.2e-01  not converged
+# h2o x3.0     DIIS+AH        19  -75.42265853   8.1e-08